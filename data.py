@@ -20,7 +20,6 @@ lifestyle_data = pd.DataFrame({
     'gender': np.random.choice(['Male', 'Female'], n_subjects),
     'height_cm': np.round(np.random.normal(170, 10, n_subjects), 1),
     'weight_kg': np.round(np.random.normal(75, 15, n_subjects), 1),
-    'bmi': lambda x: np.round(x.weight_kg / ((x.height_cm/100)**2), 1),
     'waist_circumference_cm': np.round(np.random.normal(90, 15, n_subjects), 1),
     'hip_circumference_cm': np.round(np.random.normal(100, 10, n_subjects), 1),
     'diet': np.random.choice(['Vegetarian', 'Non-Vegetarian', 'Vegan', 'Mediterranean', 'Keto'], n_subjects),
@@ -33,6 +32,7 @@ lifestyle_data = pd.DataFrame({
     'supplements': [', '.join(np.random.choice(supplements, np.random.randint(0, 3))) for _ in range(n_subjects)],
     'family_history': [', '.join(np.random.choice(family_history, np.random.randint(0, 3))) for _ in range(n_subjects)]
 })
+lifestyle_data.insert(5, 'bmi', np.round(lifestyle_data.weight_kg / ((lifestyle_data.height_cm / 100) ** 2), 1))
 
 # 2. Enhanced Scanning Data
 scanning_data = pd.DataFrame({
@@ -11,6 +11,7 @@ setup(
     entry_points={
         'console_scripts': [
             'cohortagent=src.cli:main',
+            'cohortagent-generate=src.synthetic:main',
         ],
     },
     author="CohortAgent Team",
@@ -1,31 +1,122 @@
+import asyncio
+import contextvars
 import os
-from typing import List, Dict, Any, Optional, Callable
+import threading
+from dataclasses import dataclass
+from typing import List, Dict, Any, Optional, Callable, Iterator, AsyncIterator
 import json
 
+from .budget import Budget, budget_limits
+from .cache import CachedTool, ResultCache
+from .executor import AsyncToolExecutor, ToolTimeoutError
+from .planner import (
+    DEFAULT_DATA_DIR,
+    QueryPlan,
+    ToolCall,
+    compile_query,
+    model_plan_prompt,
+    parse_model_plan
+)
 from .tools import (
     analyze_data,
+    iter_analyze_data,
     visualize_data,
     merge_and_analyze,
+    iter_merge_and_analyze,
     merge_and_visualize,
-    analyze_images
+    analyze_images,
+    analyze_all,
+    analyze_volumes,
+    extract_image_features
 )
+from .tracing import span
+from .utils import data_cache
+
+# How each tool's result (or error) is reported back to the user
+RESPONSE_TEMPLATES = {
+    "analyze_data": ("Analysis Results:\n\n{result}",
+                     "Error performing analysis: {error}"),
+    "visualize_data": ("Visualization created and saved to: {result}",
+                       "Error creating visualization: {error}"),
+    "merge_and_analyze": ("Merged Analysis Results:\n\n{result}",
+                          "Error performing merged analysis: {error}\nParams: {params}"),
+    "merge_and_visualize": ("Merged visualization created and saved to: {result}",
+                            "Error creating merged visualization: {error}\nParams: {params}"),
+    "analyze_images": ("Image Analysis Results:\n\n{result}",
+                       "Error analyzing images: {error}"),
+    "analyze_volumes": ("Volume Analysis Results:\n\n{result}",
+                        "Error analyzing volumes: {error}"),
+    "extract_image_features": ("Image features for each subject saved to: {result}",
+                               "Error extracting image features: {error}"),
+    "analyze_all": ("{result}",
+                    "Error analyzing datasets: {error}"),
+}
+
+HELP_MESSAGE = """
+            I can help with the following types of health data analysis:
+            
+            1. Data Analysis: Provide statistical analysis of health data files
+            2. Visualization: Create plots and charts from health data
+            3. Merged Analysis: Combine and analyze multiple datasets
+            4. Merged Visualization: Create visualizations from multiple datasets
+            5. Image Analysis: Process and analyze medical images
+            6. Cohort-wide Analysis: Run one analysis on every dataset
+            
+            Please provide specific files and parameters for your analysis.
+            You can chain steps with "then", e.g. "merge lifestyle and blood,
+            then correlate, then plot heatmap".
+            """
+
+@dataclass
+class StreamChunk:
+    """A piece of a streamed response (see CohortAgent.run_stream)."""
+    step: int
+    tool: str
+    text: str
+    artifact: Optional[str] = None
+    final: bool = False
+    error: bool = False
 
 class CohortAgent:
     """
     A simplified agent for analyzing multi-modal health data locally.
     """
     
-    def __init__(self, model_name: str = None):
+    def __init__(self, model_name: str = None, data_dir: str = DEFAULT_DATA_DIR,
+                 max_workers: Optional[int] = None, process_workers: int = 0,
+                 cache: Optional[ResultCache] = None, model_url: Optional[str] = None,
+                 model_timeout: Optional[float] = None, budget: Optional[Budget] = None):
         """
         Initialize the CohortAgent.
         
         Args:
-            model_name: Not used in this simplified version
+            model_name: Local model ("ollama/llava", "openai/<name>") used to plan
+                        queries the keyword compiler cannot and to interpret
+                        images; None disables model calls
+            data_dir: Directory whose datasets can be referred to by name in queries
+            max_workers: Thread pool size for run_async (default: chosen by Python)
+            process_workers: Process pool size for CPU-bound tools in run_async;
+                            0 keeps everything on threads
+            cache: Persistent result cache wrapped around every tool (None disables it)
+            model_url: Model server URL (default depends on the provider)
+            model_timeout: Model request timeout in seconds
+            budget: Row, memory and time limits for each tool call; tools that
+                    would exceed them sample or reduce their input and say so
         """
+        self.model_name = model_name
+        self.model_url = model_url
+        self.model_timeout = model_timeout
+        self.budget = budget
+        self.data_dir = data_dir
+        self.max_workers = max_workers
+        self.process_workers = process_workers
+        self._executor: Optional[AsyncToolExecutor] = None
+        self.cache = cache
         # Define custom tools
         self.tools = {
             "analyze_data": {
                 "function": analyze_data,
+                "stream": iter_analyze_data,
                 "description": "Perform statistical analysis on health data",
                 "parameters": {
                     "file_path": "string", 
@@ -45,11 +136,13 @@ class CohortAgent:
                     "groupby": "string",
                     "title": "string",
                     "figsize": "list[integer]",
-                    "palette": "string"
+                    "palette": "string",
+                    "output_format": "string"
                 }
             },
             "merge_and_analyze": {
                 "function": merge_and_analyze,
+                "stream": iter_merge_and_analyze,
                 "description": "Merge multiple datasets and perform analysis",
                 "parameters": {
                     "file_paths": "list[string]",
@@ -71,24 +164,70 @@ class CohortAgent:
                     "groupby": "string",
                     "title": "string",
                     "figsize": "list[integer]",
-                    "palette": "string"
+                    "palette": "string",
+                    "output_format": "string"
                 }
             },
             "analyze_images": {
                 "function": analyze_images,
                 "description": "Process and analyze medical images",
                 "parameters": {
-                    "image_paths": "list[string]"
+                    "image_paths": "list[string]",
+                    "interpret": "boolean",
+                    "model": "string",
+                    "pixels": "boolean",
+                    "workers": "integer",
+                    "subject": "string",
+                    "scan_dir": "string",
+                    "dedupe": "boolean",
+                    "model_url": "string",
+                    "model_timeout": "number"
+                }
+            },
+            "analyze_volumes": {
+                "function": analyze_volumes,
+                "description": "Describe 3D scan volumes (NIfTI files, DICOM series) and their intensities",
+                "parameters": {
+                    "volume_paths": "list[string]",
+                    "stats": "boolean",
+                    "threshold": "number"
+                }
+            },
+            "extract_image_features": {
+                "function": extract_image_features,
+                "description": "Extract image features into a CSV table keyed by subject id, for merging",
+                "parameters": {
+                    "image_paths": "list[string]",
+                    "output_path": "string",
+                    "workers": "integer",
+                    "dedupe": "boolean"
+                }
+            },
+            "analyze_all": {
+                "function": analyze_all,
+                "description": "Run the same analysis on every dataset in a directory in parallel",
+                "parameters": {
+                    "data_dir": "string",
+                    "analysis_type": "string",
+                    "columns": "list[string]",
+                    "groupby": "string",
+                    "workers": "integer",
+                    "timeout": "number"
                 }
             }
         }
+        
+        # Memoize tool results across sessions
+        if cache is not None:
+            for name, tool in self.tools.items():
+                tool["function"] = cache.wrap(name, tool["function"])
     
     def run(self, query: str) -> str:
         """
         Run the agent with a given query.
         
-        In this simplified version, we just parse the query to extract the command
-        and parameters, then run the appropriate tool function.
+        The query is compiled into a plan of one or more tool calls (see
+        planner.compile_query), which is then executed in order.
         
         Args:
             query: The user's query string
@@ -96,174 +235,269 @@ class CohortAgent:
         Returns:
             The agent's response
         """
-        # Parse the query to identify the tool and parameters
-        if "analysis" in query.lower() or "summary" in query.lower() or "statistics" in query.lower():
-            tool = "analyze_data"
-            params = self._extract_params_from_query(query, tool)
-            
-            # Set some defaults if not specified
-            if "analysis_type" not in params:
-                params["analysis_type"] = "summary"
-                
-            # Call the function
-            try:
-                result = self.tools[tool]["function"](**params)
-                return f"Analysis Results:\n\n{result}"
-            except Exception as e:
-                return f"Error performing analysis: {str(e)}"
-                
-        elif "visualization" in query.lower() or "plot" in query.lower() or "chart" in query.lower():
-            tool = "visualize_data"
-            params = self._extract_params_from_query(query, tool)
-            
-            # Set some defaults if not specified
-            if "plot_type" not in params:
-                params["plot_type"] = "scatter"
-            if "output_path" not in params:
-                params["output_path"] = "output/plot.png"
-                
-            # Call the function
-            try:
-                result = self.tools[tool]["function"](**params)
-                return f"Visualization created and saved to: {result}"
-            except Exception as e:
-                return f"Error creating visualization: {str(e)}"
-                
-        elif "merge" in query.lower() and ("analysis" in query.lower() or "statistics" in query.lower()):
-            tool = "merge_and_analyze"
-            params = self._extract_params_from_query(query, tool)
-            
-            # Set some defaults if not specified
-            if "analysis_type" not in params:
-                params["analysis_type"] = "correlation"
-            if "merge_on" not in params:
-                params["merge_on"] = "id"
-                
-            # Call the function
-            try:
-                result = self.tools[tool]["function"](**params)
-                return f"Merged Analysis Results:\n\n{result}"
-            except Exception as e:
-                return f"Error performing merged analysis: {str(e)}\nParams: {params}"
-                
-        elif "merge" in query.lower() and ("visualization" in query.lower() or "plot" in query.lower()):
-            tool = "merge_and_visualize"
-            params = self._extract_params_from_query(query, tool)
-            
-            # Set some defaults if not specified
-            if "plot_type" not in params:
-                params["plot_type"] = "heatmap"
-            if "output_path" not in params:
-                params["output_path"] = "output/merged_plot.png"
-            if "merge_on" not in params:
-                params["merge_on"] = "id"
-                
-            # Call the function
-            try:
-                result = self.tools[tool]["function"](**params)
-                return f"Merged visualization created and saved to: {result}"
-            except Exception as e:
-                return f"Error creating merged visualization: {str(e)}\nParams: {params}"
-                
-        elif "image" in query.lower() or "scan" in query.lower():
-            tool = "analyze_images"
-            params = self._extract_params_from_query(query, tool)
-            
-            # Call the function
-            try:
-                result = self.tools[tool]["function"](**params)
-                return f"Image Analysis Results:\n\n{result}"
-            except Exception as e:
-                return f"Error analyzing images: {str(e)}"
-        
-        else:
+        plan = self.plan(query)
+        if not plan.steps:
             # Help message if we can't determine the tool
-            return """
-            I can help with the following types of health data analysis:
-            
-            1. Data Analysis: Provide statistical analysis of health data files
-            2. Visualization: Create plots and charts from health data
-            3. Merged Analysis: Combine and analyze multiple datasets
-            4. Merged Visualization: Create visualizations from multiple datasets
-            5. Image Analysis: Process and analyze medical images
+            return HELP_MESSAGE
+        return self.execute(plan)
+    
+    def plan(self, query: str) -> QueryPlan:
+        """
+        Compile a query into a plan without running it.
+        
+        Queries the keyword compiler cannot map to a tool are planned by the
+        model, if one is configured. Image interpretation steps are pointed
+        at the agent's model, its server and its timeout.
+        
+        Args:
+            query: The user's query string
             
-            Please provide specific files and parameters for your analysis.
-            """
+        Returns:
+            The compiled QueryPlan
+        """
+        plan = compile_query(query, data_dir=self.data_dir)
+        if not plan.steps and self.model is not None:
+            plan = self._plan_with_model(query)
+        if self.model_name:
+            for step in plan.steps:
+                if step.tool == "analyze_images" and step.params.get("interpret"):
+                    step.params.setdefault("model", self.model_name)
+                    if self.model_url:
+                        step.params.setdefault("model_url", self.model_url)
+                    if self.model_timeout:
+                        step.params.setdefault("model_timeout", self.model_timeout)
+        return plan
+    
+    @property
+    def model(self):
+        """Model backend (see model.get_backend), or None without a model_name."""
+        if not self.model_name:
+            return None
+        from .model import DEFAULT_TIMEOUT, get_backend
+        return get_backend(self.model_name, base_url=self.model_url,
+                           timeout=self.model_timeout or DEFAULT_TIMEOUT)
     
-    def _extract_params_from_query(self, query: str, tool: str) -> Dict[str, Any]:
+    def _plan_with_model(self, query: str) -> QueryPlan:
+        """Ask the model to plan a query; an empty plan if it cannot."""
+        from .model import ModelError
+        try:
+            response = self.model.generate(model_plan_prompt(query, self.tools, self.data_dir))
+        except ModelError:
+            return QueryPlan(query=query)
+        return parse_model_plan(query, response, self.tools)
+    
+    def execute(self, plan: QueryPlan) -> str:
+        """
+        Execute every step of a plan.
+        
+        All steps share one data cache, so a dataset (or merged set of
+        datasets) is read once per plan no matter how many steps use it.
+        
+        Args:
+            plan: Plan returned by plan()
+            
+        Returns:
+            The responses of all steps, separated by blank lines
         """
-        Simple parameter extractor from query text.
-        This is a naive implementation. In a real system, you'd use NLP/LLM.
+        with data_cache(), budget_limits(self.budget):
+            return "\n\n".join(self._call_tool(step) for step in plan.steps)
+    
+    async def run_async(self, query: str, timeout: Optional[float] = None) -> str:
         """
-        params = {}
+        Run the agent with a given query without blocking the event loop.
         
-        # Extract file paths if mentioned
-        if "file" in query.lower() and ":" in query:
-            file_part = query.split("file:")[1].split()[0].strip()
-            if tool in ["merge_and_analyze", "merge_and_visualize"]:
-                files = file_part.split(",")
-                params["file_paths"] = [f.strip() for f in files]
-            elif tool in ["analyze_images"]:
-                files = file_part.split(",")
-                params["image_paths"] = [f.strip() for f in files]
-            else:
-                params["file_path"] = file_part.strip()
+        The steps of the compiled plan are independent tool calls, so they run
+        concurrently on the executor's worker pools while sharing one data
+        cache. Responses are returned in plan order.
         
-        # Default to example data if no files specified
-        if "file_path" not in params and tool in ["analyze_data", "visualize_data"]:
-            params["file_path"] = "data/example/lifestyle_data.csv"
-        if "file_paths" not in params and tool in ["merge_and_analyze", "merge_and_visualize"]:
-            params["file_paths"] = ["data/example/lifestyle_data.csv", "data/example/blood_biochemistry.csv"]
-        if "image_paths" not in params and tool == "analyze_images":
-            # Just a placeholder since we don't have real image data
-            params["image_paths"] = ["scans/sample/example.jpg"]
+        Args:
+            query: The user's query string
+            timeout: Per-tool-call timeout in seconds (None waits forever)
             
-        # Extract columns if mentioned
-        if "columns" in query.lower() and ":" in query:
-            col_part = query.split("columns:")[1].split(".")[0].strip()
-            cols = col_part.split(",")
-            params["columns"] = [c.strip() for c in cols]
+        Returns:
+            The agent's response
+        """
+        plan = self.plan(query)
+        if not plan.steps:
+            return HELP_MESSAGE
+        return await self.execute_async(plan, timeout=timeout)
+    
+    async def execute_async(self, plan: QueryPlan, timeout: Optional[float] = None) -> str:
+        """
+        Execute every step of a plan concurrently.
         
-        # Default columns if not specified
-        if "columns" not in params:
-            if tool in ["analyze_data", "visualize_data"]:
-                params["columns"] = ["age", "weight_kg", "height_cm"]
-            elif tool in ["merge_and_analyze", "merge_and_visualize"]:
-                params["columns"] = ["weight_kg", "Hemoglobin_g_dL"]
-                
-        # Extract plot type if mentioned
-        if "plot type" in query.lower() and ":" in query:
-            plot_part = query.split("plot type:")[1].split()[0].strip()
-            params["plot_type"] = plot_part
+        Cancelling the awaiting task cancels the steps that have not started.
         
-        # Extract analysis type if mentioned
-        if "analysis type" in query.lower() and ":" in query:
-            analysis_part = query.split("analysis type:")[1].split()[0].strip()
-            params["analysis_type"] = analysis_part
+        Args:
+            plan: Plan returned by plan()
+            timeout: Per-tool-call timeout in seconds
             
-        # Extract merge column if mentioned
-        if "merge on" in query.lower() and ":" in query:
-            merge_part = query.split("merge on:")[1].split()[0].strip()
-            params["merge_on"] = merge_part
-        elif tool in ["merge_and_analyze", "merge_and_visualize"]:
-            params["merge_on"] = "id"
+        Returns:
+            The responses of all steps, separated by blank lines
+        """
+        with data_cache():
+            results = await self.executor.gather(plan.steps, timeout=timeout)
+        responses = []
+        for call, result in zip(plan.steps, results):
+            if isinstance(result, Exception):
+                responses.append(self._format_error(call, result))
+            else:
+                responses.append(self._format_result(call, result))
+        return "\n\n".join(responses)
+    
+    async def run_stream(self, query: str,
+                         timeout: Optional[float] = None) -> AsyncIterator[StreamChunk]:
+        """
+        Run the agent with a given query, yielding results as they appear.
+        
+        Steps run in plan order. Tools with a streaming variant (analyses)
+        yield a chunk per group or block of columns; other tools yield one
+        chunk when done, carrying the path of any file they wrote as its
+        artifact. The last chunk of each step has final set.
+        
+        Args:
+            query: The user's query string
+            timeout: Per-step timeout in seconds (None waits forever)
             
-        # Extract group by if mentioned
-        if "group by" in query.lower() and ":" in query:
-            group_part = query.split("group by:")[1].split()[0].strip()
-            params["groupby"] = group_part
+        Yields:
+            StreamChunk objects
+        """
+        plan = self.plan(query)
+        if not plan.steps:
+            yield StreamChunk(0, "", HELP_MESSAGE, final=True)
+            return
+        async for chunk in self.execute_stream(plan, timeout=timeout):
+            yield chunk
+    
+    async def execute_stream(self, plan: QueryPlan, timeout: Optional[float] = None,
+                             cancel: Optional[threading.Event] = None) -> AsyncIterator[StreamChunk]:
+        """
+        Execute a plan step by step, yielding results as they appear.
+        
+        Closing the iterator (or cancelling its consumer) stops the running
+        step at its next chunk.
+        
+        Args:
+            plan: Plan returned by plan()
+            timeout: Per-step timeout in seconds
+            cancel: Event that, once set, stops the running step at its next
+                    piece and skips the remaining steps
             
-        # Extract title if mentioned for visualization
-        if "title:" in query.lower():
+        Yields:
+            StreamChunk objects
+        """
+        with data_cache(), budget_limits(self.budget):
+            for index, call in enumerate(plan.steps):
+                if cancel is not None and cancel.is_set():
+                    return
+                async for chunk in self._stream_step(index, call, timeout, cancel):
+                    yield chunk
+    
+    async def _stream_step(self, index: int, call: ToolCall, timeout: Optional[float],
+                           cancel: Optional[threading.Event] = None) -> AsyncIterator[StreamChunk]:
+        """Run one step on a worker thread and relay its pieces."""
+        loop = asyncio.get_running_loop()
+        pieces: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+        stopped = stop.is_set if cancel is None else lambda: stop.is_set() or cancel.is_set()
+        done = object()
+        
+        def put(item):
             try:
-                title_part = query.split("title:")[1].split(".")[0].strip()
-                params["title"] = title_part
-            except (IndexError, KeyError):
-                # If there's an error parsing the title, try a different approach
-                if "title" in query.lower():
-                    # Just use what comes after "title:" as the title
-                    parts = query.lower().split("title:")
-                    if len(parts) > 1:
-                        params["title"] = parts[1].strip()
-            
-        return params
\ No newline at end of file
+                loop.call_soon_threadsafe(pieces.put_nowait, item)
+            except RuntimeError:
+                # The event loop is gone; nobody is listening any more
+                stop.set()
+        
+        def produce():
+            try:
+                for piece in self._step_pieces(call):
+                    if stopped():
+                        return
+                    put(piece)
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+        
+        streaming = "stream" in self.tools[call.tool]
+        prefix, suffix = self._templates(call.tool)[0].split("{result}", 1)
+        deadline = None if timeout is None else loop.time() + timeout
+        loop.run_in_executor(self.executor.threads, contextvars.copy_context().run, produce)
+        started = False
+        try:
+            while True:
+                remaining = None if deadline is None else max(0.0, deadline - loop.time())
+                try:
+                    piece = await asyncio.wait_for(pieces.get(), remaining)
+                except asyncio.TimeoutError:
+                    error = ToolTimeoutError(f"{call.tool} timed out after {timeout:g}s")
+                    yield StreamChunk(index, call.tool, self._format_error(call, error),
+                                      final=True, error=True)
+                    return
+                if piece is done:
+                    break
+                if isinstance(piece, Exception):
+                    text = ("\n" if started else "") + self._format_error(call, piece)
+                    yield StreamChunk(index, call.tool, text, final=True, error=True)
+                    return
+                if streaming:
+                    yield StreamChunk(index, call.tool, (prefix if not started else "") + piece)
+                    started = True
+                else:
+                    artifact = piece if isinstance(piece, str) and os.path.isfile(piece) else None
+                    yield StreamChunk(index, call.tool, self._format_result(call, piece),
+                                      artifact=artifact, final=True)
+                    return
+            yield StreamChunk(index, call.tool, suffix if started else prefix + suffix, final=True)
+        finally:
+            stop.set()
+    
+    def _step_pieces(self, call: ToolCall) -> Iterator[Any]:
+        """Pieces of a step's result: streamed if the tool supports it, else the whole result."""
+        tool = self.tools[call.tool]
+        function, stream = tool["function"], tool.get("stream")
+        with span(f"tool:{call.tool}"):
+            if stream is None:
+                yield function(**call.params)
+            elif isinstance(function, CachedTool):
+                yield from function.stream(stream, **call.params)
+            else:
+                yield from stream(**call.params)
+    
+    @property
+    def executor(self) -> AsyncToolExecutor:
+        """Worker pools used by run_async, created on first use."""
+        if self._executor is None:
+            self._executor = AsyncToolExecutor(self.tools, max_workers=self.max_workers,
+                                               process_workers=self.process_workers,
+                                               budget=self.budget)
+        return self._executor
+    
+    def close(self):
+        """Shut down the worker pools used by run_async."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+    
+    def _call_tool(self, call: ToolCall) -> str:
+        """Run one tool call and format its result or error."""
+        try:
+            with span(f"tool:{call.tool}"):
+                result = self.tools[call.tool]["function"](**call.params)
+            return self._format_result(call, result)
+        except Exception as e:
+            return self._format_error(call, e)
+    
+    def _templates(self, tool: str):
+        """Success and error templates for a tool."""
+        return RESPONSE_TEMPLATES.get(
+            tool, (f"{tool} results:\n\n{{result}}", f"Error in {tool}: {{error}}"))
+    
+    def _format_result(self, call: ToolCall, result: Any) -> str:
+        """Format a tool's return value as a response."""
+        return self._templates(call.tool)[0].format(result=result)
+    
+    def _format_error(self, call: ToolCall, error: Exception) -> str:
+        """Format a tool's exception as a response."""
+        return self._templates(call.tool)[1].format(error=str(error), params=call.params)
@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import json
+import sys
+import time
+from typing import List, Dict, Union, Optional, Tuple, Any, Iterable, Iterator, TextIO
+
+from .planner import ToolCall
+from .utils import data_cache
+
+def read_batch_requests(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    Parse batch input, one request per line.
+
+    A line is either a plain-text query or a JSON object:
+    {"query": "..."} or {"tool": "analyze_data", "params": {...}}, with an
+    optional "id". Blank lines and lines starting with # are skipped. Lines
+    that cannot be parsed become requests carrying an "error".
+
+    Args:
+        lines: Input lines (e.g. an open file or sys.stdin)
+
+    Returns:
+        Iterator of request dictionaries, each with an "id"
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if not line.startswith("{"):
+            yield {"id": line_number, "query": line}
+            continue
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict) or not ("query" in request or "tool" in request):
+                raise ValueError('expected an object with "query" or "tool"')
+        except ValueError as e:
+            yield {"id": line_number, "error": f"Invalid request on line {line_number}: {e}"}
+            continue
+        request.setdefault("id", line_number)
+        yield request
+
+async def run_batch_request(agent, request: Dict[str, Any],
+                            timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Run one batch request and describe the outcome.
+
+    Never raises: failures are reported in the returned record.
+
+    Args:
+        agent: CohortAgent to run the request with
+        request: Request from read_batch_requests
+        timeout: Per-tool-call timeout in seconds
+
+    Returns:
+        Result record with id, ok, per-step results and timings
+    """
+    start = time.perf_counter()
+    record: Dict[str, Any] = {"id": request.get("id")}
+    for key in ("query", "tool"):
+        if key in request:
+            record[key] = request[key]
+
+    if "error" in request:
+        steps, error = [], request["error"]
+    elif "tool" in request:
+        if request["tool"] not in agent.tools:
+            steps, error = [], f"Unknown tool: {request['tool']}"
+        else:
+            steps, error = [ToolCall(request["tool"], dict(request.get("params") or {}))], None
+    else:
+        # Planning may ask the model and block; keep the other requests running meanwhile
+        loop = asyncio.get_running_loop()
+        plan = await loop.run_in_executor(None, contextvars.copy_context().run,
+                                          agent.plan, str(request["query"]))
+        steps = plan.steps
+        error = None if steps else "No tool matched the query"
+
+    record["steps"] = []
+    for step in steps:
+        step_start = time.perf_counter()
+        step_record: Dict[str, Any] = {"tool": step.tool, "params": step.params}
+        try:
+            step_record["result"] = await agent.executor.call(step, timeout=timeout)
+            step_record["ok"] = True
+        except Exception as e:
+            step_record["error"] = f"{type(e).__name__}: {e}"
+            step_record["ok"] = False
+        step_record["elapsed_ms"] = round((time.perf_counter() - step_start) * 1000, 2)
+        record["steps"].append(step_record)
+
+    record["ok"] = error is None and all(s["ok"] for s in record["steps"])
+    if error is not None:
+        record["error"] = error
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return record
+
+async def run_batch_async(agent, requests: Iterable[Dict[str, Any]], output: TextIO,
+                          workers: int = 4, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Run batch requests on a shared agent and stream JSONL results.
+
+    Up to `workers` requests run at once. All requests share one data cache,
+    so each dataset is read once per batch. Records are written as soon as
+    each request finishes, so they may be out of input order (use "id").
+
+    Args:
+        agent: CohortAgent shared by all requests
+        requests: Requests from read_batch_requests
+        output: Stream that receives one JSON record per line
+        workers: Maximum number of requests in flight
+        timeout: Per-tool-call timeout in seconds
+
+    Returns:
+        Summary with the number of requests, failures and total time
+    """
+    start = time.perf_counter()
+    slots = asyncio.Semaphore(max(1, workers))
+    summary = {"requests": 0, "failed": 0}
+
+    async def run_one(request):
+        async with slots:
+            record = await run_batch_request(agent, request, timeout=timeout)
+        summary["requests"] += 1
+        summary["failed"] += 0 if record["ok"] else 1
+        output.write(json.dumps(record, default=str) + "\n")
+        output.flush()
+
+    with data_cache():
+        await asyncio.gather(*(run_one(request) for request in requests))
+    summary["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+    return summary
+
+def run_batch(agent, source: str, output_path: Optional[str] = None,
+              workers: int = 4, timeout: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Run a batch file (or stdin) through the agent.
+
+    Args:
+        agent: CohortAgent shared by all requests
+        source: Path to the batch file, or "-" for stdin
+        output_path: Path of the JSONL output, or None/"-" for stdout
+        workers: Maximum number of requests in flight
+        timeout: Per-tool-call timeout in seconds
+
+    Returns:
+        Summary with the number of requests, failures and total time
+    """
+    input_file = sys.stdin if source == "-" else open(source)
+    output_file = sys.stdout if output_path in (None, "-") else open(output_path, "w")
+    try:
+        requests = list(read_batch_requests(input_file))
+        return asyncio.run(run_batch_async(agent, requests, output_file,
+                                           workers=workers, timeout=timeout))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
@@ -0,0 +1,385 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, List, Dict, Union, Optional, Tuple, Any
+
+from .budget import Budget, budget_limits
+from .cache import DEFAULT_CACHE_DIR
+from .tracing import span
+
+# Cohort sizes benchmarked: subjects and features per omics modality
+SCALES = {
+    "small": {"subjects": 1_000, "features": 50},
+    "medium": {"subjects": 20_000, "features": 200},
+    "large": {"subjects": 100_000, "features": 500},
+}
+
+ANALYSIS_TYPES = ("summary", "correlation", "distribution", "regression", "ttest", "anova")
+PLOT_TYPES = ("histogram", "scatter", "heatmap", "bar", "box", "violin", "swarm", "joint",
+              "pair", "density", "line", "regression")
+
+# End-to-end queries timed through CohortAgent.run
+AGENT_QUERIES = (
+    "summary of lifestyle",
+    "correlation of proteomics",
+    "merge lifestyle and proteomics then summary",
+)
+
+# Tool calls run under the GUI's default limits, as in production; without
+# them a swarm plot of 10^5 points alone would take hours
+BENCHMARK_BUDGET = Budget(max_rows=1_000_000, max_memory_mb=1024, max_seconds=120)
+
+DEFAULT_REPEAT = 3
+
+# How tools begin the text they return on failure
+ERROR_PREFIXES = ("Error", "Unknown analysis type")
+
+# A stage regresses when its median is this fraction slower than the baseline
+# and slower by at least MIN_DELTA_MS (differences below that are noise)
+DEFAULT_THRESHOLD = 0.25
+MIN_DELTA_MS = 5.0
+MIN_DELTA_MB = 1.0
+
+# Allocation sites recorded per stage when profiling memory
+MEMORY_SITES = 5
+
+# Bump when the layout of result files changes
+RESULTS_VERSION = 1
+
+DEFAULT_COHORT_DIR = os.path.join(DEFAULT_CACHE_DIR, "benchmark_cohorts")
+
+def prepare_cohort(scale: str, cohort_dir: str = DEFAULT_COHORT_DIR, seed: int = 42) -> Dict[str, str]:
+    """
+    Files of the benchmark cohort of a scale, generated on first use.
+
+    Generation is deterministic, so a cohort is generated once per scale
+    and seed and reused by later runs.
+
+    Returns:
+        Modality -> path of the lifestyle, proteomics and metabolomics files
+    """
+    from .synthetic import generate_cohort
+
+    size = SCALES[scale]
+    directory = os.path.join(cohort_dir, f"{scale}-{size['subjects']}x{size['features']}-{seed}")
+    modalities = ["lifestyle", "proteomics", "metabolomics"]
+    files = {m: os.path.join(directory, f"{m}.csv") for m in modalities}
+    if not all(os.path.exists(path) for path in files.values()):
+        generate_cohort(directory, n_subjects=size["subjects"], features=size["features"],
+                        modalities=modalities, n_sites=4, missing_rate=0.02, seed=seed)
+    return files
+
+def benchmark_stages(files: Dict[str, str], output_dir: str) -> List[Tuple[str, Callable[[], Any]]]:
+    """
+    The stages timed on one cohort, as (name, function) pairs.
+
+    Tool stages call the tools as the agent does, so each includes reading
+    its input files; load_csv and merge_dataframes time those parts alone.
+    """
+    from .agent import CohortAgent
+    from .tools import analyze_data, merge_and_analyze, visualize_data
+    from .utils import load_csv, merge_dataframes
+
+    lifestyle, proteomics = files["lifestyle"], files["proteomics"]
+    features = [c for c in load_csv(proteomics).columns if c not in ("id", "site")]
+    frames = [load_csv(lifestyle), load_csv(proteomics)]
+    analysis_params = {
+        "summary": {},
+        "correlation": {"columns": features[:20]},
+        "distribution": {"columns": features[:20]},
+        "regression": {"columns": features[:2]},
+        "ttest": {"columns": features[:2]},
+        "anova": {"columns": features[:5] + ["site"], "groupby": "site"},
+    }
+    merged_params = {
+        "summary": {"columns": ["age", "bmi"] + features[:10]},
+        "correlation": {"columns": ["age", "bmi"] + features[:10]},
+        "distribution": {"columns": ["age", "bmi"] + features[:10]},
+        "regression": {"columns": ["bmi", features[0]]},
+        "ttest": {"columns": ["bmi", features[0]]},
+        # Both files have a site column; the merge suffixes them
+        "anova": {"columns": ["bmi", features[0], "site_x"], "groupby": "site_x"},
+    }
+    plot_columns = ["age", "height_cm", "weight_kg", "bmi"]
+    agent = CohortAgent(data_dir=os.path.dirname(lifestyle), budget=BENCHMARK_BUDGET)
+
+    stages: List[Tuple[str, Callable[[], Any]]] = [
+        ("load_csv", lambda: load_csv(proteomics)),
+        ("merge_dataframes", lambda: merge_dataframes(frames, on="id")),
+    ]
+    for analysis_type in ANALYSIS_TYPES:
+        stages.append((f"analyze_data:{analysis_type}",
+                       lambda t=analysis_type: analyze_data(proteomics, t, **analysis_params[t])))
+    for analysis_type in ANALYSIS_TYPES:
+        stages.append((f"merge_and_analyze:{analysis_type}",
+                       lambda t=analysis_type: merge_and_analyze([lifestyle, proteomics], t, merge_on="id",
+                                                                 **merged_params[t])))
+    for plot_type in PLOT_TYPES:
+        stages.append((f"visualize_data:{plot_type}",
+                       lambda p=plot_type: visualize_data(lifestyle, p, columns=plot_columns,
+                                                          output_path=os.path.join(output_dir, f"{p}.png"))))
+    for query in AGENT_QUERIES:
+        stages.append((f"agent:{query}", lambda q=query: agent.run(q)))
+    return stages
+
+def time_stage(function: Callable[[], Any], repeat: int = DEFAULT_REPEAT) -> Dict[str, Any]:
+    """
+    Time a stage: one untimed warm-up run (imports, caches), then repeat timed runs.
+
+    Returns:
+        Dictionary with median_ms, min_ms and runs
+
+    Raises:
+        RuntimeError: If the stage reports an error (tools return their errors
+                     as text, and timing an error path would hide a regression)
+    """
+    with budget_limits(BENCHMARK_BUDGET):
+        result = function()
+        if isinstance(result, str) and result.startswith(ERROR_PREFIXES):
+            raise RuntimeError(result)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            times.append((time.perf_counter() - start) * 1000)
+    return {"median_ms": round(statistics.median(times), 2), "min_ms": round(min(times), 2), "runs": repeat}
+
+def profile_stage(function: Callable[[], Any], sites: int = MEMORY_SITES) -> Dict[str, Any]:
+    """
+    Run a stage once under the memory profiler (src/memory.py).
+
+    Run it after time_stage, so imports and caches do not count.
+
+    Returns:
+        Dictionary with peak_mb (heap above the start), rss_peak_mb, the
+        peak of each phase in phases and the top allocation sites as
+        [phase, site, MB]
+    """
+    from .memory import memory_profiling
+
+    mb = 1024 * 1024
+    with budget_limits(BENCHMARK_BUDGET), memory_profiling() as tracer:
+        with span("stage") as s:
+            function()
+    phases = tracer.memory_summary()
+    return {"peak_mb": round(s.attributes["peak_bytes"] / mb, 2),
+            "rss_peak_mb": round(s.attributes["rss_peak_bytes"] / mb, 1),
+            "phases": {p["phase"]: round(p["peak_bytes"] / mb, 2) for p in phases if p["phase"] != "stage"},
+            "sites": [[phase, site, round(size / mb, 2)] for phase, site, size in tracer.top_sites(sites)]}
+
+def run_benchmarks(scales: List[str], stages: Optional[List[str]] = None,
+                   repeat: int = DEFAULT_REPEAT, cohort_dir: str = DEFAULT_COHORT_DIR,
+                   progress: Optional[Callable[[str], None]] = None,
+                   memory: bool = False) -> Dict[str, Any]:
+    """
+    Time every stage at every scale.
+
+    Args:
+        scales: Keys of SCALES
+        stages: Only run stages whose name starts with one of these (None: all)
+        repeat: Timed runs per stage
+        cohort_dir: Directory benchmark cohorts are generated in
+        progress: Called with a line of text as each stage finishes
+        memory: Also run each stage once under the memory profiler and record
+                its peak memory (see profile_stage) under "memory"
+
+    Returns:
+        Results: {"version", "machine", "repeat", "results": {scale: {stage: timing}}}
+    """
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown:
+        raise ValueError(f"Unknown scale: {', '.join(unknown)}; expected {', '.join(SCALES)}")
+    results: Dict[str, Dict[str, Any]] = {}
+    output_dir = tempfile.mkdtemp(prefix="cohortagent-bench-")
+    try:
+        for scale in scales:
+            files = prepare_cohort(scale, cohort_dir)
+            results[scale] = {}
+            for name, function in benchmark_stages(files, output_dir):
+                if stages and not any(name.startswith(prefix) for prefix in stages):
+                    continue
+                timing = results[scale][name] = time_stage(function, repeat)
+                line = f"{scale:>6}  {name:<40} {timing['median_ms']:>10.1f} ms"
+                if memory:
+                    timing["memory"] = profile_stage(function)
+                    line += f" {timing['memory']['peak_mb']:>10.1f} MB"
+                if progress:
+                    progress(line)
+    finally:
+        shutil.rmtree(output_dir, ignore_errors=True)
+    return {"version": RESULTS_VERSION, "machine": machine_info(), "repeat": repeat, "results": results}
+
+def machine_info() -> Dict[str, Any]:
+    """What the timings depend on besides the code."""
+    import numpy as np
+    import pandas as pd
+
+    return {"platform": platform.platform(), "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(), "python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__}
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any],
+            threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """
+    Compare results against a baseline, stage by stage.
+
+    Peak memory is compared the same way where both have it (benchmarks
+    run with memory profiling), with MIN_DELTA_MB as the noise floor.
+
+    Returns:
+        One row per timed stage: scale, stage, median_ms, baseline_ms, ratio,
+        peak_mb, baseline_peak_mb, regressed (the metrics that regressed:
+        "time" and/or "memory") and status ("regression", "improved", "ok",
+        or "new" if the baseline has no timing for it)
+    """
+    def change(current: float, previous: float, min_delta: float) -> str:
+        if current > previous * (1 + threshold) and current - previous >= min_delta:
+            return "regression"
+        if current < previous / (1 + threshold) and previous - current >= min_delta:
+            return "improved"
+        return "ok"
+
+    rows = []
+    for scale, stages in results["results"].items():
+        for stage, timing in stages.items():
+            base = baseline.get("results", {}).get(scale, {}).get(stage)
+            peak = timing.get("memory", {}).get("peak_mb")
+            row = {"scale": scale, "stage": stage, "median_ms": timing["median_ms"],
+                   "baseline_ms": None, "ratio": None, "peak_mb": peak, "baseline_peak_mb": None,
+                   "regressed": [], "status": "new"}
+            if base is not None:
+                current, previous = timing["median_ms"], base["median_ms"]
+                row.update(baseline_ms=previous, ratio=round(current / previous, 3) if previous else None)
+                changes = {"time": change(current, previous, MIN_DELTA_MS)}
+                base_peak = base.get("memory", {}).get("peak_mb")
+                if peak is not None and base_peak is not None:
+                    row["baseline_peak_mb"] = base_peak
+                    changes["memory"] = change(peak, base_peak, MIN_DELTA_MB)
+                row["regressed"] = [metric for metric, status in changes.items() if status == "regression"]
+                if row["regressed"]:
+                    row["status"] = "regression"
+                elif "improved" in changes.values():
+                    row["status"] = "improved"
+                else:
+                    row["status"] = "ok"
+            rows.append(row)
+    return rows
+
+def format_report(rows: List[Dict[str, Any]]) -> str:
+    """Comparison rows as a text table, regressions first."""
+    order = {"regression": 0, "improved": 1, "new": 2, "ok": 3}
+    memory = any(row.get("peak_mb") is not None for row in rows)
+    header = f"{'Scale':<8}{'Stage':<42}{'Median ms':>11}{'Baseline':>11}{'Ratio':>8}"
+    if memory:
+        header += f"{'Peak MB':>10}{'Baseline':>10}"
+    lines = [header + "  Status"]
+
+    def number(value: Optional[float], spec: str) -> str:
+        return format(value, spec) if value is not None else "-"
+
+    for row in sorted(rows, key=lambda r: (order[r["status"]], r["scale"], r["stage"])):
+        line = (f"{row['scale']:<8}{row['stage']:<42}{row['median_ms']:>11.1f}"
+                f"{number(row['baseline_ms'], '.1f'):>11}{number(row['ratio'], '.2f'):>8}")
+        if memory:
+            line += f"{number(row.get('peak_mb'), '.1f'):>10}{number(row.get('baseline_peak_mb'), '.1f'):>10}"
+        status = row["status"]
+        if status == "regression":
+            status = f"REGRESSION ({', '.join(row.get('regressed') or ['time'])})"
+        lines.append(f"{line}  {status}")
+    regressions = sum(1 for r in rows if r["status"] == "regression")
+    lines.append(f"\n{regressions} regression(s) in {len(rows)} stage(s)")
+    return "\n".join(lines)
+
+def format_memory_report(results: Dict[str, Any]) -> str:
+    """Peak memory of each profiled stage, its largest phase and top allocation sites."""
+    lines = ["Peak memory per stage (heap above the start of the stage)"]
+    for scale, stages in results["results"].items():
+        for stage, timing in stages.items():
+            memory = timing.get("memory")
+            if memory is None:
+                continue
+            phase = max(memory["phases"].items(), key=lambda p: p[1], default=("-", 0))
+            lines.append(f"{scale:>6}  {stage:<40}{memory['peak_mb']:>9.1f} MB peak, "
+                         f"{memory['rss_peak_mb']:.0f} MB RSS; largest phase {phase[0]} ({phase[1]:.1f} MB)")
+            for site_phase, site, mb in memory["sites"]:
+                lines.append(f"{'':>8}{mb:>9.1f} MB  {site_phase:<24}{site}")
+    return "\n".join(lines)
+
+def save_results(results: Dict[str, Any], path: str, merge: bool = True):
+    """
+    Write results as JSON; with merge, timings already in the file for other
+    scales and stages are kept.
+    """
+    if merge and os.path.exists(path):
+        previous = load_results(path)
+        for scale, stages in results["results"].items():
+            previous["results"].setdefault(scale, {}).update(stages)
+        previous.update(version=results["version"], machine=results["machine"], repeat=results["repeat"])
+        results = previous
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def load_results(path: str) -> Dict[str, Any]:
+    """Read results or a baseline written by save_results."""
+    with open(path) as f:
+        results = json.load(f)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{path} has results version {results.get('version')}, expected {RESULTS_VERSION}")
+    return results
+
+def main(argv: Optional[List[str]] = None):
+    """Command-line entry point (python -m src.benchmark)."""
+    parser = argparse.ArgumentParser(description="Benchmark CohortAgent's stages on synthetic cohorts")
+    parser.add_argument("--scales", nargs="+", default=["small"], choices=list(SCALES),
+                        help="Cohort sizes to benchmark (default: small)")
+    parser.add_argument("--stages", nargs="+", default=None, metavar="PREFIX",
+                        help="Only run stages starting with these names, e.g. load_csv visualize_data")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="Timed runs per stage")
+    parser.add_argument("--output", type=str, default=None, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Compare against this results file and exit with status 1 on regressions")
+    parser.add_argument("--save-baseline", type=str, default=None, metavar="FILE",
+                        help="Record the results as the baseline in FILE (merged with its other timings)")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Fraction slower (or larger peak memory) than the baseline that counts "
+                             "as a regression")
+    parser.add_argument("--memory", action="store_true",
+                        help="Also profile each stage's peak memory, per phase, with its top "
+                             "allocation sites (one extra run per stage)")
+    parser.add_argument("--cohort-dir", type=str, default=DEFAULT_COHORT_DIR,
+                        help="Where benchmark cohorts are generated and kept")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, stages=args.stages, repeat=args.repeat,
+                             cohort_dir=args.cohort_dir, progress=print, memory=args.memory)
+    if args.memory:
+        print()
+        print(format_memory_report(results))
+    if args.output:
+        save_results(results, args.output, merge=False)
+    if args.save_baseline:
+        save_results(results, args.save_baseline)
+        print(f"Baseline saved to {args.save_baseline}")
+    if args.baseline:
+        baseline = load_results(args.baseline)
+        if baseline.get("machine") != results["machine"]:
+            print("Warning: the baseline was recorded on a different machine or library versions",
+                  file=sys.stderr)
+        rows = compare(results, baseline, args.threshold)
+        print()
+        print(format_report(rows))
+        if any(row["status"] == "regression" for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Tuple, Any, Callable, Iterator
+
+from .longitudinal import LONGITUDINAL_OPERATIONS, visit_columns
+from .tracing import span
+from .utils import load_csv, load_merged, merge_dataframes
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Rough size of a parsed CSV in memory relative to its size on disk
+CSV_MEMORY_FACTOR = 2.0
+
+# Peak memory of a column-wise analysis as a multiple of its input frame
+ANALYSIS_MEMORY_FACTOR = 3
+
+# Approximate matplotlib memory per drawn point, and per annotated heatmap cell
+PLOT_BYTES_PER_POINT = 200
+HEATMAP_BYTES_PER_CELL = 2000
+
+# Operations whose cost grows with the number of column pairs; they shed
+# columns rather than rows
+PAIRWISE_OPERATIONS = ("correlation", "heatmap", "pair")
+
+# With a time budget, rows kept for plots whose layout cost grows faster than
+# linearly with the number of points
+SLOW_PLOT_ROWS = {"swarm": 2000, "pair": 5000, "clustermap": 5000, "joint": 20000,
+                  "density": 20000, "violin": 50000}
+
+# Rows read per chunk when filtering a large file against sampled merge keys
+CHUNK_ROWS = 100000
+
+# Seed of every sample, so degraded results are reproducible
+SAMPLE_SEED = 0
+
+@dataclass
+class Budget:
+    """
+    Limits for a single tool call. None means unlimited.
+
+    Attributes:
+        max_rows: Rows a tool works on; larger inputs are sampled
+        max_memory_mb: Estimated peak memory of the call; over-budget inputs
+                      are sampled (or, for pairwise operations, reduced to
+                      fewer columns) before the work starts
+        max_seconds: Wall time of the call; long analyses stop early and
+                    report what they finished, slow plot types are sampled
+    """
+    max_rows: Optional[int] = None
+    max_memory_mb: Optional[float] = None
+    max_seconds: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, override_env: bool = False, **limits) -> "Budget":
+        """
+        Budget from COHORTAGENT_MAX_ROWS, COHORTAGENT_MAX_MEMORY_MB and
+        COHORTAGENT_MAX_SECONDS combined with the given limits.
+
+        Args:
+            override_env: If True the given limits win over the environment;
+                         otherwise they are defaults the environment can change
+            **limits: max_rows, max_memory_mb and/or max_seconds
+        """
+        values = {}
+        for field, variable, cast in (("max_rows", "COHORTAGENT_MAX_ROWS", int),
+                                      ("max_memory_mb", "COHORTAGENT_MAX_MEMORY_MB", float),
+                                      ("max_seconds", "COHORTAGENT_MAX_SECONDS", float)):
+            if os.environ.get(variable):
+                values[field] = cast(os.environ[variable])
+        if override_env:
+            values.update(limits)
+        else:
+            values = dict(limits, **values)
+        return cls(**values)
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_rows is None and self.max_memory_mb is None and self.max_seconds is None
+
+_active_budget: ContextVar[Optional[Budget]] = ContextVar("cohortagent_budget", default=None)
+
+@contextmanager
+def budget_limits(budget: Optional[Budget]) -> Iterator[Optional[Budget]]:
+    """
+    Apply a budget to every tool call made in this context (and in tool
+    threads started from it). None leaves the current budget in place.
+    """
+    if budget is None:
+        yield _active_budget.get()
+        return
+    token = _active_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _active_budget.reset(token)
+
+def current_budget() -> Optional[Budget]:
+    """Budget active in this context, if any."""
+    return _active_budget.get()
+
+_time_cutoffs: ContextVar[Optional[List[str]]] = ContextVar("cohortagent_time_cutoffs", default=None)
+
+@contextmanager
+def time_cutoffs() -> Iterator[List[str]]:
+    """
+    Collect the tools cut short by their time budget within this context.
+
+    What such a call returns depends on how fast it ran, so it is not
+    worth caching; row and memory limits are deterministic and are.
+    """
+    cutoffs: List[str] = []
+    token = _time_cutoffs.set(cutoffs)
+    try:
+        yield cutoffs
+    finally:
+        _time_cutoffs.reset(token)
+
+def note_time_cutoff(tool: str):
+    """Record that tool stopped early for lack of time (see time_cutoffs)."""
+    cutoffs = _time_cutoffs.get()
+    if cutoffs is not None:
+        cutoffs.append(tool)
+
+def call_with_budget(budget: Optional[Budget], function: Callable, **params) -> Any:
+    """Call a tool under a budget (used to carry the budget into worker processes)."""
+    with budget_limits(budget):
+        return function(**params)
+
+def sample_rows(data: "pd.DataFrame", n: int, group: Optional[str] = None) -> "pd.DataFrame":
+    """
+    n rows of data at random, in their original order.
+
+    With group, whole groups (e.g. all visits of a subject) are drawn
+    instead, as many as fit in n rows (at least one).
+    """
+    if group is None:
+        return data.sample(n=n, random_state=SAMPLE_SEED).sort_index()
+    import numpy as np
+
+    sizes = data[group].value_counts(sort=False).sample(frac=1, random_state=SAMPLE_SEED)
+    count = max(1, int(np.searchsorted(np.cumsum(sizes.to_numpy()), n, side="right")))
+    return data[data[group].isin(sizes.index[:count])]
+
+def estimate_peak_bytes(data: "pd.DataFrame", operation: str) -> int:
+    """
+    Rough peak memory of running an analysis or plot on data.
+
+    Args:
+        data: Input frame
+        operation: Analysis type or plot type
+
+    Returns:
+        Estimated bytes
+    """
+    rows = len(data)
+    numeric = len(data.select_dtypes(include="number").columns)
+    base = int(data.memory_usage(deep=False).sum())
+    if operation == "correlation":
+        return 2 * base + numeric * numeric * 8
+    if operation == "heatmap":
+        return 2 * base + numeric * numeric * (8 + HEATMAP_BYTES_PER_CELL)
+    if operation == "pair":
+        return base + rows * numeric * numeric * PLOT_BYTES_PER_POINT
+    if operation == "clustermap":
+        # Rows are clustered too: the distance matrix is quadratic in rows
+        return base + rows * rows * 8 + numeric * numeric * 8
+    if operation in SLOW_PLOT_ROWS or operation in ("histogram", "scatter", "bar", "box", "line"):
+        return base + rows * max(1, numeric) * PLOT_BYTES_PER_POINT
+    return ANALYSIS_MEMORY_FACTOR * base
+
+class CallBudget:
+    """
+    Budget bookkeeping for one tool call.
+
+    Created by the tool at the start of the call (see call_budget); loads
+    data within the budget, trims it before expensive work, tells long
+    loops when to stop, and records a note for every degradation so the tool
+    can report it.
+    """
+
+    def __init__(self, tool: str, budget: Optional[Budget] = None):
+        self.tool = tool
+        self.budget = budget or Budget()
+        self.started = time.monotonic()
+        self.notes: List[str] = []
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        if self.budget.max_memory_mb is None:
+            return None
+        return int(self.budget.max_memory_mb * 1024 * 1024)
+
+    def note(self, message: str):
+        """Record a degradation."""
+        if message not in self.notes:
+            self.notes.append(message)
+
+    def out_of_time(self) -> bool:
+        """Whether the call has used up its wall-time budget (recorded as a time cutoff)."""
+        if (self.budget.max_seconds is not None
+                and time.monotonic() - self.started > self.budget.max_seconds):
+            note_time_cutoff(self.tool)
+            return True
+        return False
+
+    def _read_fraction(self, file_paths: List[str]) -> float:
+        """Fraction of rows that can be read from files without breaking the budget."""
+        fraction = 1.0
+        sizes = [os.path.getsize(p) for p in file_paths if os.path.exists(p)]
+        if self.max_bytes is not None and sizes:
+            estimated = sum(sizes) * CSV_MEMORY_FACTOR
+            if estimated > self.max_bytes:
+                fraction = min(fraction, self.max_bytes / estimated)
+        if self.budget.max_rows is not None and sizes:
+            rows = max(_estimate_rows(p) for p in file_paths if os.path.exists(p))
+            if rows > self.budget.max_rows:
+                # Read a little extra; fit() trims to the exact row budget
+                fraction = min(fraction, 1.1 * self.budget.max_rows / rows)
+        return fraction
+
+    def load_csv(self, file_path: str, operation: Optional[str] = None) -> "pd.DataFrame":
+        """
+        load_csv that never parses more rows than the budget allows.
+
+        Files whose estimated size in memory exceeds the budget are sampled
+        while parsing, so the full file is never materialized. For
+        longitudinal operations, whole subjects are sampled instead of rows.
+        """
+        fraction = self._read_fraction([file_path])
+        if fraction >= 1.0:
+            return load_csv(file_path)
+        subject = None
+        if operation in LONGITUDINAL_OPERATIONS:
+            import pandas as pd
+
+            subject = (visit_columns(list(pd.read_csv(file_path, nrows=0).columns)) or [None])[0]
+        if subject is not None:
+            self.note(f"sampled about {fraction:.0%} of the subjects of {os.path.basename(file_path)} "
+                      f"while reading to stay within the budget")
+            return _read_csv_groups(file_path, fraction, subject)
+        self.note(f"sampled about {fraction:.0%} of the rows of {os.path.basename(file_path)} "
+                  f"while reading to stay within the budget")
+        return _read_csv_sample(file_path, fraction)
+
+    def load_merged(self, file_paths: List[str], on: Optional[str] = None) -> "pd.DataFrame":
+        """
+        load_merged that never parses more rows than the budget allows.
+
+        Over budget, the first file is sampled while reading and the others
+        are streamed in chunks, keeping only rows whose merge key was
+        sampled, so the merge stays consistent.
+        """
+        fraction = self._read_fraction(file_paths)
+        if fraction >= 1.0:
+            return load_merged(file_paths, on=on)
+        self.note(f"sampled about {fraction:.0%} of the rows before merging to stay within the budget")
+        if not on:
+            # Index-aligned concat: the same seed samples the same row positions in every file
+            return merge_dataframes([_read_csv_sample(p, fraction) for p in file_paths])
+        import pandas as pd
+
+        first = _read_csv_sample(file_paths[0], fraction)
+        keys = set(first[on])
+        frames = [first]
+        for path in file_paths[1:]:
+            with span("filter_csv_chunks", path=path) as s:
+                parts = [chunk[chunk[on].isin(keys)] for chunk in pd.read_csv(path, chunksize=CHUNK_ROWS)]
+                frames.append(pd.concat(parts, ignore_index=True))
+                s.set(rows=len(frames[-1]))
+        return merge_dataframes(frames, on=on)
+
+    def fit(self, data: "pd.DataFrame", operation: str,
+            keep: Optional[List[str]] = None) -> "pd.DataFrame":
+        """
+        Trim loaded data to the budget before running operation on it.
+
+        Rows beyond max_rows are sampled. If the estimated peak memory is
+        still too high, pairwise operations drop the lowest-variance numeric
+        columns and everything else is sampled further. With a time budget,
+        slow plot types are limited to SLOW_PLOT_ROWS.
+
+        Args:
+            data: Loaded data
+            operation: Analysis type or plot type
+            keep: Columns that must not be dropped (e.g. groupby)
+
+        Returns:
+            The data to work on (the input itself if it fits)
+        """
+        if self.budget.unlimited:
+            return data
+        # Longitudinal operations need every visit of a subject; sample whole subjects
+        group = None
+        if operation in LONGITUDINAL_OPERATIONS:
+            subject = visit_columns(list(data.columns))
+            group = subject[0] if subject else None
+        rows = len(data)
+        if self.budget.max_rows is not None and rows > self.budget.max_rows:
+            data = sample_rows(data, self.budget.max_rows, group)
+            self.note(f"sampled {len(data):,} of {rows:,} rows (row budget)")
+        if self.budget.max_seconds is not None and len(data) > SLOW_PLOT_ROWS.get(operation, len(data)):
+            limit = SLOW_PLOT_ROWS[operation]
+            self.note(f"sampled {limit:,} of {len(data):,} rows for the {operation} plot (time budget)")
+            data = sample_rows(data, limit, group)
+        if self.max_bytes is None:
+            return data
+        estimated = estimate_peak_bytes(data, operation)
+        if estimated <= self.max_bytes:
+            return data
+
+        if operation in PAIRWISE_OPERATIONS:
+            numeric = list(data.select_dtypes(include="number").columns)
+            keep = [c for c in (keep or []) if c in data.columns]
+            ranked = list(data[numeric].var().sort_values(ascending=False).index)
+            count = len(ranked)
+            while count > 2 and estimate_peak_bytes(
+                    data[list(dict.fromkeys(keep + ranked[:count]))], operation) > self.max_bytes:
+                count = max(2, count * 3 // 4)
+            if count < len(ranked):
+                chosen = set(ranked[:count]) | set(keep)
+                data = data[[c for c in data.columns if c in chosen]]
+                self.note(f"kept the {count} highest-variance of {len(ranked)} numeric columns "
+                          f"(memory budget {self.budget.max_memory_mb:g} MB)")
+                estimated = estimate_peak_bytes(data, operation)
+                if estimated <= self.max_bytes:
+                    return data
+
+        # Sample rows; clustering is quadratic in rows, everything else linear
+        ratio = self.max_bytes / estimated
+        ratio = ratio ** 0.5 if operation == "clustermap" else ratio
+        target = max(1, int(len(data) * ratio))
+        if target < len(data):
+            sampled = sample_rows(data, target, group)
+            self.note(f"sampled {len(sampled):,} of {len(data):,} rows "
+                      f"(memory budget {self.budget.max_memory_mb:g} MB)")
+            data = sampled
+        return data
+
+    def report(self) -> str:
+        """Notes on what was degraded, formatted for a text result ("" if nothing)."""
+        if not self.notes:
+            return ""
+        return "\n\nNote: budget exceeded, " + "; ".join(self.notes) + "."
+
+    def annotate_figure(self):
+        """Write the degradation notes at the bottom of the current pyplot figure."""
+        if not self.notes:
+            return
+        import matplotlib.pyplot as plt
+
+        plt.gcf().text(0.01, 0.005, "Budget: " + "; ".join(self.notes),
+                       fontsize=7, color="gray", va="bottom", wrap=True)
+
+def call_budget(tool: str) -> CallBudget:
+    """Start budget bookkeeping for a tool call under the active budget."""
+    return CallBudget(tool, _active_budget.get())
+
+def _estimate_rows(file_path: str, probe_bytes: int = 65536) -> int:
+    """Estimate the number of data rows of a CSV from the length of its first lines."""
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        head = f.read(probe_bytes)
+    lines = head.count(b"\n")
+    if lines <= 1 or len(head) >= size:
+        return max(0, lines - 1) if len(head) >= size else lines
+    return int(size / (len(head) / lines))
+
+def _read_csv_sample(file_path: str, fraction: float) -> "pd.DataFrame":
+    """Parse a uniform sample of a CSV's rows without loading the rest."""
+    import pandas as pd
+
+    rng = random.Random(SAMPLE_SEED)
+    with span("read_csv_sample", path=file_path, fraction=round(fraction, 4)) as s:
+        df = pd.read_csv(file_path, skiprows=lambda i: i > 0 and rng.random() >= fraction)
+        s.set(rows=len(df), columns=len(df.columns))
+    return df
+
+def _read_csv_groups(file_path: str, fraction: float, group: str) -> "pd.DataFrame":
+    """
+    Parse all rows of a sample of a CSV's groups (e.g. every visit of a
+    fraction of subjects), streaming it in chunks. Groups are chosen by a
+    hash of their value, so rows of a group are kept wherever they are.
+    """
+    import pandas as pd
+
+    threshold = int(fraction * 2**32)
+    with span("read_csv_groups", path=file_path, fraction=round(fraction, 4)) as s:
+        parts = []
+        for chunk in pd.read_csv(file_path, chunksize=CHUNK_ROWS):
+            hashes = pd.util.hash_pandas_object(chunk[group].astype(str), index=False).to_numpy()
+            parts.append(chunk[(hashes & 0xFFFFFFFF) < threshold])
+        df = pd.concat(parts, ignore_index=True)
+        s.set(rows=len(df), columns=len(df.columns))
+    return df
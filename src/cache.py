@@ -0,0 +1,325 @@
+import dataclasses
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import sys
+import tempfile
+import time
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable, Iterator
+
+from .budget import current_budget, time_cutoffs
+from .tracing import span
+
+# Default location of the persistent result cache
+DEFAULT_CACHE_DIR = os.environ.get(
+    "COHORTAGENT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "cohortagent"))
+
+# Entries older than this are recomputed (seconds)
+DEFAULT_TTL = 7 * 24 * 3600
+
+# Least recently used entries are evicted above this total size (bytes)
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Tool parameters that name input files; their fingerprints are part of the key
+FILE_PARAMETERS = ("file_path", "file_paths", "image_paths", "volume_paths")
+
+# Tool parameters that name a directory, and the extensions of the input files
+# under it (scan_dir holds images.IMAGE_EXTENSIONS, not imported here because
+# images imports this module)
+DIRECTORY_PARAMETERS = {
+    "data_dir": (".csv",),
+    "scan_dir": (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp"),
+}
+
+# Bump to invalidate every existing entry after an incompatible change
+CACHE_VERSION = 1
+
+def file_fingerprint(path: str) -> Optional[List[Any]]:
+    """
+    Cheap identity of a file's contents: absolute path, size and mtime.
+
+    Args:
+        path: Path to the file
+
+    Returns:
+        [path, size, mtime_ns], or None if the file does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+def code_fingerprint(function: Callable) -> List[Optional[List[Any]]]:
+    """
+    Fingerprints of the code a tool's results depend on.
+
+    A tool in a package calls helpers throughout it (a longitudinal analysis
+    runs code in longitudinal.py, budget.py and utils.py), so every module
+    of the package is fingerprinted; a tool outside a package only has its
+    own file.
+
+    Args:
+        function: Tool function
+
+    Returns:
+        file_fingerprint() of each source file, in path order
+    """
+    function = inspect.unwrap(function)
+    source = inspect.getsourcefile(function) or ""
+    module = sys.modules.get(getattr(function, "__module__", None) or "")
+    if not getattr(module, "__package__", None):
+        return [file_fingerprint(source)]
+    directory = os.path.dirname(source)
+    return [file_fingerprint(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith(".py")]
+
+class ResultCache:
+    """
+    Disk-backed memoization of tool results.
+
+    An entry is keyed by the tool name, its normalized parameters (defaults
+    filled in, input paths made absolute) and fingerprints of the input files
+    and of every module of the tool's package (see code_fingerprint), so
+    editing a dataset, the tool or any code it calls invalidates it. Results that name an output file (plots) are only served
+    while that file is unchanged on disk.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, ttl: Optional[float] = DEFAULT_TTL,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding the cache entries
+            ttl: Maximum age of an entry in seconds (None for no limit)
+            max_bytes: Maximum total size of the entries in bytes
+        """
+        self.cache_dir = cache_dir
+        self.results_dir = os.path.join(cache_dir, "results")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+
+    def key(self, tool: str, function: Callable, params: Dict[str, Any]) -> Optional[str]:
+        """
+        Compute the cache key of a tool call.
+
+        Args:
+            tool: Tool name
+            function: Tool function (used to fill in default parameters)
+            params: Parameters of the call
+
+        Returns:
+            Hex digest, or None if an input file is missing (nothing to cache)
+        """
+        try:
+            bound = inspect.signature(function).bind(**params)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+        except (TypeError, ValueError):
+            arguments = dict(params)
+
+        inputs = []
+        for name in FILE_PARAMETERS:
+            value = arguments.get(name)
+            if value is None:
+                continue
+            paths = [value] if isinstance(value, str) else list(value)
+            arguments[name] = [os.path.abspath(p) for p in paths]
+            for path in paths:
+                if os.path.isdir(path):
+                    # A directory of inputs (e.g. scans) changes when any file in it does
+                    inputs.extend(file_fingerprint(os.path.join(root, f))
+                                  for root, _, files in sorted(os.walk(path)) for f in sorted(files))
+                    continue
+                fingerprint = file_fingerprint(path)
+                if fingerprint is None:
+                    return None
+                inputs.append(fingerprint)
+        for name, extensions in DIRECTORY_PARAMETERS.items():
+            value = arguments.get(name)
+            if value is None:
+                continue
+            arguments[name] = os.path.abspath(value)
+            inputs.extend(file_fingerprint(os.path.join(root, f))
+                          for root, _, files in sorted(os.walk(value)) for f in sorted(files)
+                          if f.lower().endswith(extensions))
+
+        key_parts = [CACHE_VERSION, tool, arguments, inputs, code_fingerprint(function)]
+        # Results computed under a budget may be degraded; keep them apart
+        budget = current_budget()
+        if budget is not None and not budget.unlimited:
+            key_parts.append(dataclasses.asdict(budget))
+        payload = json.dumps(key_parts, sort_keys=True, default=repr)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        """File that holds the entry for key."""
+        return os.path.join(self.results_dir, key[:2], key + ".pkl")
+
+    def get(self, key: str) -> Tuple[bool, Any]:
+        """
+        Look up an entry.
+
+        Args:
+            key: Key from key()
+
+        Returns:
+            (True, value) on a hit, (False, None) on a miss
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.PickleError, EOFError):
+            return False, None
+        expired = self.ttl is not None and time.time() - entry["created"] > self.ttl
+        stale = any(file_fingerprint(p) != fp for p, fp in entry["outputs"].items())
+        if expired or stale:
+            self._remove(path)
+            return False, None
+        # Touch the entry so size-based eviction drops the least recently used ones
+        os.utime(path)
+        return True, entry["value"]
+
+    def put(self, key: str, value: Any):
+        """
+        Store an entry and evict old ones if the cache grew too large.
+
+        Args:
+            key: Key from key()
+            value: Tool result (must be picklable)
+        """
+        outputs = {}
+        if isinstance(value, str) and len(value) < 4096 and os.path.isfile(value):
+            outputs[value] = file_fingerprint(value)
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first so concurrent readers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump({"created": time.time(), "value": value, "outputs": outputs}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def wrap(self, tool: str, function: Callable) -> "CachedTool":
+        """
+        Wrap a tool function so its results are memoized.
+
+        Args:
+            tool: Tool name
+            function: Tool function
+
+        Returns:
+            Callable with the same parameters as function
+        """
+        return CachedTool(self, tool, function)
+
+    def _entries(self) -> List[Tuple[float, int, str]]:
+        """(last use, size, path) of every entry."""
+        entries = []
+        if not os.path.isdir(self.results_dir):
+            return entries
+        for bucket in os.scandir(self.results_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".pkl"):
+                    st = entry.stat()
+                    entries.append((st.st_mtime, st.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def _remove(self, path: str):
+        """Delete an entry file, ignoring entries that are already gone."""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self) -> int:
+        """
+        Remove every entry.
+
+        Returns:
+            Number of entries removed
+        """
+        entries = self._entries()
+        for _, _, path in entries:
+            self._remove(path)
+        return len(entries)
+
+    def stats(self) -> Dict[str, int]:
+        """Number of entries and their total size in bytes."""
+        entries = self._entries()
+        return {"entries": len(entries), "bytes": sum(size for _, size, _ in entries)}
+
+class CachedTool:
+    """
+    A tool function wrapped by a ResultCache.
+
+    A class rather than a closure so that wrapped tools can still be sent to
+    a process pool.
+    """
+
+    def __init__(self, cache: ResultCache, tool: str, function: Callable):
+        self.cache = cache
+        self.tool = tool
+        self.function = function
+        self.__wrapped__ = function
+        self.__name__ = getattr(function, "__name__", tool)
+        self.__doc__ = getattr(function, "__doc__", None)
+
+    def __call__(self, **params) -> Any:
+        with span("result_cache_lookup", tool=self.tool) as s:
+            key = self.cache.key(self.tool, self.function, params)
+            hit, value = self.cache.get(key) if key is not None else (False, None)
+            s.set(hit=hit)
+        if hit:
+            return value
+        with time_cutoffs() as cutoffs:
+            value = self.function(**params)
+        # A result cut short by the time budget may be complete next time
+        if key is not None and not cutoffs:
+            self.cache.put(key, value)
+        return value
+
+    def stream(self, stream_function: Callable[..., Iterator[str]], **params) -> Iterator[str]:
+        """
+        Streaming counterpart of calling the tool.
+
+        A cached result is yielded in one piece. Otherwise the pieces of
+        stream_function (a streaming variant of the tool) are passed through
+        and, once complete, stored under the tool's key unless the time
+        budget cut it short.
+
+        Args:
+            stream_function: Generator function taking the tool's parameters
+            **params: Parameters of the call
+        """
+        with span("result_cache_lookup", tool=self.tool) as s:
+            key = self.cache.key(self.tool, self.function, params)
+            hit, value = self.cache.get(key) if key is not None else (False, None)
+            s.set(hit=hit)
+        if hit:
+            yield value
+            return
+        pieces = []
+        with time_cutoffs() as cutoffs:
+            for piece in stream_function(**params):
+                pieces.append(piece)
+                yield piece
+        if key is not None and not cutoffs:
+            self.cache.put(key, "".join(pieces))
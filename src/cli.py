@@ -1,11 +1,23 @@
 import argparse
+import asyncio
 import os
 import glob
 import subprocess
 import sys
+from contextlib import contextmanager
 from typing import List, Optional
 
-from .agent import CohortAgent
+# Wall-clock budget (seconds) for `cohortagent --help`. The CLI is spawned
+# thousands of times by batch scripts, so nothing heavy (pandas, matplotlib,
+# seaborn, scipy, PIL) may be imported before a query actually needs it.
+# Enforced by test_startup.py.
+STARTUP_BUDGET_SECONDS = 0.5
+
+# Options a daemon does not apply to the queries it answers: it runs them with
+# the cache, budgets, workers and model settings it was started with
+DAEMON_IGNORED_OPTIONS = ("no_cache", "clear_cache", "cache_dir", "cache_ttl", "cache_max_mb",
+                          "max_rows", "max_memory_mb", "max_seconds", "processes", "workers",
+                          "model_url", "model_timeout")
 
 def parse_args():
     """Parse command line arguments."""
@@ -15,6 +27,11 @@ def parse_args():
     parser.add_argument('--query', '-q', type=str, help='Query for the agent to process')
     parser.add_argument('--model', '-m', type=str, default='ollama/llava', 
                         help='Local model to use (default: ollama/llava)')
+    parser.add_argument('--model-url', type=str, default=None,
+                        help='URL of the Ollama or OpenAI-compatible model server '
+                             '(default: $OLLAMA_HOST or $COHORTAGENT_MODEL_URL)')
+    parser.add_argument('--model-timeout', type=float, default=None,
+                        help='Model request timeout in seconds (default: 60)')
     
     # Data paths
     parser.add_argument('--data-dir', '-d', type=str, default='./data',
@@ -24,12 +41,64 @@ def parse_args():
     parser.add_argument('--output-dir', '-o', type=str, default='./output',
                         help='Directory for saving outputs (default: ./output)')
     
+    # Execution
+    parser.add_argument('--timeout', type=float, default=None,
+                        help='Per-tool-call timeout in seconds (default: no timeout)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Worker threads for running independent steps concurrently')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Worker processes for CPU-bound analysis and plotting (default: 0, threads only)')
+    parser.add_argument('--max-rows', type=int, default=None,
+                        help='Row budget per tool call; larger inputs are sampled')
+    parser.add_argument('--max-memory-mb', type=float, default=None,
+                        help='Estimated peak memory budget per tool call in MB; inputs are '
+                             'sampled or reduced to fewer columns to fit')
+    parser.add_argument('--max-seconds', type=float, default=None,
+                        help='Wall-time budget per tool call; long analyses stop early and report it')
+    parser.add_argument('--profile', nargs='?', const='', default=None, metavar='TRACE_FILE',
+                        help='Print a per-phase time breakdown to stderr; with TRACE_FILE, '
+                             'also write a Chrome trace (open in chrome://tracing or Perfetto)')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='Print peak and net memory per phase and the top allocation sites to '
+                             'stderr (slows the query down several times)')
+    
+    # Result cache
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Bypass the persistent result cache')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Remove all cached results before running')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                        help='Directory of the result cache (default: $COHORTAGENT_CACHE_DIR or ~/.cache/cohortagent)')
+    parser.add_argument('--cache-ttl', type=float, default=None,
+                        help='Maximum age of cached results in hours (default: 168)')
+    parser.add_argument('--cache-max-mb', type=float, default=None,
+                        help='Maximum size of the result cache in MB (default: 256)')
+    
+    # Daemon
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='Run the query in this process even if a daemon is running')
+    parser.add_argument('--port', type=int, default=None,
+                        help='Port for --serve (default: 8765)')
+    
     # Interactive modes
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--interactive', '-i', action='store_true',
                       help='Start in interactive CLI mode')
     group.add_argument('--gui', '-g', action='store_true',
                       help='Launch the interactive GUI')
+    group.add_argument('--batch', '-b', type=str, metavar='FILE',
+                      help='Run queries or JSON tool calls from FILE (one per line, "-" for stdin) '
+                           'and write one JSON result per line')
+    group.add_argument('--serve', action='store_true',
+                      help='Run a long-lived daemon that keeps the agent and data warm; '
+                           '--query then uses it automatically')
+    group.add_argument('--stop-daemon', action='store_true',
+                      help='Stop the running daemon')
+    group.add_argument('--analyze-all', type=str, metavar='ANALYSIS_TYPE',
+                      help='Run one analysis (summary, correlation, ...) on every CSV file under '
+                           '--data-dir in parallel and print a combined report with per-file timings')
+    parser.add_argument('--batch-output', type=str, default=None, metavar='FILE',
+                        help='Write batch results to FILE instead of stdout')
     
     return parser.parse_args()
 
@@ -80,6 +149,84 @@ if __name__ == "__main__":
         print(f"Failed to launch GUI: {str(e)}")
         sys.exit(1)
 
+def create_cache(args):
+    """Create the result cache configured on the command line, or None if bypassed."""
+    from .cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, DEFAULT_TTL, ResultCache
+    from .images import ImageCache, configure_image_cache
+    
+    cache = ResultCache(
+        cache_dir=args.cache_dir or DEFAULT_CACHE_DIR,
+        ttl=args.cache_ttl * 3600 if args.cache_ttl is not None else DEFAULT_TTL,
+        max_bytes=int(args.cache_max_mb * 1024 * 1024) if args.cache_max_mb is not None else DEFAULT_MAX_BYTES
+    )
+    # Per-image results of analyze_images live next to the tool results
+    configure_image_cache(cache.cache_dir, enabled=not args.no_cache)
+    if args.clear_cache:
+        removed = cache.clear()
+        print(f"Cleared {removed} cached results from {cache.cache_dir}")
+        removed = ImageCache(os.path.join(cache.cache_dir, "images")).clear()
+        print(f"Cleared {removed} cached image results")
+    return None if args.no_cache else cache
+
+@contextmanager
+def profiling(trace_path: Optional[str], memory: bool = False):
+    """
+    Trace the enclosed work if --profile or --profile-memory was given.
+    
+    Prints the per-phase breakdown to stderr when done (with memory, also
+    the per-phase memory and top allocation sites) and, if trace_path is
+    set, writes the spans as a Chrome trace.
+    """
+    if trace_path is None and not memory:
+        yield
+        return
+    if memory:
+        from .memory import memory_profiling as tracing
+    else:
+        from .tracing import tracing
+    
+    with tracing() as tracer:
+        try:
+            yield
+        finally:
+            print(tracer.format_summary(), file=sys.stderr)
+            if memory:
+                print(file=sys.stderr)
+                print(tracer.format_memory_summary(), file=sys.stderr)
+            if trace_path:
+                tracer.export_chrome_trace(trace_path)
+                print(f"Chrome trace written to {trace_path}", file=sys.stderr)
+
+def daemon_conflicts(args, info: dict) -> List[str]:
+    """
+    What in this run a daemon would not honour (empty if it can answer the query).
+
+    Args:
+        args: Parsed command line arguments
+        info: The daemon's /health response
+
+    Returns:
+        Offending options, plus the model or working directory where the
+        daemon's differ from this run's
+    """
+    conflicts = [f"--{name.replace('_', '-')}" for name in DAEMON_IGNORED_OPTIONS
+                 if getattr(args, name) not in (None, False, 0)]
+    if args.model != info.get("model"):
+        conflicts.append(f"--model {args.model} (daemon: {info.get('model')})")
+    if os.path.realpath(os.getcwd()) != info.get("cwd"):
+        conflicts.append(f"this working directory (daemon: {info.get('cwd')})")
+    return conflicts
+
+async def print_stream(agent, query: str, timeout: Optional[float] = None):
+    """Print a query's results as they are produced (see CohortAgent.run_stream)."""
+    step = None
+    async for chunk in agent.run_stream(query, timeout=timeout):
+        if step is not None and chunk.step != step:
+            print("\n")
+        step = chunk.step
+        print(chunk.text, end="", flush=True)
+    print()
+
 def main():
     """Main entry point for the CLI."""
     args = parse_args()
@@ -87,36 +234,117 @@ def main():
     # Create output directory if it doesn't exist
     os.makedirs(args.output_dir, exist_ok=True)
     
+    if args.stop_daemon:
+        from .client import find_daemon
+        
+        client = find_daemon()
+        if client:
+            client.shutdown()
+            print("Daemon stopped.")
+        else:
+            print("No daemon is running.")
+        return
+    
+    # A running daemon answers queries without re-importing or reloading anything
+    # (profiling has to happen in this process)
+    if (args.query and not args.no_daemon and not args.interactive and args.profile is None
+            and not args.profile_memory):
+        from .client import find_daemon
+        
+        client = find_daemon()
+        conflicts = daemon_conflicts(args, client.info) if client else []
+        if conflicts:
+            print(f"Running locally instead of on the daemon, which does not apply: "
+                  f"{', '.join(conflicts)}", file=sys.stderr)
+        elif client:
+            try:
+                print(client.query(args.query, timeout=args.timeout))
+                return
+            except (OSError, ConnectionError) as e:
+                print(f"Daemon unavailable ({e}); running locally.", file=sys.stderr)
+    
     if args.gui:
         # Launch the GUI
         launch_streamlit_gui(args.model, args.data_dir, args.scan_dir, args.output_dir)
     else:
         # Initialize the agent for CLI mode
-        agent = CohortAgent(model_name=args.model)
+        from .agent import CohortAgent
+
+        cache = create_cache(args)
+        if args.clear_cache and not (args.query or args.interactive or args.batch or args.serve
+                                     or args.analyze_all):
+            return
+        from .budget import Budget
+
+        # Command line limits take precedence over the COHORTAGENT_MAX_* variables
+        limits = {"max_rows": args.max_rows, "max_memory_mb": args.max_memory_mb,
+                  "max_seconds": args.max_seconds}
+        budget = Budget.from_env(**{k: v for k, v in limits.items() if v is not None},
+                                 override_env=True)
+        agent = CohortAgent(model_name=args.model, max_workers=args.workers,
+                            process_workers=args.processes, cache=cache,
+                            model_url=args.model_url, model_timeout=args.model_timeout,
+                            budget=None if budget.unlimited else budget)
         
-        if args.interactive:
-            print("CohortAgent Interactive Mode")
-            print("Type 'exit' or 'quit' to end the session")
-            print("-----------------------------------")
+        with profiling(args.profile, memory=args.profile_memory):
+            if args.serve:
+                from .server import DEFAULT_PORT, serve
             
-            while True:
-                query = input("\nEnter your query: ")
-                if query.lower() in ['exit', 'quit']:
-                    break
-                    
-                response = agent.run(query)
-                print(f"\nResponse:\n{response}")
+                serve(agent, port=args.port or DEFAULT_PORT, data_dir=agent.data_dir)
         
-        elif args.query:
-            response = agent.run(args.query)
-            print(response)
+            elif args.batch:
+                from .batch import run_batch
+            
+                summary = run_batch(agent, args.batch, output_path=args.batch_output,
+                                    workers=args.workers or 4, timeout=args.timeout)
+                print(f"Batch finished: {summary['requests']} requests, {summary['failed']} failed, "
+                      f"{summary['elapsed_ms'] / 1000:.2f}s", file=sys.stderr)
         
-        else:
-            print("No query provided. Use one of the following options:")
-            print("  --query (-q): Provide a query to process")
-            print("  --interactive (-i): Start interactive CLI mode")
-            print("  --gui (-g): Launch the interactive GUI")
-            print("Run with --help for more information.")
+            elif args.analyze_all:
+                from .planner import QueryPlan, ToolCall
+            
+                # One worker process per CPU unless --processes says otherwise;
+                # --timeout applies to each file
+                params = {"data_dir": args.data_dir, "analysis_type": args.analyze_all,
+                          "workers": args.processes or None, "timeout": args.timeout}
+                plan = QueryPlan(f"analyze all: {args.analyze_all}", [ToolCall("analyze_all", params)])
+                print(agent.execute(plan))
+        
+            elif args.interactive:
+                print("CohortAgent Interactive Mode")
+                print("Type 'exit' or 'quit' to end the session")
+                print("Press Ctrl+C to cancel a running query")
+                print("-----------------------------------")
+            
+                while True:
+                    try:
+                        query = input("\nEnter your query: ")
+                    except (EOFError, KeyboardInterrupt):
+                        break
+                    if query.lower() in ['exit', 'quit']:
+                        break
+                
+                    print("\nResponse:")
+                    try:
+                        asyncio.run(print_stream(agent, query, timeout=args.timeout))
+                    except KeyboardInterrupt:
+                        print("\nQuery cancelled.")
+        
+            elif args.query:
+                response = asyncio.run(agent.run_async(args.query, timeout=args.timeout))
+                print(response)
+        
+            else:
+                print("No query provided. Use one of the following options:")
+                print("  --query (-q): Provide a query to process")
+                print("  --interactive (-i): Start interactive CLI mode")
+                print("  --batch (-b): Run a file of queries and write JSONL results")
+                print("  --analyze-all: Run one analysis on every dataset in --data-dir")
+                print("  --gui (-g): Launch the interactive GUI")
+                print("  --serve: Run a daemon that keeps the agent warm for --query")
+                print("Run with --help for more information.")
+        
+        agent.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,96 @@
+import http.client
+import json
+import os
+from typing import List, Dict, Union, Optional, Tuple, Any
+
+from .cache import DEFAULT_CACHE_DIR
+
+# Kept free of heavy imports: the client runs in every short-lived CLI process
+
+# Written by a running daemon so that clients can find it
+DAEMON_STATE_FILE = os.path.join(DEFAULT_CACHE_DIR, "daemon.json")
+
+# How long to wait for a daemon to accept a connection before running locally
+CONNECT_TIMEOUT = 0.5
+
+class DaemonClient:
+    """Thin client for a running CohortAgent daemon (see src/server.py)."""
+
+    def __init__(self, host: str, port: int, token: str):
+        self.host = host
+        self.port = port
+        self.token = token
+        # Last /health response: the daemon's working directory and model
+        self.info: Dict[str, Any] = {}
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None,
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Send one request and decode the JSON response."""
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=CONNECT_TIMEOUT)
+        try:
+            connection.connect()
+            # Queries may legitimately take long; only the connect is short
+            connection.sock.settimeout(timeout)
+            body = json.dumps(payload).encode("utf-8") if payload is not None else None
+            headers = {"X-CohortAgent-Token": self.token, "Content-Type": "application/json"}
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            data = json.loads(response.read() or b"{}")
+            if response.status != 200:
+                raise ConnectionError(data.get("error", f"HTTP {response.status}"))
+            return data
+        finally:
+            connection.close()
+
+    def health(self) -> Dict[str, Any]:
+        """Daemon status (pid, uptime, requests served, working directory, model)."""
+        self.info = self._request("GET", "/health", timeout=CONNECT_TIMEOUT)
+        return self.info
+
+    def query(self, query: str, timeout: Optional[float] = None) -> str:
+        """
+        Run a query on the daemon.
+
+        The daemon refuses queries sent from another working directory,
+        whose relative paths it would resolve differently.
+
+        Args:
+            query: The user's query string
+            timeout: Per-tool-call timeout applied by the daemon
+
+        Returns:
+            The agent's response
+
+        Raises:
+            ConnectionError: If the daemon refused or could not answer the query
+        """
+        return self._request("POST", "/query", {"query": query, "timeout": timeout,
+                                                "cwd": os.getcwd()})["response"]
+
+    def call_tool(self, tool: str, params: Dict[str, Any],
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a single tool call on the daemon; returns {"ok", "result" | "error"}."""
+        return self._request("POST", "/tool", {"tool": tool, "params": params, "timeout": timeout})
+
+    def shutdown(self):
+        """Ask the daemon to exit."""
+        self._request("POST", "/shutdown", {}, timeout=CONNECT_TIMEOUT)
+
+def find_daemon(state_file: str = DAEMON_STATE_FILE) -> Optional[DaemonClient]:
+    """
+    Return a client for the running daemon, or None if there is none.
+
+    Args:
+        state_file: State file written by the daemon
+
+    Returns:
+        DaemonClient, or None if no daemon answers
+    """
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+        client = DaemonClient(state["host"], state["port"], state["token"])
+        client.health()
+        return client
+    except (OSError, ValueError, KeyError, ConnectionError):
+        return None
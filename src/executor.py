@@ -0,0 +1,116 @@
+import asyncio
+import contextvars
+import functools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable, Iterable
+
+from .budget import Budget, call_with_budget, current_budget
+from .planner import ToolCall
+from .tracing import call_in_span
+
+# Tools that are worth shipping to a process pool when one is configured.
+# They are pure functions of their parameters; analyze_images mostly waits on
+# I/O and stays on threads.
+PROCESS_TOOLS = ("analyze_data", "merge_and_analyze", "visualize_data", "merge_and_visualize")
+
+class ToolTimeoutError(TimeoutError):
+    """Raised when a tool call exceeds its timeout."""
+
+class AsyncToolExecutor:
+    """
+    Run tool calls from an asyncio event loop without blocking it.
+
+    Calls run on a thread pool by default. With process_workers > 0, the
+    tools in process_tools run on a process pool instead, which sidesteps the
+    GIL (and pyplot's global state) for CPU-bound analysis and rendering.
+    Process workers do not see the caller's data cache, so each call there
+    loads its own data.
+
+    Timeouts and cancellation stop waiting for a call and cancel it if it has
+    not started yet. A call that is already running on a thread cannot be
+    interrupted; it finishes in the background and its result is dropped.
+    """
+
+    def __init__(self, tools: Dict[str, Dict[str, Any]],
+                 max_workers: Optional[int] = None,
+                 process_workers: int = 0,
+                 process_tools: Iterable[str] = PROCESS_TOOLS,
+                 budget: Optional[Budget] = None):
+        """
+        Initialize the executor.
+
+        Args:
+            tools: Tool registry (name -> {"function": ..., ...}), as in CohortAgent.tools
+            max_workers: Size of the thread pool (default: min(32, cpu_count + 4))
+            process_workers: Size of the process pool; 0 disables it
+            process_tools: Names of the tools sent to the process pool
+            budget: Limits applied to every call (default: the caller's active budget)
+        """
+        self.tools = tools
+        self.threads = ThreadPoolExecutor(max_workers=max_workers,
+                                          thread_name_prefix="cohortagent-tool")
+        self.processes = ProcessPoolExecutor(max_workers=process_workers) if process_workers > 0 else None
+        self.process_tools = set(process_tools)
+        self.budget = budget
+
+    def _pool_for(self, tool: str) -> Executor:
+        """Pick the pool a tool runs on."""
+        if self.processes is not None and tool in self.process_tools:
+            return self.processes
+        return self.threads
+
+    async def call(self, call: ToolCall, timeout: Optional[float] = None) -> Any:
+        """
+        Run a single tool call.
+
+        Args:
+            call: The tool call to run
+            timeout: Seconds to wait before giving up (None waits forever)
+
+        Returns:
+            The tool's return value
+
+        Raises:
+            ToolTimeoutError: If the call does not finish within timeout
+            asyncio.CancelledError: If the awaiting task is cancelled
+        """
+        loop = asyncio.get_running_loop()
+        function = self.tools[call.tool]["function"]
+        pool = self._pool_for(call.tool)
+        budget = self.budget or current_budget()
+        if pool is self.threads:
+            # Threads run in a copy of the caller's context so they share its data
+            # cache and tracer
+            task = functools.partial(contextvars.copy_context().run, call_in_span,
+                                     f"tool:{call.tool}", call_with_budget, budget, function,
+                                     **call.params)
+        else:
+            task = functools.partial(call_with_budget, budget, function, **call.params)
+        future = loop.run_in_executor(pool, task)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise ToolTimeoutError(f"{call.tool} timed out after {timeout:g}s") from None
+
+    async def gather(self, calls: List[ToolCall],
+                     timeout: Optional[float] = None) -> List[Union[Any, BaseException]]:
+        """
+        Run independent tool calls concurrently.
+
+        Args:
+            calls: Tool calls to run
+            timeout: Per-call timeout in seconds
+
+        Returns:
+            One entry per call, in the same order: the return value, or the
+            exception the call raised
+        """
+        return await asyncio.gather(*(self.call(c, timeout) for c in calls),
+                                    return_exceptions=True)
+
+    def shutdown(self, wait: bool = True):
+        """Shut down the worker pools."""
+        self.threads.shutdown(wait=wait, cancel_futures=True)
+        if self.processes is not None:
+            self.processes.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,167 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable
+
+def echo_responder(prompt: str, images: List[str]) -> str:
+    """Default answer of the stand-in server: echo the prompt."""
+    suffix = f" [{len(images)} image(s)]" if images else ""
+    return f"echo: {prompt}{suffix}"
+
+class FakeModelHandler(BaseHTTPRequestHandler):
+    """
+    Minimal Ollama and OpenAI-compatible API.
+
+    POST /api/generate          Ollama, NDJSON when "stream" is true
+    POST /v1/chat/completions   OpenAI chat, server-sent events when streaming
+    POST /v1/completions        OpenAI completions, "prompt" may be a list
+    """
+
+    server: "FakeModelServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.count("connections")
+
+    def _send_json(self, payload: Dict[str, Any]):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, lines: List[str], content_type: str):
+        """Send lines with chunked encoding so the connection stays open."""
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for line in lines:
+            data = (line + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.count(self.path)
+        self.server.requests.append((self.path, request))
+        if self.server.delay:
+            with self.server.slots:
+                time.sleep(self.server.delay)
+
+        if self.path == "/api/generate":
+            text = self.server.respond(request.get("prompt", ""), request.get("images") or [])
+            if not request.get("stream"):
+                self._send_json({"model": request.get("model"), "response": text, "done": True})
+                return
+            lines = [json.dumps({"response": token, "done": False}) for token in _tokens(text)]
+            lines.append(json.dumps({"response": "", "done": True}))
+            self._send_stream(lines, "application/x-ndjson")
+        elif self.path == "/v1/chat/completions":
+            prompt, images = _chat_prompt(request.get("messages") or [])
+            text = self.server.respond(prompt, images)
+            if not request.get("stream"):
+                self._send_json({"choices": [{"index": 0, "message": {"role": "assistant", "content": text}}]})
+                return
+            lines = [f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': token}}]})}\n"
+                     for token in _tokens(text)]
+            lines.append("data: [DONE]\n")
+            self._send_stream(lines, "text/event-stream")
+        elif self.path == "/v1/completions":
+            prompts = request.get("prompt", "")
+            prompts = prompts if isinstance(prompts, list) else [prompts]
+            self._send_json({"choices": [{"index": i, "text": self.server.respond(p, [])}
+                                         for i, p in enumerate(prompts)]})
+        else:
+            body = b'{"error": "not found"}'
+            self.send_response(404)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+def _tokens(text: str) -> List[str]:
+    """Split a response into streamed tokens (words with their spacing)."""
+    words = text.split(" ")
+    return [w if i == 0 else " " + w for i, w in enumerate(words)]
+
+def _chat_prompt(messages: List[Dict[str, Any]]) -> Tuple[str, List[str]]:
+    """Text and base64 images of the last chat message."""
+    if not messages:
+        return "", []
+    content = messages[-1].get("content", "")
+    if isinstance(content, str):
+        return content, []
+    text = " ".join(part["text"] for part in content if part.get("type") == "text")
+    images = [part["image_url"]["url"].split(",", 1)[-1]
+              for part in content if part.get("type") == "image_url"]
+    return text, images
+
+class FakeModelServer(ThreadingHTTPServer):
+    """
+    Local stand-in for a model server, for tests and offline development.
+
+    Answers come from responder(prompt, images); counters record
+    connections and requests per endpoint so tests can check pooling and
+    batching. Use as a context manager to serve on a background thread.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, responder: Callable[[str, List[str]], str] = echo_responder,
+                 host: str = "127.0.0.1", port: int = 0, delay: float = 0.0,
+                 max_parallel: int = 64):
+        """
+        Initialize the server.
+
+        Args:
+            responder: Function producing the answer to a prompt and its base64 images
+            host: Interface to bind
+            port: TCP port (0 picks a free one)
+            delay: Seconds to wait before answering each request, like model compute time
+            max_parallel: Requests whose delay can overlap, like the number of
+                         sequences a model server runs in one batch
+        """
+        super().__init__((host, port), FakeModelHandler)
+        self.responder = responder
+        self.delay = delay
+        self.slots = threading.BoundedSemaphore(max_parallel)
+        self.counts: Dict[str, int] = {}
+        self.requests: List[Tuple[str, Dict[str, Any]]] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def handle_error(self, request, client_address):
+        # Clients that time out hang up mid-response; that is expected here
+        pass
+
+    def respond(self, prompt: str, images: List[str]) -> str:
+        return self.responder(prompt, images)
+
+    def __enter__(self) -> "FakeModelServer":
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
@@ -2,12 +2,289 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import io
+import mimetypes
 import os
-from typing import List, Dict, Any, Optional
+import time
+from typing import Callable, List, Dict, Any, Optional
 import json
 import glob
+from concurrent.futures import ThreadPoolExecutor
 
 from .agent import CohortAgent
+from .budget import Budget
+from .cache import file_fingerprint
+from .jobs import (CANCELLING, DEFAULT_JOB_WORKERS, DONE, FAILED, FINISHED_STATES, INTERRUPTED, QUEUED,
+                   JobQueue, QueueFullError)
+from .utils import SAMPLE_FULL_BYTES, read_csv_page, sample_csv
+
+# Per-call limits for the shared GUI server, so one heavy request cannot
+# exhaust CPU or memory for every user (COHORTAGENT_MAX_* variables override)
+GUI_BUDGET_DEFAULTS = {"max_rows": 1_000_000, "max_memory_mb": 1024, "max_seconds": 120}
+
+# Seconds a directory listing is reused before the directory is listed again
+# (the sidebar's "Refresh Data" button lists it at once)
+LISTING_TTL = 30
+
+# Rows per page offered in the Data Explorer preview
+PAGE_SIZES = [10, 25, 100]
+
+# Rows the Data Explorer's approximate statistics are computed from
+SAMPLE_ROWS = 10_000
+
+# Leading rows used to estimate the row count of files too large to read whole
+ESTIMATE_ROWS = 1000
+
+# Seconds between checks on running queries, and queries listed per browser
+JOB_POLL_SECONDS = 1.0
+MAX_SHOWN_JOBS = 5
+
+# Result files listed per page of the Results History
+HISTORY_PAGE_SIZE = 20
+
+# Longest side of the image previews in the GUI, and how many are kept in memory
+THUMBNAIL_SIZE = 320
+MAX_THUMBNAILS = 1000
+
+# Generated plots of query responses kept in memory
+MAX_ARTIFACTS = 64
+
+# Image files shown as thumbnails
+THUMBNAIL_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp", ".webp")
+
+# Streamlit reruns the whole script on every interaction. Everything that
+# touches the disk goes through the cached functions below: directory
+# listings are reused for LISTING_TTL seconds, and file contents and what is
+# computed from them are keyed by the file's fingerprint (path, size, mtime),
+# so a rerun that changes no input does no file I/O and a changed file is
+# picked up on the next listing.
+
+@st.cache_resource(show_spinner=False)
+def _shared_agent(model_name: Optional[str]) -> CohortAgent:
+    """One agent per model for every session of this server."""
+    return CohortAgent(model_name=model_name, budget=Budget.from_env(**GUI_BUDGET_DEFAULTS))
+
+@st.cache_resource(show_spinner=False)
+def _shared_job_queue(model_name: Optional[str]) -> JobQueue:
+    """The queue GUI queries run in, shared by every session of this server."""
+    workers = int(os.environ.get("COHORTAGENT_GUI_JOB_WORKERS", DEFAULT_JOB_WORKERS))
+    return JobQueue(_shared_agent(model_name), max_workers=workers)
+
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False)
+def _list_files(directory: str, pattern: str) -> List[tuple]:
+    """Fingerprints of the files matching pattern under directory, sorted by path."""
+    files = sorted(glob.glob(os.path.join(directory, "**", pattern), recursive=True))
+    return [tuple(fp) for fp in map(file_fingerprint, files) if fp is not None]
+
+@st.cache_data(show_spinner=False)
+def _dataset_info(path: str, fingerprint: tuple) -> Dict[str, Any]:
+    """
+    Records, columns and leading column names of a dataset, for the treemap.
+    
+    Files larger than SAMPLE_FULL_BYTES are not read whole: their row count
+    is estimated from the length of their first rows.
+    """
+    try:
+        if fingerprint[1] <= SAMPLE_FULL_BYTES:
+            df = pd.read_csv(path)
+            records, estimated = len(df), False
+        else:
+            df = pd.read_csv(path, nrows=ESTIMATE_ROWS)
+            with open(path, "rb") as f:
+                head = [f.readline() for _ in range(ESTIMATE_ROWS + 1)]
+            row_bytes = sum(len(line) for line in head[1:]) / max(len(head) - 1, 1)
+            records, estimated = int((fingerprint[1] - len(head[0])) / max(row_bytes, 1)), True
+    except Exception:
+        return {"records": 0, "columns": 0, "column_names": "Error reading file", "estimated": False}
+    col_names = ", ".join(df.columns[:5])
+    if len(df.columns) > 5:
+        col_names += "..."
+    return {"records": records, "columns": len(df.columns), "column_names": col_names,
+            "estimated": estimated}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def _dataset_page(path: str, fingerprint: tuple, page: int, page_size: int) -> pd.DataFrame:
+    """One page of a dataset's rows, read without loading the rest of the file."""
+    return read_csv_page(path, page * page_size, page_size)
+
+def _describe(df: pd.DataFrame) -> Dict[str, Any]:
+    """Descriptive statistics and correlations of a frame's numeric columns."""
+    numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
+    return {
+        "rows": len(df),
+        "numeric_cols": numeric_cols,
+        "describe": df[numeric_cols].describe() if numeric_cols else None,
+        "corr": df[numeric_cols].corr() if len(numeric_cols) > 1 else None,
+    }
+
+@st.cache_data(show_spinner=False)
+def _sample_stats(path: str, fingerprint: tuple) -> Dict[str, Any]:
+    """Statistics of a random sample of at most SAMPLE_ROWS rows of a dataset."""
+    df, exact = sample_csv(path, SAMPLE_ROWS)
+    return dict(_describe(df), exact=exact)
+
+def _exact_stats(path: str) -> Dict[str, Any]:
+    """Statistics over every row of a dataset (run as a background job)."""
+    return dict(_describe(pd.read_csv(path)), exact=True)
+
+@st.cache_resource(show_spinner=False)
+def _stats_jobs() -> Dict[str, Any]:
+    """Background jobs computing exact statistics, shared by every session."""
+    return {"pool": ThreadPoolExecutor(max_workers=2, thread_name_prefix="gui-stats"), "jobs": {}}
+
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False)
+def _artifact_index(output_dir: str) -> List[Dict[str, Any]]:
+    """
+    Every result file under output_dir, newest first.
+    
+    Each entry holds the file's path, name, extension, size and mtime; the
+    files themselves are not opened.
+    """
+    artifacts = []
+    stack = [output_dir]
+    while stack:
+        try:
+            entries = list(os.scandir(stack.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.is_file() and "." in entry.name:
+                stat = entry.stat()
+                artifacts.append({"path": os.path.abspath(entry.path), "name": entry.name,
+                                  "ext": os.path.splitext(entry.name)[1].lower(),
+                                  "size": stat.st_size, "mtime_ns": stat.st_mtime_ns})
+    artifacts.sort(key=lambda a: (-a["mtime_ns"], a["path"]))
+    return artifacts
+
+@st.cache_data(max_entries=MAX_THUMBNAILS, show_spinner=False)
+def _thumbnail(path: str, fingerprint: tuple) -> Optional[bytes]:
+    """
+    A JPEG of an image at most THUMBNAIL_SIZE pixels on its longest side.
+    
+    JPEGs are decoded at reduced scale directly. Returns None if the image
+    cannot be read.
+    """
+    from PIL import Image
+    
+    try:
+        with Image.open(path) as img:
+            img.draft("RGB", (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+            small = img.convert("RGB")
+        small.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    except Exception:
+        return None
+    buffer = io.BytesIO()
+    small.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+@st.cache_data(max_entries=MAX_ARTIFACTS, show_spinner=False)
+def _artifact(path: str, fingerprint: tuple) -> Any:
+    """A generated plot: the figure dict of a plotly spec, or the bytes of an image."""
+    if path.endswith(".json"):
+        with open(path) as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        return f.read()
+
+def _file_reader(path: str) -> Callable[[], bytes]:
+    """Callable returning a file's contents, so a download reads it only when clicked."""
+    def read() -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+@st.cache_data(ttl=LISTING_TTL, show_spinner=False)
+def _refresh_scan_index(scan_dir: str) -> Optional[Dict[str, int]]:
+    """
+    Bring the scan index of scan_dir up to date at most once per LISTING_TTL.
+    
+    Returns:
+        Counts of added, updated, removed and unchanged scans, or None if
+        scan_dir is not a directory
+    """
+    if not os.path.isdir(scan_dir):
+        return None
+    from .scan_index import get_scan_index
+    
+    return get_scan_index(scan_dir, refresh=False).refresh()
+
+@st.cache_data(show_spinner=False)
+def _treemap_figure(data_dir: str, files: tuple) -> go.Figure:
+    """Treemap of the datasets with the given fingerprints (rebuilt only when one changes)."""
+    treemap_data = []
+    for fingerprint in files:
+        file_path = fingerprint[0]
+        # Directory levels below data_dir give the category and subcategory
+        path_parts = os.path.relpath(file_path, os.path.abspath(data_dir)).split(os.sep)
+        info = _dataset_info(file_path, fingerprint)
+        records_label = f"~{info['records']}" if info["estimated"] else str(info["records"])
+        treemap_data.append({
+            "category": path_parts[0] if len(path_parts) > 1 else "root",
+            "subcategory": path_parts[1] if len(path_parts) > 2 else "",
+            "dataset": path_parts[-1],
+            "records": info["records"],
+            "columns": info["columns"],
+            "path": file_path,
+            "records_label": records_label,
+            "details": f"Records: {records_label}, Columns: {info['columns']}",
+            "column_names": info["column_names"]
+        })
+    
+    # Convert to DataFrame for plotly
+    df_treemap = pd.DataFrame(treemap_data)
+    
+    if df_treemap.empty:
+        fig = go.Figure()
+        fig.add_annotation(
+            text="No data files found",
+            xref="paper", yref="paper",
+            x=0.5, y=0.5, showarrow=False
+        )
+        return fig
+    
+    # Create hierarchical structure for treemap
+    df_treemap["size"] = df_treemap["records"] * df_treemap["columns"] + 10  # Ensure all items are visible
+    
+    # Create custom hover text
+    df_treemap["hover_text"] = df_treemap.apply(
+        lambda row: f"<b>{row['dataset']}</b><br>"
+                   f"Category: {row['category']}<br>"
+                   f"Records: {row['records_label']}<br>"
+                   f"Columns: {row['columns']}<br>"
+                   f"Path: {row['path']}<br>"
+                   f"Column names: {row['column_names']}",
+        axis=1
+    )
+    
+    # Create treemap figure
+    fig = px.treemap(
+        df_treemap,
+        path=['category', 'subcategory', 'dataset'],
+        values='size',
+        color='columns',
+        color_continuous_scale='Viridis',
+        hover_data=['records', 'columns'],
+        custom_data=['path', 'hover_text'],
+        title="Available Datasets"
+    )
+    
+    # Customize hover template
+    fig.update_traces(
+        hovertemplate='%{customdata[1]}<extra></extra>'
+    )
+    
+    # Update layout for better aesthetics
+    fig.update_layout(
+        margin=dict(t=50, l=25, r=25, b=25),
+        coloraxis_colorbar=dict(
+            title="Columns",
+        ),
+        font=dict(family="Arial", size=12),
+    )
+    
+    return fig
 
 class CohortAgentGUI:
     """Interactive GUI for CohortAgent using Streamlit"""
@@ -19,7 +296,8 @@ class CohortAgentGUI:
         Args:
             model_name: Model name to use
         """
-        self.agent = CohortAgent(model_name=model_name)
+        self.agent = _shared_agent(model_name)
+        self.jobs = _shared_job_queue(model_name)
         self.data_dir = "./data"
         self.scan_dir = "./scans"
         self.output_dir = "./output"
@@ -37,101 +315,197 @@ class CohortAgentGUI:
         Returns:
             Plotly figure with treemap visualization
         """
-        # Scan for data files
-        data_files = glob.glob(f"{data_dir}/**/*.csv", recursive=True)
+        return _treemap_figure(data_dir, tuple(_list_files(data_dir, "*.csv")))
+    
+    def _data_files(self) -> Dict[str, tuple]:
+        """Datasets under the data directory: path -> fingerprint."""
+        return {fp[0]: fp for fp in _list_files(self.data_dir, "*.csv")}
         
-        # Group data by categories
-        treemap_data = []
+    def _render_jobs(self):
+        """
+        Show this browser's recent queries, newest first.
         
-        for file_path in data_files:
-            # Get relative path from data directory
-            rel_path = os.path.relpath(file_path, data_dir)
-            
-            # Get directory levels and filename
-            path_parts = rel_path.split(os.sep)
-            filename = path_parts[-1]
-            category = path_parts[0] if len(path_parts) > 1 else "root"
-            subcategory = path_parts[1] if len(path_parts) > 2 else ""
-            
-            # Try to read the file to get the number of records and columns
-            try:
-                df = pd.read_csv(file_path)
-                records = len(df)
-                columns = len(df.columns)
-                col_names = ", ".join(df.columns[:5])
-                if len(df.columns) > 5:
-                    col_names += "..."
-            except Exception:
-                records = 0
-                columns = 0
-                col_names = "Error reading file"
-            
-            # Create entry for treemap
-            entry = {
-                "category": category,
-                "subcategory": subcategory,
-                "dataset": filename,
-                "records": records,
-                "columns": columns,
-                "path": file_path,
-                "details": f"Records: {records}, Columns: {columns}",
-                "column_names": col_names
-            }
-            treemap_data.append(entry)
+        While any of them is waiting or running, the panel polls the job
+        queue every JOB_POLL_SECONDS and redraws itself (only this panel
+        reruns, not the page).
+        """
+        jobs = [job for job in map(self.jobs.get, st.query_params.get_all("job")) if job is not None]
+        if not jobs:
+            return
+        active = any(job.status not in FINISHED_STATES for job in jobs)
         
-        # Convert to DataFrame for plotly
-        df_treemap = pd.DataFrame(treemap_data)
+        @st.fragment(run_every=JOB_POLL_SECONDS if active else None)
+        def panel():
+            for job in jobs:
+                with st.container(border=True):
+                    st.write(f"**{job.query}**")
+                    if job.status == QUEUED:
+                        st.info(f"Waiting in queue (position {self.jobs.position(job.id)})")
+                    elif job.status == CANCELLING:
+                        st.info("Cancelling...")
+                    elif job.status not in FINISHED_STATES:
+                        st.progress(job.progress, text=f"Running: {job.steps_done} of "
+                                                       f"{job.steps_total or '?'} steps done")
+                    if job.status not in FINISHED_STATES:
+                        if job.status != CANCELLING and st.button("Cancel", key=f"cancel:{job.id}"):
+                            self.jobs.cancel(job.id)
+                            st.rerun()
+                    elif job.status == FAILED:
+                        st.error(f"Error processing query: {job.error}")
+                    elif job.status == INTERRUPTED:
+                        st.warning(job.error)
+                    elif job.status != DONE:
+                        st.warning("Cancelled")
+                    if job.text:
+                        st.text(job.text)
+                    if job.status == DONE:
+                        for artifact in job.artifacts:
+                            fingerprint = file_fingerprint(artifact)
+                            if fingerprint is not None:
+                                self._render_artifact(artifact, tuple(fingerprint))
+            if active and all(job.status in FINISHED_STATES for job in jobs):
+                # Stop polling
+                st.rerun()
         
-        if df_treemap.empty:
-            fig = go.Figure()
-            fig.add_annotation(
-                text="No data files found",
-                xref="paper", yref="paper",
-                x=0.5, y=0.5, showarrow=False
-            )
-            return fig
+        st.subheader("Responses")
+        panel()
+    
+    def _render_artifact(self, path: str, fingerprint: tuple):
+        """Show a generated plot: plotly specs in the browser, images as images."""
+        content = _artifact(path, fingerprint)
+        if path.endswith(".json"):
+            # Plotly figure spec: rendered in the browser
+            st.plotly_chart(go.Figure(content), use_container_width=True)
+        else:
+            st.image(content, caption="Generated Visualization")
+    
+    def _render_dataset_preview(self, path: str, fingerprint: tuple):
+        """
+        Show one page of a dataset and statistics of its numeric columns.
         
-        # Create hierarchical structure for treemap
-        df_treemap["size"] = df_treemap["records"] * df_treemap["columns"] + 10  # Ensure all items are visible
+        Only the requested page is read. Statistics come from a random sample
+        of at most SAMPLE_ROWS rows (labelled approximate) unless exact ones
+        have been computed with the "Compute exact statistics" background job.
+        """
+        info = _dataset_info(path, fingerprint)
+        records = f"~{info['records']}" if info["estimated"] else str(info["records"])
         
-        # Create custom hover text
-        df_treemap["hover_text"] = df_treemap.apply(
-            lambda row: f"<b>{row['dataset']}</b><br>"
-                       f"Category: {row['category']}<br>"
-                       f"Records: {row['records']}<br>"
-                       f"Columns: {row['columns']}<br>"
-                       f"Path: {row['path']}<br>"
-                       f"Column names: {row['column_names']}",
-            axis=1
-        )
+        # Display file info
+        st.write(f"**File Path:** {path}")
+        st.write(f"**Records:** {records}, **Columns:** {info['columns']}")
         
-        # Create treemap figure
-        fig = px.treemap(
-            df_treemap,
-            path=['category', 'subcategory', 'dataset'],
-            values='size',
-            color='columns',
-            color_continuous_scale='Viridis',
-            hover_data=['records', 'columns'],
-            custom_data=['path', 'hover_text'],
-            title="Available Datasets"
-        )
+        # Show one page of rows, read on demand
+        col1, col2 = st.columns([1, 3])
+        with col1:
+            page_size = st.selectbox("Rows per page", PAGE_SIZES, key="preview_page_size")
+        pages = max(1, -(-info["records"] // page_size))
+        with col2:
+            page = st.number_input(f"Page (of {'~' if info['estimated'] else ''}{pages})",
+                                   min_value=1, max_value=pages if not info["estimated"] else None,
+                                   value=1, step=1, key="preview_page")
+        st.dataframe(_dataset_page(path, fingerprint, int(page) - 1, page_size))
         
-        # Customize hover template
-        fig.update_traces(
-            hovertemplate='%{customdata[1]}<extra></extra>'
-        )
+        # Display basic statistics
+        st.write("### Basic Statistics")
+        jobs = _stats_jobs()
+        job = jobs["jobs"].get(fingerprint)
+        if job is not None and job.done() and job.exception() is None:
+            stats = job.result()
+            st.caption(f"Exact: computed over all {stats['rows']} rows.")
+        else:
+            stats = _sample_stats(path, fingerprint)
+            if stats["exact"]:
+                st.caption(f"Exact: computed over all {stats['rows']} rows.")
+            else:
+                st.caption(f"Approximate: computed from a random sample of {stats['rows']} "
+                           f"of {records} rows.")
+                if job is not None and not job.done():
+                    st.info("Computing exact statistics in the background; "
+                            "they replace these when done (rerun to check).")
+                else:
+                    if job is not None:
+                        st.error(f"Exact statistics failed: {job.exception()}")
+                    if st.button("Compute exact statistics", key="exact_stats"):
+                        # Results for older versions of the file are no longer needed
+                        for old in [fp for fp in jobs["jobs"] if fp[0] == path]:
+                            del jobs["jobs"][old]
+                        jobs["jobs"][fingerprint] = jobs["pool"].submit(_exact_stats, path)
+                        st.info("Computing exact statistics in the background; "
+                                "they replace these when done (rerun to check).")
         
-        # Update layout for better aesthetics
-        fig.update_layout(
-            margin=dict(t=50, l=25, r=25, b=25),
-            coloraxis_colorbar=dict(
-                title="Columns",
-            ),
-            font=dict(family="Arial", size=12),
-        )
+        if stats["numeric_cols"]:
+            # Display descriptive statistics
+            st.dataframe(stats["describe"])
+            
+            # Create a simple correlation heatmap for numeric columns
+            if stats["corr"] is not None:
+                st.write("### Correlation Heatmap")
+                
+                # Create correlation heatmap
+                fig = px.imshow(
+                    stats["corr"],
+                    color_continuous_scale="RdBu_r",
+                    labels=dict(color="Correlation"),
+                    title="Correlation between variables"
+                )
+                st.plotly_chart(fig, use_container_width=True)
+        else:
+            st.info("No numeric columns found for statistics.")
+    
+    def _render_results_history(self):
+        """
+        Show one page of result files, newest first.
         
-        return fig
+        Files come from the cached artifact index, images are shown as cached
+        thumbnails, and a file is read only when its download is clicked.
+        """
+        artifacts = _artifact_index(self.output_dir)
+        if not artifacts:
+            st.info("No output files found yet. Run some queries to generate results.")
+            return
+        
+        # Filter by file type
+        counts: Dict[str, int] = {}
+        for artifact in artifacts:
+            counts[artifact["ext"]] = counts.get(artifact["ext"], 0) + 1
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            ext = st.selectbox("File type", ["All"] + sorted(counts), key="history_type",
+                               format_func=lambda e: e if e == "All" else f"{e.upper()} ({counts[e]})")
+        shown = artifacts if ext == "All" else [a for a in artifacts if a["ext"] == ext]
+        pages = max(1, -(-len(shown) // HISTORY_PAGE_SIZE))
+        with col2:
+            page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages,
+                                   value=1, step=1, key="history_page")
+        first = (int(page) - 1) * HISTORY_PAGE_SIZE
+        st.write(f"Found {len(artifacts)} result files; showing {first + 1}-"
+                 f"{min(first + HISTORY_PAGE_SIZE, len(shown))} of {len(shown)}, newest first")
+        
+        output_root = os.path.abspath(self.output_dir)
+        for artifact in shown[first:first + HISTORY_PAGE_SIZE]:
+            fingerprint = (artifact["path"], artifact["size"], artifact["mtime_ns"])
+            col1, col2, col3 = st.columns([1, 3, 1])
+            with col1:
+                thumbnail = (_thumbnail(artifact["path"], fingerprint)
+                             if artifact["ext"] in THUMBNAIL_EXTENSIONS else None)
+                if thumbnail is not None:
+                    st.image(thumbnail)
+                else:
+                    st.caption(artifact["ext"].upper())
+            with col2:
+                st.write(f"**{artifact['name']}**")
+                st.caption(f"{os.path.relpath(artifact['path'], output_root)} · "
+                           f"{artifact['size'] / 1024:.1f} KB · "
+                           f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(artifact['mtime_ns'] / 1e9))}")
+            with col3:
+                st.download_button(
+                    label="Download",
+                    data=_file_reader(artifact["path"]),
+                    file_name=artifact["name"],
+                    mime=mimetypes.guess_type(artifact["name"])[0] or "application/octet-stream",
+                    key=f"download:{artifact['path']}",
+                    on_click="ignore"
+                )
     
     def run(self):
         """Run the Streamlit GUI application"""
@@ -209,16 +583,35 @@ class CohortAgentGUI:
             
             viz_type = st.selectbox(
                 "Default Visualization",
-                options=["heatmap", "scatter", "histogram", "bar", "box", "line", "pair", "regression"],
+                options=["heatmap", "scatter", "histogram", "bar", "box", "line", "pair", "regression",
+                         "trajectory"],
                 index=0
             )
             
+            interactive_plots = st.checkbox(
+                "Interactive plots (rendered in the browser)",
+                value=True,
+                help="Return plotly figure specs instead of server-rendered PNG images"
+            )
+            
+            query_timeout = st.number_input(
+                "Query timeout (seconds, 0 = none)",
+                min_value=0, value=120, step=10,
+                help="Maximum time each analysis step may take"
+            )
+            
             # Apply button
             if st.button("Apply Settings"):
                 self.data_dir = data_dir
                 self.scan_dir = scan_dir
                 self.output_dir = output_dir
                 st.success("Settings applied!")
+            
+            # Directory listings are cached; list them again now
+            if st.button("Refresh Data", help="Look for new or changed files now"):
+                _list_files.clear()
+                _artifact_index.clear()
+                _refresh_scan_index.clear()
         
         # Main panel with tabs
         tab1, tab2, tab3 = st.tabs(["Query", "Data Explorer", "Results History"])
@@ -235,27 +628,21 @@ class CohortAgentGUI:
                 placeholder="Example: Create a visualization of age vs weight from lifestyle data"
             )
             
-            # Run button
-            if st.button("Run Query"):
+            # Run button: the query runs in the background job queue
+            if st.button("Run Query", key="run_query"):
                 if query:
-                    with st.spinner("Processing query..."):
-                        try:
-                            # Run the query through the agent
-                            response = self.agent.run(query)
-                            
-                            # Display the response
-                            st.subheader("Response:")
-                            st.write(response)
-                            
-                            # Check if visualization was created
-                            if "visualization" in query.lower() and "saved to:" in response:
-                                image_path = response.split("saved to:")[1].strip()
-                                if os.path.exists(image_path):
-                                    st.image(image_path, caption="Generated Visualization")
-                        except Exception as e:
-                            st.error(f"Error processing query: {str(e)}")
+                    try:
+                        job = self.jobs.submit(query, timeout=query_timeout or None,
+                                               output_format="plotly" if interactive_plots else None)
+                        # Job ids live in the URL, so results survive a page reload
+                        job_ids = [job.id] + [j for j in st.query_params.get_all("job") if j != job.id]
+                        st.query_params["job"] = job_ids[:MAX_SHOWN_JOBS]
+                    except QueueFullError as e:
+                        st.error(str(e))
                 else:
                     st.warning("Please enter a query.")
+            
+            self._render_jobs()
         
         # Data Explorer tab
         with tab2:
@@ -271,94 +658,51 @@ class CohortAgentGUI:
             st.subheader("Dataset Preview")
             
             # Let user select a file to preview
-            data_files = glob.glob(f"{self.data_dir}/**/*.csv", recursive=True)
+            data_files = self._data_files()
             if data_files:
-                selected_file = st.selectbox("Select a dataset to preview:", data_files)
+                data_root = os.path.abspath(self.data_dir)
+                selected_file = st.selectbox("Select a dataset to preview:", list(data_files),
+                                             format_func=lambda p: os.path.relpath(p, data_root))
                 
                 if selected_file:
                     try:
-                        # Read the file and display a preview
-                        df = pd.read_csv(selected_file)
-                        
-                        # Display file info
-                        st.write(f"**File Path:** {selected_file}")
-                        st.write(f"**Records:** {len(df)}, **Columns:** {len(df.columns)}")
-                        
-                        # Show the dataframe preview
-                        st.dataframe(df.head(10))
-                        
-                        # Display basic statistics
-                        st.write("### Basic Statistics")
-                        
-                        # Select numeric columns for statistics
-                        numeric_cols = df.select_dtypes(include=['number']).columns.tolist()
-                        
-                        if numeric_cols:
-                            # Display descriptive statistics
-                            st.dataframe(df[numeric_cols].describe())
-                            
-                            # Create a simple correlation heatmap for numeric columns
-                            if len(numeric_cols) > 1:
-                                st.write("### Correlation Heatmap")
-                                corr = df[numeric_cols].corr()
-                                
-                                # Create correlation heatmap
-                                fig = px.imshow(
-                                    corr,
-                                    color_continuous_scale="RdBu_r",
-                                    labels=dict(color="Correlation"),
-                                    title="Correlation between variables"
-                                )
-                                st.plotly_chart(fig, use_container_width=True)
-                        else:
-                            st.info("No numeric columns found for statistics.")
+                        self._render_dataset_preview(selected_file, data_files[selected_file])
                     except Exception as e:
                         st.error(f"Error reading file: {str(e)}")
             else:
                 st.info("No data files found. Please check the data directory.")
+            
+            # Scans of one subject, looked up in the persistent scan index
+            st.subheader("Scans by Subject")
+            if _refresh_scan_index(self.scan_dir) is not None:
+                from .scan_index import get_scan_index
+                
+                index = get_scan_index(self.scan_dir, refresh=False)
+                subject = st.text_input("Subject id (e.g. SUBJ042):", key="scan_subject")
+                if subject:
+                    scans = index.scans_for(subject)
+                    kept, skipped = index.unique([scan.path for scan in scans])
+                    st.write(f"**{len(kept)}** scans for {subject}"
+                             + (f" ({len(skipped)} near-duplicates hidden)" if skipped else ""))
+                    for scan in scans:
+                        if scan.path in kept:
+                            caption = (f"{os.path.relpath(scan.path, self.scan_dir)} "
+                                       f"({scan.width}x{scan.height} {scan.format or '?'})")
+                            if scan.error:
+                                st.warning(f"{caption}: {scan.error}")
+                            else:
+                                st.image(_thumbnail(scan.path, (scan.path, scan.size, scan.mtime_ns)),
+                                         caption=caption, width=256)
+                else:
+                    st.caption(f"{len(index.subjects())} subjects with scans in {self.scan_dir}")
+            else:
+                st.info("Scan directory not found. Please check the scan directory.")
         
         # Results History tab
         with tab3:
             st.header("Results History")
             
-            # Display output files
-            output_files = glob.glob(f"{self.output_dir}/**/*.*", recursive=True)
-            
-            if output_files:
-                st.write(f"Found {len(output_files)} result files")
-                
-                # Group by file type
-                output_by_type = {}
-                for f in output_files:
-                    ext = os.path.splitext(f)[1].lower()
-                    if ext not in output_by_type:
-                        output_by_type[ext] = []
-                    output_by_type[ext].append(f)
-                
-                # Create expandable sections for each type
-                for ext, files in output_by_type.items():
-                    with st.expander(f"{ext.upper()} Files ({len(files)})"):
-                        for f in files:
-                            filename = os.path.basename(f)
-                            col1, col2 = st.columns([4, 1])
-                            
-                            with col1:
-                                st.write(f"**{filename}**")
-                                st.write(f"Path: {f}")
-                                
-                                # If image, display it
-                                if ext.lower() in ['.png', '.jpg', '.jpeg', '.gif']:
-                                    st.image(f, caption=filename)
-                            
-                            with col2:
-                                st.download_button(
-                                    label="Download",
-                                    data=open(f, 'rb').read(),
-                                    file_name=filename,
-                                    mime=f"application/{ext.replace('.', '')}"
-                                )
-            else:
-                st.info("No output files found yet. Run some queries to generate results.")
+            self._render_results_history()
 
 def main():
     """Main entry point for the GUI application"""
@@ -368,11 +712,15 @@ def main():
     scan_dir = os.environ.get("SCAN_DIR", "./scans")
     output_dir = os.environ.get("OUTPUT_DIR", "./output")
     
-    # Initialize the GUI with the configuration
-    gui = CohortAgentGUI(model_name=model_name)
-    gui.data_dir = data_dir
-    gui.scan_dir = scan_dir
-    gui.output_dir = output_dir
+    # Initialize the GUI once per browser session, so settings applied in the
+    # sidebar survive reruns (the agent itself is shared by all sessions)
+    if "gui" not in st.session_state:
+        gui = CohortAgentGUI(model_name=model_name)
+        gui.data_dir = data_dir
+        gui.scan_dir = scan_dir
+        gui.output_dir = output_dir
+        st.session_state.gui = gui
+    gui = st.session_state.gui
     
     # Run the GUI
     gui.run()
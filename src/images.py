@@ -0,0 +1,277 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Union, Optional, Tuple, Any, Iterable
+
+from .cache import DEFAULT_CACHE_DIR
+from .tracing import span
+
+# File extensions treated as images when a directory is given
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".tif", ".tiff", ".webp")
+
+# Longest side of the reduced image that pixel statistics are computed on
+THUMBNAIL_SIZE = 256
+
+# Bump when the content of cached results changes
+IMAGE_CACHE_VERSION = 1
+
+# Subject ids as used in the "id" column of the datasets (SUBJ001, ...)
+SUBJECT_ID_RE = re.compile(r"subj[_\-]?(\d+)", re.IGNORECASE)
+
+def subject_id(path: str) -> str:
+    """
+    Subject id of a scan, from its file name or the nearest directory naming one.
+
+    "scans/SUBJ042/liver.jpg" and "scans/subj_042_t1.png" both give
+    "SUBJ042"; a path without an id gives its file name without extension.
+    """
+    parts = os.path.normpath(path).split(os.sep)
+    for part in reversed(parts):
+        match = SUBJECT_ID_RE.search(part)
+        if match:
+            return f"SUBJ{match.group(1)}"
+    return os.path.splitext(parts[-1])[0]
+
+def expand_image_paths(paths: Iterable[str]) -> List[str]:
+    """
+    Replace directories by the image files under them (recursively, sorted).
+
+    Args:
+        paths: Image files and/or directories
+
+    Returns:
+        List of image file paths; plain file paths are kept as given
+    """
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, _, files in os.walk(path):
+                found.extend(os.path.join(root, f) for f in files
+                             if f.lower().endswith(IMAGE_EXTENSIONS))
+            expanded.extend(sorted(found))
+        else:
+            expanded.append(path)
+    return expanded
+
+def read_header(path: str) -> Dict[str, Any]:
+    """
+    Metadata of an image read from its header, without decoding pixels.
+
+    PIL parses only the header on open; pixel data is read on first access,
+    which never happens here.
+
+    Args:
+        path: Path to the image file
+
+    Returns:
+        Dictionary with width, height, format, mode, frames and bytes
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        return {"width": img.size[0], "height": img.size[1], "format": img.format,
+                "mode": img.mode, "frames": getattr(img, "n_frames", 1),
+                "bytes": os.path.getsize(path)}
+
+def pixel_stats(path: str, size: int = THUMBNAIL_SIZE) -> Dict[str, Any]:
+    """
+    Intensity statistics of an image, computed on a reduced-resolution decode.
+
+    JPEG files are decoded directly at 1/2, 1/4 or 1/8 scale (PIL draft
+    mode), which is several times faster than a full decode; other formats
+    are decoded fully and then shrunk.
+
+    Args:
+        path: Path to the image file
+        size: Longest side of the image the statistics are computed on
+
+    Returns:
+        Dictionary with mean, std, min and max grey level and the decoded size
+    """
+    from PIL import Image, ImageStat
+
+    with Image.open(path) as img:
+        img.draft("L", (size, size))
+        grey = img.convert("L")
+        grey.thumbnail((size, size))
+        stat = ImageStat.Stat(grey)
+        low, high = stat.extrema[0]
+        return {"mean": round(stat.mean[0], 2), "std": round(stat.stddev[0], 2),
+                "min": low, "max": high, "decoded_size": list(grey.size)}
+
+class ImageCache:
+    """
+    Per-image results keyed by a hash of the file's contents.
+
+    Content hashes are remembered by path, size and mtime, so an unchanged
+    directory is not even re-read; a copied or renamed file still hits
+    because its contents hash the same.
+    """
+
+    def __init__(self, cache_dir: str = os.path.join(DEFAULT_CACHE_DIR, "images")):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding the hash index and per-image results
+        """
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "hashes.json")
+        self._lock = threading.Lock()
+        self._dirty = False
+        try:
+            with open(self.index_path) as f:
+                self._hashes: Dict[str, List[Any]] = json.load(f)
+        except (OSError, ValueError):
+            self._hashes = {}
+
+    def content_hash(self, path: str) -> str:
+        """SHA-256 of a file's contents, re-hashed only when its size or mtime change."""
+        st = os.stat(path)
+        path = os.path.abspath(path)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._hashes[path] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+            self._dirty = True
+        return digest.hexdigest()
+
+    def _entry_path(self, content_hash: str) -> str:
+        return os.path.join(self.cache_dir, content_hash[:2], content_hash + ".json")
+
+    def get(self, content_hash: str) -> Dict[str, Any]:
+        """Results cached for an image (empty if none)."""
+        try:
+            with open(self._entry_path(content_hash)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entry if entry.get("version") == IMAGE_CACHE_VERSION else {}
+
+    def put(self, content_hash: str, results: Dict[str, Any]):
+        """Store the results for an image, replacing earlier ones."""
+        path = self._entry_path(content_hash)
+        _write_json(path, dict(results, version=IMAGE_CACHE_VERSION))
+
+    def flush(self):
+        """Save the hash index if new files were hashed."""
+        with self._lock:
+            if not self._dirty:
+                return
+            hashes = dict(self._hashes)
+            self._dirty = False
+        _write_json(self.index_path, hashes)
+
+    def clear(self) -> int:
+        """
+        Remove every cached result and the hash index.
+
+        Returns:
+            Number of results removed
+        """
+        removed = 0
+        if os.path.isdir(self.cache_dir):
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    os.remove(os.path.join(root, name))
+                    removed += name.endswith(".json") and name != "hashes.json"
+        with self._lock:
+            self._hashes = {}
+            self._dirty = False
+        return removed
+
+def _write_json(path: str, payload: Dict[str, Any]):
+    """Write JSON through a temporary file so readers never see half of it."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, path)
+
+_default_cache: Optional[ImageCache] = None
+_default_cache_dir: Optional[str] = os.path.join(DEFAULT_CACHE_DIR, "images")
+_default_cache_lock = threading.Lock()
+
+def configure_image_cache(cache_dir: Optional[str] = DEFAULT_CACHE_DIR, enabled: bool = True):
+    """
+    Choose the cache that default_image_cache() returns from now on.
+
+    Args:
+        cache_dir: Result cache directory; image results are kept in its
+                  images subdirectory, next to the cached tool results
+        enabled: False to bypass the image cache, as --no-cache does
+    """
+    global _default_cache, _default_cache_dir
+    with _default_cache_lock:
+        _default_cache = None
+        _default_cache_dir = os.path.join(cache_dir, "images") if enabled else None
+
+def default_image_cache() -> Optional[ImageCache]:
+    """The configured image cache, shared by this process, or None if it is bypassed."""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None and _default_cache_dir is not None:
+            _default_cache = ImageCache(_default_cache_dir)
+        return _default_cache
+
+def inspect_images(paths: List[str], pixels: bool = False, workers: Optional[int] = None,
+                   cache: Optional[ImageCache] = None) -> List[Dict[str, Any]]:
+    """
+    Header metadata, and optionally pixel statistics, of many images.
+
+    Images are processed on a thread pool: reading headers is I/O bound and
+    PIL releases the GIL while decoding, so threads scale without the cost
+    of sending images to other processes.
+
+    Args:
+        paths: Image files
+        pixels: Also decode the images and compute intensity statistics
+        workers: Worker threads (default: 2 per CPU, at most 32)
+        cache: Cache of per-image results (None to always recompute)
+
+    Returns:
+        One dictionary per path, in order, with "path", "header", "stats"
+        (if pixels) and "error" (if the image could not be read)
+    """
+    def inspect(path: str) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"path": path}
+        try:
+            key = cache.content_hash(path) if cache is not None else None
+            cached = cache.get(key) if key is not None else {}
+            fresh = dict(cached)
+            if "header" not in fresh:
+                fresh["header"] = read_header(path)
+            if pixels and "stats" not in fresh:
+                fresh["stats"] = pixel_stats(path)
+            if key is not None and len(fresh) > len(cached):
+                cache.put(key, fresh)
+            result["header"] = fresh["header"]
+            if pixels:
+                result["stats"] = fresh["stats"]
+            result["cached"] = len(fresh) == len(cached)
+        except Exception as e:
+            result["error"] = str(e)
+        return result
+
+    with span("inspect_images", images=len(paths), pixels=pixels) as s:
+        workers = workers or min(32, 2 * (os.cpu_count() or 1))
+        if len(paths) <= 1 or workers == 1:
+            results = [inspect(path) for path in paths]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(inspect, paths))
+        if cache is not None:
+            cache.flush()
+        s.set(cached=sum(1 for r in results if r.get("cached")))
+    return results
@@ -0,0 +1,226 @@
+import base64
+import hashlib
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Union, Optional, Tuple, Any
+
+from .images import ImageCache, default_image_cache
+from .model import DEFAULT_TIMEOUT, INTERPRET_PROMPT, MicroBatcher, ModelBackend, get_backend
+from .tracing import span
+
+# Longest side images are resized to before they are sent (LLaVA's vision
+# encoder works at 336 pixels; larger images only cost bandwidth and decoding)
+MODEL_IMAGE_SIZE = 336
+
+# Images per micro-batch, and how long the first image waits for others
+MAX_BATCH = 8
+MAX_WAIT = 0.05
+
+def prepare_image(path: str, size: int = MODEL_IMAGE_SIZE) -> str:
+    """
+    Resize an image to the model's input size and encode it as base64 JPEG.
+
+    JPEGs are decoded at reduced scale directly when they are much larger
+    than size.
+
+    Args:
+        path: Image file
+        size: Longest side of the encoded image
+
+    Returns:
+        Base64-encoded JPEG
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        img.draft("RGB", (size, size))
+        rgb = img.convert("RGB")
+    rgb.thumbnail((size, size))
+    buffer = io.BytesIO()
+    rgb.save(buffer, format="JPEG", quality=90)
+    return base64.b64encode(buffer.getvalue()).decode("ascii")
+
+class InferenceQueue:
+    """
+    Batched image interpretation on a vision model.
+
+    Each image is resized and encoded once (encodings are kept in memory by
+    content hash). Pending requests are grouped into micro-batches of up to
+    max_batch, waiting at most max_wait seconds for a batch to fill, and each
+    batch is sent to the backend at once. Answers are cached per (image
+    content hash, prompt) in the image cache, so they survive restarts, and
+    identical requests in flight are sent only once.
+    """
+
+    def __init__(self, backend: ModelBackend, image_size: int = MODEL_IMAGE_SIZE,
+                 max_batch: int = MAX_BATCH, max_wait: float = MAX_WAIT,
+                 cache: Optional[ImageCache] = None, max_encoded: int = 256):
+        """
+        Initialize the queue.
+
+        Args:
+            backend: Model backend to send batches to
+            image_size: Longest side images are resized to
+            max_batch: Maximum images per batch
+            max_wait: Seconds a request may wait for its batch to fill
+            cache: Persistent cache of answers (None for memory only)
+            max_encoded: Encoded images kept in memory
+        """
+        self.backend = backend
+        self.image_size = image_size
+        self.cache = cache
+        self.max_encoded = max_encoded
+        self.stats = {"submitted": 0, "cache_hits": 0, "deduplicated": 0, "encoded": 0, "sent": 0}
+        self._batcher = MicroBatcher(self._dispatch, max_batch=max_batch, max_wait=max_wait)
+        self._encoded: "OrderedDict[str, str]" = OrderedDict()
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+        self._answers: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _prompt_key(self, prompt: str) -> str:
+        """Key of a prompt for this model, server and image size in the answer cache."""
+        pool = getattr(self.backend, "pool", None)
+        server = f"{pool.host}:{pool.port}{pool.prefix}" if pool is not None else ""
+        return hashlib.sha256(f"{type(self.backend).__name__}|{server}|{self.backend.model}|"
+                              f"{self.image_size}|{prompt}".encode("utf-8")).hexdigest()[:16]
+
+    def _content_hash(self, path: str) -> str:
+        if self.cache is not None:
+            return self.cache.content_hash(path)
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _cached_answer(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            if key in self._answers:
+                return self._answers[key]
+        if self.cache is None:
+            return None
+        return self.cache.get(key[0]).get("interpretations", {}).get(key[1])
+
+    def _store_answer(self, key: Tuple[str, str], answer: str):
+        with self._lock:
+            self._answers[key] = answer
+            while len(self._answers) > 16 * self.max_encoded:
+                self._answers.popitem(last=False)
+            self._in_flight.pop(key, None)
+            if self.cache is not None:
+                entry = self.cache.get(key[0])
+                entry.setdefault("interpretations", {})[key[1]] = answer
+                self.cache.put(key[0], entry)
+
+    def _encode(self, path: str, content_hash: str) -> str:
+        with self._lock:
+            if content_hash in self._encoded:
+                self._encoded.move_to_end(content_hash)
+                return self._encoded[content_hash]
+        with span("encode_image", path=path):
+            encoded = prepare_image(path, self.image_size)
+        with self._lock:
+            self.stats["encoded"] += 1
+            self._encoded[content_hash] = encoded
+            while len(self._encoded) > self.max_encoded:
+                self._encoded.popitem(last=False)
+        return encoded
+
+    def submit(self, path: str, prompt: str = INTERPRET_PROMPT) -> Future:
+        """
+        Queue an image for interpretation.
+
+        Args:
+            path: Image file
+            prompt: Question about the image
+
+        Returns:
+            Future resolved with the model's answer (or its error)
+        """
+        key = (self._content_hash(path), self._prompt_key(prompt))
+        with self._lock:
+            self.stats["submitted"] += 1
+        answer = self._cached_answer(key)
+        if answer is not None:
+            with self._lock:
+                self.stats["cache_hits"] += 1
+            future: Future = Future()
+            future.set_result(answer)
+            return future
+        with self._lock:
+            if key in self._in_flight:
+                self.stats["deduplicated"] += 1
+                return self._in_flight[key]
+        encoded = self._encode(path, key[0])
+        with self._lock:
+            # Another thread may have queued the same request meanwhile
+            if key in self._in_flight:
+                self.stats["deduplicated"] += 1
+                return self._in_flight[key]
+            future = self._in_flight[key] = self._batcher.submit((prompt, encoded))
+
+        def done(f: Future):
+            if f.exception() is None:
+                self._store_answer(key, f.result())
+            else:
+                with self._lock:
+                    self._in_flight.pop(key, None)
+        future.add_done_callback(done)
+        return future
+
+    def interpret_many(self, paths: List[str], prompt: str = INTERPRET_PROMPT) -> List[str]:
+        """
+        Interpret several images, batching them.
+
+        Returns:
+            One answer per path, in order
+
+        Raises:
+            ModelError: If the model fails for any of the images
+        """
+        with span("interpret_images", images=len(paths)):
+            futures = [self.submit(path, prompt) for path in paths]
+            return [future.result() for future in futures]
+
+    def _dispatch(self, requests: List[Tuple[str, str]]) -> List[str]:
+        with self._lock:
+            self.stats["sent"] += len(requests)
+        with span("model_batch", size=len(requests)):
+            return self.backend.complete_images(requests)
+
+    @property
+    def batches(self) -> int:
+        """Number of batches sent so far."""
+        return self._batcher.batches_dispatched
+
+    def close(self):
+        """Send what is pending and stop the batcher."""
+        self._batcher.close()
+
+_queues: Dict[Tuple[str, Optional[str], float], InferenceQueue] = {}
+_queues_lock = threading.Lock()
+
+def get_inference_queue(model_name: str, base_url: Optional[str] = None,
+                        timeout: float = DEFAULT_TIMEOUT) -> InferenceQueue:
+    """
+    Shared inference queue for a model, created on first use.
+
+    The queue sends to get_backend(model_name, base_url, timeout) and caches
+    answers in the default image cache.
+    """
+    key = (model_name, base_url, timeout)
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = InferenceQueue(get_backend(model_name, base_url=base_url, timeout=timeout),
+                                          cache=default_image_cache())
+        return _queues[key]
+
+def close_queues():
+    """Close every shared inference queue."""
+    with _queues_lock:
+        queues = list(_queues.values())
+        _queues.clear()
+    for q in queues:
+        q.close()
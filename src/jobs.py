@@ -0,0 +1,282 @@
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from dataclasses import asdict, dataclass, field
+from typing import List, Dict, Union, Optional, Tuple, Any
+
+from .cache import DEFAULT_CACHE_DIR
+
+# Queries run at once; further ones wait in the queue
+DEFAULT_JOB_WORKERS = 2
+
+# Queries that may wait at once; submitting more raises QueueFullError
+MAX_QUEUED_JOBS = 32
+
+# Finished jobs kept (in memory and on disk) before the oldest are dropped
+MAX_FINISHED_JOBS = 200
+
+# Job states
+QUEUED, RUNNING, CANCELLING = "queued", "running", "cancelling"
+DONE, FAILED, CANCELLED, INTERRUPTED = "done", "failed", "cancelled", "interrupted"
+FINISHED_STATES = (DONE, FAILED, CANCELLED, INTERRUPTED)
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while MAX_QUEUED_JOBS are waiting."""
+
+@dataclass
+class Job:
+    """A query run in the background, and everything it has produced so far."""
+    id: str
+    query: str
+    timeout: Optional[float] = None
+    output_format: Optional[str] = None
+    status: str = QUEUED
+    submitted: float = field(default_factory=time.time)
+    started: Optional[float] = None
+    finished: Optional[float] = None
+    steps_total: int = 0
+    steps_done: int = 0
+    texts: List[str] = field(default_factory=list)
+    artifacts: List[str] = field(default_factory=list)
+    error: str = ""
+
+    @property
+    def progress(self) -> float:
+        """Fraction of the plan's steps completed (1.0 once finished)."""
+        if self.status in FINISHED_STATES:
+            return 1.0
+        return self.steps_done / self.steps_total if self.steps_total else 0.0
+
+    @property
+    def text(self) -> str:
+        """The response so far, steps separated by blank lines."""
+        return "\n\n".join(t for t in self.texts if t)
+
+class JobQueue:
+    """
+    Bounded pool running agent queries in the background.
+
+    Each submitted query gets a job id and runs on one of max_workers
+    threads; the others wait in submission order. A job's output grows
+    step by step while it runs, so callers can poll it, and it can be
+    cancelled: a waiting job never starts, a running one is "cancelling"
+    until it stops, which it does right away, abandoning its current step
+    (a tool that does not stream finishes on its own thread, but its
+    result is dropped). Jobs are saved to job_dir when submitted, started
+    and finished, so results survive restarts of the server, and jobs that
+    a restart cut short are reported as interrupted.
+    """
+
+    def __init__(self, agent, max_workers: int = DEFAULT_JOB_WORKERS,
+                 max_queued: int = MAX_QUEUED_JOBS,
+                 job_dir: Optional[str] = os.path.join(DEFAULT_CACHE_DIR, "jobs")):
+        """
+        Initialize the queue.
+
+        Args:
+            agent: CohortAgent that runs the queries
+            max_workers: Queries run at once
+            max_queued: Queries that may wait at once
+            job_dir: Directory finished jobs are saved to (None keeps them in memory only)
+        """
+        self.agent = agent
+        self.max_queued = max_queued
+        self.job_dir = job_dir
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._futures: Dict[str, Future] = {}
+        self._cancel: Dict[str, threading.Event] = {}
+        self._tasks: Dict[str, Tuple[asyncio.AbstractEventLoop, asyncio.Task]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="cohortagent-job")
+
+    def submit(self, query: str, timeout: Optional[float] = None,
+               output_format: Optional[str] = None) -> Job:
+        """
+        Queue a query.
+
+        Args:
+            query: The user's query string
+            timeout: Per-step timeout in seconds
+            output_format: Output format of the query's plots ("png" or "plotly")
+                           unless the query asks for one
+
+        Returns:
+            The new job
+
+        Raises:
+            QueueFullError: If max_queued jobs are already waiting
+        """
+        with self._lock:
+            if sum(1 for job in self.jobs.values() if job.status == QUEUED) >= self.max_queued:
+                raise QueueFullError(f"{self.max_queued} queries are already waiting; try again later")
+            job = Job(id=uuid.uuid4().hex[:12], query=query, timeout=timeout, output_format=output_format)
+            self.jobs[job.id] = job
+            self._cancel[job.id] = threading.Event()
+            self._save(job)
+            self._futures[job.id] = self._pool.submit(self._run, job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        A job by id, from memory or from job_dir; None if unknown.
+
+        A job saved unfinished by an earlier server is reported as interrupted.
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None or self.job_dir is None or not job_id.isalnum():
+            return job
+        try:
+            with open(self._job_path(job_id)) as f:
+                job = Job(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        with self._lock:
+            if job_id in self.jobs:
+                return self.jobs[job_id]
+            self.jobs[job_id] = job
+            if job.status not in FINISHED_STATES:
+                job.error = f"The server stopped while the job was {job.status}"
+                self._finish(job, INTERRUPTED)
+            return job
+
+    def position(self, job_id: str) -> int:
+        """Place of a waiting job in the queue (1 is next), 0 if it is not waiting."""
+        with self._lock:
+            waiting = [job.id for job in self.jobs.values() if job.status == QUEUED]
+        return waiting.index(job_id) + 1 if job_id in waiting else 0
+
+    def cancel(self, job_id: str) -> bool:
+        """
+        Cancel a job that has not finished.
+
+        A running job is marked "cancelling" and its current step abandoned;
+        it is "cancelled" once its worker has stopped.
+
+        Returns:
+            True if the job was waiting or running
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status in FINISHED_STATES:
+                return False
+            self._cancel[job_id].set()
+            if self._futures[job_id].cancel():
+                # Never started
+                self._finish(job, CANCELLED)
+                return True
+            job.status = CANCELLING
+            task = self._tasks.get(job_id)
+        if task is not None:
+            loop, task = task
+            try:
+                loop.call_soon_threadsafe(task.cancel)
+            except RuntimeError:
+                # The job's event loop has already closed
+                pass
+        return True
+
+    def wait(self, job_id: str, timeout: Optional[float] = None) -> Job:
+        """Block until a job has finished (or timeout seconds have passed) and return it."""
+        future = self._futures.get(job_id)
+        if future is not None and not future.cancelled():
+            try:
+                future.result(timeout)
+            except FutureTimeoutError:
+                pass
+        return self.get(job_id)
+
+    def _run(self, job: Job):
+        cancel = self._cancel[job.id]
+        with self._lock:
+            if job.status == QUEUED:
+                job.status = RUNNING
+            job.started = time.time()
+            self._save(job)
+        try:
+            asyncio.run(self._run_async(job, cancel))
+            status = CANCELLED if cancel.is_set() else DONE
+        except asyncio.CancelledError:
+            status = CANCELLED
+        except Exception as e:
+            job.error = str(e)
+            status = FAILED
+        with self._lock:
+            self._tasks.pop(job.id, None)
+            self._finish(job, status)
+
+    async def _run_async(self, job: Job, cancel: threading.Event):
+        from .agent import HELP_MESSAGE
+        from .planner import PLOT_TOOLS
+
+        with self._lock:
+            # cancel() cancels this task, which stops the current step at once
+            self._tasks[job.id] = (asyncio.get_running_loop(), asyncio.current_task())
+        if cancel.is_set():
+            return
+        plan = self.agent.plan(job.query)
+        if job.output_format:
+            for step in plan.steps:
+                if step.tool in PLOT_TOOLS:
+                    step.params.setdefault("output_format", job.output_format)
+        job.steps_total = len(plan.steps)
+        if not plan.steps:
+            job.texts.append(HELP_MESSAGE)
+            return
+        stream = self.agent.execute_stream(plan, timeout=job.timeout, cancel=cancel)
+        try:
+            async for chunk in stream:
+                if cancel.is_set():
+                    return
+                while len(job.texts) <= chunk.step:
+                    job.texts.append("")
+                job.texts[chunk.step] += chunk.text
+                if chunk.artifact:
+                    job.artifacts.append(chunk.artifact)
+                if chunk.final:
+                    job.steps_done += 1
+        finally:
+            await stream.aclose()
+
+    def _finish(self, job: Job, status: str):
+        """Record a job's end (called with the lock held) and save it."""
+        job.status, job.finished = status, time.time()
+        self._cancel.pop(job.id, None)
+        finished = [j.id for j in self.jobs.values() if j.status in FINISHED_STATES]
+        for old in finished[:-MAX_FINISHED_JOBS]:
+            del self.jobs[old]
+            self._futures.pop(old, None)
+            if self.job_dir is not None:
+                try:
+                    os.remove(self._job_path(old))
+                except OSError:
+                    pass
+        self._save(job)
+
+    def _save(self, job: Job):
+        """Write a job to job_dir (called with the lock held)."""
+        if self.job_dir is not None:
+            os.makedirs(self.job_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.job_dir, suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(asdict(job), f)
+            os.replace(tmp_path, self._job_path(job.id))
+
+    def _job_path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir, f"{job_id}.json")
+
+    def close(self):
+        """Cancel every unfinished job and stop the workers."""
+        # Waiting jobs first, so a worker freed by cancelling a running job
+        # cannot start one of them
+        with self._lock:
+            waiting = [job.id for job in self.jobs.values() if job.status == QUEUED]
+        for job_id in waiting + list(self.jobs):
+            self.cancel(job_id)
+        self._pool.shutdown(wait=False, cancel_futures=True)
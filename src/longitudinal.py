@@ -0,0 +1,489 @@
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Tuple, Any, Iterator, Sequence
+
+from .tracing import span
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Column names taken as the subject id and as the visit time, in order of preference
+SUBJECT_COLUMNS = ("subject_id", "subject", "participant_id", "patient_id", "id")
+TIME_COLUMNS = ("visit_date", "date", "visit_time", "time", "timestamp", "days", "day",
+                "visit", "visit_number", "week", "month", "year")
+
+# Analysis and plot types that work on repeated visits per subject
+LONGITUDINAL_ANALYSIS_TYPES = ("longitudinal",)
+LONGITUDINAL_PLOT_TYPES = ("trajectory",)
+LONGITUDINAL_OPERATIONS = LONGITUDINAL_ANALYSIS_TYPES + LONGITUDINAL_PLOT_TYPES
+
+# Visits in a rolling window unless a time span is given
+DEFAULT_WINDOW = 3
+
+# Subjects drawn individually in a trajectory plot, panels per plot, and time
+# bins of the cohort mean curve
+MAX_TRAJECTORIES = 50
+MAX_TRAJECTORY_PANELS = 4
+TRAJECTORY_BINS = 20
+
+# Columns per piece when streaming a longitudinal analysis
+STREAM_COLUMN_BLOCK = 10
+
+DAYS_PER_YEAR = 365.25
+NS_PER_DAY = 86400 * 10**9
+
+def find_visit_columns(columns: Sequence[str], subject: Optional[str] = None,
+                       time: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Subject id and visit time columns among columns (names are matched
+    case-insensitively against SUBJECT_COLUMNS and TIME_COLUMNS).
+
+    Raises:
+        ValueError: If either is missing
+    """
+    lower = {str(c).lower(): c for c in columns}
+    subject = subject or next((lower[c] for c in SUBJECT_COLUMNS if c in lower), None)
+    time = time or next((lower[c] for c in TIME_COLUMNS if c in lower), None)
+    if subject is None or time is None or subject not in columns or time not in columns:
+        raise ValueError(f"longitudinal data needs a subject column (one of {', '.join(SUBJECT_COLUMNS)}) "
+                         f"and a visit time column (one of {', '.join(TIME_COLUMNS)})")
+    return subject, time
+
+def visit_columns(columns: Sequence[str]) -> List[str]:
+    """The subject and visit time columns among columns ([] if either is missing)."""
+    try:
+        return list(find_visit_columns(columns))
+    except ValueError:
+        return []
+
+def _ranges(starts: "np.ndarray", lengths: "np.ndarray") -> "np.ndarray":
+    """Concatenation of range(start, start + length) for each pair, without a Python loop."""
+    import numpy as np
+
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths, lengths) + np.repeat(starts, lengths)
+
+class VisitStore:
+    """
+    Repeated measurements indexed by (subject, visit time).
+
+    Rows are sorted by subject, then time; the visits of the i-th subject
+    (in sorted order) are rows offsets[i] to offsets[i + 1] of frame. Each
+    row also has a key, subject code * stride + time since the first
+    visit in the data, that increases through the whole store, so time
+    ranges and time windows of any set of subjects are found by binary
+    search. Per-visit and per-subject features are computed for the whole
+    cohort at once from these arrays.
+
+    Date columns are parsed and measured in days; numeric time columns
+    (visit number, months, ...) are used as they are.
+    """
+
+    def __init__(self, data: "pd.DataFrame", subject: Optional[str] = None, time: Optional[str] = None):
+        """
+        Index data.
+
+        Rows without a subject or with a time that cannot be parsed are
+        left out (counted in dropped).
+
+        Args:
+            data: One row per visit
+            subject: Subject id column (default: found by name)
+            time: Visit time column (default: found by name)
+
+        Raises:
+            ValueError: If there is no subject or visit time column
+        """
+        import numpy as np
+        import pandas as pd
+
+        self.subject_column, self.time_column = find_visit_columns(list(data.columns), subject, time)
+        with span("visit_store", rows=len(data)) as s:
+            raw = data[self.time_column]
+            self.datetime = not pd.api.types.is_numeric_dtype(raw)
+            if self.datetime:
+                parsed = pd.to_datetime(raw, errors="coerce")
+                if getattr(parsed.dt, "tz", None) is not None:
+                    parsed = parsed.dt.tz_convert(None)
+                times = parsed.to_numpy("datetime64[ns]").astype("int64") / NS_PER_DAY
+                times[parsed.isna().to_numpy()] = np.nan
+            else:
+                times = raw.to_numpy(dtype=float)
+            valid = ~np.isnan(times) & data[self.subject_column].notna().to_numpy()
+            codes, subjects = pd.factorize(data[self.subject_column][valid], sort=True)
+            times = times[valid]
+            order = np.lexsort((times, codes))
+            self.frame = data[valid].iloc[order].reset_index(drop=True)
+            self.codes = codes[order]
+            self.times = times[order]
+            self.subjects = subjects
+            self.offsets = np.searchsorted(self.codes, np.arange(len(subjects) + 1))
+            self.dropped = int(len(data) - len(self.frame))
+            self.origin = float(self.times.min()) if len(self.times) else 0.0
+            self.stride = float(self.times.max()) - self.origin + 1.0 if len(self.times) else 1.0
+            self.keys = self.codes * self.stride + (self.times - self.origin)
+            s.set(subjects=len(subjects), dropped=self.dropped)
+
+    @classmethod
+    def from_csv(cls, file_path: str, subject: Optional[str] = None, time: Optional[str] = None) -> "VisitStore":
+        """Index a CSV file of visits (read through load_csv, so data caches apply)."""
+        from .utils import load_csv
+
+        return cls(load_csv(file_path), subject, time)
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    @property
+    def n_subjects(self) -> int:
+        return len(self.subjects)
+
+    @property
+    def time_unit(self) -> str:
+        """What one unit of time is: "day" for dates, else the time column's name."""
+        return "day" if self.datetime else self.time_column
+
+    def to_time(self, value: Any) -> float:
+        """A time in the store's units (dates and date strings become days since 1970)."""
+        import pandas as pd
+
+        if self.datetime:
+            return pd.Timestamp(value).value / NS_PER_DAY
+        return float(value)
+
+    def to_span(self, value: Any) -> float:
+        """A length of time in the store's units ("180D" or a Timedelta for dates, else a number)."""
+        import pandas as pd
+
+        if self.datetime and not isinstance(value, (int, float)):
+            return pd.Timedelta(value) / pd.Timedelta(days=1)
+        return float(value)
+
+    def _codes(self, subjects: Optional[Sequence[Any]]) -> "np.ndarray":
+        import numpy as np
+
+        if subjects is None:
+            return np.arange(self.n_subjects)
+        codes = self.subjects.get_indexer(list(subjects))
+        return codes[codes >= 0]
+
+    def rows_between(self, start: Any = None, end: Any = None,
+                     subjects: Optional[Sequence[Any]] = None) -> "np.ndarray":
+        """
+        Positions in frame of the visits with start <= time <= end.
+
+        Two binary searches per subject; the rows of other subjects and
+        other times are never looked at.
+
+        Args:
+            start: Earliest time (None: no lower bound)
+            end: Latest time (None: no upper bound)
+            subjects: Subject ids to search (None: all); unknown ids are ignored
+        """
+        import numpy as np
+
+        codes = self._codes(subjects)
+        base = codes * self.stride
+        low = 0.0 if start is None else min(max(self.to_time(start) - self.origin, 0.0), self.stride)
+        high = self.stride - 1.0 if end is None else min(max(self.to_time(end) - self.origin, -0.5),
+                                                         self.stride - 1.0)
+        lo = np.searchsorted(self.keys, base + low, side="left")
+        hi = np.searchsorted(self.keys, base + high, side="right")
+        return _ranges(lo, np.maximum(hi - lo, 0))
+
+    def between(self, start: Any = None, end: Any = None,
+                subjects: Optional[Sequence[Any]] = None) -> "pd.DataFrame":
+        """Visits with start <= time <= end, of the given subjects (see rows_between)."""
+        return self.frame.iloc[self.rows_between(start, end, subjects)]
+
+    def visits(self, subject: Any) -> "pd.DataFrame":
+        """All visits of one subject, in time order."""
+        return self.between(subjects=[subject])
+
+    def _values(self, column: str) -> "np.ndarray":
+        return self.frame[column].to_numpy(dtype=float)
+
+    def _first_rows(self) -> "np.ndarray":
+        """For every row, the row of its subject's first visit."""
+        return self.offsets[self.codes]
+
+    def since_baseline(self) -> "np.ndarray":
+        """Time of every visit since the subject's first visit."""
+        return self.times - self.times[self._first_rows()]
+
+    def delta(self, column: str) -> "np.ndarray":
+        """Change of column since the subject's previous visit (NaN at first visits)."""
+        import numpy as np
+
+        values = self._values(column)
+        result = np.full(len(values), np.nan)
+        result[1:] = values[1:] - values[:-1]
+        result[self.offsets[:-1]] = np.nan
+        return result
+
+    def change_from_baseline(self, column: str) -> "np.ndarray":
+        """Change of column since the subject's first visit."""
+        values = self._values(column)
+        return values - values[self._first_rows()]
+
+    def window_starts(self, visits: Optional[int] = DEFAULT_WINDOW, span: Any = None) -> "np.ndarray":
+        """
+        For every row, the first row of the window ending at it: the last
+        visits visits of the subject, or with span, the subject's visits at
+        most span before it.
+        """
+        import numpy as np
+
+        first = self._first_rows()
+        if span is not None:
+            return np.maximum(np.searchsorted(self.keys, self.keys - self.to_span(span), side="left"), first)
+        if visits is None or visits < 1:
+            raise ValueError("a rolling window needs at least one visit")
+        return np.maximum(np.arange(len(self)) - (visits - 1), first)
+
+    def rolling_mean(self, column: str, visits: Optional[int] = DEFAULT_WINDOW, span: Any = None) -> "np.ndarray":
+        """
+        Mean of column over a window ending at each visit (see
+        window_starts), skipping missing values. Computed from cumulative
+        sums, so the cost does not depend on the window size.
+        """
+        import numpy as np
+
+        values = self._values(column)
+        valid = ~np.isnan(values)
+        sums = np.concatenate(([0.0], np.cumsum(np.where(valid, values, 0.0))))
+        counts = np.concatenate(([0], np.cumsum(valid)))
+        starts = self.window_starts(visits, span)
+        ends = np.arange(1, len(values) + 1)
+        n = counts[ends] - counts[starts]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(n > 0, (sums[ends] - sums[starts]) / n, np.nan)
+
+    def slopes(self, column: str) -> "pd.Series":
+        """
+        Least-squares slope of column against time, per subject (change per
+        time unit; per day for dates). NaN for subjects with fewer than two
+        measured visits at different times.
+        """
+        import numpy as np
+        import pandas as pd
+
+        if not len(self):
+            return pd.Series([], index=self.subjects, dtype=float, name=column)
+        values = self._values(column)
+        measured = ~np.isnan(values)
+        x = np.where(measured, self.since_baseline(), 0.0)
+        y = np.where(measured, values, 0.0)
+        starts = self.offsets[:-1]
+        n = np.add.reduceat(measured.astype(float), starts)
+        sx = np.add.reduceat(x, starts)
+        sy = np.add.reduceat(y, starts)
+        sxx = np.add.reduceat(x * x, starts)
+        sxy = np.add.reduceat(x * y, starts)
+        denominator = n * sxx - sx * sx
+        with np.errstate(invalid="ignore", divide="ignore"):
+            slope = np.where((n >= 2) & (denominator > 0), (n * sxy - sx * sy) / denominator, np.nan)
+        return pd.Series(slope, index=self.subjects, name=column)
+
+    def baseline(self) -> "pd.DataFrame":
+        """First visit of every subject, indexed by subject."""
+        return self.frame.iloc[self.offsets[:-1]].set_index(self.subject_column)
+
+    def follow_up(self) -> "np.ndarray":
+        """Time from first to last visit, per subject."""
+        return self.times[self.offsets[1:] - 1] - self.times[self.offsets[:-1]]
+
+    def features(self, columns: Sequence[str], visits: Optional[int] = DEFAULT_WINDOW,
+                 span: Any = None) -> "pd.DataFrame":
+        """
+        Per-visit features: time since baseline and, for each column, its
+        change since the previous visit (_delta), since baseline (_change)
+        and its rolling mean (_rolling_mean).
+        """
+        features = self.frame[[self.subject_column, self.time_column]].copy()
+        features["since_baseline"] = self.since_baseline()
+        for column in columns:
+            features[f"{column}_delta"] = self.delta(column)
+            features[f"{column}_change"] = self.change_from_baseline(column)
+            features[f"{column}_rolling_mean"] = self.rolling_mean(column, visits, span)
+        return features
+
+def value_columns(data: "pd.DataFrame", columns: Optional[List[str]], exclude: Sequence[str]) -> List[str]:
+    """Numeric columns to follow over time: those requested, or all of them, minus exclude."""
+    import numpy as np
+
+    numeric = set(data.select_dtypes(include=np.number).columns)
+    candidates = columns or list(data.columns)
+    return [c for c in candidates if c in numeric and c not in exclude]
+
+def iter_longitudinal_analysis(data: "pd.DataFrame", columns: Optional[List[str]] = None,
+                               groupby: Optional[str] = None, call=None) -> Iterator[str]:
+    """
+    Longitudinal analysis report, piece by piece: visit structure, then
+    per-subject slopes of each column, then (with groupby) mean slopes per
+    group of the subjects' first-visit groupby value.
+
+    Column blocks stop early once call's time budget is used up.
+    """
+    import numpy as np
+    import pandas as pd
+
+    try:
+        store = VisitStore(data)
+    except ValueError as e:
+        yield f"Column error: {e}"
+        return
+    grouped = groupby and groupby in store.frame.columns
+    values = value_columns(store.frame, columns,
+                           [store.subject_column, store.time_column] + ([groupby] if grouped else []))
+    visits = np.diff(store.offsets)
+    per = "year" if store.datetime else store.time_unit
+    scale = DAYS_PER_YEAR if store.datetime else 1.0
+
+    result = "Longitudinal Analysis:\n\n"
+    result += (f"Subjects: {store.n_subjects:,} (by {store.subject_column}), "
+               f"visits: {len(store):,} (timed by {store.time_column})\n")
+    if store.n_subjects:
+        follow_up = store.follow_up()
+        result += (f"Visits per subject: median {np.median(visits):g}, "
+                   f"range {visits.min()}-{visits.max()}\n")
+        result += (f"Follow-up ({store.time_unit}s): median {np.median(follow_up):.4g}, "
+                   f"range {follow_up.min():.4g}-{follow_up.max():.4g}\n")
+    if store.dropped:
+        result += f"Skipped {store.dropped:,} rows without a subject or a valid visit time\n"
+    yield result
+    if not values or not store.n_subjects:
+        yield "\nNo numeric columns to follow over time"
+        return
+
+    yield f"\nPer-subject slopes (least-squares change per {per}):\n\n"
+    last = store.offsets[1:] - 1
+    slopes = {}
+    for start in range(0, len(values), STREAM_COLUMN_BLOCK):
+        if call is not None and call.out_of_time():
+            call.note(f"time budget ran out after {start} of {len(values)} columns")
+            break
+        rows = []
+        for column in values[start:start + STREAM_COLUMN_BLOCK]:
+            slope = slopes[column] = store.slopes(column) * scale
+            change = store.change_from_baseline(column)[last]
+            fitted = slope.dropna()
+            rows.append({"column": column, "subjects": len(fitted), "mean_slope": fitted.mean(),
+                         "median_slope": fitted.median(), "sd_slope": fitted.std(),
+                         "increasing_pct": 100 * (fitted > 0).mean() if len(fitted) else np.nan,
+                         "mean_change": np.nanmean(change) if np.isfinite(change).any() else np.nan})
+        yield pd.DataFrame(rows).set_index("column").to_string(float_format=lambda v: f"{v:.4g}") + "\n"
+
+    if grouped and slopes:
+        groups = store.frame[groupby].to_numpy()[store.offsets[:-1]]
+        by_group = pd.DataFrame(slopes).groupby(groups).mean()
+        by_group.index.name = groupby
+        yield (f"\nMean slope per {per} by {groupby} (at first visit):\n\n"
+               + by_group.to_string(float_format=lambda v: f"{v:.4g}") + "\n")
+
+def trajectory_lines(store: VisitStore, column: str, groups: Optional["np.ndarray"] = None,
+                     max_subjects: int = MAX_TRAJECTORIES,
+                     bins: int = TRAJECTORY_BINS) -> Dict[str, Any]:
+    """
+    What a trajectory plot of column draws, in time since baseline.
+
+    Args:
+        store: Visits
+        column: Measurement to follow
+        groups: Group of every subject (in store order) for one mean curve per group
+        max_subjects: Subjects drawn individually, chosen at random (seeded)
+        bins: Time bins of the mean curves
+
+    Returns:
+        {"subjects": [(x, y) per drawn subject], "means": {group (None
+        without groups): (bin centers, mean per bin)}}
+    """
+    import numpy as np
+    import pandas as pd
+
+    x = store.since_baseline()
+    y = store._values(column)
+    measured = ~np.isnan(y)
+    counts = np.add.reduceat(measured.astype(int), store.offsets[:-1]) if len(store) else np.array([], int)
+    candidates = np.flatnonzero(counts > 0)
+    rng = np.random.default_rng(0)
+    chosen = np.sort(rng.choice(candidates, size=min(max_subjects, len(candidates)), replace=False))
+    lines = []
+    for code in chosen:
+        rows = slice(store.offsets[code], store.offsets[code + 1])
+        keep = measured[rows]
+        lines.append((x[rows][keep], y[rows][keep]))
+
+    edges = np.linspace(0.0, x.max() if len(x) and x.max() > 0 else 1.0, bins + 1)
+    bin_of = np.clip(np.searchsorted(edges, x, side="right") - 1, 0, bins - 1)
+    centers = (edges[:-1] + edges[1:]) / 2
+    rows = np.flatnonzero(measured)
+    if groups is None:
+        by_group = [(None, rows)]
+    else:
+        # Like the slope means, subjects without a group value are left out
+        by_group = [(group, members.to_numpy())
+                    for group, members in pd.Series(rows).groupby(groups[store.codes][rows])]
+    means = {}
+    for group, mask in by_group:
+        n = np.bincount(bin_of[mask], minlength=bins)
+        total = np.bincount(bin_of[mask], weights=y[mask], minlength=bins)
+        filled = n > 0
+        means[group] = (centers[filled], total[filled] / n[filled])
+    return {"subjects": lines, "means": means}
+
+def _trajectory_setup(data: "pd.DataFrame", columns: Optional[List[str]],
+                      groupby: Optional[str]) -> Tuple[VisitStore, List[str], Optional["np.ndarray"]]:
+    store = VisitStore(data)
+    grouped = groupby and groupby in store.frame.columns
+    values = value_columns(store.frame, columns,
+                           [store.subject_column, store.time_column] + ([groupby] if grouped else []))
+    if not values:
+        raise ValueError("no numeric columns to follow over time")
+    groups = store.frame[groupby].to_numpy()[store.offsets[:-1]] if grouped else None
+    return store, values[:MAX_TRAJECTORY_PANELS], groups
+
+def plot_trajectories(data: "pd.DataFrame", columns: Optional[List[str]] = None,
+                      groupby: Optional[str] = None, palette: str = "viridis"):
+    """
+    Draw trajectories into the current pyplot figure: one panel per column
+    (up to MAX_TRAJECTORY_PANELS), each with a sample of subjects' visits
+    as thin lines and the cohort mean over time since baseline (one mean
+    per group of the subjects' first-visit groupby value).
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    store, values, groups = _trajectory_setup(data, columns, groupby)
+    unit = f"{store.time_unit}s" if store.datetime else store.time_unit
+    for i, column in enumerate(values):
+        plt.subplot(1, len(values), i + 1)
+        lines = trajectory_lines(store, column, groups)
+        for x, y in lines["subjects"]:
+            plt.plot(x, y, color="gray", alpha=0.3, linewidth=0.8)
+        colors = sns.color_palette(palette, len(lines["means"]))
+        for color, (group, (x, y)) in zip(colors, lines["means"].items()):
+            plt.plot(x, y, color=color, linewidth=2.5, label="cohort mean" if group is None else str(group))
+        plt.xlabel(f"{unit} since first visit")
+        plt.ylabel(column)
+        plt.title(f"{column} ({len(lines['subjects'])} of {store.n_subjects} subjects shown)")
+        plt.legend(title=groupby if groups is not None else None)
+
+def trajectory_spec(data: "pd.DataFrame", columns: Optional[List[str]] = None,
+                    groupby: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """Plotly traces and layout of a trajectory plot of the first column."""
+    from .plot_specs import _values
+
+    store, values, groups = _trajectory_setup(data, columns, groupby)
+    column = values[0]
+    lines = trajectory_lines(store, column, groups)
+    traces = [{"type": "scattergl", "mode": "lines+markers", "showlegend": False, "hoverinfo": "skip",
+               "x": _values(x), "y": _values(y), "line": {"color": "rgba(128,128,128,0.35)", "width": 1},
+               "marker": {"size": 3}}
+              for x, y in lines["subjects"]]
+    for group, (x, y) in lines["means"].items():
+        traces.append({"type": "scatter", "mode": "lines", "name": "cohort mean" if group is None else str(group),
+                       "x": _values(x), "y": _values(y), "line": {"width": 3}})
+    unit = f"{store.time_unit}s" if store.datetime else store.time_unit
+    layout = {"xaxis": {"title": {"text": f"{unit} since first visit"}},
+              "yaxis": {"title": {"text": column}}}
+    return traces, layout
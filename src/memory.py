@@ -0,0 +1,273 @@
+import bisect
+import importlib
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Dict, Union, Optional, Tuple, Any, Iterator
+
+from .tracing import Span, Tracer, tracing
+
+# Frames recorded per allocation. One frame names the line that allocated,
+# usually inside pandas, numpy or matplotlib; about 25 reach back to the line
+# of this package that asked for the memory, but slow allocation down several
+# times more
+TRACEBACK_FRAMES = 1
+
+# Imported before tracing starts: their module state is not what is being
+# profiled, and tracing the imports themselves takes minutes
+PRELOAD_MODULES = ("numpy", "pandas", "scipy.stats", "matplotlib.pyplot", "seaborn")
+
+# Seconds between resident set size samples
+RSS_INTERVAL = 0.005
+
+# Allocation sites listed in reports
+TOP_SITES = 10
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+STDLIB_DIR = os.path.dirname(os.__file__)
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (0 where it cannot be read)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    return psutil.Process().memory_info().rss
+
+def _site(traceback: tracemalloc.Traceback) -> str:
+    """The innermost frame in this package (else the innermost frame) as file:line."""
+    frames = list(traceback)
+    for frame in reversed(frames):
+        if frame.filename.startswith(PACKAGE_DIR) and frame.filename != __file__:
+            return f"{os.path.relpath(frame.filename, os.path.dirname(PACKAGE_DIR))}:{frame.lineno}"
+    filename = frames[-1].filename
+    if "site-packages" in filename:
+        filename = filename.split("site-packages" + os.sep, 1)[1]
+    elif filename.startswith(STDLIB_DIR):
+        filename = os.path.relpath(filename, STDLIB_DIR)
+    return f"{filename}:{frames[-1].lineno}"
+
+class MemoryTracer(Tracer):
+    """
+    Tracer that also records memory per span.
+
+    Each span gets the attributes peak_bytes (highest Python heap usage
+    while it was open, above its usage at the start), net_bytes (heap
+    still held when it closed) and rss_peak_bytes (highest resident set
+    size sampled while it was open). Heap usage comes from tracemalloc,
+    which sees numpy and pandas buffers as well as Python objects; RSS also
+    covers memory allocated outside of it (some C libraries, fragmentation).
+
+    Allocation sites are attributed to the innermost open span: between
+    two span boundaries, the allocations still held are charged to the
+    line that made them (with more than one frame, the nearest line of
+    this package), so sites show where each phase's retained memory comes
+    from. Memory is process-wide: spans on parallel threads see each
+    other's allocations.
+
+    tracemalloc slows allocation-heavy code several times over, so time
+    measured by this tracer is not comparable to normal profiling.
+    """
+
+    def __init__(self, sites: bool = True, frames: int = TRACEBACK_FRAMES,
+                 rss_interval: float = RSS_INTERVAL):
+        """
+        Initialize the tracer.
+
+        Args:
+            sites: Record allocation sites (takes a heap snapshot at every
+                   span boundary)
+            frames: Frames recorded per allocation, if this tracer starts tracemalloc
+            rss_interval: Seconds between RSS samples
+        """
+        super().__init__()
+        self.sites = sites
+        self.frames = frames
+        self.rss_interval = rss_interval
+        self.site_bytes: Dict[str, Dict[str, int]] = {}
+        self._open: Dict[int, Dict[str, int]] = {}
+        self._memory_lock = threading.Lock()
+        self._snapshot: Optional[tracemalloc.Snapshot] = None
+        self._sample_times: List[int] = []
+        self._samples: List[int] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._started_tracemalloc = False
+
+    def start(self):
+        """
+        Start tracemalloc (unless it is running already) and RSS sampling.
+
+        PRELOAD_MODULES are imported first.
+        """
+        for module in PRELOAD_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError:
+                pass
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._started_tracemalloc = True
+        self._reset_peak()
+        if self.sites:
+            self._snapshot = self._take_snapshot()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample_rss, name="cohortagent-rss", daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        """Stop RSS sampling, and tracemalloc if start() started it."""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        self._snapshot = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def _sample_rss(self):
+        while not self._stop.is_set():
+            rss = current_rss()
+            with self._memory_lock:
+                self._sample_times.append(time.perf_counter_ns())
+                self._samples.append(rss)
+            self._stop.wait(self.rss_interval)
+
+    @staticmethod
+    def _reset_peak():
+        # reset_peak is new in Python 3.9; before that peaks only grow, and
+        # spans report the highest usage since profiling started
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @staticmethod
+    def _take_snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)])
+
+    def _boundary(self, owner: Optional[Span]) -> int:
+        """
+        Fold the heap peak since the last boundary into every open span and
+        charge allocations since then to owner. Called with the memory lock held.
+
+        Returns:
+            Current heap usage
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        for state in self._open.values():
+            state["peak"] = max(state["peak"], peak)
+        self._reset_peak()
+        if self.sites and self._snapshot is not None:
+            snapshot = self._take_snapshot()
+            if owner is not None:
+                sites = self.site_bytes.setdefault(owner.name, {})
+                for diff in snapshot.compare_to(self._snapshot, "traceback"):
+                    if diff.size_diff > 0:
+                        site = _site(diff.traceback)
+                        sites[site] = sites.get(site, 0) + diff.size_diff
+            self._snapshot = snapshot
+        return current
+
+    def _push(self, span: Span):
+        stack = getattr(self._stacks, "spans", None)
+        with self._memory_lock:
+            current = self._boundary(stack[-1] if stack else None)
+            self._open[id(span)] = {"start": current, "peak": current, "rss": current_rss(),
+                                    "start_ns": time.perf_counter_ns()}
+        super()._push(span)
+
+    def _pop(self, span: Span):
+        with self._memory_lock:
+            current = self._boundary(span)
+            state = self._open.pop(id(span), None)
+            if state is not None:
+                rss = current_rss()
+                first = bisect.bisect_left(self._sample_times, state["start_ns"])
+                rss_peak = max(self._samples[first:] + [rss, state["rss"]])
+                span.set(peak_bytes=state["peak"] - state["start"], net_bytes=current - state["start"],
+                         rss_peak_bytes=rss_peak, rss_net_bytes=rss - state["rss"])
+        super()._pop(span)
+
+    def memory_summary(self) -> List[Dict[str, Any]]:
+        """
+        Per-phase memory, largest peak first.
+
+        Returns:
+            One dictionary per span name with calls, peak_bytes (largest
+            peak of a call), net_bytes (summed over calls), rss_peak_bytes
+            (highest RSS seen) and its top allocation sites
+        """
+        phases: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            if "peak_bytes" not in span.attributes:
+                continue
+            phase = phases.setdefault(span.name, {"phase": span.name, "calls": 0, "peak_bytes": 0,
+                                                  "net_bytes": 0, "rss_peak_bytes": 0})
+            phase["calls"] += 1
+            phase["peak_bytes"] = max(phase["peak_bytes"], span.attributes["peak_bytes"])
+            phase["net_bytes"] += span.attributes["net_bytes"]
+            phase["rss_peak_bytes"] = max(phase["rss_peak_bytes"], span.attributes["rss_peak_bytes"])
+        for name, phase in phases.items():
+            phase["sites"] = self.top_sites(phase=name)
+        return sorted(phases.values(), key=lambda p: p["peak_bytes"], reverse=True)
+
+    def top_sites(self, limit: int = TOP_SITES, phase: Optional[str] = None) -> List[Tuple[str, str, int]]:
+        """
+        Largest allocation sites, as (phase, file:line, bytes), optionally of one phase only.
+
+        Bytes are those still held at the end of each stretch of the phase,
+        summed over its calls.
+        """
+        with self._memory_lock:
+            sites = [(name, site, size) for name, by_site in self.site_bytes.items()
+                     if phase is None or name == phase for site, size in by_site.items()]
+        return sorted(sites, key=lambda s: s[2], reverse=True)[:limit]
+
+    def format_memory_summary(self, limit: int = TOP_SITES) -> str:
+        """Per-phase memory and the top allocation sites as a text table."""
+        mb = 1024 * 1024
+        phases = self.memory_summary()
+        lines = ["Memory profile (heap via tracemalloc; RSS sampled every "
+                 f"{self.rss_interval * 1000:g} ms)",
+                 f"{'phase':<24}{'calls':>7}{'peak MB':>10}{'net MB':>10}{'peak RSS MB':>13}"]
+        for p in phases:
+            lines.append(f"{p['phase']:<24}{p['calls']:>7}{p['peak_bytes'] / mb:>10.1f}"
+                         f"{p['net_bytes'] / mb:>10.1f}{p['rss_peak_bytes'] / mb:>13.1f}")
+        sites = self.top_sites(limit)
+        if sites:
+            lines.append("")
+            lines.append("Top allocation sites (memory held at the end of each phase)")
+            lines.append(f"{'MB':>8}  {'phase':<24}site")
+            for name, site, size in sites:
+                lines.append(f"{size / mb:>8.1f}  {name:<24}{site}")
+        return "\n".join(lines)
+
+@contextmanager
+def memory_profiling(tracer: Optional[MemoryTracer] = None) -> Iterator[MemoryTracer]:
+    """
+    Record spans, with their memory, opened in this context:
+
+        with memory_profiling() as tracer:
+            analyze_data("data/example/lifestyle_data.csv", "summary")
+        print(tracer.format_memory_summary())
+
+    Args:
+        tracer: MemoryTracer to record into (a new one if None)
+    """
+    tracer = tracer if tracer is not None else MemoryTracer()
+    tracer.start()
+    try:
+        with tracing(tracer):
+            yield tracer
+    finally:
+        tracer.stop()
@@ -0,0 +1,611 @@
+import base64
+import hashlib
+import http.client
+import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable, Iterator
+
+# Default endpoints of the supported local model servers
+OLLAMA_URL = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OPENAI_COMPATIBLE_URL = os.environ.get("COHORTAGENT_MODEL_URL", "http://localhost:8000")
+
+# Seconds to wait for a model response
+DEFAULT_TIMEOUT = 60.0
+
+# Responses kept in memory for exact prompt matches
+DEFAULT_CACHE_SIZE = 256
+
+# Question asked about an image when none is given
+INTERPRET_PROMPT = "Describe this medical image and any notable findings."
+
+class ModelError(RuntimeError):
+    """Raised when the model backend cannot produce a response."""
+
+def _normalize_url(url: str) -> str:
+    """Add a scheme to host:port style URLs (as used by OLLAMA_HOST)."""
+    return url if "://" in url else f"http://{url}"
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to one model server.
+
+    At most max_size requests are in flight; idle connections are reused by
+    the next request instead of paying TCP setup again. A reused connection
+    the server already closed is retried once on a fresh connection.
+    """
+
+    def __init__(self, base_url: str, max_size: int = 8, timeout: float = DEFAULT_TIMEOUT):
+        """
+        Initialize the pool.
+
+        Args:
+            base_url: Server URL, e.g. http://localhost:11434
+            max_size: Maximum number of concurrent connections
+            timeout: Socket timeout in seconds for connect and each read
+        """
+        parts = urllib.parse.urlsplit(_normalize_url(base_url))
+        self.scheme = parts.scheme
+        self.host = parts.hostname or "localhost"
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.max_size = max_size
+        self.connections_created = 0
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+
+    def _new_connection(self) -> http.client.HTTPConnection:
+        """Open a new connection to the server."""
+        with self._lock:
+            self.connections_created += 1
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout)
+
+    @contextmanager
+    def _connection(self, fresh: bool = False) -> Iterator[Tuple[http.client.HTTPConnection, bool]]:
+        """
+        Borrow a connection; yields (connection, reused).
+
+        The connection goes back to the pool only if the block completes,
+        i.e. after the response has been read completely.
+        """
+        self._slots.acquire()
+        connection, reused = None, False
+        try:
+            if not fresh:
+                try:
+                    connection, reused = self._idle.get_nowait(), True
+                except queue.Empty:
+                    pass
+            if connection is None:
+                connection = self._new_connection()
+            yield connection, reused
+            self._idle.put(connection)
+            connection = None
+        finally:
+            if connection is not None:
+                connection.close()
+            self._slots.release()
+
+    def _send(self, connection: http.client.HTTPConnection, path: str,
+              payload: Dict[str, Any]) -> http.client.HTTPResponse:
+        """Send a JSON POST and return the response (status checked)."""
+        body = json.dumps(payload).encode("utf-8")
+        connection.request("POST", self.prefix + path, body=body,
+                           headers={"Content-Type": "application/json", "Connection": "keep-alive"})
+        response = connection.getresponse()
+        if response.status != 200:
+            detail = response.read().decode("utf-8", "replace")[:500]
+            raise ModelError(f"Model server returned HTTP {response.status}: {detail}")
+        return response
+
+    def post_json(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a JSON payload and decode the JSON response.
+
+        Raises:
+            ModelError: On connection errors, timeouts and non-200 responses
+        """
+        for attempt in range(2):
+            try:
+                with self._connection(fresh=attempt > 0) as (connection, reused):
+                    try:
+                        response = self._send(connection, path, payload)
+                        return json.loads(response.read())
+                    except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                        if reused and attempt == 0:
+                            raise _StaleConnection()
+                        raise
+            except _StaleConnection:
+                continue
+            except ModelError:
+                raise
+            except (OSError, http.client.HTTPException, ValueError) as e:
+                raise ModelError(f"Request to {self.host}:{self.port}{self.prefix}{path} failed: {e}") from e
+        raise ModelError("unreachable")
+
+    def post_lines(self, path: str, payload: Dict[str, Any]) -> Iterator[str]:
+        """
+        POST a JSON payload and yield the response body line by line.
+
+        Used for streaming (NDJSON and server-sent events). The connection
+        returns to the pool once the stream has been fully consumed; a
+        consumer that stops early closes it.
+
+        Raises:
+            ModelError: On connection errors, timeouts and non-200 responses
+        """
+        try:
+            with self._connection() as (connection, reused):
+                try:
+                    response = self._send(connection, path, payload)
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    if not reused:
+                        raise
+                    connection.close()
+                    connection.connect()
+                    response = self._send(connection, path, payload)
+                for line in response:
+                    line = line.decode("utf-8").strip()
+                    if line:
+                        yield line
+        except ModelError:
+            raise
+        except (OSError, http.client.HTTPException) as e:
+            raise ModelError(f"Streaming request to {self.host}:{self.port}{self.prefix}{path} failed: {e}") from e
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+class _StaleConnection(Exception):
+    """A reused keep-alive connection was closed by the server."""
+
+class MicroBatcher:
+    """
+    Group concurrent submissions into batches.
+
+    Items submitted from any thread are collected until max_batch items are
+    pending or the oldest has waited max_wait seconds, then handed to
+    dispatch as one list. dispatch must return one result per item, in order.
+    Up to max_in_flight batches are dispatched at the same time.
+    """
+
+    def __init__(self, dispatch: Callable[[List[Any]], List[Any]], max_batch: int = 8,
+                 max_wait: float = 0.01, max_in_flight: int = 4):
+        self.dispatch = dispatch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches_dispatched = 0
+        self._pending: List[Tuple[Any, Future]] = []
+        self._oldest = 0.0
+        self._condition = threading.Condition()
+        self._workers = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="cohortagent-batch")
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+
+    def submit(self, item: Any) -> Future:
+        """
+        Queue an item for the next batch.
+
+        Returns:
+            Future resolved with the item's result (or its batch's exception)
+        """
+        future: Future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("MicroBatcher is closed")
+            if not self._pending:
+                self._oldest = time.monotonic()
+            self._pending.append((item, future))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, daemon=True,
+                                                name="cohortagent-batcher")
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def _collect(self):
+        """Background loop that cuts batches and hands them to the workers."""
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if self._closed and not self._pending:
+                    return
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = self._oldest + self.max_wait - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                self._pending = self._pending[self.max_batch:]
+                if self._pending:
+                    self._oldest = time.monotonic()
+                self.batches_dispatched += 1
+            self._workers.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[Any, Future]]):
+        """Dispatch one batch and resolve its futures."""
+        live = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            results = self.dispatch([item for item, _ in live])
+            for (_, future), result in zip(live, results):
+                future.set_result(result)
+        except BaseException as e:
+            for _, future in live:
+                future.set_exception(e)
+
+    def close(self):
+        """Dispatch what is pending and stop the background thread."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self._workers.shutdown(wait=True)
+
+def encode_image(image: Union[str, bytes]) -> str:
+    """Base64-encode an image given as a path or raw bytes."""
+    if isinstance(image, str):
+        with open(image, "rb") as f:
+            image = f.read()
+    return base64.b64encode(image).decode("ascii")
+
+class ModelBackend:
+    """
+    Interface of a local language/vision model.
+
+    Subclasses implement _complete, _stream and (optionally) _complete_many;
+    this class adds exact-match response caching, batching of concurrent
+    text requests and image interpretation on top.
+    """
+
+    supports_batch = False
+
+    def __init__(self, model: str, cache_size: int = DEFAULT_CACHE_SIZE,
+                 batch_size: int = 8, batch_wait: float = 0.01):
+        """
+        Initialize the backend.
+
+        Args:
+            model: Model name as known by the server (e.g. "llava")
+            cache_size: Number of responses cached for exact prompt matches (0 disables)
+            batch_size: Maximum prompts per batched request
+            batch_wait: Seconds a prompt may wait for others to join its batch
+        """
+        self.model = model
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._batcher = (MicroBatcher(self._complete_many, max_batch=batch_size, max_wait=batch_wait)
+                         if self.supports_batch and batch_size > 1 else None)
+
+    # Implemented by subclasses
+
+    def _complete(self, prompt: str, images: Optional[List[str]] = None, **options) -> str:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str, images: Optional[List[str]] = None, **options) -> Iterator[str]:
+        yield self._complete(prompt, images, **options)
+
+    def _complete_many(self, prompts: List[str]) -> List[str]:
+        return [self._complete(p) for p in prompts]
+
+    def _complete_images(self, requests: List[Tuple[str, str]]) -> List[str]:
+        """
+        Answer several (prompt, base64 image) requests.
+
+        Local servers have no batch endpoint for images, so the requests are
+        sent concurrently over the connection pool, where servers that batch
+        internally (vLLM, llama.cpp, Ollama with OLLAMA_NUM_PARALLEL) can run
+        them together.
+        """
+        if len(requests) == 1:
+            return [self._complete(requests[0][0], [requests[0][1]])]
+        with ThreadPoolExecutor(max_workers=len(requests), thread_name_prefix="cohortagent-model") as pool:
+            return list(pool.map(lambda r: self._complete(r[0], [r[1]]), requests))
+
+    # Public API
+
+    def _cache_key(self, prompt: str, images: Optional[List[str]], options: Dict[str, Any]) -> str:
+        """Key of a request in the response cache."""
+        digest = hashlib.sha256()
+        digest.update(json.dumps([type(self).__name__, self.model, prompt, options],
+                                 sort_keys=True).encode("utf-8"))
+        for image in images or []:
+            digest.update(hashlib.sha256(image.encode("ascii")).digest())
+        return digest.hexdigest()
+
+    def _cached(self, key: str) -> Optional[str]:
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        return None
+
+    def _remember(self, key: str, response: str):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = response
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def generate(self, prompt: str, images: Optional[List[Union[str, bytes]]] = None,
+                 **options) -> str:
+        """
+        Generate a complete response.
+
+        Identical requests are answered from the response cache. Concurrent
+        text-only requests are merged into batched server calls when the
+        backend supports it.
+
+        Args:
+            prompt: Prompt text
+            images: Image paths or bytes for vision models
+            **options: Model options (e.g. temperature)
+
+        Returns:
+            The model's response text
+
+        Raises:
+            ModelError: If the server fails or times out
+        """
+        encoded = [encode_image(i) for i in images] if images else None
+        key = self._cache_key(prompt, encoded, options)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        if self._batcher is not None and not encoded and not options:
+            response = self._batcher.submit(prompt).result()
+        else:
+            response = self._complete(prompt, encoded, **options)
+        self._remember(key, response)
+        return response
+
+    def generate_batch(self, prompts: List[str]) -> List[str]:
+        """
+        Generate responses for several text prompts at once.
+
+        Returns:
+            One response per prompt, in order
+        """
+        keys = [self._cache_key(p, None, {}) for p in prompts]
+        responses = [self._cached(k) for k in keys]
+        missing = [i for i, r in enumerate(responses) if r is None]
+        if missing:
+            for i, response in zip(missing, self._complete_many([prompts[i] for i in missing])):
+                responses[i] = response
+                self._remember(keys[i], response)
+        return responses
+
+    def complete_images(self, requests: List[Tuple[str, str]]) -> List[str]:
+        """
+        Answer several (prompt, base64 image) requests at once.
+
+        Requests answered before come from the response cache; the others
+        are sent together (see _complete_images).
+
+        Returns:
+            One response per request, in order
+
+        Raises:
+            ModelError: If the server fails or times out
+        """
+        keys = [self._cache_key(prompt, [image], {}) for prompt, image in requests]
+        responses = [self._cached(k) for k in keys]
+        missing = [i for i, r in enumerate(responses) if r is None]
+        if missing:
+            for i, response in zip(missing, self._complete_images([requests[i] for i in missing])):
+                responses[i] = response
+                self._remember(keys[i], response)
+        return responses
+
+    def stream(self, prompt: str, images: Optional[List[Union[str, bytes]]] = None,
+               **options) -> Iterator[str]:
+        """
+        Stream the response token by token.
+
+        A cached response is yielded in one piece; a completed stream is
+        added to the cache.
+
+        Yields:
+            Response fragments as they arrive
+        """
+        encoded = [encode_image(i) for i in images] if images else None
+        key = self._cache_key(prompt, encoded, options)
+        cached = self._cached(key)
+        if cached is not None:
+            yield cached
+            return
+        parts = []
+        for token in self._stream(prompt, encoded, **options):
+            parts.append(token)
+            yield token
+        self._remember(key, "".join(parts))
+
+    def interpret_image(self, image: Union[str, bytes],
+                        prompt: str = INTERPRET_PROMPT) -> str:
+        """
+        Ask a vision model about an image.
+
+        Args:
+            image: Image path or bytes
+            prompt: Question about the image
+
+        Returns:
+            The model's interpretation
+        """
+        return self.generate(prompt, images=[image])
+
+    def close(self):
+        """Release connections and background threads."""
+        if self._batcher is not None:
+            self._batcher.close()
+
+class OllamaBackend(ModelBackend):
+    """Ollama's native API (/api/generate)."""
+
+    def __init__(self, model: str = "llava", base_url: str = OLLAMA_URL,
+                 timeout: float = DEFAULT_TIMEOUT, pool_size: int = 8, **kwargs):
+        self.pool = ConnectionPool(base_url, max_size=pool_size, timeout=timeout)
+        super().__init__(model, **kwargs)
+        self._fanout = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="cohortagent-model")
+
+    def _payload(self, prompt: str, images: Optional[List[str]], stream: bool,
+                 options: Dict[str, Any]) -> Dict[str, Any]:
+        payload: Dict[str, Any] = {"model": self.model, "prompt": prompt, "stream": stream}
+        if images:
+            payload["images"] = images
+        if options:
+            payload["options"] = options
+        return payload
+
+    def _complete(self, prompt: str, images: Optional[List[str]] = None, **options) -> str:
+        return self.pool.post_json("/api/generate", self._payload(prompt, images, False, options))["response"]
+
+    def _stream(self, prompt: str, images: Optional[List[str]] = None, **options) -> Iterator[str]:
+        for line in self.pool.post_lines("/api/generate", self._payload(prompt, images, True, options)):
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield chunk["response"]
+
+    def _complete_many(self, prompts: List[str]) -> List[str]:
+        # Ollama has no batch endpoint: send the prompts concurrently over the pool
+        return list(self._fanout.map(self._complete, prompts))
+
+    def _complete_images(self, requests: List[Tuple[str, str]]) -> List[str]:
+        return list(self._fanout.map(lambda r: self._complete(r[0], [r[1]]), requests))
+
+    def close(self):
+        super().close()
+        self._fanout.shutdown(wait=False)
+        self.pool.close()
+
+class OpenAICompatibleBackend(ModelBackend):
+    """
+    OpenAI-compatible servers (llama.cpp, vLLM, LM Studio, Ollama's /v1).
+
+    Chat completions are used for single prompts and images; batches of text
+    prompts go out as one /v1/completions request with a list of prompts.
+    """
+
+    supports_batch = True
+
+    def __init__(self, model: str, base_url: str = OPENAI_COMPATIBLE_URL,
+                 timeout: float = DEFAULT_TIMEOUT, pool_size: int = 8, **kwargs):
+        self.pool = ConnectionPool(base_url, max_size=pool_size, timeout=timeout)
+        super().__init__(model, **kwargs)
+
+    def _messages(self, prompt: str, images: Optional[List[str]]) -> List[Dict[str, Any]]:
+        if not images:
+            return [{"role": "user", "content": prompt}]
+        content: List[Dict[str, Any]] = [{"type": "text", "text": prompt}]
+        content += [{"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image}"}}
+                    for image in images]
+        return [{"role": "user", "content": content}]
+
+    def _complete(self, prompt: str, images: Optional[List[str]] = None, **options) -> str:
+        payload = dict(options, model=self.model, messages=self._messages(prompt, images))
+        response = self.pool.post_json("/v1/chat/completions", payload)
+        return response["choices"][0]["message"]["content"]
+
+    def _stream(self, prompt: str, images: Optional[List[str]] = None, **options) -> Iterator[str]:
+        payload = dict(options, model=self.model, messages=self._messages(prompt, images), stream=True)
+        for line in self.pool.post_lines("/v1/chat/completions", payload):
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                continue
+            delta = json.loads(data)["choices"][0].get("delta", {})
+            if delta.get("content"):
+                yield delta["content"]
+
+    def _complete_many(self, prompts: List[str]) -> List[str]:
+        response = self.pool.post_json("/v1/completions", {"model": self.model, "prompt": prompts})
+        choices = sorted(response["choices"], key=lambda c: c.get("index", 0))
+        return [c["text"] for c in choices]
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+def create_backend(model_name: str, base_url: Optional[str] = None,
+                   timeout: float = DEFAULT_TIMEOUT, **kwargs) -> ModelBackend:
+    """
+    Create a backend from a "provider/model" name.
+
+    "ollama/<model>" talks to Ollama's native API; "openai/<model>" and
+    "local/<model>" talk to an OpenAI-compatible server.
+
+    Args:
+        model_name: Provider and model, e.g. "ollama/llava"
+        base_url: Server URL (default: OLLAMA_HOST or COHORTAGENT_MODEL_URL)
+        timeout: Request timeout in seconds
+        **kwargs: Passed to the backend (pool_size, cache_size, batch_size, batch_wait)
+
+    Returns:
+        The backend
+
+    Raises:
+        ValueError: If the provider is unknown
+    """
+    provider, _, model = model_name.partition("/")
+    if not model:
+        provider, model = "ollama", provider
+    if provider == "ollama":
+        return OllamaBackend(model, base_url=base_url or OLLAMA_URL, timeout=timeout, **kwargs)
+    if provider in ("openai", "local"):
+        return OpenAICompatibleBackend(model, base_url=base_url or OPENAI_COMPATIBLE_URL,
+                                       timeout=timeout, **kwargs)
+    raise ValueError(f"Unknown model provider: {provider} (expected ollama, openai or local)")
+
+_backends: Dict[Tuple[str, Optional[str], float], ModelBackend] = {}
+_backends_lock = threading.Lock()
+
+def get_backend(model_name: str, base_url: Optional[str] = None,
+                timeout: float = DEFAULT_TIMEOUT) -> ModelBackend:
+    """
+    Shared backend for a model, created on first use.
+
+    Everything asking for the same model at the same server with the same
+    timeout (the agent, and tools such as analyze_images) shares one
+    connection pool and response cache.
+
+    Args:
+        model_name: Provider and model, e.g. "ollama/llava"
+        base_url: Server URL (default depends on the provider)
+        timeout: Request timeout in seconds
+
+    Returns:
+        The backend
+    """
+    key = (model_name, base_url, timeout)
+    with _backends_lock:
+        if key not in _backends:
+            _backends[key] = create_backend(model_name, base_url=base_url, timeout=timeout)
+        return _backends[key]
+
+def close_backends():
+    """Close and forget every shared backend."""
+    with _backends_lock:
+        backends = list(_backends.values())
+        _backends.clear()
+    for backend in backends:
+        backend.close()
@@ -0,0 +1,388 @@
+import glob
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import List, Dict, Union, Optional, Tuple, Any
+
+# Directory whose CSV files can be referred to by name in a query
+DEFAULT_DATA_DIR = "data/example"
+
+# Files used when a query does not name any dataset
+DEFAULT_FILE = "data/example/lifestyle_data.csv"
+DEFAULT_MERGE_FILES = ["data/example/lifestyle_data.csv", "data/example/blood_biochemistry.csv"]
+DEFAULT_IMAGES = ["scans/sample/example.jpg"]
+DEFAULT_VOLUMES = ["scans"]
+DEFAULT_COLUMNS = ["age", "weight_kg", "height_cm"]
+DEFAULT_MERGE_COLUMNS = ["weight_kg", "Hemoglobin_g_dL"]
+
+# Tools that write a plot (and accept output_format)
+PLOT_TOOLS = ("visualize_data", "merge_and_visualize")
+
+# Tool-specific defaults applied when the query does not set them
+TOOL_DEFAULTS = {
+    "analyze_data": {"analysis_type": "summary"},
+    "visualize_data": {"plot_type": "scatter", "output_path": "output/plot.png"},
+    "merge_and_analyze": {"analysis_type": "correlation", "merge_on": "id"},
+    "merge_and_visualize": {"plot_type": "heatmap", "output_path": "output/merged_plot.png",
+                            "merge_on": "id"},
+    "analyze_images": {},
+    "analyze_volumes": {},
+    "extract_image_features": {"output_path": "output/imaging_features.csv"},
+    "analyze_all": {"analysis_type": "summary"},
+}
+
+# "key: value" directives. Values of columns and title run to the next period,
+# all others are a single word.
+DIRECTIVES = {
+    "file": "files",
+    "columns": "columns",
+    "plot type": "plot_type",
+    "analysis type": "analysis_type",
+    "merge on": "merge_on",
+    "group by": "groupby",
+    "title": "title",
+    "format": "output_format",
+}
+_DIRECTIVE_RE = re.compile(
+    r"\b(" + "|".join(re.escape(k) for k in sorted(DIRECTIVES, key=len, reverse=True)) + r")\s*:\s*",
+    re.IGNORECASE)
+_SENTENCE_VALUES = ("columns", "title")
+
+# Directives that carry over to later steps of the same query
+_INHERITED = ("files", "columns", "merge_on", "groupby")
+
+# Step-local directives each kind of tool accepts
+_ANALYSIS_DIRECTIVES = ("analysis_type",)
+_PLOT_DIRECTIVES = ("plot_type", "title", "output_format")
+
+# Steps are separated by "then" or a semicolon
+_STEP_SPLIT_RE = re.compile(r"\s*(?:;|,?\s*\b(?:and\s+)?then\b)\s*", re.IGNORECASE)
+
+_IMAGE_RE = re.compile(r"\b(images?|scans?|pictures?|photos?)\b")
+_PLOT_RE = re.compile(r"\b(visuali[sz]\w*|plot\w*|charts?|graphs?|heatmap|histogram|"
+                      r"scatter|clustermap|interactive|trajector\w*)\b")
+_ANALYSIS_RE = re.compile(r"\b(analy[sz]\w*|summar\w*|statistic\w*|stats|describe|"
+                          r"correlat\w*|regression|distribution|anova|t-?test|longitudinal|slopes?)\b")
+_MERGE_RE = re.compile(r"\b(merg\w*|combin\w*|join\w*)\b")
+_VOLUME_RE = re.compile(r"\b(nifti|dicom|volumetric|3d|volumes?\s+(scans?|files?|data))\b|\.nii\b|\.dcm\b")
+_FEATURES_RE = re.compile(r"\b(extract\w*\s+(\w+\s+)?features?|feature\s+(table|extraction))\b")
+_SUBJECT_RE = re.compile(r"\bsubj[_\-]?(\d+)\b")
+_FANOUT_RE = re.compile(r"\b(every|all|each)\s+(of\s+the\s+)?(datasets?|modalit\w*|files?)\b")
+_PIXELS_RE = re.compile(r"\b(intensit\w*|brightness|contrast|pixels?)\b")
+_INTERPRET_RE = re.compile(r"\b(interpret\w*|describe|findings?|abnormal\w*|diagnos\w*)\b")
+
+# Keywords that select an analysis or plot type, checked in order
+ANALYSIS_KEYWORDS = [
+    (r"\bcorrelat\w*", "correlation"),
+    (r"\bregression\b", "regression"),
+    (r"\bdistribution\b", "distribution"),
+    (r"\banova\b", "anova"),
+    (r"\bt-?test\b", "ttest"),
+    (r"\blongitudinal\w*|\bslopes?\b|\bover\s+time\b|\bchange\s+from\s+baseline\b", "longitudinal"),
+    (r"\b(summar\w*|describe|statistic\w*)", "summary"),
+]
+PLOT_KEYWORDS = [
+    (r"\bclustermap\b", "clustermap"),
+    (r"\bheatmap\b", "heatmap"),
+    (r"\bhistogram\w*", "histogram"),
+    (r"\bscatter\w*", "scatter"),
+    (r"\bregression\b", "regression"),
+    (r"\bviolin\w*", "violin"),
+    (r"\bswarm\w*", "swarm"),
+    (r"\bjoint\w*", "joint"),
+    (r"\bpair\s*plot\w*|\bpairs?\b", "pair"),
+    (r"\bdensity\b", "density"),
+    (r"\bbox\s*plot\w*|\bbox\b", "box"),
+    (r"\bbar\s*(chart|plot)\w*|\bbar\b", "bar"),
+    (r"\btrajector\w*|\bspaghetti\b", "trajectory"),
+    (r"\bline\s*(chart|plot)\w*|\btrend\w*", "line"),
+    (r"\bcorrelat\w*", "heatmap"),
+]
+
+@dataclass
+class ToolCall:
+    """A single tool invocation in a query plan."""
+    tool: str
+    params: Dict[str, Any]
+    text: str = ""
+
+@dataclass
+class QueryPlan:
+    """Ordered tool calls compiled from one query."""
+    query: str
+    steps: List[ToolCall] = field(default_factory=list)
+
+def dataset_aliases(data_dir: str = DEFAULT_DATA_DIR) -> Dict[str, str]:
+    """
+    Map words that identify a single dataset to its path.
+
+    A file is named by any word of its file name ("blood" for
+    blood_biochemistry.csv) that no other file in data_dir shares, so
+    "biochemistry" or "data" never pick a file on their own.
+
+    Args:
+        data_dir: Directory to scan for CSV files
+
+    Returns:
+        Dictionary of lowercase word -> file path
+    """
+    owners: Dict[str, set] = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, "**", "*.csv"), recursive=True)):
+        stem = os.path.splitext(os.path.basename(path))[0].lower()
+        for token in re.split(r"[_\-\s]+", stem):
+            if token:
+                owners.setdefault(token, set()).add(path)
+    return {token: paths.pop() for token, paths in owners.items() if len(paths) == 1}
+
+def _split_directives(text: str) -> Tuple[str, Dict[str, Any]]:
+    """Separate "key: value" directives from the free text of a step."""
+    matches = list(_DIRECTIVE_RE.finditer(text))
+    directives: Dict[str, Any] = {}
+    free_text = text[:matches[0].start()] if matches else text
+    for i, match in enumerate(matches):
+        end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+        raw = text[match.end():end].strip()
+        key = DIRECTIVES[match.group(1).lower()]
+        if key in _SENTENCE_VALUES:
+            value = raw.split(".")[0].strip()
+            free_text += " " + raw[len(value) + 1:]
+        else:
+            words = raw.split(None, 1)
+            value = words[0].strip(" ,.") if words else ""
+            free_text += " " + (words[1] if len(words) > 1 else "")
+        if not value:
+            continue
+        if key in ("files", "columns"):
+            directives[key] = [v.strip() for v in value.split(",") if v.strip()]
+        elif key == "output_format":
+            directives[key] = value.lower().strip(".")
+        else:
+            directives[key] = value
+    return free_text, directives
+
+def _first_keyword(text: str, keywords: List[Tuple[str, str]]) -> Optional[str]:
+    """Return the value of the earliest keyword pattern found in text."""
+    found = [(m.start(), value) for pattern, value in keywords
+             for m in [re.search(pattern, text)] if m]
+    return min(found)[1] if found else None
+
+def _mentioned_datasets(text: str, aliases: Dict[str, str]) -> List[str]:
+    """Datasets named in text, in order of first mention."""
+    positions = {}
+    for token, path in aliases.items():
+        match = re.search(r"\b" + re.escape(token) + r"\b", text)
+        if match and (path not in positions or match.start() < positions[path]):
+            positions[path] = match.start()
+    return sorted(positions, key=positions.get)
+
+def compile_query(query: str, data_dir: str = DEFAULT_DATA_DIR) -> QueryPlan:
+    """
+    Compile a natural language query into a plan of tool calls.
+
+    The query is split into steps on "then" and ";". Each step is parsed once:
+    "key: value" directives (file:, columns:, plot type:, analysis type:,
+    merge on:, group by:, title:, format:) are extracted, and keywords pick
+    the tool and analysis/plot type. Datasets, columns and merge settings
+    carry over from earlier steps, so "merge lifestyle and blood, then
+    correlate, then plot heatmap" runs two tools on the same merged data.
+
+    Args:
+        query: The user's query string
+        data_dir: Directory whose datasets can be referred to by name
+
+    Returns:
+        QueryPlan with zero or more steps (zero when no tool matches)
+    """
+    plan = QueryPlan(query=query)
+    aliases = dataset_aliases(data_dir)
+    context: Dict[str, Any] = {}
+    merge = False
+
+    for step_text in _STEP_SPLIT_RE.split(query.strip()):
+        if not step_text:
+            continue
+        free_text, directives = _split_directives(step_text)
+        text = free_text.lower()
+
+        # Datasets named in this step replace the ones carried over
+        listed_files = directives.pop("files", None)
+        datasets = listed_files or _mentioned_datasets(text, aliases)
+        if datasets:
+            context["files"] = datasets
+            merge = bool(_MERGE_RE.search(text)) or len(datasets) > 1
+        elif _MERGE_RE.search(text):
+            merge = True
+        for key in _INHERITED:
+            if key in directives:
+                context[key] = directives.pop(key)
+
+        if _VOLUME_RE.search(text) or (listed_files and _VOLUME_RE.search(" ".join(listed_files).lower())):
+            tool = "analyze_volumes"
+        elif _FEATURES_RE.search(text):
+            tool = "extract_image_features"
+        elif _IMAGE_RE.search(text):
+            tool = "analyze_images"
+        elif _FANOUT_RE.search(text) and not datasets and not _PLOT_RE.search(text):
+            tool = "analyze_all"
+        elif _PLOT_RE.search(text) or "plot_type" in directives:
+            tool = "merge_and_visualize" if merge else "visualize_data"
+        elif _ANALYSIS_RE.search(text) or "analysis_type" in directives:
+            tool = "merge_and_analyze" if merge else "analyze_data"
+        else:
+            # e.g. "merge lifestyle and blood": only sets up data for later steps
+            continue
+
+        params = dict(TOOL_DEFAULTS[tool])
+        if tool == "analyze_images":
+            subject = _SUBJECT_RE.search(text)
+            if subject:
+                params["subject"] = f"SUBJ{subject.group(1)}"
+                if listed_files:
+                    params["image_paths"] = listed_files
+            else:
+                params["image_paths"] = listed_files or list(DEFAULT_IMAGES)
+            if _INTERPRET_RE.search(text):
+                params["interpret"] = True
+            if _PIXELS_RE.search(text):
+                params["pixels"] = True
+            plan.steps.append(ToolCall(tool, params, step_text))
+            continue
+        if tool == "extract_image_features":
+            params["image_paths"] = listed_files or [os.path.dirname(DEFAULT_IMAGES[0])]
+            plan.steps.append(ToolCall(tool, params, step_text))
+            continue
+        if tool == "analyze_volumes":
+            params["volume_paths"] = listed_files or list(DEFAULT_VOLUMES)
+            plan.steps.append(ToolCall(tool, params, step_text))
+            continue
+        if tool == "analyze_all":
+            params["data_dir"] = data_dir
+            params["analysis_type"] = (directives.get("analysis_type")
+                                       or _first_keyword(text, ANALYSIS_KEYWORDS) or "summary")
+            for key in ("columns", "groupby"):
+                if key in context:
+                    params[key] = context[key]
+            plan.steps.append(ToolCall(tool, params, step_text))
+            continue
+
+        # Default columns only make sense for the default datasets; otherwise
+        # the tools use every column
+        files = context.get("files")
+        if tool.startswith("merge_"):
+            params["file_paths"] = files if files and len(files) > 1 else list(DEFAULT_MERGE_FILES)
+            default_columns = DEFAULT_MERGE_COLUMNS if params["file_paths"] == DEFAULT_MERGE_FILES else None
+        else:
+            params["file_path"] = files[0] if files else DEFAULT_FILE
+            default_columns = DEFAULT_COLUMNS if params["file_path"] == DEFAULT_FILE else None
+        columns = context.get("columns") or default_columns
+        if columns:
+            params["columns"] = list(columns)
+        if "merge_on" in context and tool.startswith("merge_"):
+            params["merge_on"] = context["merge_on"]
+        if "groupby" in context:
+            params["groupby"] = context["groupby"]
+
+        if tool.endswith("_visualize") or tool == "visualize_data":
+            plot_type = _first_keyword(text, PLOT_KEYWORDS)
+            if plot_type:
+                params["plot_type"] = plot_type
+            if "interactive" in text:
+                params["output_format"] = "plotly"
+            accepted = _PLOT_DIRECTIVES
+        else:
+            analysis_type = _first_keyword(text, ANALYSIS_KEYWORDS)
+            if analysis_type:
+                params["analysis_type"] = analysis_type
+            accepted = _ANALYSIS_DIRECTIVES
+        params.update({k: v for k, v in directives.items() if k in accepted})
+        plan.steps.append(ToolCall(tool, params, step_text))
+
+    # Several plots in one plan must not overwrite each other
+    plot_steps = [s for s in plan.steps if s.tool in PLOT_TOOLS]
+    for i, step in enumerate(plot_steps[1:], start=2):
+        root, ext = os.path.splitext(step.params["output_path"])
+        step.params["output_path"] = f"{root}_{i}{ext}"
+
+    # A lone "merge X and Y" still does something useful
+    if not plan.steps and merge and context.get("files"):
+        params = dict(TOOL_DEFAULTS["merge_and_analyze"], analysis_type="summary",
+                      file_paths=context["files"])
+        for key in ("columns", "merge_on", "groupby"):
+            if key in context:
+                params[key] = context[key]
+        plan.steps.append(ToolCall("merge_and_analyze", params, query))
+    return plan
+
+MODEL_PLAN_PROMPT = """You route questions about health data files to analysis tools.
+
+Tools (name: description; parameters):
+{tools}
+
+Datasets: {datasets}
+
+Answer with JSON only, in the form
+{{"steps": [{{"tool": "<tool name>", "params": {{...}}}}]}}
+Use an empty list of steps if no tool fits.
+
+Question: {query}
+"""
+
+def model_plan_prompt(query: str, tools: Dict[str, Dict[str, Any]],
+                      data_dir: str = DEFAULT_DATA_DIR) -> str:
+    """
+    Prompt asking a language model to plan a query the keyword compiler
+    could not.
+
+    Args:
+        query: The user's query string
+        tools: Tool registry (name -> {"description", "parameters", ...})
+        data_dir: Directory whose datasets are listed in the prompt
+
+    Returns:
+        The prompt text
+    """
+    tool_lines = "\n".join(
+        f"- {name}: {tool['description']}; "
+        + ", ".join(f"{p} ({t})" for p, t in tool["parameters"].items())
+        for name, tool in tools.items())
+    datasets = sorted(glob.glob(os.path.join(data_dir, "**", "*.csv"), recursive=True))
+    return MODEL_PLAN_PROMPT.format(tools=tool_lines, datasets=", ".join(datasets) or "none",
+                                    query=query)
+
+def parse_model_plan(query: str, response: str, tools: Dict[str, Dict[str, Any]]) -> QueryPlan:
+    """
+    Turn a model's answer to model_plan_prompt into a plan.
+
+    The first JSON object in the response is read; steps naming unknown
+    tools, and parameters a tool does not take, are dropped. Tool defaults
+    fill in the rest, as for compiled queries.
+
+    Args:
+        query: The user's query string
+        response: Model response text
+        tools: Tool registry used to validate the steps
+
+    Returns:
+        QueryPlan with zero or more steps
+    """
+    plan = QueryPlan(query=query)
+    start, end = response.find("{"), response.rfind("}")
+    if start < 0 or end < start:
+        return plan
+    try:
+        answer = json.loads(response[start:end + 1])
+    except ValueError:
+        return plan
+    if not isinstance(answer, dict):
+        return plan
+    steps = answer.get("steps", [answer] if "tool" in answer else [])
+    for step in steps if isinstance(steps, list) else []:
+        if not isinstance(step, dict) or step.get("tool") not in tools:
+            continue
+        tool = step["tool"]
+        params = dict(TOOL_DEFAULTS.get(tool, {}))
+        given = step.get("params") if isinstance(step.get("params"), dict) else {}
+        params.update({k: v for k, v in given.items() if k in tools[tool]["parameters"]})
+        plan.steps.append(ToolCall(tool, params, query))
+    return plan
@@ -0,0 +1,248 @@
+import json
+import os
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Tuple, Any
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Output formats understood by visualize_data and merge_and_visualize
+OUTPUT_FORMATS = ("png", "plotly")
+
+# Plot types build_plotly_spec can draw; the others are always rendered as PNG
+PLOTLY_PLOT_TYPES = ("histogram", "scatter", "regression", "heatmap", "bar", "box", "violin",
+                     "density", "line", "trajectory")
+
+# Above this many rows, point-based traces are downsampled before they are
+# shipped to the browser
+MAX_POINTS = 5000
+
+# Number of bins used for pre-aggregated histograms and density curves
+HISTOGRAM_BINS = 30
+
+def spec_output_path(output_path: str) -> str:
+    """
+    Return the path a plotly figure spec is written to for a given plot path.
+
+    Args:
+        output_path: Requested output path (usually ending in .png)
+
+    Returns:
+        The same path with a .json extension
+    """
+    return os.path.splitext(output_path)[0] + ".json"
+
+def writes_spec(plot_type: str, output_format: str) -> bool:
+    """
+    Whether a plot is written as a plotly spec rather than rendered as PNG.
+
+    Plot types without a plotly builder (pair, swarm, joint, ...) fall back
+    to PNG whatever the output format.
+
+    Raises:
+        ValueError: If output_format is not one of OUTPUT_FORMATS
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {output_format} "
+                         f"(expected one of {', '.join(OUTPUT_FORMATS)})")
+    return output_format != "png" and plot_type in PLOTLY_PLOT_TYPES
+
+def _values(series) -> List[Any]:
+    """Convert a pandas Series or numpy array to a JSON-safe list (NaN -> None)."""
+    import numpy as np
+    import pandas as pd
+
+    values = pd.Series(series)
+    if pd.api.types.is_numeric_dtype(values):
+        values = values.astype(float).round(6)
+        return [None if np.isnan(v) else float(v) for v in values]
+    return [None if pd.isna(v) else str(v) for v in values]
+
+def _sample(data: "pd.DataFrame", max_points: int) -> "pd.DataFrame":
+    """Deterministically downsample rows so point traces stay small."""
+    if len(data) > max_points:
+        return data.sample(n=max_points, random_state=0).sort_index()
+    return data
+
+def _histogram_trace(series, name: str) -> Dict[str, Any]:
+    """Pre-binned histogram as a bar trace."""
+    import numpy as np
+
+    values = series.dropna().to_numpy(dtype=float)
+    counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+    centers = (edges[:-1] + edges[1:]) / 2
+    return {"type": "bar", "name": name, "x": _values(centers), "y": counts.tolist(),
+            "width": float(edges[1] - edges[0]) if len(edges) > 1 else None,
+            "opacity": 0.6}
+
+def _finite(series) -> "pd.Series":
+    """Finite numeric values of a Series (statistics of NaN or inf are not valid JSON)."""
+    import numpy as np
+    import pandas as pd
+
+    values = pd.to_numeric(series, errors="coerce")
+    return values[np.isfinite(values)]
+
+def _box_trace(series, name: str) -> Optional[Dict[str, Any]]:
+    """Box trace with precomputed quartiles instead of raw samples (None without values)."""
+    values = _finite(series)
+    if values.empty:
+        return None
+    q1, median, q3 = values.quantile([0.25, 0.5, 0.75])
+    iqr = q3 - q1
+    lower = values[values >= q1 - 1.5 * iqr].min()
+    upper = values[values <= q3 + 1.5 * iqr].max()
+    return {"type": "box", "name": name, "x": [name],
+            "q1": [float(q1)], "median": [float(median)], "q3": [float(q3)],
+            "lowerfence": [float(lower)], "upperfence": [float(upper)],
+            "mean": [float(values.mean())]}
+
+def _violin_trace(series, name: str, max_points: int) -> Optional[Dict[str, Any]]:
+    """
+    Violin trace of at most max_points values (None without values).
+
+    Plotly estimates violin densities from samples, so unlike box plots the
+    values themselves are shipped, downsampled like point traces.
+    """
+    values = _finite(series)
+    if values.empty:
+        return None
+    if len(values) > max_points:
+        values = values.sample(n=max_points, random_state=0)
+    return {"type": "violin", "name": name, "x0": name, "y": _values(values),
+            "box": {"visible": True}, "meanline": {"visible": True}, "points": False}
+
+def build_plotly_spec(data: "pd.DataFrame", plot_type: str,
+                      columns: Optional[List[str]] = None,
+                      groupby: Optional[str] = None,
+                      title: Optional[str] = None,
+                      max_points: int = MAX_POINTS) -> Dict[str, Any]:
+    """
+    Build a compact plotly figure spec for the given data.
+
+    Statistics that the browser would otherwise compute from raw rows
+    (histogram bins, box quartiles, correlations, densities) are aggregated
+    here, and scatter-like traces are downsampled to at most max_points.
+
+    Args:
+        data: DataFrame holding the columns to plot (and the groupby column)
+        plot_type: Type of plot (histogram, scatter, heatmap, bar, box, violin,
+                  density, line, regression, trajectory)
+        columns: Columns requested for the plot
+        groupby: Column to group data by
+        title: Title for the plot
+        max_points: Maximum number of points per trace
+
+    Returns:
+        Dictionary with "data" and "layout" keys, loadable by plotly.io.from_json
+    """
+    import numpy as np
+
+    requested = columns or list(data.columns)
+    columns = [c for c in requested if c in data.columns]
+    if not columns:
+        raise ValueError("None of the specified columns were found in the data")
+    numeric = data[columns].select_dtypes(include=np.number)
+    grouped = groupby and groupby in data.columns
+    traces = []
+    layout = {"template": "plotly_white", "title": {"text": title} if title else None}
+
+    if plot_type == "histogram":
+        traces = [_histogram_trace(numeric[col], col) for col in numeric.columns]
+        layout["barmode"] = "overlay"
+
+    elif plot_type in ("scatter", "regression") and len(columns) >= 2:
+        x_col, y_col = columns[0], columns[1]
+        subset = _sample(data, max_points)
+        groups = subset.groupby(groupby) if grouped and plot_type == "scatter" else [(None, subset)]
+        for name, group in groups:
+            traces.append({"type": "scattergl", "mode": "markers",
+                           "name": str(name) if name is not None else y_col,
+                           "x": _values(group[x_col]), "y": _values(group[y_col]),
+                           "marker": {"opacity": 0.7}})
+        if plot_type == "regression":
+            pairs = data[[x_col, y_col]].dropna()
+            slope, intercept = np.polyfit(pairs[x_col], pairs[y_col], 1)
+            r_squared = pairs[x_col].corr(pairs[y_col]) ** 2
+            x_range = np.array([pairs[x_col].min(), pairs[x_col].max()])
+            traces.append({"type": "scatter", "mode": "lines", "name": "fit",
+                           "x": _values(x_range), "y": _values(slope * x_range + intercept)})
+            layout["annotations"] = [{
+                "text": f"R² = {r_squared:.3f}<br>y = {slope:.3f}x + {intercept:.3f}",
+                "xref": "paper", "yref": "paper", "x": 0.05, "y": 0.95, "showarrow": False}]
+        layout["xaxis"] = {"title": {"text": x_col}}
+        layout["yaxis"] = {"title": {"text": y_col}}
+
+    elif plot_type == "heatmap":
+        corr = numeric.corr()
+        traces = [{"type": "heatmap", "z": [_values(corr[c]) for c in corr.columns],
+                   "x": list(corr.columns), "y": list(corr.columns),
+                   "colorscale": "RdBu", "reversescale": True, "zmin": -1, "zmax": 1}]
+
+    elif plot_type == "bar":
+        means = data.groupby(groupby)[list(numeric.columns)].mean() if grouped else numeric.mean().to_frame().T
+        for col in means.columns:
+            traces.append({"type": "bar", "name": col, "x": _values(means.index.to_series()),
+                           "y": _values(means[col])})
+
+    elif plot_type in ("box", "violin"):
+        trace = _box_trace if plot_type == "box" else lambda series, name: _violin_trace(series, name, max_points)
+        if grouped and len(numeric.columns):
+            y_col = numeric.columns[0]
+            traces = [trace(group[y_col], str(name)) for name, group in data.groupby(groupby)]
+            layout["yaxis"] = {"title": {"text": y_col}}
+        else:
+            traces = [trace(numeric[col], col) for col in numeric.columns]
+        # Columns or groups without any values get no trace
+        traces = [t for t in traces if t is not None]
+
+    elif plot_type == "density":
+        for col in numeric.columns:
+            values = numeric[col].dropna().to_numpy(dtype=float)
+            density, edges = np.histogram(values, bins=HISTOGRAM_BINS, density=True)
+            traces.append({"type": "scatter", "mode": "lines", "fill": "tozeroy", "name": col,
+                           "x": _values((edges[:-1] + edges[1:]) / 2), "y": _values(density)})
+
+    elif plot_type == "line":
+        time_col = "date" if "date" in data.columns else ("time" if "time" in data.columns else None)
+        step = max(1, len(data) // max_points)
+        subset = data.iloc[::step]
+        x = _values(subset[time_col]) if time_col else _values(subset.index.to_series())
+        for col in numeric.columns:
+            if col != time_col:
+                traces.append({"type": "scattergl", "mode": "lines", "name": col,
+                               "x": x, "y": _values(subset[col])})
+
+    elif plot_type == "trajectory":
+        from .longitudinal import trajectory_spec
+
+        traces, axes = trajectory_spec(data, columns, groupby)
+        layout.update(axes)
+
+    else:
+        raise ValueError(f"Unsupported plot type for plotly output: {plot_type}")
+
+    layout = {key: value for key, value in layout.items() if value is not None}
+    return {"data": traces, "layout": layout}
+
+def error_spec(message: str) -> Dict[str, Any]:
+    """Figure spec that only shows an error message (mirrors the PNG error images)."""
+    return {"data": [], "layout": {"annotations": [{
+        "text": message, "xref": "paper", "yref": "paper",
+        "x": 0.5, "y": 0.5, "showarrow": False}]}}
+
+def save_spec(spec: Dict[str, Any], output_path: str) -> str:
+    """
+    Write a figure spec as compact JSON.
+
+    Args:
+        spec: Figure spec from build_plotly_spec or error_spec
+        output_path: Requested output path; the extension is replaced by .json
+
+    Returns:
+        Path to the saved spec
+    """
+    spec_path = spec_output_path(output_path)
+    os.makedirs(os.path.dirname(spec_path) or ".", exist_ok=True)
+    with open(spec_path, "w") as f:
+        json.dump(spec, f, separators=(",", ":"), allow_nan=False)
+    return spec_path
@@ -0,0 +1,302 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from typing import List, Dict, Union, Optional, Tuple, Any, Iterable
+
+from .cache import DEFAULT_CACHE_DIR
+from .images import IMAGE_EXTENSIONS, subject_id
+from .tracing import span
+
+# Bump when the stored fields change; older indexes are rebuilt
+INDEX_VERSION = 1
+
+# Scans of one subject whose perceptual hashes differ in at most this many of
+# their 64 bits are treated as copies of the same acquisition
+NEAR_DUPLICATE_BITS = 4
+
+@dataclass
+class ScanRecord:
+    """What the index knows about one scan file (path is relative to the scan directory)."""
+    path: str
+    size: int
+    mtime_ns: int
+    subject: str
+    format: Optional[str] = None
+    width: int = 0
+    height: int = 0
+    phash: Optional[str] = None
+    error: str = ""
+
+def perceptual_hash(path: str) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    Header fields and 64-bit difference hash (dHash) of an image.
+
+    The hash compares neighbouring pixels of a 9x8 grey thumbnail, so it
+    survives re-encoding, rescaling and small intensity changes that make
+    exported copies of one scan differ byte for byte.
+
+    Returns:
+        ({"format", "width", "height"}, hash as 16 hex digits)
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        header = {"format": img.format, "width": img.size[0], "height": img.size[1]}
+        img.draft("L", (64, 64))
+        small = img.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return header, f"{bits:016x}"
+
+def hamming(a: str, b: str) -> int:
+    """Number of differing bits between two hashes."""
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def _index_path(scan_dir: str) -> str:
+    """Where the index of scan_dir is kept."""
+    digest = hashlib.sha1(os.path.abspath(scan_dir).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(DEFAULT_CACHE_DIR, "scan_index", digest + ".json")
+
+class ScanIndex:
+    """
+    Persistent index of the scans under a directory.
+
+    refresh() brings it up to date incrementally: directories whose mtime is
+    unchanged are not listed again, and only new or changed files are
+    opened (to read their header and perceptual hash). Lookups by subject
+    are dictionary lookups.
+    """
+
+    def __init__(self, scan_dir: str, index_path: Optional[str] = None):
+        """
+        Initialize the index, loading the saved copy if there is one.
+
+        Args:
+            scan_dir: Directory of scans (searched recursively)
+            index_path: JSON file the index is saved to (default: under the cache directory)
+        """
+        self.scan_dir = scan_dir
+        self.index_path = index_path or _index_path(scan_dir)
+        self.records: Dict[str, ScanRecord] = {}
+        self._dirs: Dict[str, int] = {}
+        self._by_subject: Dict[str, List[str]] = {}
+        self._lock = threading.RLock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("version") != INDEX_VERSION or saved.get("scan_dir") != os.path.abspath(self.scan_dir):
+            return
+        self.records = {r["path"]: ScanRecord(**r) for r in saved["records"]}
+        self._dirs = saved["dirs"]
+        self._rebuild_subjects()
+
+    def save(self):
+        """Write the index to index_path."""
+        with self._lock:
+            payload = {"version": INDEX_VERSION, "scan_dir": os.path.abspath(self.scan_dir),
+                       "dirs": self._dirs, "records": [asdict(r) for r in self.records.values()]}
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path), suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _rebuild_subjects(self):
+        by_subject: Dict[str, List[str]] = {}
+        for path in sorted(self.records):
+            by_subject.setdefault(self.records[path].subject, []).append(path)
+        self._by_subject = by_subject
+
+    def refresh(self, full: bool = False, workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        Bring the index up to date with the directory.
+
+        Args:
+            full: Re-check every file, also in directories whose mtime did not
+                 change (catches files overwritten in place)
+            workers: Threads for reading new files (default: 2 per CPU, at most 32)
+
+        Returns:
+            Counts of added, updated, removed and unchanged scans
+        """
+        with self._lock, span("scan_index_refresh", scan_dir=self.scan_dir) as s:
+            by_dir: Dict[str, List[str]] = {}
+            for rel in self.records:
+                by_dir.setdefault(os.path.dirname(rel), []).append(rel)
+            seen_dirs: Dict[str, int] = {}
+            present: Dict[str, os.stat_result] = {}
+            kept: set = set()
+            for root, dirs, files in os.walk(self.scan_dir):
+                dirs.sort()
+                rel_root = os.path.relpath(root, self.scan_dir)
+                rel_root = "" if rel_root == "." else rel_root
+                mtime = os.stat(root).st_mtime_ns
+                seen_dirs[rel_root] = mtime
+                if not full and self._dirs.get(rel_root) == mtime:
+                    # Same entries as last time; keep their records unopened
+                    kept.update(by_dir.get(rel_root, []))
+                    continue
+                for name in files:
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        rel = os.path.join(rel_root, name)
+                        try:
+                            present[rel] = os.stat(os.path.join(root, name))
+                        except OSError:
+                            pass
+
+            counts = {"added": 0, "updated": 0, "removed": 0, "unchanged": len(kept)}
+            todo = []
+            for path, st in present.items():
+                record = self.records.get(path)
+                if record and record.size == st.st_size and record.mtime_ns == st.st_mtime_ns:
+                    counts["unchanged"] += 1
+                else:
+                    counts["updated" if record else "added"] += 1
+                    todo.append((path, st))
+            for path in list(self.records):
+                if path not in present and path not in kept:
+                    del self.records[path]
+                    counts["removed"] += 1
+
+            def read(item: Tuple[str, os.stat_result]) -> ScanRecord:
+                rel, st = item
+                record = ScanRecord(path=rel, size=st.st_size, mtime_ns=st.st_mtime_ns,
+                                    subject=subject_id(self._full(rel)))
+                try:
+                    header, record.phash = perceptual_hash(self._full(rel))
+                    record.format, record.width, record.height = header["format"], header["width"], header["height"]
+                except Exception as e:
+                    record.error = str(e)
+                return record
+
+            if todo:
+                workers = workers or min(32, 2 * (os.cpu_count() or 1))
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    for record in pool.map(read, todo):
+                        self.records[record.path] = record
+            self._dirs = seen_dirs
+            if todo or counts["removed"] or not os.path.exists(self.index_path):
+                self._rebuild_subjects()
+                self.save()
+            s.set(**counts)
+            return counts
+
+    def _full(self, rel: str) -> str:
+        return os.path.join(self.scan_dir, rel)
+
+    def _rel(self, path: str) -> str:
+        return os.path.relpath(path, self.scan_dir)
+
+    def paths(self) -> List[str]:
+        """Every indexed scan (under scan_dir), sorted."""
+        with self._lock:
+            return [self._full(rel) for rel in sorted(self.records)]
+
+    def subjects(self) -> List[str]:
+        """Subject ids with at least one scan."""
+        with self._lock:
+            return sorted(self._by_subject)
+
+    def scans_for(self, subject: str) -> List[ScanRecord]:
+        """Scans of one subject (e.g. "SUBJ042"; "subj_042" style ids are accepted), paths under scan_dir."""
+        key = subject_id(subject) if subject else subject
+        with self._lock:
+            return [replace(self.records[rel], path=self._full(rel)) for rel in self._by_subject.get(key, [])]
+
+    def unique(self, paths: Iterable[str],
+               max_bits: int = NEAR_DUPLICATE_BITS) -> Tuple[List[str], List[str]]:
+        """
+        Drop near-duplicate scans: of scans of the same subject whose hashes
+        are within max_bits of each other, only the first (by path) is kept.
+
+        Paths that are not indexed or could not be hashed are always kept.
+
+        Returns:
+            (kept paths in their original order, skipped paths)
+        """
+        kept, skipped = [], []
+        representatives: Dict[str, List[str]] = {}
+        with self._lock:
+            for path in paths:
+                record = self.records.get(self._rel(path))
+                if record is None or record.phash is None:
+                    kept.append(path)
+                    continue
+                seen = representatives.setdefault(record.subject, [])
+                if any(hamming(record.phash, other) <= max_bits for other in seen):
+                    skipped.append(path)
+                else:
+                    seen.append(record.phash)
+                    kept.append(path)
+        return kept, skipped
+
+_indexes: Dict[str, ScanIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_scan_index(scan_dir: str, refresh: bool = True) -> ScanIndex:
+    """
+    The index of scan_dir shared by this process, brought up to date.
+
+    Args:
+        scan_dir: Directory of scans
+        refresh: Check the directory for changes first (cheap when nothing
+                changed: one stat per directory)
+    """
+    key = os.path.abspath(scan_dir)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = ScanIndex(scan_dir)
+    if refresh:
+        index.refresh()
+    return index
+
+def resolve_scans(image_paths: Optional[List[str]] = None, subject: Optional[str] = None,
+                  scan_dir: str = "scans", dedupe: bool = True) -> Tuple[List[str], List[str]]:
+    """
+    Image files named by a request, through the scan index.
+
+    Directories (and the scans of a subject) come from the index, without
+    listing or opening files again; near-duplicates among them are dropped
+    if dedupe is set. Files named directly are always kept.
+
+    Args:
+        image_paths: Image files and/or directories
+        subject: Subject id whose scans under scan_dir to include
+        scan_dir: Directory searched for the subject's scans
+        dedupe: Skip near-duplicate scans from directories and subject lookups
+
+    Returns:
+        (image paths, skipped near-duplicates)
+    """
+    paths: List[str] = []
+    skipped: List[str] = []
+
+    def add_indexed(index: ScanIndex, found: List[str]):
+        if dedupe:
+            found, dropped = index.unique(found)
+            skipped.extend(dropped)
+        paths.extend(found)
+
+    if subject:
+        index = get_scan_index(scan_dir)
+        add_indexed(index, [r.path for r in index.scans_for(subject)])
+    for path in image_paths or []:
+        if os.path.isdir(path):
+            index = get_scan_index(path)
+            add_indexed(index, index.paths())
+        else:
+            paths.append(path)
+    return paths, skipped
@@ -0,0 +1,222 @@
+import asyncio
+import json
+import os
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Union, Optional, Tuple, Any
+
+from .client import DAEMON_STATE_FILE
+from .planner import ToolCall
+from .utils import DataCache, data_cache
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# Number of loaded/merged datasets the daemon keeps in memory
+DAEMON_DATA_CACHE_ENTRIES = 32
+
+def warm_up(data_dir: Optional[str] = None, cache: Optional[DataCache] = None):
+    """
+    Import the scientific stack and optionally preload datasets.
+
+    Args:
+        data_dir: Directory whose CSV files are loaded into cache
+        cache: Data cache to preload
+    """
+    import glob
+    import numpy
+    import pandas
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot
+    import seaborn
+    from scipy import stats
+
+    if data_dir and cache is not None:
+        from .utils import load_csv
+        with data_cache(cache):
+            for path in glob.glob(os.path.join(data_dir, "**", "*.csv"), recursive=True):
+                try:
+                    load_csv(path)
+                except Exception:
+                    pass
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON-over-HTTP API of the daemon.
+
+    GET  /health   -> {"status": "ok", "pid", "uptime_s", "requests", "cwd", "model"}
+    POST /query    {"query", "timeout", "cwd"} -> {"ok", "response", "elapsed_ms"}
+    POST /tool     {"tool", "params", "timeout"} -> {"ok", "result" | "error", "elapsed_ms"}
+    POST /shutdown -> {"ok": true}
+
+    Every request must carry the daemon's token in the X-CohortAgent-Token
+    header; the token is only readable from the state file by its owner.
+    Relative paths in queries are resolved against the daemon's working
+    directory, so a query sent from another directory (cwd) is refused
+    with 409 and the client runs it itself.
+    """
+
+    server: "AgentServer"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        """Only log requests when the server is verbose."""
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, status: int, payload: Dict[str, Any]):
+        """Send a JSON response."""
+        body = json.dumps(payload, default=str).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self) -> bool:
+        """Check the request token, answering 403 if it is wrong."""
+        if self.headers.get("X-CohortAgent-Token") == self.server.token:
+            return True
+        self._send(403, {"ok": False, "error": "Invalid or missing token"})
+        return False
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "pid": os.getpid(),
+                             "uptime_s": round(time.time() - self.server.started, 1),
+                             "requests": self.server.requests, "cwd": self.server.cwd,
+                             "model": self.server.agent.model_name})
+        else:
+            self._send(404, {"ok": False, "error": f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send(400, {"ok": False, "error": f"Invalid JSON: {e}"})
+            return
+
+        start = time.perf_counter()
+        self.server.count_request()
+        if self.path == "/query":
+            cwd = request.get("cwd")
+            if cwd is not None and os.path.realpath(cwd) != self.server.cwd:
+                self._send(409, {"ok": False, "error": f"Daemon runs in {self.server.cwd}, not {cwd}"})
+                return
+            response = self.server.run_query(str(request.get("query", "")), request.get("timeout"))
+            payload = {"ok": True, "response": response}
+        elif self.path == "/tool":
+            payload = self.server.run_tool(request.get("tool", ""), request.get("params") or {},
+                                           request.get("timeout"))
+        elif self.path == "/shutdown":
+            self._send(200, {"ok": True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        else:
+            self._send(404, {"ok": False, "error": f"Unknown endpoint: {self.path}"})
+            return
+        payload["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        self._send(200, payload)
+
+class AgentServer(ThreadingHTTPServer):
+    """
+    HTTP server that keeps a warm CohortAgent and its data resident.
+
+    Each request runs on its own thread. All requests share the agent (and
+    its result cache) and a bounded, fingerprint-keyed data cache, so repeat
+    queries skip imports, agent construction and CSV parsing.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, agent, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+                 token: Optional[str] = None, verbose: bool = False):
+        """
+        Initialize the server.
+
+        Args:
+            agent: CohortAgent that handles every request
+            host: Interface to bind (keep this local)
+            port: TCP port (0 picks a free one)
+            token: Shared secret clients must send (generated if None)
+            verbose: Log each request to stderr
+        """
+        super().__init__((host, port), AgentRequestHandler)
+        self.agent = agent
+        self.token = token or secrets.token_hex(16)
+        self.verbose = verbose
+        self.data_cache = DataCache(max_entries=DAEMON_DATA_CACHE_ENTRIES)
+        self.cwd = os.path.realpath(os.getcwd())
+        self.started = time.time()
+        self.requests = 0
+        self._count_lock = threading.Lock()
+
+    def count_request(self):
+        """Count a handled request (reported by /health)."""
+        with self._count_lock:
+            self.requests += 1
+
+    def run_query(self, query: str, timeout: Optional[float] = None) -> str:
+        """Run a query against the warm agent and data cache."""
+        with data_cache(self.data_cache):
+            return asyncio.run(self.agent.run_async(query, timeout=timeout))
+
+    def run_tool(self, tool: str, params: Dict[str, Any],
+                 timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Run a single tool call against the warm agent and data cache."""
+        if tool not in self.agent.tools:
+            return {"ok": False, "error": f"Unknown tool: {tool}"}
+        try:
+            with data_cache(self.data_cache):
+                result = asyncio.run(self.agent.executor.call(ToolCall(tool, params), timeout=timeout))
+            return {"ok": True, "result": result}
+        except Exception as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def write_state(self, path: str = DAEMON_STATE_FILE):
+        """Record address, pid and token so clients can find this daemon."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"host": self.server_address[0], "port": self.server_address[1],
+                       "pid": os.getpid(), "token": self.token}, f)
+
+def serve(agent, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          data_dir: Optional[str] = None, state_file: str = DAEMON_STATE_FILE,
+          verbose: bool = False):
+    """
+    Run the daemon in the foreground until interrupted or shut down.
+
+    Args:
+        agent: CohortAgent that handles every request
+        host: Interface to bind
+        port: TCP port
+        data_dir: Directory whose datasets are preloaded
+        state_file: Where to record the daemon's address for clients
+        verbose: Log each request to stderr
+    """
+    server = AgentServer(agent, host=host, port=port, verbose=verbose)
+    warm_up(data_dir, server.data_cache)
+    server.write_state(state_file)
+    print(f"CohortAgent daemon listening on http://{host}:{server.server_address[1]} "
+          f"(pid {os.getpid()}); press Ctrl+C to stop")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        try:
+            with open(state_file) as f:
+                if json.load(f).get("pid") == os.getpid():
+                    os.remove(state_file)
+        except (OSError, ValueError):
+            pass
@@ -0,0 +1,326 @@
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Tuple, Any
+
+from .tracing import span
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Omics modalities and the distribution their features are drawn from
+OMICS_MODALITIES = {
+    "proteomics": "lognormal",
+    "metabolomics": "gamma",
+    "lipidomics": "exponential",
+    "microbiome": "composition",
+}
+
+# Prefix of generated feature names ("PROT_00001", ...)
+FEATURE_PREFIXES = {"proteomics": "PROT", "metabolomics": "METAB", "lipidomics": "LIPID",
+                    "microbiome": "TAXON"}
+
+DEFAULT_FEATURES = 100
+
+# Subjects drawn from one random stream. Every block is seeded from (seed,
+# modality, block index) alone, so the output does not depend on chunk size
+# or the number of workers.
+SEED_BLOCK = 256
+
+# Values generated per chunk (subjects x features); bounds each worker's memory
+CHUNK_CELLS = 4_000_000
+
+# Random stream of the site effects (block indexes never reach it)
+SITE_EFFECT_STREAM = 2 ** 32 - 1
+
+FORMATS = ("csv", "parquet")
+
+LIFESTYLE_COLUMNS = ["age", "gender", "height_cm", "weight_kg", "bmi", "exercise_min_per_week",
+                     "sleep_hours_per_day", "smoking_status"]
+
+def subject_ids(start: int, stop: int, n_subjects: int) -> List[str]:
+    """Ids of subjects start..stop-1, numbered from 1 and zero-padded like the example data."""
+    width = max(3, len(str(n_subjects)))
+    return [f"SUBJ{i + 1:0{width}d}" for i in range(start, stop)]
+
+def site_of(index: "np.ndarray", n_sites: int) -> "np.ndarray":
+    """Site of each subject: a fixed pseudo-random assignment, the same in every modality."""
+    import numpy as np
+
+    return ((index.astype(np.uint64) * np.uint64(2654435761)) % np.uint64(2 ** 32)) % np.uint64(n_sites)
+
+def modality_columns(modality: str, n_features: int) -> List[str]:
+    """Columns of a modality's file, in order."""
+    if modality == "lifestyle":
+        return ["id", "site"] + LIFESTYLE_COLUMNS
+    return ["id", "site"] + feature_names(modality, n_features)
+
+def feature_names(modality: str, n_features: int) -> List[str]:
+    """Column names of a modality's features."""
+    width = max(5, len(str(n_features)))
+    return [f"{FEATURE_PREFIXES[modality]}_{i + 1:0{width}d}" for i in range(n_features)]
+
+def _block_rng(seed: int, modality: int, block: int) -> "np.random.Generator":
+    import numpy as np
+
+    return np.random.default_rng(np.random.SeedSequence([seed, modality, block]))
+
+def _site_effects(seed: int, modality: int, n_sites: int, n_features: int) -> "np.ndarray":
+    """Multiplicative batch effect of each site on each feature (about +-10%)."""
+    return _block_rng(seed, modality, SITE_EFFECT_STREAM).lognormal(0.0, 0.1, size=(n_sites, n_features))
+
+def _lifestyle_chunk(rng: "np.random.Generator", n: int) -> Dict[str, "np.ndarray"]:
+    import numpy as np
+
+    height = np.round(rng.normal(170, 10, n), 1)
+    weight = np.round(rng.normal(75, 15, n), 1)
+    return {
+        "age": rng.integers(18, 80, n),
+        "gender": rng.choice(np.array(["Male", "Female"]), n),
+        "height_cm": height,
+        "weight_kg": weight,
+        "bmi": np.round(weight / (height / 100) ** 2, 1),
+        "exercise_min_per_week": rng.integers(0, 300, n),
+        "sleep_hours_per_day": np.round(rng.uniform(4, 10, n), 1),
+        "smoking_status": rng.choice(np.array(["Never", "Former", "Current"]), n),
+    }
+
+def _omics_chunk(rng: "np.random.Generator", distribution: str, n: int, n_features: int) -> "np.ndarray":
+    if distribution == "lognormal":
+        return rng.lognormal(3.0, 1.0, size=(n, n_features))
+    if distribution == "gamma":
+        return rng.gamma(2.0, 1.5, size=(n, n_features))
+    if distribution == "exponential":
+        return rng.exponential(1e4, size=(n, n_features))
+    # Abundances, made relative (summing to 1 per subject) by generate_chunk
+    return rng.gamma(0.5, 1.0, size=(n, n_features))
+
+def generate_chunk(modality: str, start: int, stop: int, n_subjects: int, n_features: int,
+                   missing_rate: float, n_sites: int, seed: int) -> "pd.DataFrame":
+    """
+    Generate the rows of subjects start..stop-1 of one modality.
+
+    start must be a multiple of SEED_BLOCK. The result depends only on the
+    arguments, so chunks can be generated in any order, in any process.
+
+    Returns:
+        DataFrame with "id", "site" and the modality's columns
+    """
+    import numpy as np
+    import pandas as pd
+
+    modality_index = (["lifestyle"] + list(OMICS_MODALITIES)).index(modality)
+    effects = (_site_effects(seed, modality_index, n_sites, n_features)
+               if modality != "lifestyle" else None)
+    blocks = []
+    for block_start in range(start, stop, SEED_BLOCK):
+        n = min(block_start + SEED_BLOCK, stop) - block_start
+        rng = _block_rng(seed, modality_index, block_start // SEED_BLOCK)
+        sites = site_of(np.arange(block_start, block_start + n), n_sites)
+        if modality == "lifestyle":
+            columns = _lifestyle_chunk(rng, n)
+            frame = pd.DataFrame(columns)[LIFESTYLE_COLUMNS]
+            numeric = ["height_cm", "weight_kg", "bmi", "sleep_hours_per_day"]
+            frame[numeric] = frame[numeric].mask(rng.random((n, len(numeric))) < missing_rate)
+        else:
+            values = _omics_chunk(rng, OMICS_MODALITIES[modality], n, n_features) * effects[sites]
+            if OMICS_MODALITIES[modality] == "composition":
+                values /= values.sum(axis=1, keepdims=True)
+            values[rng.random(values.shape) < missing_rate] = np.nan
+            names = feature_names(modality, n_features)
+            frame = pd.DataFrame(values.astype(np.float32), columns=names)
+        frame.insert(0, "site", [f"SITE{s + 1:02d}" for s in sites])
+        frame.insert(0, "id", subject_ids(block_start, block_start + n, n_subjects))
+        blocks.append(frame)
+    return pd.concat(blocks, ignore_index=True)
+
+def _csv_rows(frame: "pd.DataFrame") -> bytes:
+    """
+    CSV rows (without header) of a generated chunk.
+
+    Omics chunks are formatted one row at a time with a single format
+    string, which is several times faster than DataFrame.to_csv and never holds
+    more than a row of formatted values besides the output.
+    """
+    if list(frame.columns[2:]) == LIFESTYLE_COLUMNS:
+        return frame.to_csv(header=False, index=False, float_format="%.6g").encode("utf-8")
+    line = "%s,%s," + ",".join(["%.6g"] * (frame.shape[1] - 2)) + "\n"
+    values = frame.iloc[:, 2:].to_numpy()
+    text = "".join(line % (sid, site, *row.tolist())
+                   for sid, site, row in zip(frame["id"], frame["site"], values))
+    # Missing values are written as empty fields, like to_csv does
+    return text.replace("nan", "").encode("utf-8")
+
+def _encode_chunk(output_format: str, *args) -> Union[bytes, "pd.DataFrame"]:
+    """Generate a chunk in a worker and encode it (CSV rows without header) for writing."""
+    frame = generate_chunk(*args)
+    return _csv_rows(frame) if output_format == "csv" else frame
+
+def generate_cohort(output_dir: str, n_subjects: int = 1000,
+                    features: Union[int, Dict[str, int]] = DEFAULT_FEATURES,
+                    modalities: Optional[List[str]] = None, missing_rate: float = 0.0,
+                    n_sites: int = 1, output_format: str = "csv", seed: int = 42,
+                    workers: Optional[int] = None, chunk_size: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Generate a synthetic cohort: one file per modality, keyed by "id".
+
+    Subjects are generated in chunks on a process pool and streamed to disk
+    in order, with at most two chunks per worker in memory at a time, so
+    memory stays bounded whatever the cohort size. Output is deterministic:
+    the same seed and parameters give the same files for any chunk size or
+    number of workers.
+
+    Args:
+        output_dir: Directory the files are written to
+        n_subjects: Number of subjects
+        features: Features per omics modality (one count for all, or per modality)
+        modalities: "lifestyle" and/or keys of OMICS_MODALITIES (default: all)
+        missing_rate: Fraction of values left empty, at random
+        n_sites: Number of recruitment sites; each site shifts the omics
+                values by its own batch effect
+        output_format: "csv" or "parquet" (parquet needs pyarrow)
+        seed: Random seed
+        workers: Worker processes (default: one per CPU)
+        chunk_size: Subjects per chunk (default: CHUNK_CELLS values per chunk)
+
+    Returns:
+        Dictionary with subjects, files (modality -> path), bytes and seconds
+    """
+    if output_format not in FORMATS:
+        raise ValueError(f"Unknown format {output_format!r}; expected one of {', '.join(FORMATS)}")
+    if not 0 <= missing_rate < 1:
+        raise ValueError("missing_rate must be at least 0 and below 1")
+    modalities = modalities or ["lifestyle"] + list(OMICS_MODALITIES)
+    unknown = [m for m in modalities if m != "lifestyle" and m not in OMICS_MODALITIES]
+    if unknown:
+        raise ValueError(f"Unknown modality: {', '.join(unknown)}")
+    if output_format == "parquet":
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("Writing parquet needs pyarrow: pip install pyarrow") from None
+
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or os.cpu_count() or 1
+    start_time = time.perf_counter()
+    files: Dict[str, str] = {}
+    total_bytes = 0
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        for modality in modalities:
+            n_features = (0 if modality == "lifestyle" else
+                          features.get(modality, DEFAULT_FEATURES) if isinstance(features, dict) else features)
+            rows = chunk_size or CHUNK_CELLS // max(n_features, 10)
+            rows = max(SEED_BLOCK, rows // SEED_BLOCK * SEED_BLOCK)
+            path = os.path.join(output_dir, f"{modality}.{output_format}")
+            chunks = [(modality, start, min(start + rows, n_subjects), n_subjects, n_features,
+                       missing_rate, n_sites, seed) for start in range(0, n_subjects, rows)]
+            with span("generate_modality", modality=modality, subjects=n_subjects,
+                      features=n_features, chunks=len(chunks)):
+                _write_modality(path, output_format, chunks, pool, 2 * workers)
+            files[modality] = path
+            total_bytes += os.path.getsize(path)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return {"subjects": n_subjects, "files": files, "bytes": total_bytes,
+            "seconds": round(time.perf_counter() - start_time, 2)}
+
+def _write_modality(path: str, output_format: str, chunks: List[Tuple], pool: Optional[ProcessPoolExecutor],
+                    max_pending: int):
+    """Generate chunks (on pool, if any) and write them to path in order, through a temporary file."""
+    tmp_path = path + ".tmp"
+    writer = None
+    pending: deque = deque()
+    next_chunk = 0
+
+    def results():
+        nonlocal next_chunk
+        while next_chunk < len(chunks) or pending:
+            if pool is None:
+                next_chunk += 1
+                yield _encode_chunk(output_format, *chunks[next_chunk - 1])
+                continue
+            while next_chunk < len(chunks) and len(pending) < max_pending:
+                pending.append(pool.submit(_encode_chunk, output_format, *chunks[next_chunk]))
+                next_chunk += 1
+            yield pending.popleft().result()
+
+    try:
+        with open(tmp_path, "wb") as f:
+            for index, result in enumerate(results()):
+                if output_format == "csv":
+                    if index == 0:
+                        header = modality_columns(chunks[0][0], chunks[0][4])
+                        f.write((",".join(header) + "\n").encode("utf-8"))
+                    f.write(result)
+                else:
+                    import pyarrow as pa
+                    import pyarrow.parquet as pq
+
+                    table = pa.Table.from_pandas(result, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(f, table.schema)
+                    writer.write_table(table)
+            if writer is not None:
+                writer.close()
+        os.replace(tmp_path, path)
+    finally:
+        for future in pending:
+            future.cancel()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def parse_features(values: List[str]) -> Union[int, Dict[str, int]]:
+    """Parse --features: a count for every omics modality, or modality=count pairs."""
+    if len(values) == 1 and "=" not in values[0]:
+        return int(values[0])
+    counts = {}
+    for value in values:
+        modality, _, count = value.partition("=")
+        counts[modality] = int(count)
+    return counts
+
+def main(argv: Optional[List[str]] = None):
+    """Command-line entry point (cohortagent-generate)."""
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic multimodal cohort for load testing")
+    parser.add_argument("output_dir", help="Directory to write one file per modality to")
+    parser.add_argument("--subjects", "-n", type=int, default=1000, help="Number of subjects")
+    parser.add_argument("--features", "-f", nargs="+", default=[str(DEFAULT_FEATURES)],
+                        metavar="N|MODALITY=N",
+                        help="Features per omics modality, e.g. 10000 or proteomics=5000 lipidomics=200")
+    parser.add_argument("--modalities", nargs="+", default=None,
+                        choices=["lifestyle"] + list(OMICS_MODALITIES),
+                        help="Modalities to generate (default: all)")
+    parser.add_argument("--missing-rate", type=float, default=0.0,
+                        help="Fraction of values left empty (0-1)")
+    parser.add_argument("--sites", type=int, default=1, help="Number of recruitment sites")
+    parser.add_argument("--format", choices=FORMATS, default="csv", help="Output format")
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help="Subjects per chunk (default: sized to the feature count)")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = generate_cohort(args.output_dir, n_subjects=args.subjects,
+                                  features=parse_features(args.features), modalities=args.modalities,
+                                  missing_rate=args.missing_rate, n_sites=args.sites,
+                                  output_format=args.format, seed=args.seed, workers=args.workers,
+                                  chunk_size=args.chunk_size)
+    except (ValueError, ImportError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for modality, path in summary["files"].items():
+        print(f"{modality}: {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    print(f"Generated {summary['subjects']} subjects, {summary['bytes'] / 1e6:.1f} MB "
+          f"in {summary['seconds']:.1f}s")
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,33 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import glob
 import os
-from typing import List, Dict, Union, Optional, Tuple, Any
-import numpy as np
-from PIL import Image
-from scipy import stats
-from .utils import load_csv, merge_dataframes, save_plot
+import time
+from typing import List, Dict, Union, Optional, Tuple, Any, Iterator
+
+# pandas, numpy, scipy, matplotlib, seaborn and PIL are imported inside the
+# functions that need them so that importing this module (and therefore the
+# CLI) stays fast. Python caches modules, so repeated calls pay nothing extra;
+# the first call's cost shows up as the "import" phase when profiling.
+from .budget import (Budget, CallBudget, call_budget, call_with_budget, current_budget, note_time_cutoff,
+                     time_cutoffs)
+from .longitudinal import LONGITUDINAL_ANALYSIS_TYPES, LONGITUDINAL_PLOT_TYPES, visit_columns
+from .tracing import span
+from .utils import exclusive_plotting, load_csv, load_merged, save_plot
+
+# Analysis types that need scipy.stats, which is slow to import
+SCIPY_ANALYSIS_TYPES = ("distribution", "regression", "ttest", "anova")
+
+# Columns per piece when streaming a distribution analysis
+STREAM_COLUMN_BLOCK = 10
+
+def _selected_columns(data, columns: List[str], operation: str, groupby: Optional[str]) -> List[str]:
+    """
+    Columns to keep for operation: the requested ones, plus for longitudinal
+    analyses and plots the subject, visit time and groupby columns.
+    """
+    if operation not in LONGITUDINAL_ANALYSIS_TYPES + LONGITUDINAL_PLOT_TYPES:
+        return columns
+    extra = visit_columns(list(data.columns)) + ([groupby] if groupby in data.columns else [])
+    return list(dict.fromkeys(extra + columns))
 
 def analyze_data(file_path: str, analysis_type: str = "summary", 
                  columns: Optional[List[str]] = None,
@@ -17,53 +38,98 @@ def analyze_data(file_path: str, analysis_type: str = "summary",
     Args:
         file_path: Path to the CSV file containing the data
         analysis_type: Type of analysis to perform (summary, correlation, 
-                      distribution, regression, anova, ttest)
+                      distribution, regression, anova, ttest, longitudinal)
         columns: Specific columns to analyze
         groupby: Column to group data by for group analysis
         
     Returns:
         String representation of the analysis results
     """
-    data = load_csv(file_path)
+    return "".join(iter_analyze_data(file_path, analysis_type, columns, groupby))
+
+def iter_analyze_data(file_path: str, analysis_type: str = "summary",
+                      columns: Optional[List[str]] = None,
+                      groupby: Optional[str] = None) -> Iterator[str]:
+    """
+    Streaming variant of analyze_data.
+    
+    Yields the result in pieces as they are computed (one per group of a
+    grouped summary, one per block of columns of a distribution analysis);
+    the pieces concatenate to analyze_data's result.
+    """
+    call = call_budget("analyze_data")
+    data = call.load_csv(file_path, analysis_type)
     
     if columns:
         try:
-            data = data[columns]
+            with span("select_columns", columns=len(columns)):
+                data = data[_selected_columns(data, columns, analysis_type, groupby)]
         except KeyError as e:
-            return f"Column error: {str(e)}"
+            yield f"Column error: {str(e)}"
+            return
     
+    data = call.fit(data, analysis_type, keep=[groupby] if groupby else None)
+    with span("statistics", analysis_type=analysis_type, rows=len(data), columns=len(data.columns)):
+        yield from _analysis_chunks(data, analysis_type, columns, groupby, call)
+    if call.notes:
+        yield call.report()
+
+def _analysis_chunks(data, analysis_type: str, columns: Optional[List[str]],
+                     groupby: Optional[str], call: Optional[CallBudget] = None) -> Iterator[str]:
+    """
+    Compute an analysis of loaded data, yielding the report piece by piece.
+    
+    Loops over groups and column blocks stop early once call's time budget
+    is used up, noting how far they got.
+    """
+    with span("import"):
+        import numpy as np
+        if analysis_type in SCIPY_ANALYSIS_TYPES:
+            from scipy import stats
+
+    if analysis_type in LONGITUDINAL_ANALYSIS_TYPES:
+        from .longitudinal import iter_longitudinal_analysis
+
+        yield from iter_longitudinal_analysis(data, columns, groupby, call)
+        return
+
     if groupby and groupby in data.columns:
         grouped = data.groupby(groupby)
         
         if analysis_type == "summary":
-            result = "Group Summary Statistics:\n\n"
-            for name, group in grouped:
-                result += f"Group: {name}\n"
-                result += group.describe().to_string()
-                result += "\n\n"
-            return result
+            yield "Group Summary Statistics:\n\n"
+            for i, (name, group) in enumerate(grouped):
+                if call is not None and call.out_of_time():
+                    call.note(f"time budget ran out after {i} of {grouped.ngroups} groups")
+                    break
+                yield f"Group: {name}\n" + group.describe().to_string() + "\n\n"
+            return
             
     if analysis_type == "summary":
-        return data.describe().to_string()
+        yield data.describe().to_string()
     
     elif analysis_type == "correlation":
-        return data.corr().to_string()
+        yield data.corr(numeric_only=True).to_string()
     
     elif analysis_type == "distribution":
-        result = "Distribution Analysis:\n\n"
+        yield "Distribution Analysis:\n\n"
         numeric_cols = data.select_dtypes(include=np.number).columns
         
-        for col in numeric_cols:
-            skewness = stats.skew(data[col].dropna())
-            kurtosis = stats.kurtosis(data[col].dropna())
-            normality = stats.shapiro(data[col].dropna()) if len(data[col].dropna()) >= 3 else ("N/A", "N/A")
-            
-            result += f"Column: {col}\n"
-            result += f"Skewness: {skewness:.4f}\n"
-            result += f"Kurtosis: {kurtosis:.4f}\n"
-            result += f"Shapiro-Wilk Test (normality): stat={normality[0]:.4f}, p={normality[1]:.4f}\n\n"
-        
-        return result
+        for start in range(0, len(numeric_cols), STREAM_COLUMN_BLOCK):
+            if call is not None and call.out_of_time():
+                call.note(f"time budget ran out after {start} of {len(numeric_cols)} columns")
+                break
+            result = ""
+            for col in numeric_cols[start:start + STREAM_COLUMN_BLOCK]:
+                skewness = stats.skew(data[col].dropna())
+                kurtosis = stats.kurtosis(data[col].dropna())
+                normality = stats.shapiro(data[col].dropna()) if len(data[col].dropna()) >= 3 else ("N/A", "N/A")
+                
+                result += f"Column: {col}\n"
+                result += f"Skewness: {skewness:.4f}\n"
+                result += f"Kurtosis: {kurtosis:.4f}\n"
+                result += f"Shapiro-Wilk Test (normality): stat={normality[0]:.4f}, p={normality[1]:.4f}\n\n"
+            yield result
     
     elif analysis_type == "regression" and len(columns) >= 2:
         x = data[columns[0]]
@@ -79,7 +145,7 @@ def analyze_data(file_path: str, analysis_type: str = "summary",
         result += f"P-value: {p_value:.4f}\n"
         result += f"Standard Error: {std_err:.4f}\n"
         
-        return result
+        yield result
     
     elif analysis_type == "ttest" and len(columns) >= 2:
         result = "T-Test Analysis:\n\n"
@@ -90,7 +156,7 @@ def analyze_data(file_path: str, analysis_type: str = "summary",
         result += f"P-value: {p_value:.4f}\n"
         result += f"Significant difference: {'Yes' if p_value < 0.05 else 'No'}\n"
         
-        return result
+        yield result
     
     elif analysis_type == "anova" and groupby:
         result = "ANOVA Analysis:\n\n"
@@ -102,10 +168,35 @@ def analyze_data(file_path: str, analysis_type: str = "summary",
         result += f"P-value: {p_value:.4f}\n"
         result += f"Significant difference: {'Yes' if p_value < 0.05 else 'No'}\n"
         
-        return result
+        yield result
     
     else:
-        return f"Unknown analysis type or insufficient parameters: {analysis_type}"
+        yield f"Unknown analysis type or insufficient parameters: {analysis_type}"
+
+def _plotly_visualization(data, plot_type: str, columns: Optional[List[str]],
+                          groupby: Optional[str], title: Optional[str],
+                          output_path: str, output_format: str,
+                          notes: Optional[List[str]] = None) -> str:
+    """
+    Write a plotly figure spec instead of rendering a PNG.
+    
+    Errors are written into the spec as a message, like the PNG error images;
+    budget notes are added as a caption.
+    
+    Returns:
+        Path to the saved JSON spec
+    """
+    from .plot_specs import build_plotly_spec, error_spec, save_spec
+    
+    try:
+        spec = build_plotly_spec(data, plot_type, columns=columns, groupby=groupby, title=title)
+    except Exception as e:
+        spec = error_spec(f"Error creating {plot_type} plot: {str(e)}")
+    if notes:
+        spec.setdefault("layout", {}).setdefault("annotations", []).append(
+            {"text": "Budget: " + "; ".join(notes), "showarrow": False, "xref": "paper",
+             "yref": "paper", "x": 0, "y": -0.15, "xanchor": "left", "font": {"size": 10, "color": "gray"}})
+    return save_spec(spec, output_path)
 
 def visualize_data(file_path: str, plot_type: str = "histogram", 
                    columns: Optional[List[str]] = None, 
@@ -113,25 +204,54 @@ def visualize_data(file_path: str, plot_type: str = "histogram",
                    groupby: Optional[str] = None,
                    title: Optional[str] = None,
                    figsize: Tuple[int, int] = (12, 8),
-                   palette: str = "viridis") -> str:
+                   palette: str = "viridis",
+                   output_format: str = "png") -> str:
     """
     Generate visualizations from health data.
     
     Args:
         file_path: Path to the CSV file containing the data
         plot_type: Type of plot to generate (histogram, scatter, heatmap, bar, box,
-                  violin, swarm, joint, pair, density, line, regression)
+                  violin, swarm, joint, pair, density, line, regression, trajectory)
         columns: List of columns to include in the visualization
         output_path: Path where to save the generated plot
         groupby: Column to group data by for grouped visualizations
         title: Title for the plot
         figsize: Figure size as (width, height)
         palette: Color palette to use for the plot
+        output_format: "png" to render with matplotlib, or "plotly" to write a
+                      compact plotly JSON figure spec (next to output_path, with a
+                      .json extension) for client-side rendering; plot types
+                      without a plotly builder are rendered as PNG either way
         
     Returns:
         Path to the saved visualization
     """
-    data = load_csv(file_path)
+    from .plot_specs import writes_spec
+
+    spec = writes_spec(plot_type, output_format)
+    call = call_budget("visualize_data")
+    data = call.load_csv(file_path, plot_type)
+    
+    if spec:
+        data = call.fit(data, plot_type, keep=[c for c in (columns or []) + [groupby] if c])
+        return _plotly_visualization(data, plot_type, columns, groupby, title,
+                                     output_path, output_format, notes=call.notes)
+    
+    with span("render", plot_type=plot_type, rows=len(data), columns=len(data.columns)):
+        return _render_plot(data, plot_type, columns, output_path, groupby, title,
+                            figsize, palette, call)
+
+@exclusive_plotting
+def _render_plot(data, plot_type: str, columns: Optional[List[str]], output_path: str,
+                 groupby: Optional[str], title: Optional[str], figsize: Tuple[int, int],
+                 palette: str, call: CallBudget) -> str:
+    """Render visualize_data's PNG: select columns, fit the budget, draw and save."""
+    with span("import"):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        if plot_type == "regression":
+            from scipy import stats
     
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
@@ -148,13 +268,16 @@ def visualize_data(file_path: str, plot_type: str = "histogram",
                 plt.text(0.5, 0.5, f"None of the specified columns were found in the data",
                         horizontalalignment='center', verticalalignment='center')
                 return save_plot(output_path)
-            data = data[columns_to_use]
+            with span("select_columns", columns=len(columns_to_use)):
+                data = data[_selected_columns(data, columns_to_use, plot_type, groupby)]
         except Exception as e:
             plt.figure(figsize=(8, 6))
             plt.text(0.5, 0.5, f"Error selecting columns: {str(e)}",
                     horizontalalignment='center', verticalalignment='center')
             return save_plot(output_path)
     
+    data = call.fit(data, plot_type, keep=[groupby] if groupby else None)
+    
     # Create the figure
     plt.figure(figsize=figsize)
     
@@ -179,7 +302,7 @@ def visualize_data(file_path: str, plot_type: str = "histogram",
             plt.ylabel(columns[1])
             
         elif plot_type == "heatmap":
-            corr = data.corr()
+            corr = data.corr(numeric_only=True)
             sns.heatmap(corr, annot=True, cmap='coolwarm', linewidths=.5)
             
         elif plot_type == "bar":
@@ -252,6 +375,11 @@ def visualize_data(file_path: str, plot_type: str = "histogram",
                 plt.plot(data[columns])
                 plt.legend(columns)
                 
+        elif plot_type == "trajectory":
+            from .longitudinal import plot_trajectories
+
+            plot_trajectories(data, columns, groupby, palette)
+        
         elif plot_type == "regression" and len(columns) >= 2:
             sns.regplot(x=columns[0], y=columns[1], data=data)
             # Add regression equation
@@ -272,6 +400,7 @@ def visualize_data(file_path: str, plot_type: str = "histogram",
         
         plt.tight_layout()
         
+        call.annotate_figure()
         return save_plot(output_path)
     
     except Exception as e:
@@ -292,7 +421,7 @@ def merge_and_analyze(file_paths: List[str],
     Args:
         file_paths: List of paths to CSV files
         analysis_type: Type of analysis to perform (summary, correlation, distribution,
-                      regression, anova, ttest)
+                      regression, anova, ttest, longitudinal)
         merge_on: Column name to use for merging datasets
         columns: Specific columns to analyze
         groupby: Column to group data by for group analysis
@@ -301,92 +430,194 @@ def merge_and_analyze(file_paths: List[str],
         String representation of the analysis results
     """
     try:
-        dataframes = [load_csv(fp) for fp in file_paths]
-        merged_data = merge_dataframes(dataframes, on=merge_on)
-        
-        if columns:
-            try:
-                merged_data = merged_data[columns]
-            except KeyError as e:
-                return f"Column error: {str(e)}"
-        
-        if groupby and groupby in merged_data.columns:
-            grouped = merged_data.groupby(groupby)
-            
-            if analysis_type == "summary":
-                result = "Group Summary Statistics:\n\n"
-                for name, group in grouped:
-                    result += f"Group: {name}\n"
-                    result += group.describe().to_string()
-                    result += "\n\n"
-                return result
-        
-        if analysis_type == "summary":
-            return merged_data.describe().to_string()
-        
-        elif analysis_type == "correlation":
-            return merged_data.corr().to_string()
-        
-        elif analysis_type == "distribution":
-            result = "Distribution Analysis:\n\n"
-            numeric_cols = merged_data.select_dtypes(include=np.number).columns
-            
-            for col in numeric_cols:
-                skewness = stats.skew(merged_data[col].dropna())
-                kurtosis = stats.kurtosis(merged_data[col].dropna())
-                normality = stats.shapiro(merged_data[col].dropna()) if len(merged_data[col].dropna()) >= 3 else ("N/A", "N/A")
-                
-                result += f"Column: {col}\n"
-                result += f"Skewness: {skewness:.4f}\n"
-                result += f"Kurtosis: {kurtosis:.4f}\n"
-                result += f"Shapiro-Wilk Test (normality): stat={normality[0]:.4f}, p={normality[1]:.4f}\n\n"
-            
-            return result
-        
-        elif analysis_type == "regression" and len(columns) >= 2:
-            x = merged_data[columns[0]]
-            y = merged_data[columns[1]]
-            slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
-            
-            result = "Linear Regression Analysis:\n\n"
-            result += f"Dependent variable: {columns[1]}\n"
-            result += f"Independent variable: {columns[0]}\n"
-            result += f"Slope: {slope:.4f}\n"
-            result += f"Intercept: {intercept:.4f}\n"
-            result += f"R-squared: {r_value**2:.4f}\n"
-            result += f"P-value: {p_value:.4f}\n"
-            result += f"Standard Error: {std_err:.4f}\n"
-            
-            return result
-        
-        elif analysis_type == "ttest" and len(columns) >= 2:
-            result = "T-Test Analysis:\n\n"
-            t_stat, p_value = stats.ttest_ind(merged_data[columns[0]].dropna(), merged_data[columns[1]].dropna())
-            
-            result += f"T-test between {columns[0]} and {columns[1]}:\n"
-            result += f"T-statistic: {t_stat:.4f}\n"
-            result += f"P-value: {p_value:.4f}\n"
-            result += f"Significant difference: {'Yes' if p_value < 0.05 else 'No'}\n"
-            
-            return result
-        
-        elif analysis_type == "anova" and groupby:
-            result = "ANOVA Analysis:\n\n"
-            groups = [group[columns[0]].dropna() for name, group in merged_data.groupby(groupby)]
-            f_stat, p_value = stats.f_oneway(*groups)
-            
-            result += f"ANOVA for {columns[0]} across {groupby} groups:\n"
-            result += f"F-statistic: {f_stat:.4f}\n"
-            result += f"P-value: {p_value:.4f}\n"
-            result += f"Significant difference: {'Yes' if p_value < 0.05 else 'No'}\n"
-            
-            return result
+        return "".join(_merged_analysis_chunks(file_paths, analysis_type, merge_on, columns, groupby))
+    except Exception as e:
+        return f"Error in merge_and_analyze: {str(e)}"
+
+def iter_merge_and_analyze(file_paths: List[str],
+                           analysis_type: str = "summary",
+                           merge_on: Optional[str] = None,
+                           columns: Optional[List[str]] = None,
+                           groupby: Optional[str] = None) -> Iterator[str]:
+    """
+    Streaming variant of merge_and_analyze (see iter_analyze_data).
+    
+    An error after partial output is reported as a final piece.
+    """
+    try:
+        yield from _merged_analysis_chunks(file_paths, analysis_type, merge_on, columns, groupby)
+    except Exception as e:
+        yield f"Error in merge_and_analyze: {str(e)}"
+
+def _merged_analysis_chunks(file_paths: List[str], analysis_type: str, merge_on: Optional[str],
+                            columns: Optional[List[str]], groupby: Optional[str]) -> Iterator[str]:
+    """Merge datasets and analyze them, yielding the report piece by piece."""
+    call = call_budget("merge_and_analyze")
+    merged_data = call.load_merged(file_paths, on=merge_on)
+    
+    if columns:
+        try:
+            with span("select_columns", columns=len(columns)):
+                merged_data = merged_data[_selected_columns(merged_data, columns, analysis_type, groupby)]
+        except KeyError as e:
+            yield f"Column error: {str(e)}"
+            return
+    
+    merged_data = call.fit(merged_data, analysis_type, keep=[groupby] if groupby else None)
+    with span("statistics", analysis_type=analysis_type, rows=len(merged_data),
+              columns=len(merged_data.columns)):
+        yield from _analysis_chunks(merged_data, analysis_type, columns, groupby, call)
+    if call.notes:
+        yield call.report()
+
+def analyze_all(data_dir: str, analysis_type: str = "summary",
+                columns: Optional[List[str]] = None,
+                groupby: Optional[str] = None,
+                workers: Optional[int] = None,
+                timeout: Optional[float] = None) -> str:
+    """
+    Run the same analysis on every dataset under a directory.
+    
+    Files are analyzed in parallel, each in its own worker process (one at
+    a time per CPU by default). A file that fails is reported and does not
+    affect the others; with a timeout, a file still running that long after
+    its worker started is reported as timed out and its worker terminated.
+    
+    Args:
+        data_dir: Directory searched recursively for CSV files
+        analysis_type: Analysis to run on each file (see analyze_data)
+        columns: Columns to analyze; each file uses those it has
+        groupby: Column to group by, in files that have it
+        workers: Number of worker processes (default: CPU count)
+        timeout: Seconds each file may take; also its time budget
         
+    Returns:
+        One report with a section per file and a table of per-file timings
+    """
+    paths = sorted(glob.glob(os.path.join(data_dir, "**", "*.csv"), recursive=True))
+    if not paths:
+        return f"No datasets found in {data_dir}"
+    budget = current_budget()
+    if timeout is not None:
+        budget = Budget(max_rows=budget.max_rows if budget else None,
+                        max_memory_mb=budget.max_memory_mb if budget else None,
+                        max_seconds=timeout)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(paths)))
+    
+    start = time.perf_counter()
+    outcomes: Dict[str, Tuple[str, Optional[float], bool]] = {}
+    with span("analyze_all", files=len(paths), workers=workers):
+        if workers == 1 and timeout is None:
+            for path in paths:
+                outcomes[path] = _analyze_one_file(path, analysis_type, columns, groupby, budget)
         else:
-            return f"Unknown analysis type or insufficient parameters: {analysis_type}"
+            outcomes = _analyze_files_in_processes(paths, (analysis_type, columns, groupby, budget),
+                                                   workers, timeout)
+    
+    failed = sum(1 for _, _, ok in outcomes.values() if not ok)
+    report = (f"Analysis ({analysis_type}) of {len(paths)} datasets in {data_dir}: "
+              f"{len(paths) - failed} succeeded, {failed} failed, "
+              f"{time.perf_counter() - start:.2f}s with {workers} worker(s)\n")
+    for path in paths:
+        result, elapsed, _ = outcomes[path]
+        timing = f"{elapsed * 1000:.0f} ms" if elapsed is not None else "not finished"
+        report += f"\n=== {os.path.relpath(path, data_dir)} ({timing}) ===\n{result}\n"
+    report += "\nPer-file timings (slowest first):\n"
+    for path in sorted(paths, key=lambda p: -(outcomes[p][1] or float("inf"))):
+        result, elapsed, ok = outcomes[path]
+        timing = f"{elapsed * 1000:10.1f} ms" if elapsed is not None else f"{'-':>10}   "
+        report += f"{timing}  {'ok    ' if ok else 'FAILED'}  {os.path.relpath(path, data_dir)}\n"
+    return report
+
+def _analyze_files_in_processes(paths: List[str], args: Tuple, workers: int,
+                                timeout: Optional[float]) -> Dict[str, Tuple[str, Optional[float], bool]]:
+    """
+    Run _analyze_one_file on every path, each in its own process, at most
+    workers at a time.
+    
+    Each file's timeout counts from the start of its process; a process
+    still running when its time is up is terminated and the file reported
+    as timed out, so no worker outlives the call.
     
+    Returns:
+        Outcome per path, as returned by _analyze_one_file
+    """
+    import multiprocessing
+    from multiprocessing.connection import wait
+    
+    waiting = list(paths)
+    running: Dict[Any, Tuple[str, Any, float]] = {}
+    outcomes: Dict[str, Tuple[str, Optional[float], bool]] = {}
+    try:
+        while waiting or running:
+            while waiting and len(running) < workers:
+                path = waiting.pop(0)
+                receiver, sender = multiprocessing.Pipe(duplex=False)
+                process = multiprocessing.Process(target=_analyze_file_in_process,
+                                                  args=(sender, path) + args, daemon=True)
+                process.start()
+                sender.close()
+                running[receiver] = (path, process, time.perf_counter())
+            now = time.perf_counter()
+            remaining = None if timeout is None else max(
+                0.0, min(started + timeout for _, _, started in running.values()) - now)
+            for receiver in wait(list(running), timeout=remaining):
+                path, process, _ = running.pop(receiver)
+                try:
+                    outcomes[path], cut_short = receiver.recv()
+                    if cut_short:
+                        note_time_cutoff("analyze_all")
+                except EOFError:
+                    outcomes[path] = (f"Error: worker exited with code {process.exitcode}", None, False)
+                receiver.close()
+                process.join()
+            now = time.perf_counter()
+            for receiver, (path, process, started) in list(running.items()):
+                if timeout is not None and now - started >= timeout:
+                    process.terminate()
+                    process.join()
+                    receiver.close()
+                    del running[receiver]
+                    outcomes[path] = (f"Timed out after {timeout:g}s", None, False)
+                    note_time_cutoff("analyze_all")
+    finally:
+        for receiver, (path, process, _) in running.items():
+            process.terminate()
+            process.join()
+            receiver.close()
+    return outcomes
+
+def _analyze_file_in_process(connection, path: str, *args):
+    """
+    Process target of _analyze_files_in_processes: send _analyze_one_file's
+    outcome back, and whether the time budget cut it short.
+    """
+    with time_cutoffs() as cutoffs:
+        outcome = _analyze_one_file(path, *args)
+    connection.send((outcome, bool(cutoffs)))
+    connection.close()
+
+def _analyze_one_file(path: str, analysis_type: str, columns: Optional[List[str]],
+                      groupby: Optional[str], budget: Optional[Budget]) -> Tuple[str, float, bool]:
+    """
+    Analyze one file for analyze_all (usually in a worker process).
+    
+    Returns:
+        (result or error message, seconds taken, whether it succeeded)
+    """
+    import pandas as pd
+    
+    start = time.perf_counter()
+    try:
+        header = list(pd.read_csv(path, nrows=0).columns)
+        file_columns = [c for c in columns if c in header] if columns else None
+        if columns and not file_columns:
+            return "Skipped: none of the requested columns", time.perf_counter() - start, True
+        result = call_with_budget(budget, analyze_data, file_path=path, analysis_type=analysis_type,
+                                  columns=file_columns, groupby=groupby if groupby in header else None)
+        return result, time.perf_counter() - start, True
     except Exception as e:
-        return f"Error in merge_and_analyze: {str(e)}"
+        return f"Error: {type(e).__name__}: {e}", time.perf_counter() - start, False
 
 def merge_and_visualize(file_paths: List[str], 
                         plot_type: str = "heatmap",
@@ -396,14 +627,15 @@ def merge_and_visualize(file_paths: List[str],
                         groupby: Optional[str] = None,
                         title: Optional[str] = None,
                         figsize: Tuple[int, int] = (12, 8),
-                        palette: str = "viridis") -> str:
+                        palette: str = "viridis",
+                        output_format: str = "png") -> str:
     """
     Merge multiple datasets and create visualization.
     
     Args:
         file_paths: List of paths to CSV files
         plot_type: Type of plot to generate (histogram, scatter, heatmap, bar, box,
-                  violin, swarm, joint, pair, density, line, regression)
+                  violin, swarm, joint, pair, density, line, regression, trajectory)
         columns: List of columns to include in the visualization
         merge_on: Column name to use for merging datasets
         output_path: Path where to save the generated plot
@@ -411,14 +643,61 @@ def merge_and_visualize(file_paths: List[str],
         title: Title for the plot
         figsize: Figure size as (width, height)
         palette: Color palette to use for the plot
+        output_format: "png" to render with matplotlib, or "plotly" to write a
+                      compact plotly JSON figure spec (next to output_path, with a
+                      .json extension) for client-side rendering; plot types
+                      without a plotly builder are rendered as PNG either way
         
     Returns:
         Path to the saved visualization
     """
+    from .plot_specs import writes_spec
+
+    spec = writes_spec(plot_type, output_format)
     try:
-        dataframes = [load_csv(fp) for fp in file_paths]
-        merged_data = merge_dataframes(dataframes, on=merge_on)
+        call = call_budget("merge_and_visualize")
+        merged_data = call.load_merged(file_paths, on=merge_on)
+        
+        if spec:
+            merged_data = call.fit(merged_data, plot_type,
+                                   keep=[c for c in (columns or []) + [groupby] if c])
+            return _plotly_visualization(merged_data, plot_type, columns, groupby, title,
+                                         output_path, output_format, notes=call.notes)
         
+        with span("render", plot_type=plot_type, rows=len(merged_data), columns=len(merged_data.columns)):
+            return _render_merged_plot(merged_data, plot_type, columns, output_path, groupby, title,
+                                       figsize, palette, call)
+    
+    except Exception as e:
+        if spec:
+            from .plot_specs import error_spec, save_spec
+
+            return save_spec(error_spec(f"Error creating {plot_type} plot: {str(e)}"), output_path)
+        return _error_plot(output_path, f"Error creating {plot_type} plot: {str(e)}")
+
+@exclusive_plotting
+def _error_plot(output_path: str, message: str) -> str:
+    """Save a PNG that only shows message."""
+    import matplotlib.pyplot as plt
+
+    plt.close()
+    plt.figure(figsize=(8, 6))
+    plt.text(0.5, 0.5, message, horizontalalignment='center', verticalalignment='center')
+    return save_plot(output_path)
+
+@exclusive_plotting
+def _render_merged_plot(merged_data, plot_type: str, columns: Optional[List[str]], output_path: str,
+                        groupby: Optional[str], title: Optional[str], figsize: Tuple[int, int],
+                        palette: str, call: CallBudget) -> str:
+    """Render merge_and_visualize's PNG: select columns, fit the budget, draw and save."""
+    with span("import"):
+        import numpy as np
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        if plot_type == "regression":
+            from scipy import stats
+
+    try:
         # Create output directory if it doesn't exist
         os.makedirs(os.path.dirname(output_path), exist_ok=True)
         
@@ -434,13 +713,16 @@ def merge_and_visualize(file_paths: List[str],
                     plt.text(0.5, 0.5, f"None of the specified columns were found in the data",
                             horizontalalignment='center', verticalalignment='center')
                     return save_plot(output_path)
-                merged_data = merged_data[columns_to_use]
+                with span("select_columns", columns=len(columns_to_use)):
+                    merged_data = merged_data[_selected_columns(merged_data, columns_to_use, plot_type, groupby)]
             except Exception as e:
                 plt.figure(figsize=(8, 6))
                 plt.text(0.5, 0.5, f"Error selecting columns: {str(e)}",
                         horizontalalignment='center', verticalalignment='center')
                 return save_plot(output_path)
         
+        merged_data = call.fit(merged_data, plot_type, keep=[groupby] if groupby else None)
+        
         # Create the figure
         plt.figure(figsize=figsize)
         
@@ -464,7 +746,7 @@ def merge_and_visualize(file_paths: List[str],
             plt.ylabel(columns[1])
             
         elif plot_type == "heatmap":
-            corr = merged_data.corr()
+            corr = merged_data.corr(numeric_only=True)
             mask = np.triu(np.ones_like(corr, dtype=bool))  # Mask for upper triangle
             sns.heatmap(corr, annot=True, cmap='coolwarm', mask=mask, linewidths=.5, 
                       cbar_kws={"shrink": .8})
@@ -531,6 +813,11 @@ def merge_and_visualize(file_paths: List[str],
                     sns.kdeplot(merged_data[col], label=col, fill=True, alpha=0.3)
             plt.legend()
             
+        elif plot_type == "trajectory":
+            from .longitudinal import plot_trajectories
+
+            plot_trajectories(merged_data, columns, groupby, palette)
+        
         elif plot_type == "regression" and len(columns) >= 2:
             sns.regplot(x=columns[0], y=columns[1], data=merged_data)
             # Add regression equation
@@ -567,6 +854,7 @@ def merge_and_visualize(file_paths: List[str],
         
         plt.tight_layout()
         
+        call.annotate_figure()
         return save_plot(output_path)
     
     except Exception as e:
@@ -576,31 +864,167 @@ def merge_and_visualize(file_paths: List[str],
                 horizontalalignment='center', verticalalignment='center')
         return save_plot(output_path)
 
-def analyze_images(image_paths: List[str]) -> str:
+def analyze_images(image_paths: Optional[List[str]] = None, interpret: bool = False,
+                   model: Optional[str] = None, pixels: bool = False,
+                   workers: Optional[int] = None, use_cache: bool = True,
+                   subject: Optional[str] = None, scan_dir: str = "scans",
+                   dedupe: bool = True, model_url: Optional[str] = None,
+                   model_timeout: Optional[float] = None) -> str:
     """
-    Process and analyze images using a local multimodal model.
-    This function would typically call the local LLaVA model for image interpretation,
-    but here we're providing a placeholder implementation.
+    Process and analyze images, optionally interpreted by a local multimodal model.
+    
+    Only image headers are read unless pixel statistics are requested, and
+    then images are decoded at reduced resolution on a worker pool. Results
+    are cached per image by content hash, so re-running over an unchanged
+    scans directory reads almost nothing. Directories and subjects are
+    resolved through the persistent scan index (see scan_index.ScanIndex).
     
     Args:
-        image_paths: List of paths to image files
+        image_paths: List of paths to image files or directories of images
+        interpret: Ask the model to describe each image
+        model: Model used for interpretation, e.g. "ollama/llava" (see inference.InferenceQueue)
+        pixels: Also report intensity statistics (mean, contrast, range)
+        workers: Worker threads for reading and decoding (default: 2 per CPU)
+        use_cache: Reuse per-image results from earlier runs
+        subject: Also include the scans of this subject id (e.g. "SUBJ042") under scan_dir
+        scan_dir: Directory searched for the subject's scans
+        dedupe: Skip near-duplicate scans of a subject found in directories
+        model_url: Server of the interpreting model (default depends on the provider)
+        model_timeout: Request timeout of the interpreting model in seconds
         
     Returns:
         Description of the images
+        
+    Raises:
+        ValueError: If interpret is set without a model, or no images are given
+        ModelError: If the model cannot be reached
     """
-    # This is a placeholder. In a real implementation, this would connect
-    # to the local LLaVA model for image processing
+    from .images import default_image_cache, inspect_images
+    from .scan_index import resolve_scans
+
+    if interpret and not model:
+        raise ValueError("Image interpretation needs a model (e.g. ollama/llava)")
+
+    if not image_paths and not subject:
+        raise ValueError("No images given: pass image_paths or a subject")
+    paths, skipped = resolve_scans(image_paths, subject=subject, scan_dir=scan_dir, dedupe=dedupe)
+    if not paths:
+        return f"No scans found for {subject} in {scan_dir}" if subject else "No images found"
+    infos = inspect_images(paths, pixels=pixels, workers=workers,
+                           cache=default_image_cache() if use_cache else None)
+    answers = {}
+    if interpret:
+        from .inference import get_inference_queue
+        from .model import DEFAULT_TIMEOUT
+
+        # All images go to the model together, in micro-batches
+        readable = [info["path"] for info in infos if "error" not in info]
+        queue = get_inference_queue(model, base_url=model_url, timeout=model_timeout or DEFAULT_TIMEOUT)
+        answers = dict(zip(readable, queue.interpret_many(readable)))
     result = "Image analysis results:\n"
     
-    for path in image_paths:
+    for info in infos:
+        path = info["path"]
+        if "error" in info:
+            result += f"\nFailed to analyze {path}: {info['error']}\n"
+            continue
+        header = info["header"]
+        result += f"\nImage: {path}\n"
+        result += f"- Dimensions: {header['width']}x{header['height']}\n"
+        result += f"- Format: {header['format']}\n"
+        if pixels:
+            stats = info["stats"]
+            result += (f"- Intensity: mean {stats['mean']}, contrast (std) {stats['std']}, "
+                       f"range {stats['min']}-{stats['max']}\n")
+        if interpret:
+            result += f"- Content: {answers[path].strip()}\n"
+        else:
+            result += "- Content: [Ask to interpret the images to get the model's description]\n"
+    if skipped:
+        result += f"\nSkipped {len(skipped)} near-duplicate image(s): {', '.join(skipped)}\n"
+    
+    return result
+
+def analyze_volumes(volume_paths: List[str], stats: bool = True,
+                    threshold: Optional[float] = None) -> str:
+    """
+    Describe 3D scan volumes (NIfTI files and DICOM series).
+    
+    Headers are read without touching the voxels. Statistics are computed
+    slab by slab from memory-mapped voxel data, so memory use stays bounded
+    however large the volume.
+    
+    Args:
+        volume_paths: NIfTI files, DICOM files, or directories holding them
+                     (each directory of DICOM files is one series)
+        stats: Also compute intensity statistics over every voxel
+        threshold: Intensity above which voxels count towards the foreground volume
+        
+    Returns:
+        Description of each volume
+    """
+    from .volumes import DEFAULT_CHUNK_BYTES, find_volumes, open_volume, volume_stats
+
+    call = call_budget("analyze_volumes")
+    chunk_bytes = DEFAULT_CHUNK_BYTES if call.max_bytes is None else max(1, min(DEFAULT_CHUNK_BYTES,
+                                                                                call.max_bytes))
+    paths = find_volumes(volume_paths)
+    if not paths:
+        return f"No NIfTI or DICOM volumes found in {', '.join(volume_paths)}"
+    result = "Volume analysis results:\n"
+    
+    for path in paths:
         try:
-            img = Image.open(path)
-            result += f"\nImage: {path}\n"
-            result += f"- Dimensions: {img.size[0]}x{img.size[1]}\n"
-            result += f"- Format: {img.format}\n"
-            # In a real implementation, the LLaVA model would analyze the image content
-            result += "- Content: [This would be the model's interpretation of the image]\n"
+            with open_volume(path) as volume:
+                header = volume.header
+                result += f"\nVolume: {path}\n"
+                compressed = ", compressed" if header.extra.get("compressed") else ""
+                result += f"- Format: {header.format} ({header.dtype}{compressed})\n"
+                result += f"- Dimensions: {'x'.join(str(d) for d in header.shape)} voxels\n"
+                result += f"- Spacing: {' x '.join(f'{s:.2f}' for s in header.spacing)} mm\n"
+                if header.modality:
+                    result += f"- Modality: {header.modality}\n"
+                if header.description:
+                    result += f"- Description: {header.description}\n"
+                if not stats:
+                    continue
+                values = volume_stats(volume, chunk_bytes=chunk_bytes, threshold=threshold, budget=call)
+                result += (f"- Intensity: min {values['min']:.4g}, max {values['max']:.4g}, "
+                           f"mean {values['mean']:.4g}, std {values['std']:.4g}\n")
+                if threshold is not None:
+                    result += f"- Volume above {threshold:g}: {values['foreground_ml']:.1f} ml\n"
         except Exception as e:
             result += f"\nFailed to analyze {path}: {str(e)}\n"
     
-    return result
+    return result + call.report()
+
+def extract_image_features(image_paths: List[str],
+                           output_path: str = "output/imaging_features.csv",
+                           workers: Optional[int] = None, dedupe: bool = True) -> str:
+    """
+    Extract intensity, texture and shape features from scans into a table keyed by subject id.
+    
+    The table has an "id" column like the other datasets, so it can be
+    merged with them directly (e.g. merge_and_analyze on "id"). Images are
+    processed in batches on a process pool, and re-runs only process images
+    that are new or changed.
+    
+    Args:
+        image_paths: Image files or directories of images; subject ids are
+                    taken from file or directory names (SUBJ001, subj_001, ...)
+        output_path: CSV file to write, one row per subject
+        workers: Worker processes (default: one per CPU)
+        dedupe: Skip near-duplicate exports of a subject's scans, so they do
+               not count twice in the subject's averages
+        
+    Returns:
+        Path to the feature table
+    """
+    from .features import extract_features
+    from .scan_index import resolve_scans
+
+    paths, _ = resolve_scans(image_paths, dedupe=dedupe)
+    summary = extract_features(paths, output_path, workers=workers)
+    if summary["images"] and summary["failed"] == summary["images"]:
+        raise ValueError(f"None of the {summary['images']} images could be read")
+    return summary["output_path"]
@@ -0,0 +1,206 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Union, Optional, Tuple, Any, Callable, Iterator
+
+class Span:
+    """
+    One timed phase of work, used as a context manager.
+
+    Attributes can be added while the span is open with set().
+    """
+
+    __slots__ = ("tracer", "name", "attributes", "start_ns", "duration_ns", "child_ns", "thread_id")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start_ns = 0
+        self.duration_ns = 0
+        self.child_ns = 0
+        self.thread_id = 0
+
+    def set(self, **attributes) -> "Span":
+        """Record attributes (rows, columns, bytes, ...) on the span."""
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self) -> "Span":
+        self.thread_id = threading.get_ident()
+        self.tracer._push(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration_ns = time.perf_counter_ns() - self.start_ns
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+    @property
+    def self_ns(self) -> int:
+        """Time spent in this span outside of nested spans."""
+        return max(0, self.duration_ns - self.child_ns)
+
+class _NoopSpan:
+    """Stand-in returned by span() when tracing is off; does nothing."""
+
+    __slots__ = ()
+
+    def set(self, **attributes) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NOOP_SPAN = _NoopSpan()
+
+class Tracer:
+    """
+    Collects spans from every thread that runs inside its tracing() context.
+
+    Spans opened while another span is open on the same thread are nested;
+    the breakdown reports each phase's self time, so nested phases are not
+    counted twice.
+    """
+
+    def __init__(self):
+        self.spans: List[Span] = []
+        self.started_ns = time.perf_counter_ns()
+        self._lock = threading.Lock()
+        self._stacks = threading.local()
+
+    def _push(self, span: Span):
+        stack = getattr(self._stacks, "spans", None)
+        if stack is None:
+            stack = self._stacks.spans = []
+        stack.append(span)
+
+    def _pop(self, span: Span):
+        stack = getattr(self._stacks, "spans", [])
+        # Spans around generators may close out of order; drop whatever is above
+        if span in stack:
+            del stack[stack.index(span):]
+            if stack:
+                stack[-1].child_ns += span.duration_ns
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """
+        Per-phase totals, slowest first.
+
+        Returns:
+            One dictionary per span name with calls, total_ms, self_ms, max_ms
+            and the summed numeric attributes rows and bytes
+        """
+        phases: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            phase = phases.setdefault(span.name, {"phase": span.name, "calls": 0, "total_ms": 0.0,
+                                                  "self_ms": 0.0, "max_ms": 0.0, "rows": 0, "bytes": 0})
+            duration_ms = span.duration_ns / 1e6
+            phase["calls"] += 1
+            phase["total_ms"] += duration_ms
+            phase["self_ms"] += span.self_ns / 1e6
+            phase["max_ms"] = max(phase["max_ms"], duration_ms)
+            for key in ("rows", "bytes"):
+                value = span.attributes.get(key)
+                if isinstance(value, (int, float)):
+                    phase[key] += value
+        return sorted(phases.values(), key=lambda p: p["self_ms"], reverse=True)
+
+    def format_summary(self) -> str:
+        """Per-phase breakdown as a text table."""
+        wall_ms = (time.perf_counter_ns() - self.started_ns) / 1e6
+        phases = self.summary()
+        # Steps running on parallel threads overlap, so shares can add up to over 100%
+        lines = [f"Profile ({wall_ms:.1f} ms wall clock, {len(self.spans)} spans)",
+                 f"{'phase':<24}{'calls':>7}{'self ms':>11}{'total ms':>11}{'max ms':>10}"
+                 f"{'self %':>8}{'rows':>10}{'bytes':>12}"]
+        for p in phases:
+            share = 100 * p["self_ms"] / wall_ms if wall_ms else 0.0
+            lines.append(f"{p['phase']:<24}{p['calls']:>7}{p['self_ms']:>11.1f}{p['total_ms']:>11.1f}"
+                         f"{p['max_ms']:>10.1f}{share:>7.1f}%{p['rows']:>10}{p['bytes']:>12}")
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> Dict[str, Any]:
+        """Spans in the Chrome trace event format (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        events = [{"name": s.name, "cat": "cohortagent", "ph": "X", "pid": pid, "tid": s.thread_id,
+                   "ts": (s.start_ns - self.started_ns) / 1000, "dur": s.duration_ns / 1000,
+                   "args": s.attributes}
+                  for s in sorted(spans, key=lambda s: s.start_ns)]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str) -> str:
+        """
+        Write the Chrome trace JSON file.
+
+        Args:
+            path: Output file
+
+        Returns:
+            The path written
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f, default=str)
+        return path
+
+_active_tracer: ContextVar[Optional[Tracer]] = ContextVar("cohortagent_tracer", default=None)
+
+@contextmanager
+def tracing(tracer: Optional[Tracer] = None) -> Iterator[Tracer]:
+    """
+    Record spans opened in this context (and in tool threads started from it).
+
+    Tools running on a process pool are not traced.
+
+    Args:
+        tracer: Tracer to record into (a new one if None)
+    """
+    tracer = tracer if tracer is not None else Tracer()
+    token = _active_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _active_tracer.reset(token)
+
+def span(name: str, **attributes) -> Union[Span, _NoopSpan]:
+    """
+    Open a span around a phase of work:
+
+        with span("load_csv", path=file_path) as s:
+            ...
+            s.set(rows=len(df))
+
+    Outside of a tracing() context this returns a shared no-op object, so
+    instrumentation costs one context variable lookup.
+    """
+    tracer = _active_tracer.get()
+    if tracer is None:
+        return _NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+def call_in_span(name: str, function: Callable, *args, **kwargs) -> Any:
+    """Call function inside a span (handy for functools.partial and executors)."""
+    with span(name):
+        return function(*args, **kwargs)
+
+def tracing_enabled() -> bool:
+    """Whether spans are currently being recorded."""
+    return _active_tracer.get() is not None
@@ -1,22 +1,227 @@
-import pandas as pd
-import matplotlib.pyplot as plt
+import functools
 import os
-import numpy as np
-from typing import List, Dict, Union, Optional, Tuple, Any
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Iterator, List, Dict, Union, Optional, Tuple, Any
 
-def load_csv(file_path: str) -> pd.DataFrame:
+from .tracing import span, tracing_enabled
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+class DataCache:
+    """
+    Loaded and merged DataFrames shared between tool calls.
+    
+    Keys include each file's size and modification time, so a long-lived
+    cache never serves data from a file that has since changed. With
+    max_entries set, the least recently used frames are dropped.
+    
+    Frames handed out by the cache are shared, so callers must treat them as
+    read-only (selecting columns or copying is fine, in-place edits are not).
+    """
+    
+    def __init__(self, max_entries: Optional[int] = None):
+        self.frames: "OrderedDict[Tuple, pd.DataFrame]" = OrderedDict()
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._key_locks: Dict[Tuple, threading.Lock] = {}
+    
+    def get_or_load(self, key: Tuple, loader: Callable[[], "pd.DataFrame"]) -> "pd.DataFrame":
+        """
+        Return the frame cached under key, loading it with loader on a miss.
+        
+        Concurrent requests for the same key load it only once.
+        """
+        with self._lock:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                return self.frames[key]
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self.frames:
+                    return self.frames[key]
+            frame = loader()
+            with self._lock:
+                self.frames[key] = frame
+                while self.max_entries is not None and len(self.frames) > self.max_entries:
+                    evicted, _ = self.frames.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+            return frame
+    
+    def clear(self):
+        """Drop every cached frame."""
+        with self._lock:
+            self.frames.clear()
+            self._key_locks.clear()
+
+_active_cache: ContextVar[Optional[DataCache]] = ContextVar("cohortagent_data_cache", default=None)
+
+@contextmanager
+def data_cache(cache: Optional[DataCache] = None) -> Iterator[DataCache]:
+    """
+    Share loaded and merged data between calls to load_csv and load_merged.
+    
+    Nested uses reuse the outermost cache. Outside of this context every call
+    reads the files again.
+    
+    Args:
+        cache: Cache to activate (e.g. one kept alive by a server); a new,
+              empty cache is used if None
+    """
+    active = _active_cache.get()
+    if active is not None:
+        yield active
+        return
+    cache = cache if cache is not None else DataCache()
+    token = _active_cache.set(cache)
+    try:
+        yield cache
+    finally:
+        _active_cache.reset(token)
+
+def _file_key(file_path: str) -> Tuple:
+    """Absolute path, size and mtime of a file, used in data cache keys."""
+    path = os.path.abspath(file_path)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_size, st.st_mtime_ns)
+
+def load_csv(file_path: str) -> "pd.DataFrame":
     """
     Load data from a CSV file.
     
+    Inside a data_cache() context the file is only read once.
+    
     Args:
         file_path: Path to the CSV file
         
     Returns:
         DataFrame containing the data
     """
-    return pd.read_csv(file_path)
+    with span("load_csv", path=file_path) as s:
+        cache = _active_cache.get()
+        if cache is not None:
+            df = cache.get_or_load(("csv", _file_key(file_path)),
+                                   lambda: _read_csv(file_path))
+        else:
+            df = _read_csv(file_path)
+        s.set(rows=len(df), columns=len(df.columns))
+        return df
+
+def _read_csv(file_path: str) -> "pd.DataFrame":
+    """Parse a CSV file (the uncached part of load_csv)."""
+    with span("import"):
+        import pandas as pd
+
+    with span("read_csv", path=file_path) as s:
+        df = pd.read_csv(file_path)
+        if tracing_enabled():
+            s.set(rows=len(df), columns=len(df.columns), bytes=os.path.getsize(file_path))
+        return df
+
+# Files up to this size are read whole when sampled; larger ones by seeking
+SAMPLE_FULL_BYTES = 32 * 1024 * 1024
+
+def read_csv_page(file_path: str, start: int, rows: int) -> "pd.DataFrame":
+    """
+    Read rows [start, start + rows) of a CSV file.
+    
+    Earlier rows are skipped by the parser without being converted, and
+    nothing after the page is read, so memory stays bounded by the page.
+    
+    Args:
+        file_path: Path to the CSV file
+        start: Index of the first data row (0 is the row after the header)
+        rows: Number of rows to read
+        
+    Returns:
+        DataFrame of at most rows rows, with the file's columns
+    """
+    import pandas as pd
+
+    with span("read_csv_page", path=file_path, start=start, rows=rows):
+        return pd.read_csv(file_path, skiprows=range(1, start + 1), nrows=rows)
+
+def sample_csv(file_path: str, rows: int, seed: int = 0) -> Tuple["pd.DataFrame", bool]:
+    """
+    Random sample of at most rows rows of a CSV file.
+    
+    Files up to SAMPLE_FULL_BYTES are read whole and sampled exactly. From
+    larger files, the line after each of rows random byte offsets is read,
+    which costs one seek per row instead of a pass over the file; lines are
+    picked with probability proportional to their length, which is close to
+    uniform for exports with fixed-format rows. Lines that do not parse
+    (e.g. inside quoted multi-line fields) are dropped.
+    
+    Args:
+        file_path: Path to the CSV file
+        rows: Maximum number of rows in the sample
+        seed: Seed of the random offsets
+        
+    Returns:
+        (sample, whether it holds every row of the file)
+    """
+    import io
+    import random
+    import pandas as pd
+
+    with span("sample_csv", path=file_path, rows=rows) as s:
+        size = os.path.getsize(file_path)
+        if size <= SAMPLE_FULL_BYTES:
+            df = pd.read_csv(file_path)
+            if len(df) <= rows:
+                return df, True
+            return df.sample(n=rows, random_state=seed).sort_index(), False
+        rng = random.Random(seed)
+        lines: Dict[int, bytes] = {}
+        with open(file_path, "rb") as f:
+            header = f.readline()
+            body_start = f.tell()
+            for offset in sorted(rng.randrange(body_start, size) for _ in range(rows)):
+                # Skip to the start of the next line, then read it whole
+                f.seek(offset - 1)
+                f.readline()
+                line_start = f.tell()
+                if line_start < size and line_start not in lines:
+                    lines[line_start] = f.readline()
+        text = header + b"".join(line if line.endswith(b"\n") else line + b"\n"
+                                 for _, line in sorted(lines.items()))
+        df = pd.read_csv(io.BytesIO(text), on_bad_lines="skip")
+        s.set(sampled=len(df))
+        return df, False
+
+def load_merged(file_paths: List[str], on: Optional[str] = None) -> "pd.DataFrame":
+    """
+    Load several CSV files and merge them.
+    
+    Inside a data_cache() context the merged result is reused by later calls
+    with the same files and merge column.
+    
+    Args:
+        file_paths: Paths to the CSV files
+        on: Column name to merge on (if None, uses index)
+        
+    Returns:
+        Merged dataframe
+    """
+    with span("load_merged", files=len(file_paths), on=on) as s:
+        cache = _active_cache.get()
+        if cache is not None:
+            key = ("merge", tuple(_file_key(fp) for fp in file_paths), on)
+            df = cache.get_or_load(
+                key, lambda: merge_dataframes([load_csv(fp) for fp in file_paths], on=on))
+        else:
+            df = merge_dataframes([load_csv(fp) for fp in file_paths], on=on)
+        s.set(rows=len(df), columns=len(df.columns))
+        return df
 
-def merge_dataframes(dataframes: List[pd.DataFrame], on: Optional[str] = None) -> pd.DataFrame:
+def merge_dataframes(dataframes: List["pd.DataFrame"], on: Optional[str] = None) -> "pd.DataFrame":
     """
     Merge multiple dataframes.
     
@@ -27,18 +232,34 @@ def merge_dataframes(dataframes: List[pd.DataFrame], on: Optional[str] = None) -
     Returns:
         Merged dataframe
     """
+    import pandas as pd
+
     if not dataframes:
         return pd.DataFrame()
     
-    result = dataframes[0].copy()
-    for df in dataframes[1:]:
-        if on:
-            result = pd.merge(result, df, on=on)
-        else:
-            result = pd.concat([result, df], axis=1)
+    with span("merge_dataframes", inputs=len(dataframes), on=on) as s:
+        result = dataframes[0].copy()
+        for df in dataframes[1:]:
+            if on:
+                result = pd.merge(result, df, on=on)
+            else:
+                result = pd.concat([result, df], axis=1)
+        s.set(rows=len(result), columns=len(result.columns))
     
     return result
 
+# pyplot keeps the "current figure" in global state, so two threads drawing at
+# the same time would draw into each other's figures
+PLOT_LOCK = threading.RLock()
+
+def exclusive_plotting(func: Callable) -> Callable:
+    """Decorator that serializes calls which draw with pyplot across threads."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with PLOT_LOCK:
+            return func(*args, **kwargs)
+    return wrapper
+
 def save_plot(plot_path: str) -> str:
     """
     Save the current matplotlib figure to a file.
@@ -49,7 +270,12 @@ def save_plot(plot_path: str) -> str:
     Returns:
         Path to the saved plot
     """
-    os.makedirs(os.path.dirname(plot_path), exist_ok=True)
-    plt.savefig(plot_path)
-    plt.close()
+    import matplotlib.pyplot as plt
+
+    with span("savefig", path=plot_path) as s:
+        os.makedirs(os.path.dirname(plot_path), exist_ok=True)
+        plt.savefig(plot_path)
+        plt.close()
+        if tracing_enabled():
+            s.set(bytes=os.path.getsize(plot_path))
     return plot_path
@@ -0,0 +1,427 @@
+import gzip
+import os
+import struct
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Dict, Union, Optional, Tuple, Any, Iterable, Iterator
+
+from .tracing import span
+
+if TYPE_CHECKING:
+    import numpy as np
+
+# Working memory per step when computing statistics (bytes)
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+# float64 buffers volume_stats keeps per voxel of a slab: the scaled values
+# and the squared deviations from the slab mean
+STATS_BUFFERS = 2
+
+# NIfTI-1 datatype codes and the numpy dtypes they map to
+NIFTI_DTYPES = {2: "u1", 4: "i2", 8: "i4", 16: "f4", 64: "f8", 256: "i1", 512: "u2",
+                768: "u4", 1024: "i8", 1280: "u8"}
+
+# DICOM transfer syntaxes whose pixel data is stored uncompressed
+UNCOMPRESSED_SYNTAXES = ("1.2.840.10008.1.2", "1.2.840.10008.1.2.1", "1.2.840.10008.1.2.2")
+
+@dataclass
+class VolumeHeader:
+    """What a volume's header says about it; available without reading voxels."""
+    path: str
+    format: str
+    shape: Tuple[int, ...]
+    spacing: Tuple[float, ...]
+    dtype: str
+    modality: Optional[str] = None
+    description: str = ""
+    slope: float = 1.0
+    intercept: float = 0.0
+    extra: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def voxel_volume_ml(self) -> float:
+        """Volume of one voxel in ml (spacing is in mm)."""
+        volume = 1.0
+        for s in self.spacing[:3]:
+            volume *= s
+        return volume / 1000.0
+
+    @property
+    def slices(self) -> int:
+        return self.shape[-1]
+
+class Volume:
+    """
+    A 3D scan whose voxels are read one slice (or slab of slices) at a time.
+
+    Subclasses implement slab(); nothing reads the whole volume at once.
+    Slices are raw stored values; header.slope and header.intercept map
+    them to physical units.
+    """
+
+    def __init__(self, header: VolumeHeader):
+        self.header = header
+
+    def slab(self, start: int, stop: int) -> "np.ndarray":
+        """Slices start to stop-1, stacked along the last axis."""
+        raise NotImplementedError
+
+    def slice(self, index: int) -> "np.ndarray":
+        """One 2D slice."""
+        return self.slab(index, index + 1)[..., 0]
+
+    def iter_slabs(self, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> Iterator["np.ndarray"]:
+        """Consecutive slabs of at most about chunk_bytes each."""
+        import numpy as np
+
+        shape = self.header.shape
+        slice_bytes = max(1, int(np.prod(shape[:-1])) * np.dtype(self.header.dtype).itemsize)
+        step = max(1, chunk_bytes // slice_bytes)
+        for start in range(0, self.header.slices, step):
+            yield self.slab(start, min(start + step, self.header.slices))
+
+    def close(self):
+        pass
+
+    def __enter__(self) -> "Volume":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class NiftiVolume(Volume):
+    """
+    NIfTI-1 volume (.nii, .nii.gz, or .hdr/.img pair).
+
+    Uncompressed voxel data is memory-mapped, so only the slices that are
+    touched are paged in. Gzipped files cannot be mapped and are decompressed
+    as slices are read, which is fast when reading in order.
+    """
+
+    def __init__(self, path: str):
+        header, self._data_path, self._offset, byte_order = _read_nifti_header(path)
+        super().__init__(header)
+        self._dtype = byte_order + header.dtype
+        self._gzip = self._data_path.endswith(".gz")
+        self._file = None
+        self._map = None
+
+    def _slice_shape(self) -> Tuple[int, ...]:
+        return self.header.shape[:-1]
+
+    def slab(self, start: int, stop: int) -> "np.ndarray":
+        import numpy as np
+
+        stop = min(stop, self.header.slices)
+        if not self._gzip:
+            if self._map is None:
+                # NIfTI stores x fastest, so each slice along the last axis is contiguous
+                self._map = np.memmap(self._data_path, dtype=self._dtype, mode="r",
+                                      offset=self._offset, shape=self.header.shape, order="F")
+            return self._map[..., start:stop]
+        slice_items = int(np.prod(self._slice_shape()))
+        itemsize = np.dtype(self._dtype).itemsize
+        if self._file is None or self._file.tell() > self._offset + start * slice_items * itemsize:
+            self.close()
+            self._file = gzip.open(self._data_path, "rb")
+        self._file.seek(self._offset + start * slice_items * itemsize)
+        count = (stop - start) * slice_items
+        data = np.frombuffer(self._file.read(count * itemsize), dtype=self._dtype, count=count)
+        return data.reshape(self._slice_shape() + (stop - start,), order="F")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        # Dropping the memmap unmaps the file once no slice refers to it
+        self._map = None
+
+def _read_nifti_header(path: str) -> Tuple[VolumeHeader, str, int, str]:
+    """
+    Parse a NIfTI-1 header.
+
+    Returns:
+        (header, path of the voxel data, byte offset of the voxels, byte order)
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        raw = f.read(348)
+    if len(raw) < 348:
+        raise ValueError(f"{path} is too short to be a NIfTI file")
+    for byte_order in ("<", ">"):
+        if struct.unpack(byte_order + "i", raw[:4])[0] == 348:
+            break
+    else:
+        raise ValueError(f"{path} is not a NIfTI-1 file (NIfTI-2 is not supported)")
+
+    dims = struct.unpack(byte_order + "8h", raw[40:56])
+    datatype = struct.unpack(byte_order + "h", raw[70:72])[0]
+    pixdim = struct.unpack(byte_order + "8f", raw[76:108])
+    vox_offset, slope, intercept = struct.unpack(byte_order + "3f", raw[108:120])
+    description = raw[148:228].split(b"\0")[0].decode("latin-1").strip()
+    magic = raw[344:348]
+    if datatype not in NIFTI_DTYPES:
+        raise ValueError(f"{path}: unsupported NIfTI datatype {datatype}")
+
+    ndim = max(1, min(dims[0], 7))
+    shape = tuple(max(1, d) for d in dims[1:1 + ndim])
+    # Time points and other extra dimensions are treated as more slices
+    if len(shape) > 3:
+        extra = 1
+        for d in shape[2:]:
+            extra *= d
+        shape = shape[:2] + (extra,)
+    while len(shape) < 3:
+        shape = shape + (1,)
+    if magic.startswith(b"ni1"):
+        # Header and voxels in separate files
+        data_path = path[:-len(".hdr")] + ".img" if path.endswith(".hdr") else path
+        if path.endswith(".hdr.gz"):
+            data_path = path[:-len(".hdr.gz")] + ".img.gz"
+        offset = 0
+    else:
+        data_path, offset = path, int(vox_offset)
+
+    header = VolumeHeader(
+        path=path, format="NIfTI", shape=shape,
+        spacing=tuple(abs(p) or 1.0 for p in pixdim[1:4]), dtype=NIFTI_DTYPES[datatype],
+        description=description,
+        # A slope of 0 means "no scaling" in NIfTI
+        slope=slope if slope else 1.0, intercept=intercept if slope else 0.0,
+        extra={"dims": ndim, "compressed": data_path.endswith(".gz")})
+    return header, data_path, offset, byte_order
+
+class DicomVolume(Volume):
+    """
+    A DICOM series (one file per slice) or a multi-frame DICOM file.
+
+    Only headers are read on open. Uncompressed pixel data is memory-mapped
+    straight from each file; compressed files are decoded one slice at a
+    time. Needs pydicom.
+    """
+
+    def __init__(self, files: List[str]):
+        pydicom = _import_pydicom()
+
+        headers = [(path, pydicom.dcmread(path, stop_before_pixels=True)) for path in files]
+        headers.sort(key=lambda item: _slice_position(item[1]))
+        self._files = [path for path, _ in headers]
+        first = headers[0][1]
+        frames = int(getattr(first, "NumberOfFrames", 1) or 1)
+        self._frames_per_file = frames
+        rows, columns = int(first.Rows), int(first.Columns)
+        bits = int(first.BitsAllocated)
+        signed = int(getattr(first, "PixelRepresentation", 0)) == 1
+        dtype = f"{'i' if signed else 'u'}{max(1, bits // 8)}"
+        row_spacing, column_spacing = (float(s) for s in getattr(first, "PixelSpacing", (1.0, 1.0)))
+        slice_spacing = _slice_spacing([h for _, h in headers])
+        syntax = str(getattr(getattr(first, "file_meta", None), "TransferSyntaxUID", ""))
+        self._mappable = syntax in UNCOMPRESSED_SYNTAXES and int(getattr(first, "SamplesPerPixel", 1)) == 1
+        self._big_endian = syntax == "1.2.840.10008.1.2.2"
+
+        super().__init__(VolumeHeader(
+            path=os.path.dirname(files[0]) if len(files) > 1 else files[0], format="DICOM",
+            shape=(rows, columns, len(files) * frames),
+            spacing=(row_spacing, column_spacing, slice_spacing), dtype=dtype,
+            modality=str(getattr(first, "Modality", "")) or None,
+            description=str(getattr(first, "SeriesDescription", "") or ""),
+            slope=float(getattr(first, "RescaleSlope", 1) or 1),
+            intercept=float(getattr(first, "RescaleIntercept", 0) or 0),
+            extra={"files": len(files), "transfer_syntax": syntax, "mapped": self._mappable}))
+        self._maps: Dict[int, "np.ndarray"] = {}
+
+    def _file_frames(self, index: int) -> "np.ndarray":
+        """All frames of one file as (rows, columns, frames), mapped when possible."""
+        import numpy as np
+
+        if index in self._maps:
+            return self._maps[index]
+        pydicom = _import_pydicom()
+        path = self._files[index]
+        rows, columns = self.header.shape[:2]
+        if self._mappable:
+            dataset = pydicom.dcmread(path, defer_size=256)
+            element = dataset.get_item(0x7FE00010)
+            offset = element.value_tell
+            dtype = np.dtype(self.header.dtype).newbyteorder(">" if self._big_endian else "<")
+            frames = np.memmap(path, dtype=dtype, mode="r", offset=offset,
+                               shape=(self._frames_per_file, rows, columns))
+        else:
+            frames = pydicom.dcmread(path).pixel_array.reshape(self._frames_per_file, rows, columns)
+        frames = np.moveaxis(frames, 0, -1)
+        # Keep the maps of a few recent files (mapping costs nothing until read)
+        if len(self._maps) >= 8:
+            self._maps.pop(next(iter(self._maps)))
+        self._maps[index] = frames
+        return frames
+
+    def slab(self, start: int, stop: int) -> "np.ndarray":
+        import numpy as np
+
+        stop = min(stop, self.header.slices)
+        per_file = self._frames_per_file
+        parts = []
+        position = start
+        while position < stop:
+            index, frame = divmod(position, per_file)
+            take = min(stop - position, per_file - frame)
+            parts.append(self._file_frames(index)[..., frame:frame + take])
+            position += take
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=-1)
+
+    def close(self):
+        self._maps.clear()
+
+def _import_pydicom():
+    try:
+        import pydicom
+    except ImportError as e:
+        raise ImportError("Reading DICOM files needs pydicom (pip install pydicom)") from e
+    return pydicom
+
+def _slice_position(dataset) -> Tuple[float, int]:
+    """Sort key of a slice: position along the scan axis, then instance number."""
+    position = getattr(dataset, "ImagePositionPatient", None)
+    z = float(position[2]) if position is not None and len(position) == 3 else 0.0
+    return (z, int(getattr(dataset, "InstanceNumber", 0) or 0))
+
+def _slice_spacing(datasets: List[Any]) -> float:
+    """Distance between slices from their positions, else the slice thickness."""
+    positions = [_slice_position(d)[0] for d in datasets]
+    if len(positions) > 1 and positions[-1] != positions[0]:
+        return abs(positions[-1] - positions[0]) / (len(positions) - 1)
+    first = datasets[0]
+    return float(getattr(first, "SpacingBetweenSlices", 0) or getattr(first, "SliceThickness", 1) or 1)
+
+def _is_dicom(path: str) -> bool:
+    if path.lower().endswith((".dcm", ".dicom")):
+        return True
+    try:
+        with open(path, "rb") as f:
+            f.seek(128)
+            return f.read(4) == b"DICM"
+    except OSError:
+        return False
+
+def _is_nifti(path: str) -> bool:
+    return path.lower().endswith((".nii", ".nii.gz", ".hdr", ".hdr.gz"))
+
+def open_volume(path: str) -> Volume:
+    """
+    Open a NIfTI file, a DICOM file, or a directory holding one DICOM series.
+
+    Only the header(s) are read here.
+
+    Args:
+        path: File or directory
+
+    Returns:
+        Volume whose slices are read on demand
+
+    Raises:
+        ValueError: If path is not a supported volume
+        ImportError: If it is DICOM and pydicom is not installed
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, f) for f in os.listdir(path)
+                       if os.path.isfile(os.path.join(path, f)) and _is_dicom(os.path.join(path, f)))
+        if not files:
+            raise ValueError(f"No DICOM files in {path}")
+        return DicomVolume(files)
+    if _is_nifti(path):
+        return NiftiVolume(path)
+    if _is_dicom(path):
+        return DicomVolume([path])
+    raise ValueError(f"{path} is not a NIfTI or DICOM volume")
+
+def find_volumes(paths: Iterable[str]) -> List[str]:
+    """
+    Volumes under the given paths: NIfTI files, and one entry per directory
+    that holds DICOM files (a series).
+
+    Args:
+        paths: Volume files and/or directories to search recursively
+
+    Returns:
+        Sorted list of volume paths (files given directly are kept as is)
+    """
+    volumes = []
+    for path in paths:
+        if not os.path.isdir(path):
+            volumes.append(path)
+            continue
+        found = []
+        for root, _, files in os.walk(path):
+            found.extend(os.path.join(root, f) for f in files if _is_nifti(f))
+            if any(_is_dicom(os.path.join(root, f)) for f in files):
+                found.append(root)
+        volumes.extend(sorted(found))
+    return volumes
+
+def volume_stats(volume: Volume, chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+                 threshold: Optional[float] = None,
+                 budget=None) -> Dict[str, Any]:
+    """
+    Summary statistics of a volume, computed one slab at a time.
+
+    Memory use is bounded by chunk_bytes, whatever the size of the volume:
+    each slab is sized so that its stored voxels and the float64 buffers the
+    statistics are computed in fit, and the buffers are reused between slabs.
+
+    Args:
+        volume: Open volume
+        chunk_bytes: Working memory per step
+        threshold: Voxels above this value (in physical units) count as
+                  foreground for the foreground volume
+        budget: CallBudget whose time limit stops the scan early
+
+    Returns:
+        Dictionary with min, max, mean, std, voxels, slices_read and, with a
+        threshold, foreground_ml
+    """
+    import numpy as np
+
+    header = volume.header
+    itemsize = np.dtype(header.dtype).itemsize
+    voxel_bytes = itemsize + 8 * STATS_BUFFERS + (1 if threshold is not None else 0)
+    voxels = max(1, chunk_bytes // voxel_bytes)
+    count, mean, m2 = 0, 0.0, 0.0
+    low, high = np.inf, -np.inf
+    foreground = 0
+    slices_read = 0
+    values = deviations = above = None
+    with span("volume_stats", path=header.path) as s:
+        for slab in volume.iter_slabs(voxels * itemsize):
+            n = slab.size
+            if values is None or values.size < n:
+                values, deviations = np.empty(n), np.empty(n)
+                above = np.empty(n, dtype=bool) if threshold is not None else None
+            slab_values = values[:n].reshape(slab.shape)
+            np.multiply(slab, header.slope, out=slab_values, casting="unsafe")
+            np.add(slab_values, header.intercept, out=slab_values)
+            # Combine per-slab mean and squared deviations (Chan et al.), which
+            # stays accurate where a running sum of squares would not
+            slab_mean = float(slab_values.mean())
+            slab_deviations = deviations[:n].reshape(slab.shape)
+            np.subtract(slab_values, slab_mean, out=slab_deviations)
+            np.square(slab_deviations, out=slab_deviations)
+            slab_m2 = float(slab_deviations.sum())
+            delta = slab_mean - mean
+            mean += delta * n / (count + n)
+            m2 += slab_m2 + delta * delta * count * n / (count + n)
+            count += n
+            low, high = min(low, float(slab_values.min())), max(high, float(slab_values.max()))
+            if threshold is not None:
+                foreground += int(np.count_nonzero(np.greater(slab_values, threshold,
+                                                              out=above[:n].reshape(slab.shape))))
+            slices_read += slab.shape[-1]
+            if budget is not None and slices_read < header.slices and budget.out_of_time():
+                budget.note(f"statistics of {header.path} use the first {slices_read} of "
+                            f"{header.slices} slices")
+                break
+        s.set(bytes=count * itemsize)
+    stats = {"min": low, "max": high, "mean": mean if count else float("nan"),
+             "std": (m2 / count) ** 0.5 if count else float("nan"),
+             "voxels": count, "slices_read": slices_read}
+    if threshold is not None:
+        stats["foreground_ml"] = foreground * header.voxel_volume_ml
+    return stats
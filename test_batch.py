@@ -0,0 +1,65 @@
+import asyncio
+import io
+import json
+import time
+
+from src.agent import CohortAgent
+from src.batch import read_batch_requests, run_batch_async
+
+BATCH = """
+# queries and structured tool calls can be mixed
+summary of lifestyle
+{"id": "corr", "tool": "analyze_data", "params": {"file_path": "data/example/blood_biochemistry.csv", "analysis_type": "correlation", "columns": ["ESR_mm_hr", "Ferritin_ng_mL"]}}
+{"id": "missing", "tool": "analyze_data", "params": {"file_path": "data/example/missing.csv"}}
+{not json
+"""
+
+# Requests are parsed line by line; bad lines become error requests
+def test_read_batch_requests():
+    requests = list(read_batch_requests(io.StringIO(BATCH)))
+    print(requests)
+    assert [r["id"] for r in requests] == [3, "corr", "missing", 6]
+    assert requests[0]["query"] == "summary of lifestyle"
+    assert "error" in requests[3]
+
+# One bad request does not abort the batch, and every request gets a record
+def test_run_batch():
+    agent = CohortAgent()
+    output = io.StringIO()
+    requests = list(read_batch_requests(io.StringIO(BATCH)))
+    summary = asyncio.run(run_batch_async(agent, requests, output, workers=2))
+    agent.close()
+    records = {r["id"]: r for r in map(json.loads, output.getvalue().splitlines())}
+    print(summary)
+    assert summary["requests"] == 4 and summary["failed"] == 2
+    assert records[3]["ok"] and "weight_kg" in records[3]["steps"][0]["result"]
+    assert records["corr"]["ok"]
+    assert not records["missing"]["ok"]
+    assert "FileNotFoundError" in records["missing"]["steps"][0]["error"]
+    assert all("elapsed_ms" in r for r in records.values())
+
+class SlowPlanningAgent(CohortAgent):
+    """Agent whose planner blocks for a second on "ask the model" queries, like a model call."""
+
+    def plan(self, query):
+        if query == "ask the model":
+            time.sleep(1)
+        return super().plan(query)
+
+# A blocking planning call does not hold up the other requests of the batch
+def test_planning_off_event_loop():
+    agent = SlowPlanningAgent()
+    output = io.StringIO()
+    requests = [{"id": "slow", "query": "ask the model"},
+                {"id": "fast", "tool": "analyze_data",
+                 "params": {"file_path": "data/example/lifestyle_data.csv", "columns": ["age"]}}]
+    asyncio.run(run_batch_async(agent, requests, output, workers=2))
+    agent.close()
+    order = [json.loads(line)["id"] for line in output.getvalue().splitlines()]
+    print(order)
+    assert order == ["fast", "slow"]
+
+if __name__ == "__main__":
+    test_read_batch_requests()
+    test_run_batch()
+    test_planning_off_event_loop()
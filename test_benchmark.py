@@ -0,0 +1,114 @@
+import json
+import os
+import shutil
+import tempfile
+
+from src import benchmark
+from src.benchmark import compare, format_report, load_results, main, run_benchmarks, save_results
+
+def _results(timings):
+    return {"version": benchmark.RESULTS_VERSION, "machine": {}, "repeat": 1,
+            "results": {"small": {stage: {"median_ms": ms, "min_ms": ms, "runs": 1}
+                                  for stage, ms in timings.items()}}}
+
+# Stages are timed per scale on a generated cohort that later runs reuse
+def test_run_benchmarks():
+    out = tempfile.mkdtemp()
+    benchmark.SCALES["tiny"] = {"subjects": 200, "features": 10}
+    try:
+        results = run_benchmarks(["tiny"], stages=["load_csv", "analyze_data:", "agent:"],
+                                 repeat=2, cohort_dir=out)
+        stages = results["results"]["tiny"]
+        assert set(stages) == ({"load_csv"} | {f"analyze_data:{t}" for t in benchmark.ANALYSIS_TYPES}
+                               | {f"agent:{q}" for q in benchmark.AGENT_QUERIES})
+        assert all(t["runs"] == 2 and 0 < t["min_ms"] <= t["median_ms"] for t in stages.values())
+        cohorts = os.listdir(out)
+        profiled = run_benchmarks(["tiny"], stages=["merge_dataframes"], repeat=1, cohort_dir=out, memory=True)
+        assert os.listdir(out) == cohorts
+        memory = profiled["results"]["tiny"]["merge_dataframes"]["memory"]
+        assert memory["peak_mb"] > 0 and "merge_dataframes" in memory["phases"] and memory["sites"]
+        try:
+            run_benchmarks(["huge"], cohort_dir=out)
+            assert False, "unknown scale accepted"
+        except ValueError as e:
+            print(e)
+    finally:
+        del benchmark.SCALES["tiny"]
+        shutil.rmtree(out)
+
+# Stages reporting an error fail the run instead of timing the error path
+def test_stage_errors():
+    try:
+        benchmark.time_stage(lambda: "Error in merge_and_analyze: no such column", repeat=1)
+        assert False, "error result timed"
+    except RuntimeError as e:
+        print(f"Stage failed: {e}")
+
+# Only stages both slower by the threshold and by MIN_DELTA_MS are regressions
+def test_compare():
+    baseline = _results({"load_csv": 100.0, "merge_dataframes": 1.0, "visualize_data:bar": 200.0,
+                         "agent:summary of lifestyle": 50.0})
+    current = _results({"load_csv": 130.0, "merge_dataframes": 2.0, "visualize_data:bar": 100.0,
+                        "agent:summary of lifestyle": 55.0, "analyze_data:summary": 10.0})
+    rows = {row["stage"]: row for row in compare(current, baseline, threshold=0.25)}
+    assert rows["load_csv"]["status"] == "regression" and rows["load_csv"]["ratio"] == 1.3
+    assert rows["merge_dataframes"]["status"] == "ok"
+    assert rows["visualize_data:bar"]["status"] == "improved"
+    assert rows["agent:summary of lifestyle"]["status"] == "ok"
+    assert rows["analyze_data:summary"]["status"] == "new"
+    assert compare(current, baseline, threshold=0.5)[0]["status"] == "ok"
+    report = format_report(list(rows.values()))
+    assert report.splitlines()[1].split()[:2] == ["small", "load_csv"]
+    assert "1 regression(s) in 5 stage(s)" in report
+
+    # Peak memory is compared too, where both runs profiled it
+    baseline["results"]["small"]["merge_dataframes"]["memory"] = {"peak_mb": 10.0}
+    current["results"]["small"]["merge_dataframes"]["memory"] = {"peak_mb": 40.0}
+    rows = {row["stage"]: row for row in compare(current, baseline, threshold=0.25)}
+    assert rows["merge_dataframes"]["status"] == "regression" and rows["merge_dataframes"]["regressed"] == ["memory"]
+    assert "REGRESSION (memory)" in format_report(list(rows.values()))
+
+# Baselines merge new timings in; the CLI exits with status 1 on regressions
+def test_baseline_files():
+    out = tempfile.mkdtemp()
+    min_delta = benchmark.MIN_DELTA_MS
+    try:
+        path = os.path.join(out, "baseline.json")
+        save_results(_results({"load_csv": 100.0}), path)
+        save_results(_results({"merge_dataframes": 5.0}), path)
+        assert set(load_results(path)["results"]["small"]) == {"load_csv", "merge_dataframes"}
+
+        old = os.path.join(out, "old.json")
+        with open(old, "w") as f:
+            json.dump({"version": 0, "results": {}}, f)
+        try:
+            load_results(old)
+            assert False, "old results version accepted"
+        except ValueError as e:
+            print(e)
+
+        benchmark.SCALES["tiny"] = {"subjects": 200, "features": 10}
+        fast = os.path.join(out, "fast.json")
+        save_results({**_results({}), "results": {"tiny": {"load_csv": {"median_ms": 0.001, "min_ms": 0.001,
+                                                                         "runs": 1}}}}, fast)
+        args = ["--scales", "tiny", "--stages", "load_csv", "--repeat", "1", "--cohort-dir", out]
+        main(args + ["--output", os.path.join(out, "results.json")])
+        assert "load_csv" in load_results(os.path.join(out, "results.json"))["results"]["tiny"]
+        # Loading a tiny CSV is only a few milliseconds slower than the baseline
+        benchmark.MIN_DELTA_MS = 0
+        try:
+            main(args + ["--baseline", fast, "--threshold", "0"])
+            assert False, "regression not flagged"
+        except SystemExit as e:
+            assert e.code == 1
+    finally:
+        benchmark.MIN_DELTA_MS = min_delta
+        benchmark.SCALES.pop("tiny", None)
+        shutil.rmtree(out)
+
+if __name__ == "__main__":
+    test_run_benchmarks()
+    test_stage_errors()
+    test_compare()
+    test_baseline_files()
+    print("All benchmark tests passed")
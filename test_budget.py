@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.budget import Budget, CallBudget, budget_limits
+from src.tools import analyze_data, merge_and_analyze, visualize_data
+
+def _write_cohort(tmp_dir, name="cohort.csv", rows=20000, columns=20, groups=4):
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(rows, columns)), columns=[f"m{i}" for i in range(columns)])
+    data.insert(0, "id", [f"SUBJ{i:06d}" for i in range(rows)])
+    data["site"] = [f"site{i % groups}" for i in range(rows)]
+    path = os.path.join(tmp_dir, name)
+    data.to_csv(path, index=False)
+    return path
+
+# Inputs over the row budget are sampled, and the result says so
+def test_row_budget():
+    tmp_dir = tempfile.mkdtemp()
+    path = _write_cohort(tmp_dir)
+    with budget_limits(Budget(max_rows=500)):
+        result = analyze_data(path, "summary", columns=["m0", "m1"])
+    print(result)
+    assert "count    500.0" in result or "count  500.0" in result
+    assert "Note: budget exceeded" in result
+    shutil.rmtree(tmp_dir)
+
+# Files too large for the memory budget are sampled while parsing
+def test_memory_budget_samples_while_reading():
+    tmp_dir = tempfile.mkdtemp()
+    path = _write_cohort(tmp_dir)
+    size_mb = os.path.getsize(path) / 1024 / 1024
+    call = CallBudget("analyze_data", Budget(max_memory_mb=size_mb / 4))
+    data = call.load_csv(path)
+    print(f"{len(data)} rows read, notes: {call.notes}")
+    assert 0 < len(data) < 20000 * 0.25
+    assert "while reading" in call.notes[0]
+    shutil.rmtree(tmp_dir)
+
+# Pairwise operations drop low-variance columns instead of rows
+def test_memory_budget_reduces_columns():
+    rng = np.random.default_rng(0)
+    data = pd.DataFrame(rng.normal(size=(200, 300)) * np.arange(1, 301), columns=[f"c{i}" for i in range(300)])
+    call = CallBudget("visualize_data", Budget(max_memory_mb=20))
+    fitted = call.fit(data, "heatmap")
+    print(call.notes)
+    assert len(fitted) == 200
+    assert 2 <= len(fitted.columns) < 300
+    assert "c299" in fitted.columns  # highest variance is kept
+    assert "highest-variance" in call.notes[0]
+
+# Long grouped analyses stop when the time budget runs out instead of hanging
+def test_time_budget_stops_early():
+    tmp_dir = tempfile.mkdtemp()
+    path = _write_cohort(tmp_dir, rows=20000, columns=5, groups=2000)
+    start = time.perf_counter()
+    with budget_limits(Budget(max_seconds=0.2)):
+        result = analyze_data(path, "summary", groupby="site")
+    elapsed = time.perf_counter() - start
+    print(f"Stopped after {elapsed:.2f}s: {result[-120:]}")
+    assert "time budget ran out after" in result
+    assert elapsed < 5
+    shutil.rmtree(tmp_dir)
+
+# Sampled merges keep matching keys across files
+def test_budgeted_merge_is_consistent():
+    tmp_dir = tempfile.mkdtemp()
+    first = _write_cohort(tmp_dir, "a.csv")
+    second = _write_cohort(tmp_dir, "b.csv")
+    with budget_limits(Budget(max_rows=1000)):
+        result = merge_and_analyze([first, second], "summary", merge_on="id", columns=["m0_x", "m0_y"])
+    print(result)
+    assert "sampled about" in result
+    count = float(result.split("count")[1].split()[0])
+    assert 900 <= count <= 1000
+    shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    test_row_budget()
+    test_memory_budget_samples_while_reading()
+    test_memory_budget_reduces_columns()
+    test_time_budget_stops_early()
+    test_budgeted_merge_is_consistent()
@@ -0,0 +1,152 @@
+import importlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from src.budget import Budget, budget_limits, call_budget
+from src.cache import ResultCache
+from src.tools import analyze_volumes
+from test_volumes import write_nifti
+
+CALLS = []
+
+def count_rows(file_path: str, skip: int = 0) -> str:
+    CALLS.append(file_path)
+    with open(file_path) as f:
+        return f"{sum(1 for _ in f) - 1 - skip} rows"
+
+# Seconds slow_rows spends per row; not a parameter, so not part of the cache key
+ROW_DELAY = [0.0]
+
+def slow_rows(file_path: str) -> str:
+    CALLS.append(file_path)
+    call = call_budget("slow_rows")
+    with open(file_path) as f:
+        rows = f.readlines()[1:]
+    for i in range(len(rows)):
+        time.sleep(ROW_DELAY[0])
+        if call.out_of_time():
+            return f"time budget ran out after {i} of {len(rows)} rows"
+    return f"{len(rows)} rows"
+
+def _setup():
+    tmp_dir = tempfile.mkdtemp()
+    data_path = os.path.join(tmp_dir, "data.csv")
+    with open(data_path, "w") as f:
+        f.write("id,value\nSUBJ001,1\nSUBJ002,2\n")
+    CALLS.clear()
+    return tmp_dir, data_path
+
+# Repeated calls are served from disk; default parameters are normalized
+def test_cache_hit():
+    tmp_dir, data_path = _setup()
+    tool = ResultCache(os.path.join(tmp_dir, "cache")).wrap("count_rows", count_rows)
+    assert tool(file_path=data_path) == "2 rows"
+    # A fresh cache object (new CLI session) sees the same entry
+    tool = ResultCache(os.path.join(tmp_dir, "cache")).wrap("count_rows", count_rows)
+    assert tool(file_path=data_path, skip=0) == "2 rows"
+    assert len(CALLS) == 1
+    shutil.rmtree(tmp_dir)
+
+# Changing an input file invalidates its entries
+def test_input_change_invalidates():
+    tmp_dir, data_path = _setup()
+    tool = ResultCache(os.path.join(tmp_dir, "cache")).wrap("count_rows", count_rows)
+    tool(file_path=data_path)
+    with open(data_path, "a") as f:
+        f.write("SUBJ003,3\n")
+    assert tool(file_path=data_path) == "3 rows"
+    assert len(CALLS) == 2
+    shutil.rmtree(tmp_dir)
+
+# Expired entries are recomputed and the size limit evicts old entries
+def test_ttl_and_size_limit():
+    tmp_dir, data_path = _setup()
+    cache = ResultCache(os.path.join(tmp_dir, "cache"), ttl=0.1)
+    tool = cache.wrap("count_rows", count_rows)
+    tool(file_path=data_path)
+    time.sleep(0.2)
+    tool(file_path=data_path)
+    assert len(CALLS) == 2
+
+    cache.max_bytes = 1
+    tool(file_path=data_path, skip=1)
+    assert cache.stats()["entries"] <= 1
+    cache.clear()
+    assert cache.stats()["entries"] == 0
+    shutil.rmtree(tmp_dir)
+
+# Editing any module of a tool's package invalidates its entries, not only the tool's own file
+def test_package_code_change_invalidates():
+    tmp_dir, data_path = _setup()
+    package = os.path.join(tmp_dir, "cached_tools")
+    os.makedirs(package)
+    for name, code in (("__init__.py", ""), ("helper.py", "SKIP = 0\n"),
+                       ("tool.py", "from . import helper\n\ndef count(file_path):\n"
+                                   "    with open(file_path) as f:\n"
+                                   "        return sum(1 for _ in f) - 1 - helper.SKIP\n")):
+        with open(os.path.join(package, name), "w") as f:
+            f.write(code)
+    sys.path.insert(0, tmp_dir)
+    try:
+        count = importlib.import_module("cached_tools.tool").count
+        cache = ResultCache(os.path.join(tmp_dir, "cache"))
+        before = cache.key("count", count, {"file_path": data_path})
+        assert cache.key("count", count, {"file_path": data_path}) == before
+        helper = os.path.join(package, "helper.py")
+        with open(helper, "w") as f:
+            f.write("SKIP = 1\n")
+        os.utime(helper, ns=(time.time_ns(), time.time_ns() + 10**9))
+        assert cache.key("count", count, {"file_path": data_path}) != before
+    finally:
+        sys.path.remove(tmp_dir)
+        for name in ("cached_tools", "cached_tools.tool", "cached_tools.helper"):
+            sys.modules.pop(name, None)
+        shutil.rmtree(tmp_dir)
+
+# Rewriting a volume, alone or in a scanned directory, invalidates analyze_volumes entries
+def test_volume_change_invalidates():
+    tmp_dir, _ = _setup()
+    path = os.path.join(tmp_dir, "scans", "brain.nii")
+    os.makedirs(os.path.dirname(path))
+    write_nifti(path, np.full((4, 4, 2), 10, dtype=np.int16))
+    tool = ResultCache(os.path.join(tmp_dir, "cache")).wrap("analyze_volumes", analyze_volumes)
+    first = tool(volume_paths=[path])
+    first_dir = tool(volume_paths=[os.path.dirname(path)])
+    assert "Dimensions: 4x4x2" in first and "Dimensions: 4x4x2" in first_dir
+    write_nifti(path, np.full((6, 4, 2), 20, dtype=np.int16))
+    second = tool(volume_paths=[path])
+    print(second)
+    assert "Dimensions: 6x4x2" in second
+    assert "Dimensions: 6x4x2" in tool(volume_paths=[os.path.dirname(path)])
+    shutil.rmtree(tmp_dir)
+
+# A result cut short by the time budget is not cached, so a retry can complete
+def test_time_cutoff_not_cached():
+    tmp_dir, data_path = _setup()
+    tool = ResultCache(os.path.join(tmp_dir, "cache")).wrap("slow_rows", slow_rows)
+    try:
+        with budget_limits(Budget(max_seconds=0.05)):
+            ROW_DELAY[0] = 0.1
+            first = tool(file_path=data_path)
+            ROW_DELAY[0] = 0.0
+            second = tool(file_path=data_path)
+            third = tool(file_path=data_path)
+        print(first, "->", second)
+        assert first.startswith("time budget ran out") and second == third == "2 rows"
+        assert len(CALLS) == 2
+    finally:
+        ROW_DELAY[0] = 0.0
+        shutil.rmtree(tmp_dir)
+
+if __name__ == "__main__":
+    test_cache_hit()
+    test_input_change_invalidates()
+    test_ttl_and_size_limit()
+    test_package_code_change_invalidates()
+    test_volume_change_invalidates()
+    test_time_cutoff_not_cached()
@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+from src.agent import CohortAgent
+from src.executor import AsyncToolExecutor, ToolTimeoutError
+from src.planner import ToolCall
+
+def slow_tool(seconds: float, value: str) -> str:
+    time.sleep(seconds)
+    return value
+
+TOOLS = {"slow_tool": {"function": slow_tool}}
+
+# Independent calls run concurrently
+def test_concurrent_calls():
+    executor = AsyncToolExecutor(TOOLS, max_workers=4)
+    calls = [ToolCall("slow_tool", {"seconds": 0.3, "value": str(i)}) for i in range(3)]
+    start = time.perf_counter()
+    results = asyncio.run(executor.gather(calls))
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    print(f"3 x 0.3s calls took {elapsed:.2f}s")
+    assert results == ["0", "1", "2"]
+    assert elapsed < 0.8
+
+# A call that exceeds its timeout is reported without affecting the others
+def test_timeout():
+    executor = AsyncToolExecutor(TOOLS, max_workers=2)
+    calls = [ToolCall("slow_tool", {"seconds": 0.05, "value": "fast"}),
+             ToolCall("slow_tool", {"seconds": 1.0, "value": "slow"})]
+    results = asyncio.run(executor.gather(calls, timeout=0.3))
+    executor.shutdown(wait=False)
+    assert results[0] == "fast"
+    assert isinstance(results[1], ToolTimeoutError)
+
+# Cancelling the awaiting task cancels calls that have not started
+def test_cancellation():
+    executor = AsyncToolExecutor(TOOLS, max_workers=1)
+
+    async def run_and_cancel():
+        task = asyncio.ensure_future(executor.gather(
+            [ToolCall("slow_tool", {"seconds": 0.2, "value": str(i)}) for i in range(5)]))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    start = time.perf_counter()
+    assert asyncio.run(run_and_cancel())
+    executor.shutdown(wait=True)
+    # Only the call that was already running had to finish
+    assert time.perf_counter() - start < 0.6
+
+# run_async runs the steps of a plan and keeps their order
+def test_run_async():
+    agent = CohortAgent()
+    response = asyncio.run(agent.run_async(
+        "summary of lifestyle; summary of blood columns: Hemoglobin_g_dL", timeout=60))
+    agent.close()
+    print(response)
+    assert response.index("weight_kg") < response.index("Hemoglobin_g_dL")
+
+# run_stream yields grouped results piece by piece and plots as artifacts
+def test_run_stream():
+    agent = CohortAgent()
+    query = "summary of lifestyle columns: age, weight_kg, gender. group by: gender. then plot histogram"
+
+    async def collect():
+        return [chunk async for chunk in agent.run_stream(query, timeout=60)]
+
+    chunks = asyncio.run(collect())
+    agent.close()
+    summary = [c for c in chunks if c.step == 0]
+    print(f"{len(summary)} chunks for the grouped summary")
+    assert len(summary) > 3
+    assert "".join(c.text for c in summary) == CohortAgent().run(query.split(" then ")[0])
+    assert chunks[-1].final and chunks[-1].artifact.endswith("plot.png")
+
+if __name__ == "__main__":
+    test_concurrent_calls()
+    test_timeout()
+    test_cancellation()
+    test_run_async()
+    test_run_stream()
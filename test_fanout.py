@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from src.agent import CohortAgent
+from src.cache import ResultCache
+from src.planner import compile_query
+from src.tools import analyze_all
+
+def make_cohort_dir():
+    """Copy the sample datasets and add one file that cannot be parsed."""
+    data_dir = tempfile.mkdtemp()
+    for name in os.listdir("data/sample"):
+        shutil.copy(os.path.join("data/sample", name), data_dir)
+    os.makedirs(os.path.join(data_dir, "broken"))
+    with open(os.path.join(data_dir, "broken", "bad.csv"), "wb") as f:
+        f.write(b"\x00\xff\xfe not,a\ncsv\x00,\"unterminated\n")
+    return data_dir
+
+# Every dataset is analyzed in worker processes; a broken file is reported, not fatal
+def test_fanout_report():
+    data_dir = make_cohort_dir()
+    try:
+        report = analyze_all(data_dir, "summary", workers=2, timeout=60)
+        print(report)
+        assert "4 datasets" in report
+        assert "3 succeeded, 1 failed" in report
+        for name in ("biochemistry.csv", "lifestyle.csv", "proteomics.csv"):
+            assert f"=== {name} (" in report
+        assert "Error:" in report
+        timings = report.split("Per-file timings (slowest first):\n")[1].strip().splitlines()
+        assert len(timings) == 4
+        assert sum("FAILED" in line for line in timings) == 1
+    finally:
+        shutil.rmtree(data_dir)
+
+# Requested columns are restricted to the ones each file has
+def test_fanout_columns():
+    report = analyze_all("data/sample", "summary", columns=["age"], workers=1)
+    assert "Skipped: none of the requested columns" in report
+    assert "0 failed" in report
+
+# "every dataset" queries plan one analyze_all step over data_dir
+def test_fanout_planning():
+    step = compile_query("correlate every dataset", data_dir="data/sample").steps[0]
+    assert step.tool == "analyze_all"
+    assert step.params == {"analysis_type": "correlation", "data_dir": "data/sample"}
+    response = CohortAgent(data_dir="data/sample").run("summarize all files")
+    assert "3 succeeded, 0 failed" in response
+
+# Adding a file to the directory changes the cached result's key
+def test_fanout_cache_key():
+    data_dir = make_cohort_dir()
+    try:
+        cache = ResultCache(cache_dir=os.path.join(data_dir, ".cache"))
+        before = cache.key("analyze_all", analyze_all, {"data_dir": data_dir})
+        shutil.copy("data/sample/lifestyle.csv", os.path.join(data_dir, "extra.csv"))
+        assert cache.key("analyze_all", analyze_all, {"data_dir": data_dir}) != before
+    finally:
+        shutil.rmtree(data_dir)
+
+# A file that overruns the timeout is cut off on time and its worker killed
+def test_fanout_timeout():
+    data_dir = make_cohort_dir()
+    try:
+        # Reading a FIFO that nobody writes to blocks forever
+        os.mkfifo(os.path.join(data_dir, "stuck.csv"))
+        start = time.perf_counter()
+        report = analyze_all(data_dir, "summary", workers=2, timeout=2)
+        elapsed = time.perf_counter() - start
+        print(report)
+        print(f"Returned after {elapsed:.1f}s")
+        assert "=== stuck.csv (not finished) ===\nTimed out after 2s" in report
+        assert "3 succeeded, 2 failed" in report
+        assert elapsed < 10
+        assert not multiprocessing.active_children()
+        # One worker still gets the timeout
+        report = analyze_all(data_dir, "summary", workers=1, timeout=1)
+        assert "Timed out after 1s" in report and "3 succeeded" in report
+    finally:
+        shutil.rmtree(data_dir)
+
+if __name__ == "__main__":
+    test_fanout_report()
+    test_fanout_columns()
+    test_fanout_planning()
+    test_fanout_cache_key()
+    test_fanout_timeout()
+    print("All fan-out tests passed")
@@ -0,0 +1,83 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from src.features import FEATURE_NAMES, batch_features, extract_features
+from src.images import subject_id
+from src.tools import merge_and_analyze
+
+def make_scan_dir():
+    """Two subjects with two scans each (one in a subject folder), one unnamed scan, one broken file."""
+    scan_dir = tempfile.mkdtemp()
+    rng = np.random.default_rng(0)
+    os.makedirs(os.path.join(scan_dir, "SUBJ002"))
+    paths = [os.path.join(scan_dir, "SUBJ001_liver.png"), os.path.join(scan_dir, "subj_001_brain.png"),
+             os.path.join(scan_dir, "SUBJ002", "fibroscan.png"), os.path.join(scan_dir, "SUBJ002", "liver.jpg"),
+             os.path.join(scan_dir, "phantom.png")]
+    for path in paths:
+        Image.fromarray(rng.integers(0, 256, size=(96, 80), dtype=np.uint8)).save(path)
+    with open(os.path.join(scan_dir, "SUBJ003.png"), "wb") as f:
+        f.write(b"broken")
+    return scan_dir, paths
+
+# Subject ids come from file or folder names
+def test_subject_id():
+    assert subject_id("scans/SUBJ042/liver.jpg") == "SUBJ042"
+    assert subject_id("scans/subj_042_t1.png") == "SUBJ042"
+    assert subject_id("scans/sample/example.jpg") == "example"
+
+# Batched features match hand-computed values on known images
+def test_batch_features():
+    images = np.zeros((2, 4, 4), dtype=np.uint8)
+    images[0, :, 2:] = 255          # right half white
+    images[1] = 100                 # flat grey
+    features = batch_features(images)
+    assert set(features) == set(FEATURE_NAMES)
+    assert np.allclose(features["img_hist_0"], [0.5, 0.0]) and np.allclose(features["img_hist_7"], [0.5, 0.0])
+    assert np.allclose(features["img_entropy"], [1.0, 0.0])
+    assert np.allclose(features["img_fg_fraction"], [0.5, 0.0])
+    assert np.allclose(features["img_fg_centroid_x"][0], 0.75) and np.allclose(features["img_fg_extent_y"][0], 1.0)
+    assert features["img_contrast"][0] > 0 and features["img_contrast"][1] == 0
+    assert np.allclose(features["img_homogeneity"][1], 1.0)
+
+# The subject table merges on id; re-runs only process new or changed images
+def test_incremental_subject_table():
+    scan_dir, paths = make_scan_dir()
+    output_path = os.path.join(scan_dir, "out", "imaging_features.csv")
+    try:
+        summary = extract_features([scan_dir], output_path, workers=2, batch_size=2)
+        print(summary)
+        assert (summary["images"], summary["processed"], summary["failed"]) == (6, 6, 1)
+        table = pd.read_csv(output_path)
+        assert list(table.columns[:2]) == ["id", "image_count"]
+        assert list(table["id"]) == ["SUBJ001", "SUBJ002", "phantom"]
+        assert list(table["image_count"]) == [2, 2, 1]
+
+        again = extract_features([scan_dir], output_path, workers=2, batch_size=2)
+        assert again["processed"] == 1  # only the broken file is retried
+        assert pd.read_csv(output_path).equals(table)
+
+        Image.new("L", (40, 40), 255).save(paths[4])
+        os.remove(paths[0])
+        changed = extract_features([scan_dir], output_path, workers=1)
+        assert changed["processed"] == 2
+        table = pd.read_csv(output_path)
+        assert list(table["image_count"]) == [1, 2, 1]
+        assert table.loc[table["id"] == "phantom", "img_mean"].item() == 255
+
+        # Joined with a tabular modality on "id" without any reshaping
+        merged = merge_and_analyze([output_path, "data/example/lifestyle_data.csv"], "summary",
+                                   merge_on="id", columns=["age", "img_mean"])
+        assert "img_mean" in merged and "age" in merged
+    finally:
+        shutil.rmtree(scan_dir)
+
+if __name__ == "__main__":
+    test_subject_id()
+    test_batch_features()
+    test_incremental_subject_table()
+    print("All feature extraction tests passed")
@@ -0,0 +1,235 @@
+import builtins
+import os
+import shutil
+import tempfile
+
+import pandas as pd
+from streamlit.testing.v1 import AppTest
+
+from src import gui, utils
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "run_gui.py")
+
+def make_data_dir():
+    root = tempfile.mkdtemp()
+    for category, rows in (("lifestyle", 50), ("blood", 80)):
+        os.makedirs(os.path.join(root, "data", category))
+        pd.DataFrame({"id": [f"SUBJ{i:03d}" for i in range(rows)],
+                      "age": range(rows), "weight_kg": [60 + i % 30 for i in range(rows)]}
+                     ).to_csv(os.path.join(root, "data", category, f"{category}.csv"), index=False)
+    os.makedirs(os.path.join(root, "output"))
+    return root
+
+class CountingReads:
+    """Counts pd.read_csv calls while active."""
+
+    def __enter__(self):
+        self.count = 0
+        self.original = pd.read_csv
+
+        def read_csv(*args, **kwargs):
+            self.count += 1
+            return self.original(*args, **kwargs)
+        pd.read_csv = read_csv
+        return self
+
+    def __exit__(self, *exc):
+        pd.read_csv = self.original
+
+class CountingOpens:
+    """Counts opens of one file while active."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+    def __enter__(self):
+        self.count = 0
+        self.original = builtins.open
+
+        def open_file(file, *args, **kwargs):
+            if isinstance(file, str) and os.path.abspath(file) == self.path:
+                self.count += 1
+            return self.original(file, *args, **kwargs)
+        builtins.open = open_file
+        return self
+
+    def __exit__(self, *exc):
+        builtins.open = self.original
+
+def start_app(root):
+    os.environ["DATA_DIR"] = os.path.join(root, "data")
+    os.environ["SCAN_DIR"] = os.path.join(root, "scans")
+    os.environ["OUTPUT_DIR"] = os.path.join(root, "output")
+    app = AppTest.from_file(APP, default_timeout=60)
+    app.run()
+    assert not app.exception, app.exception
+    return app
+
+# Sidebar interactions rerun the script without reading any dataset again
+def test_rerun_without_file_io():
+    root = make_data_dir()
+    try:
+        with CountingReads() as reads:
+            app = start_app(root)
+            first = reads.count
+            print(f"First run: {first} CSV reads")
+            # Both datasets for the treemap; a page and a sample of the previewed one
+            assert first == 4
+            app.sidebar.selectbox[1].select("scatter")
+            app.sidebar.checkbox[0].uncheck()
+            app.run()
+            assert not app.exception
+            assert reads.count == first
+    finally:
+        shutil.rmtree(root)
+
+# A changed dataset is picked up on refresh; unchanged ones stay cached
+def test_changed_file_invalidates():
+    root = make_data_dir()
+    try:
+        with CountingReads() as reads:
+            app = start_app(root)
+            before = reads.count
+            path = os.path.join(root, "data", "blood", "blood.csv")
+            pd.read_csv(path).head(10).to_csv(path, index=False)
+            reads.count -= 1
+            app.sidebar.button[1].click()
+            app.run()
+            assert not app.exception
+            # Only the changed file is read again (for the treemap, the page
+            # and the statistics); the other dataset stays cached
+            assert reads.count == before + 3
+            assert any("**Records:** 10," in md.value for md in app.markdown)
+    finally:
+        shutil.rmtree(root)
+
+# Pages and samples are read without loading the whole file
+def test_page_and_sample():
+    root = make_data_dir()
+    path = os.path.join(root, "big.csv")
+    pd.DataFrame({"row": range(20000), "value": [i % 97 for i in range(20000)]}).to_csv(path, index=False)
+    original = utils.SAMPLE_FULL_BYTES
+    utils.SAMPLE_FULL_BYTES = 0
+    try:
+        page = utils.read_csv_page(path, 1000, 25)
+        assert list(page["row"]) == list(range(1000, 1025))
+        sample, exact = utils.sample_csv(path, 500)
+        print(f"Sampled {len(sample)} rows, mean {sample['row'].mean():.0f} (true 9999.5)")
+        assert not exact and 400 <= len(sample) <= 500
+        assert sample["row"].is_unique and abs(sample["row"].mean() - 9999.5) < 1500
+    finally:
+        utils.SAMPLE_FULL_BYTES = original
+        shutil.rmtree(root)
+
+# Statistics from a partial sample are labelled approximate, with an exact job on request
+def test_approximate_statistics():
+    root = make_data_dir()
+    original = gui.SAMPLE_ROWS
+    gui.SAMPLE_ROWS = 20
+    try:
+        app = start_app(root)
+        assert any(c.value.startswith("Approximate: computed from a random sample of 20 of 80")
+                   for c in app.caption)
+        app.number_input(key="preview_page").set_value(2)
+        app.run()
+        assert app.dataframe[0].value["age"].tolist() == list(range(10, 20))
+        app.button(key="exact_stats").click()
+        app.run()
+        for job in list(gui._stats_jobs()["jobs"].values()):
+            job.result()
+        app.run()
+        assert any(c.value == "Exact: computed over all 80 rows." for c in app.caption)
+    finally:
+        gui.SAMPLE_ROWS = original
+        shutil.rmtree(root)
+
+# Results History shows one page of thumbnails and reads files only for downloads
+def test_results_history_pages():
+    from PIL import Image
+
+    root = make_data_dir()
+    for i in range(45):
+        path = os.path.join(root, "output", f"plot_{i:02d}.png")
+        Image.new("RGB", (1600, 1200), (i * 5, 100, 200)).save(path)
+        os.utime(path, ns=(i * 10**9, i * 10**9))
+    opened = []
+    original = Image.open
+
+    def counting_open(fp, *args, **kwargs):
+        if isinstance(fp, str):
+            opened.append(fp)
+        return original(fp, *args, **kwargs)
+    Image.open = counting_open
+    try:
+        app = start_app(root)
+        assert any("showing 1-20 of 45, newest first" in md.value for md in app.markdown)
+        # Only the newest page is decoded, to thumbnails
+        assert sorted(os.path.basename(p) for p in opened) == [f"plot_{i:02d}.png" for i in range(25, 45)]
+        assert len(app.get("download_button")) == 20
+        app.run()
+        assert len(opened) == 20
+        app.number_input(key="history_page").set_value(3)
+        app.run()
+        assert any("showing 41-45 of 45" in md.value for md in app.markdown)
+        assert len(opened) == 25
+        assert len(gui._thumbnail(opened[0], tuple(gui.file_fingerprint(opened[0])))) < 50_000
+        assert gui._file_reader(opened[0])() == open(opened[0], "rb").read()
+    finally:
+        Image.open = original
+        shutil.rmtree(root)
+
+# Queries run as background jobs whose results survive a page reload
+def test_query_job():
+    root = make_data_dir()
+    try:
+        app = start_app(root)
+        app.text_area[0].input("summary of lifestyle")
+        app.button(key="run_query").click()
+        app.run()
+        job_id = app.query_params["job"]  # a single value comes back as a string
+        job_id = job_id if isinstance(job_id, str) else job_id[0]
+        queue = gui._shared_job_queue("ollama/llava")
+        assert queue.wait(job_id, timeout=60).status == "done"
+        app.run()
+        assert any("weight_kg" in t.value for t in app.text)
+
+        # A new session (page reload) finds the job through the URL
+        reloaded = AppTest.from_file(APP, default_timeout=60)
+        reloaded.query_params["job"] = job_id
+        reloaded.run()
+        assert any("weight_kg" in t.value for t in reloaded.text)
+    finally:
+        shutil.rmtree(root)
+
+# A finished job's plot is read once, not on every rerun
+def test_artifact_read_once():
+    root = make_data_dir()
+    try:
+        app = start_app(root)
+        charts = len(app.get("plotly_chart"))
+        app.text_area[0].input("histogram of lifestyle")
+        app.button(key="run_query").click()
+        app.run()
+        job_id = app.query_params["job"]
+        job_id = job_id if isinstance(job_id, str) else job_id[0]
+        job = gui._shared_job_queue("ollama/llava").wait(job_id, timeout=60)
+        assert job.status == "done" and [a[-5:] for a in job.artifacts] == [".json"]
+        with CountingOpens(job.artifacts[0]) as opens:
+            for _ in range(3):
+                app.run()
+                assert not app.exception and len(app.get("plotly_chart")) == charts + 1
+        print(f"{opens.count} reads of {job.artifacts[0]} in 3 reruns")
+        assert opens.count == 1
+        os.remove(job.artifacts[0])
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == "__main__":
+    test_rerun_without_file_io()
+    test_changed_file_invalidates()
+    test_page_and_sample()
+    test_approximate_statistics()
+    test_results_history_pages()
+    test_query_job()
+    test_artifact_read_once()
+    print("All GUI tests passed")
@@ -0,0 +1,103 @@
+import os
+import shutil
+import sys
+import tempfile
+
+from PIL import Image
+
+from src import cli
+from src.images import (ImageCache, configure_image_cache, default_image_cache, expand_image_paths,
+                        inspect_images, pixel_stats, read_header)
+from src.planner import compile_query
+from src.tools import analyze_images
+
+def make_scans(count=6):
+    """A directory of gradient JPEGs and one PNG, plus a file that is not an image."""
+    scan_dir = tempfile.mkdtemp()
+    for i in range(count):
+        img = Image.linear_gradient("L").resize((1024, 768)).point(lambda v, i=i: min(255, v + 10 * i))
+        img.save(os.path.join(scan_dir, f"scan_{i}.jpg"), quality=90)
+    Image.new("RGB", (64, 32), (0, 128, 255)).save(os.path.join(scan_dir, "scan.png"))
+    with open(os.path.join(scan_dir, "notes.txt"), "w") as f:
+        f.write("not an image")
+    with open(os.path.join(scan_dir, "broken.jpg"), "wb") as f:
+        f.write(b"not a jpeg")
+    return scan_dir
+
+# Headers are read without decoding; JPEGs decode at reduced resolution
+def test_header_and_draft_decode():
+    scan_dir = make_scans(1)
+    try:
+        header = read_header(os.path.join(scan_dir, "scan_0.jpg"))
+        assert (header["width"], header["height"], header["format"]) == (1024, 768, "JPEG")
+        stats = pixel_stats(os.path.join(scan_dir, "scan_0.jpg"), size=128)
+        print(f"Stats from a reduced decode: {stats}")
+        assert max(stats["decoded_size"]) <= 128
+        assert 100 < stats["mean"] < 155 and stats["std"] > 50
+        paths = expand_image_paths([scan_dir])
+        assert [os.path.basename(p) for p in paths] == ["broken.jpg", "scan.png", "scan_0.jpg"]
+    finally:
+        shutil.rmtree(scan_dir)
+
+# Results are cached by content: unchanged, copied and edited files
+def test_content_hash_cache():
+    scan_dir = make_scans()
+    try:
+        cache = ImageCache(os.path.join(scan_dir, ".cache"))
+        paths = expand_image_paths([scan_dir])
+        first = inspect_images(paths, pixels=True, workers=4, cache=cache)
+        assert [r["path"] for r in first] == paths
+        assert "error" in first[0] and not any(r.get("cached") for r in first)
+        again = inspect_images(paths, pixels=True, workers=4, cache=ImageCache(cache.cache_dir))
+        assert all(r.get("cached") for r in again[1:])
+        assert [r.get("stats") for r in again] == [r.get("stats") for r in first]
+        # A copy hits by content; an edited file is recomputed
+        shutil.copy(paths[2], os.path.join(scan_dir, "copy.jpg"))
+        Image.new("L", (10, 10), 7).save(paths[2])
+        copy, edited = inspect_images([os.path.join(scan_dir, "copy.jpg"), paths[2]], pixels=True, cache=cache)
+        assert copy["cached"] and not edited["cached"]
+        assert edited["stats"]["mean"] == 7
+        # Seven readable images plus the new version of the edited one
+        assert cache.clear() == 8
+    finally:
+        shutil.rmtree(scan_dir)
+
+# The image cache follows --cache-dir, --no-cache and --clear-cache
+def test_cli_cache_options():
+    scan_dir = make_scans(2)
+    argv = sys.argv
+    try:
+        cache_dir = os.path.join(scan_dir, ".cache")
+        paths = expand_image_paths([scan_dir])
+        sys.argv = ["cohortagent", "--cache-dir", cache_dir]
+        cli.create_cache(cli.parse_args())
+        assert default_image_cache().cache_dir == os.path.join(cache_dir, "images")
+        analyze_images([scan_dir], pixels=True)
+        cached = inspect_images(paths, pixels=True, cache=ImageCache(os.path.join(cache_dir, "images")))
+        assert all(r.get("cached") for r in cached if "error" not in r)
+        sys.argv += ["--clear-cache"]
+        cli.create_cache(cli.parse_args())
+        cached = inspect_images(paths, pixels=True, cache=ImageCache(os.path.join(cache_dir, "images")))
+        assert not any(r.get("cached") for r in cached)
+        # Nothing is read from or written to the cache with --no-cache
+        other_dir = os.path.join(scan_dir, ".other")
+        sys.argv = ["cohortagent", "--cache-dir", other_dir, "--no-cache"]
+        assert cli.create_cache(cli.parse_args()) is None and default_image_cache() is None
+        analyze_images([scan_dir], pixels=True)
+        assert not os.path.exists(other_dir)
+    finally:
+        sys.argv = argv
+        configure_image_cache()
+        shutil.rmtree(scan_dir)
+
+# "intensity" in a query asks for pixel statistics
+def test_pixel_planning():
+    step = compile_query("Show image intensity for file: scans/sample/example.jpg").steps[0]
+    assert step.tool == "analyze_images" and step.params["pixels"]
+
+if __name__ == "__main__":
+    test_header_and_draft_decode()
+    test_content_hash_cache()
+    test_cli_cache_options()
+    test_pixel_planning()
+    print("All image pipeline tests passed")
@@ -0,0 +1,104 @@
+import base64
+import io
+import os
+import shutil
+import tempfile
+
+from PIL import Image
+
+from src.fake_model import FakeModelServer
+from src.images import ImageCache
+from src.inference import InferenceQueue, prepare_image
+from src.model import ModelBackend, OllamaBackend
+
+def make_images(count=16):
+    image_dir = tempfile.mkdtemp()
+    paths = []
+    for i in range(count):
+        path = os.path.join(image_dir, f"SUBJ{i:03d}_scan.jpg")
+        Image.new("RGB", (1200, 900), (i * 10, 80, 160)).save(path)
+        paths.append(path)
+    return image_dir, paths
+
+def size_responder(prompt, images):
+    """Answer with the size of the image the model received."""
+    img = Image.open(io.BytesIO(base64.b64decode(images[0])))
+    return f"{prompt} {img.size[0]}x{img.size[1]}"
+
+# Images are sent once each, at the model's input size
+def test_prepare_and_encode_once():
+    image_dir, paths = make_images(2)
+    try:
+        encoded = Image.open(io.BytesIO(base64.b64decode(prepare_image(paths[0], size=336))))
+        assert encoded.size == (336, 252) and encoded.format == "JPEG"
+        with FakeModelServer(size_responder) as server:
+            queue = InferenceQueue(OllamaBackend("llava", base_url=server.url))
+            answers = [queue.submit(paths[0], prompt).result() for prompt in ("first", "second")]
+            assert answers == ["first 336x252", "second 336x252"]
+            assert queue.stats["encoded"] == 1
+            queue.close()
+    finally:
+        shutil.rmtree(image_dir)
+
+class RecordingBackend(ModelBackend):
+    """Backend that answers images locally and records the size of every batch it is sent."""
+
+    def __init__(self):
+        super().__init__("recording", cache_size=0)
+        self.batch_sizes = []
+
+    def _complete(self, prompt, images=None, **options):
+        return size_responder(prompt, images)
+
+    def _complete_images(self, requests):
+        self.batch_sizes.append(len(requests))
+        return super()._complete_images(requests)
+
+# Full batches go out at once, and closing the queue sends the partial one left
+def test_batching():
+    image_dir, paths = make_images(19)
+    try:
+        backend = RecordingBackend()
+        # A long wait, so only a full batch or close() sends requests
+        queue = InferenceQueue(backend, max_batch=8, max_wait=60)
+        answers = queue.interpret_many(paths[:16])
+        assert len(answers) == 16 and all(a.endswith("336x252") for a in answers)
+        assert backend.batch_sizes == [8, 8] and queue.batches == 2
+        futures = [queue.submit(path) for path in paths[16:]]
+        assert not any(f.done() for f in futures)
+        queue.close()
+        print(f"Batch sizes: {backend.batch_sizes}")
+        assert [f.result(timeout=10).endswith("336x252") for f in futures] == [True] * 3
+        assert backend.batch_sizes == [8, 8, 3] and queue.stats["sent"] == 19
+    finally:
+        shutil.rmtree(image_dir)
+
+# Answers are cached per (image content, prompt), across queues, and duplicates share a request
+def test_answer_cache():
+    image_dir, paths = make_images(3)
+    try:
+        shutil.copy(paths[0], os.path.join(image_dir, "copy.jpg"))
+        cache = ImageCache(os.path.join(image_dir, ".cache"))
+        with FakeModelServer(size_responder, delay=0.02) as server:
+            backend = OllamaBackend("llava", base_url=server.url, cache_size=0)
+            queue = InferenceQueue(backend, cache=cache)
+            queue.interpret_many(paths + [os.path.join(image_dir, "copy.jpg")])
+            assert server.counts["/api/generate"] == 3
+            assert queue.stats["deduplicated"] == 1
+
+            fresh = InferenceQueue(backend, cache=ImageCache(cache.cache_dir))
+            assert fresh.interpret_many(paths[:2]) == queue.interpret_many(paths[:2])
+            assert fresh.stats["cache_hits"] == 2 and server.counts["/api/generate"] == 3
+            fresh.interpret_many(paths[:1], prompt="Is there fluid?")
+            assert server.counts["/api/generate"] == 4
+            queue.close()
+            fresh.close()
+            backend.close()
+    finally:
+        shutil.rmtree(image_dir)
+
+if __name__ == "__main__":
+    test_prepare_and_encode_once()
+    test_batching()
+    test_answer_cache()
+    print("All inference queue tests passed")
@@ -0,0 +1,146 @@
+import os
+import shutil
+import tempfile
+import time
+
+from src.agent import CohortAgent
+from src.jobs import CANCELLED, CANCELLING, DONE, INTERRUPTED, QUEUED, JobQueue, QueueFullError
+from src.planner import QueryPlan, ToolCall
+
+class SlowAgent(CohortAgent):
+    """
+    Agent whose "wait N" queries are N steps that stream a piece every 50 ms,
+    and whose "block N" queries are one step that returns after N seconds.
+    """
+
+    def __init__(self):
+        super().__init__()
+
+        def wait(pieces):
+            for i in range(pieces):
+                time.sleep(0.05)
+                yield f"piece {i}\n"
+        self.tools["wait"] = {"function": lambda pieces: "".join(wait(pieces)), "stream": wait}
+        self.tools["block"] = {"function": lambda seconds: time.sleep(seconds) or "unblocked"}
+
+    def plan(self, query):
+        if query.startswith("block"):
+            return QueryPlan(query, [ToolCall("block", {"seconds": float(query.split()[1])})])
+        if not query.startswith("wait"):
+            return super().plan(query)
+        steps = int(query.split()[1])
+        return QueryPlan(query, [ToolCall("wait", {"pieces": 4}) for _ in range(steps)])
+
+# Queries run in the background; a finished job is saved and can be reloaded
+def test_job_runs_and_persists():
+    job_dir = tempfile.mkdtemp()
+    try:
+        queue = JobQueue(CohortAgent(), job_dir=job_dir)
+        job = queue.submit("summary of lifestyle")
+        assert queue.wait(job.id, timeout=60).status == DONE
+        print(job.text[:200])
+        assert "weight_kg" in job.text and job.progress == 1.0
+        queue.close()
+
+        reloaded = JobQueue(CohortAgent(), job_dir=job_dir).get(job.id)
+        assert reloaded.status == DONE and reloaded.text == job.text
+        assert JobQueue(CohortAgent(), job_dir=job_dir).get("../../etc/passwd") is None
+    finally:
+        shutil.rmtree(job_dir)
+
+# Jobs beyond the worker pool wait in order, and progress grows step by step
+def test_queue_position_and_progress():
+    queue = JobQueue(SlowAgent(), max_workers=1, max_queued=2, job_dir=None)
+    first = queue.submit("wait 3")
+    time.sleep(0.1)
+    second = queue.submit("wait 1")
+    third = queue.submit("wait 1")
+    time.sleep(0.2)
+    assert first.status == "running" and 0 < first.progress < 1
+    assert second.status == QUEUED and queue.position(second.id) == 1 and queue.position(third.id) == 2
+    try:
+        queue.submit("wait 1")
+        assert False, "queue should be full"
+    except QueueFullError as e:
+        print(e)
+    assert queue.wait(third.id, timeout=30).status == DONE
+    assert first.steps_done == 3 and first.text.count("piece") == 12
+    queue.close()
+
+# Cancelling stops a running job early and keeps a waiting one from starting
+def test_cancel():
+    queue = JobQueue(SlowAgent(), max_workers=1, job_dir=None)
+    running = queue.submit("wait 5")
+    waiting = queue.submit("wait 1")
+    time.sleep(0.2)
+    assert queue.cancel(waiting.id) and waiting.status == CANCELLED and waiting.started is None
+    start = time.perf_counter()
+    assert queue.cancel(running.id) and running.status in (CANCELLING, CANCELLED)
+    assert queue.wait(running.id, timeout=30).status == CANCELLED
+    print(f"Cancelled after {running.text.count('piece')} of 20 pieces")
+    assert time.perf_counter() - start < 0.5 and running.text.count("piece") < 20
+    assert not queue.cancel(running.id)
+    queue.close()
+
+# A step that does not stream is abandoned at once, and the next job starts
+def test_cancel_blocking_step():
+    queue = JobQueue(SlowAgent(), max_workers=1, job_dir=None)
+    blocked = queue.submit("block 3")
+    waiting = queue.submit("wait 1")
+    time.sleep(0.2)
+    start = time.perf_counter()
+    assert queue.cancel(blocked.id) and blocked.status in (CANCELLING, CANCELLED)
+    assert queue.wait(blocked.id, timeout=30).status == CANCELLED
+    print(f"Cancelled a blocking step after {time.perf_counter() - start:.3f}s")
+    assert time.perf_counter() - start < 0.5 and "unblocked" not in blocked.text
+    assert queue.wait(waiting.id, timeout=2).status == DONE
+    queue.close()
+
+# Jobs are saved when submitted; after a restart unfinished ones are interrupted
+def test_interrupted_by_restart():
+    job_dir = tempfile.mkdtemp()
+    try:
+        queue = JobQueue(SlowAgent(), max_workers=1, job_dir=job_dir)
+        running = queue.submit("wait 5")
+        waiting = queue.submit("wait 1")
+        time.sleep(0.1)
+        assert os.path.exists(os.path.join(job_dir, f"{waiting.id}.json"))
+        # A new queue on the same directory stands for the restarted server
+        restarted = JobQueue(SlowAgent(), job_dir=job_dir)
+        for job in (restarted.get(running.id), restarted.get(waiting.id)):
+            print(f"{job.query}: {job.status} ({job.error})")
+            assert job.status == INTERRUPTED and job.progress == 1.0 and "stopped" in job.error
+        assert "was running" in restarted.get(running.id).error
+        assert JobQueue(SlowAgent(), job_dir=job_dir).get(waiting.id).status == INTERRUPTED
+        queue.close()
+        for job in (running, waiting):
+            queue.wait(job.id, timeout=30)
+        # Closing never lets a waiting job start
+        assert waiting.status == CANCELLED and waiting.started is None
+        restarted.close()
+    finally:
+        shutil.rmtree(job_dir)
+
+# A job's output format applies to its plots only; a format in the query wins
+def test_output_format_option():
+    queue = JobQueue(CohortAgent(), job_dir=None)
+    try:
+        job = queue.submit("summary of lifestyle, then plot a histogram of lifestyle", output_format="plotly")
+        assert queue.wait(job.id, timeout=60).status == DONE
+        print(job.artifacts)
+        assert "weight_kg" in job.text and [a[-5:] for a in job.artifacts] == [".json"]
+        os.remove(job.artifacts[0])
+        job = queue.submit("histogram of lifestyle format: png", output_format="plotly")
+        assert queue.wait(job.id, timeout=60).status == DONE
+        assert [a[-4:] for a in job.artifacts] == [".png"]
+    finally:
+        queue.close()
+
+if __name__ == "__main__":
+    test_job_runs_and_persists()
+    test_queue_position_and_progress()
+    test_cancel()
+    test_cancel_blocking_step()
+    test_interrupted_by_restart()
+    test_output_format_option()
+    print("All job queue tests passed")
@@ -0,0 +1,166 @@
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from src.budget import Budget, budget_limits, sample_rows
+from src.longitudinal import VisitStore, trajectory_lines
+from src.planner import compile_query
+from src.tools import analyze_data, visualize_data
+
+def _visits(subjects=60, seed=0):
+    """Visits in shuffled order: 2-8 per subject, a slope of 0.5 per year for group B, missing values."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for i in range(subjects):
+        group = "A" if i % 2 else "B"
+        start = pd.Timestamp("2020-01-01") + pd.Timedelta(days=int(rng.integers(0, 365)))
+        days = np.sort(rng.choice(np.arange(0, 1500, 30), size=int(rng.integers(2, 9)), replace=False))
+        for visit, day in enumerate(days):
+            slope = 0.5 if group == "B" else 0.0
+            rows.append({"subject_id": f"S{i:03d}", "visit_date": (start + pd.Timedelta(days=int(day))).date(),
+                         "visit": visit + 1, "group": group,
+                         "bmi": 25 + i % 5 + slope * day / 365.25 + rng.normal(0, 0.01),
+                         "glucose": rng.normal(90, 5) if rng.random() > 0.1 else np.nan})
+    data = pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+    data["visit_date"] = data["visit_date"].astype(str)
+    return data
+
+# Time ranges come from binary search and match a full scan
+def test_time_ranges():
+    data = _visits()
+    store = VisitStore(data)
+    assert store.n_subjects == 60 and len(store) == len(data) and store.time_unit == "day"
+    dates = pd.to_datetime(data["visit_date"])
+    for start, end, subjects in [("2021-01-01", "2022-06-30", None), (None, "2020-06-01", None),
+                                 ("2022-01-01", None, ["S001", "S007", "missing"]), ("2030-01-01", None, None)]:
+        found = store.between(start, end, subjects)
+        mask = pd.Series(True, index=data.index)
+        if start is not None:
+            mask &= dates >= pd.Timestamp(start)
+        if end is not None:
+            mask &= dates <= pd.Timestamp(end)
+        if subjects is not None:
+            mask &= data["subject_id"].isin(subjects)
+        print(start, end, subjects, len(found))
+        assert sorted(zip(found["subject_id"], found["visit_date"])) == \
+            sorted(zip(data["subject_id"][mask], data["visit_date"][mask]))
+    visits = store.visits("S003")
+    assert list(visits["visit"]) == sorted(visits["visit"])
+
+# Deltas, rolling means and slopes match per-subject pandas computations
+def test_vectorized_features():
+    data = _visits()
+    store = VisitStore(data, time="visit")
+    assert not store.datetime and store.time_unit == "visit"
+    frame = store.frame
+    by_subject = frame.groupby("subject_id")["glucose"]
+    assert np.allclose(store.delta("glucose"), by_subject.diff(), equal_nan=True)
+    assert np.allclose(store.change_from_baseline("glucose"),
+                       frame["glucose"] - by_subject.transform(lambda s: s.iloc[0]), equal_nan=True)
+    expected = by_subject.transform(lambda s: s.rolling(3, min_periods=1).mean())
+    assert np.allclose(store.rolling_mean("glucose", visits=3), expected, equal_nan=True)
+    # A two-visit span covers the visit before
+    assert np.allclose(store.rolling_mean("glucose", span=1),
+                       by_subject.transform(lambda s: s.rolling(2, min_periods=1).mean()), equal_nan=True)
+
+    dated = VisitStore(data)
+    slopes = dated.slopes("bmi") * 365.25
+    expected = {subject: np.polyfit((pd.to_datetime(g["visit_date"]) - pd.to_datetime(g["visit_date"]).min()).dt.days,
+                                    g["bmi"], 1)[0] * 365.25
+                for subject, g in data.groupby("subject_id")}
+    assert np.allclose(slopes.loc[list(expected)], list(expected.values()))
+    features = dated.features(["bmi"], span="400D")
+    assert {"since_baseline", "bmi_delta", "bmi_change", "bmi_rolling_mean"} <= set(features.columns)
+    try:
+        VisitStore(data[["group", "bmi"]])
+        assert False, "data without visit columns indexed"
+    except ValueError as e:
+        print(e)
+
+# The longitudinal analysis and trajectory plots run through the tools
+def test_tools():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "visits.csv")
+        _visits().to_csv(path, index=False)
+        result = analyze_data(path, "longitudinal", columns=["bmi", "glucose"], groupby="group")
+        print(result)
+        assert "Longitudinal Analysis" in result and "Subjects: 60" in result
+        slopes = result[result.index("Mean slope per year by group"):]
+        b_slope = float(slopes.split("\nB")[1].split()[0])
+        assert abs(b_slope - 0.5) < 0.01
+        assert "Column error" in analyze_data("data/example/lifestyle_data.csv", "longitudinal")
+
+        output = os.path.join(tmp_dir, "trajectory.png")
+        assert visualize_data(path, "trajectory", columns=["bmi"], groupby="group", output_path=output) == output
+        assert os.path.getsize(output) > 0
+        spec_path = visualize_data(path, "trajectory", columns=["bmi"], groupby="group",
+                                   output_path=output, output_format="plotly")
+        with open(spec_path) as f:
+            spec = json.load(f)
+        assert [t["name"] for t in spec["data"] if "name" in t] == ["A", "B"]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+# Subjects without a group value are left out of the group means
+def test_trajectory_missing_group():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        data = _visits()
+        data.loc[data["subject_id"].isin(["S000", "S001"]), "group"] = np.nan
+        store = VisitStore(data)
+        groups = store.frame["group"].to_numpy()[store.offsets[:-1]]
+        lines = trajectory_lines(store, "bmi", groups)
+        assert list(lines["means"]) == ["A", "B"] and len(lines["subjects"]) == 50
+        path = os.path.join(tmp_dir, "visits.csv")
+        data.to_csv(path, index=False)
+        output = os.path.join(tmp_dir, "trajectory.png")
+        assert visualize_data(path, "trajectory", columns=["bmi"], groupby="group", output_path=output) == output
+        spec_path = visualize_data(path, "trajectory", columns=["bmi"], groupby="group",
+                                   output_path=output, output_format="plotly")
+        with open(spec_path) as f:
+            spec = json.load(f)
+        assert [t["name"] for t in spec["data"] if "name" in t] == ["A", "B"]
+    finally:
+        shutil.rmtree(tmp_dir)
+
+# Row budgets sample whole subjects, so every kept subject keeps all its visits
+def test_budget_keeps_subjects():
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, "visits.csv")
+        data = _visits(subjects=200)
+        data.to_csv(path, index=False)
+        with budget_limits(Budget(max_rows=300)):
+            result = analyze_data(path, "longitudinal", columns=["bmi"])
+        print(result)
+        subjects = int(result.split("Subjects: ")[1].split()[0])
+        visits = int(result.split("visits: ")[1].split()[0].replace(",", ""))
+        assert 0 < subjects < 200 and visits <= 300
+        assert "of the subjects of visits.csv" in result
+        counts = data["subject_id"].value_counts()
+        sampled = sample_rows(data, 300, group="subject_id")["subject_id"].value_counts()
+        assert len(sampled) < 200 and sampled.sum() <= 300
+        assert (sampled == counts[sampled.index]).all()
+    finally:
+        shutil.rmtree(tmp_dir)
+
+# Queries about change over time compile to the new analysis and plot types
+def test_planner_keywords():
+    plan = compile_query("longitudinal analysis of file: data/example/lifestyle_data.csv")
+    assert plan.steps[0].params["analysis_type"] == "longitudinal"
+    plan = compile_query("plot bmi trajectories in file: data/example/lifestyle_data.csv")
+    assert plan.steps[0].params["plot_type"] == "trajectory"
+
+if __name__ == "__main__":
+    test_time_ranges()
+    test_vectorized_features()
+    test_tools()
+    test_trajectory_missing_group()
+    test_budget_keeps_subjects()
+    test_planner_keywords()
+    print("All longitudinal tests passed")
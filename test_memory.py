@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from src.memory import MemoryTracer, memory_profiling
+from src.tools import analyze_data
+from src.tracing import span
+from src.utils import data_cache
+
+MB = 1024 * 1024
+
+# Peaks include memory freed before a span closed; net is what it kept
+def test_peak_and_net():
+    with memory_profiling() as tracer:
+        with span("outer"):
+            with span("load"):
+                kept = np.ones(8 * MB // 8)
+            with span("statistics"):
+                temporary = np.ones(16 * MB // 8)
+                del temporary
+    print(tracer.format_memory_summary())
+    phases = {p["phase"]: p for p in tracer.memory_summary()}
+    assert 8 * MB <= phases["load"]["net_bytes"] < 9 * MB
+    assert phases["statistics"]["peak_bytes"] >= 16 * MB and abs(phases["statistics"]["net_bytes"]) < MB
+    assert phases["outer"]["peak_bytes"] >= 24 * MB and 8 * MB <= phases["outer"]["net_bytes"] < 9 * MB
+    assert phases["load"]["rss_peak_bytes"] > 0
+    phase, site, size = tracer.top_sites(1)[0]
+    assert phase == "load" and size >= 8 * MB
+    assert not tracemalloc.is_tracing()
+    del kept
+
+# Tool phases, column selection included, get memory and allocation sites
+def test_tool_phases():
+    with memory_profiling(MemoryTracer(frames=25)) as tracer, data_cache():
+        analyze_data("data/example/lifestyle_data.csv", "summary", columns=["age", "weight_kg"])
+    phases = {p["phase"]: p for p in tracer.memory_summary()}
+    assert {"load_csv", "read_csv", "select_columns", "statistics"} <= set(phases)
+    assert phases["load_csv"]["peak_bytes"] >= phases["read_csv"]["peak_bytes"] > 0
+    # With deep tracebacks, sites are lines of this package
+    assert tracer.top_sites(1, phase="read_csv")[0][1].startswith(os.path.join("src", "utils.py:"))
+
+# --profile-memory prints the time and memory breakdowns after the answer
+def test_cli_profile_memory():
+    result = subprocess.run([sys.executable, "-m", "src.cli", "--no-cache", "--no-daemon", "--profile-memory",
+                             "--output-dir", tempfile.mkdtemp(), "--query", "summary of lifestyle"],
+                            capture_output=True, text=True, timeout=300)
+    assert result.returncode == 0, result.stderr
+    assert "Summary" in result.stdout or "Analysis" in result.stdout
+    assert "Memory profile" in result.stderr and "Top allocation sites" in result.stderr
+    print(result.stderr[result.stderr.index("Memory profile"):])
+
+if __name__ == "__main__":
+    test_peak_and_net()
+    test_tool_phases()
+    test_cli_profile_memory()
+    print("All memory profiling tests passed")
@@ -0,0 +1,134 @@
+import json
+import threading
+
+from src.agent import CohortAgent
+from src.fake_model import FakeModelServer
+from src.model import ModelError, OllamaBackend, OpenAICompatibleBackend, create_backend, get_backend
+
+# Sequential requests reuse one keep-alive connection
+def test_connection_pooling():
+    with FakeModelServer() as server:
+        backend = OllamaBackend("llava", base_url=server.url)
+        for i in range(5):
+            assert backend.generate(f"question {i}") == f"echo: question {i}"
+        assert server.counts["/api/generate"] == 5
+        assert server.counts["connections"] == 1
+        backend.close()
+
+# Identical prompts are answered from the response cache
+def test_exact_prompt_cache():
+    with FakeModelServer() as server:
+        backend = OllamaBackend("llava", base_url=server.url)
+        assert backend.generate("same") == backend.generate("same")
+        assert backend.generate("same", temperature=0.5) == "echo: same"
+        assert server.counts["/api/generate"] == 2
+        backend.close()
+
+# Tokens arrive one by one and the full answer is cached afterwards
+def test_streaming():
+    with FakeModelServer() as server:
+        for backend in (OllamaBackend("llava", base_url=server.url),
+                        OpenAICompatibleBackend("local", base_url=server.url)):
+            tokens = list(backend.stream("stream these words"))
+            print(f"{type(backend).__name__} tokens: {tokens}")
+            assert len(tokens) == 4
+            assert "".join(tokens) == "echo: stream these words"
+            assert list(backend.stream("stream these words")) == ["echo: stream these words"]
+            # The connection went back to the pool
+            assert backend.generate("after") == "echo: after"
+            backend.close()
+        assert server.counts["connections"] == 2
+
+# Concurrent text prompts are merged into batched requests
+def test_batching():
+    with FakeModelServer(delay=0.05) as server:
+        backend = OpenAICompatibleBackend("local", base_url=server.url, batch_size=8, batch_wait=0.05)
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.update({i: backend.generate(f"q{i}")}))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert results == {i: f"echo: q{i}" for i in range(8)}
+        assert server.counts["/v1/completions"] < 8
+        assert backend.generate_batch(["q1", "new"]) == ["echo: q1", "echo: new"]
+        backend.close()
+
+# Image requests go out together and their answers are cached
+def test_complete_images():
+    with FakeModelServer(lambda prompt, images: f"{prompt}: {images[0]}") as server:
+        backend = OllamaBackend("llava", base_url=server.url)
+        requests = [("describe", "aW1hZ2Ux"), ("describe", "aW1hZ2Uy")]
+        assert backend.complete_images(requests) == ["describe: aW1hZ2Ux", "describe: aW1hZ2Uy"]
+        assert backend.complete_images(requests[1:] + [("count", "aW1hZ2Ux")]) == \
+            ["describe: aW1hZ2Uy", "count: aW1hZ2Ux"]
+        assert server.counts["/api/generate"] == 3
+        backend.close()
+
+# Slow or missing servers raise ModelError instead of hanging
+def test_timeout_and_errors():
+    with FakeModelServer(delay=0.5) as server:
+        backend = OllamaBackend("llava", base_url=server.url, timeout=0.1)
+        try:
+            backend.generate("slow")
+            assert False, "expected a timeout"
+        except ModelError as e:
+            print(f"Timeout reported as: {e}")
+        backend.close()
+    backend = create_backend("ollama/llava", base_url="http://127.0.0.1:9", timeout=1)
+    try:
+        backend.generate("nobody listening")
+        assert False, "expected a connection error"
+    except ModelError:
+        pass
+    try:
+        create_backend("unknown/model")
+        assert False, "expected ValueError"
+    except ValueError:
+        pass
+
+# Unmatched queries are planned by the model; images are interpreted by it
+def test_agent_uses_model():
+    def responder(prompt, images):
+        if images:
+            return "A chest X-ray with no visible abnormality."
+        return 'Plan: {"steps": [{"tool": "analyze_data", "params": ' \
+               '{"file_path": "data/example/lifestyle_data.csv", "columns": ["age"], "bogus": 1}}]}'
+
+    with FakeModelServer(responder) as server:
+        agent = CohortAgent(model_name="ollama/test-agent-model", model_url=server.url)
+        plan = agent.plan("How old are the participants?")
+        assert plan.steps[0].tool == "analyze_data"
+        assert "bogus" not in plan.steps[0].params
+        assert plan.steps[0].params["analysis_type"] == "summary"
+        assert "Analysis Results" in agent.run("How old are the participants?")
+
+        response = agent.run("Interpret the scans file: scans/sample/example.jpg")
+        print(response)
+        assert "no visible abnormality" in response
+        generate_requests = [r for path, r in server.requests if path == "/api/generate"]
+        assert generate_requests[-1]["images"]
+
+# Images are sent to the agent's model server even when nothing else has used the model
+def test_images_use_agent_server():
+    with FakeModelServer(lambda prompt, images: "An abdominal CT scan.") as server:
+        agent = CohortAgent(model_name="ollama/test-image-server", model_url=server.url, model_timeout=7)
+        step = agent.plan("Interpret the scans file: scans/sample/example.jpg").steps[0]
+        assert step.params["model_url"] == server.url and step.params["model_timeout"] == 7
+        response = agent.run("Interpret the scans file: scans/sample/example.jpg")
+        print(response)
+        assert "abdominal CT" in response and server.counts["/api/generate"] == 1
+        assert get_backend("ollama/test-image-server") is not get_backend("ollama/test-image-server",
+                                                                          base_url=server.url, timeout=7)
+
+if __name__ == "__main__":
+    test_connection_pooling()
+    test_exact_prompt_cache()
+    test_streaming()
+    test_batching()
+    test_complete_images()
+    test_timeout_and_errors()
+    test_agent_uses_model()
+    test_images_use_agent_server()
+    print("All model backend tests passed")
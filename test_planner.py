@@ -0,0 +1,58 @@
+from src.agent import CohortAgent
+from src.planner import compile_query
+from src import utils
+
+# "merge ... analysis" must reach merge_and_analyze
+def test_merge_analysis_routing():
+    plan = compile_query("Perform a merged analysis of lifestyle data and blood biochemistry data")
+    print([step.tool for step in plan.steps])
+    assert [step.tool for step in plan.steps] == ["merge_and_analyze"]
+    assert plan.steps[0].params["file_paths"] == [
+        "data/example/lifestyle_data.csv", "data/example/blood_biochemistry.csv"]
+
+# Multi-step queries compile into one tool call per step
+def test_multi_step_plan():
+    plan = compile_query("merge lifestyle and immuno, then correlate, then plot heatmap. title: Immune markers")
+    for step in plan.steps:
+        print(step.tool, step.params)
+    assert [step.tool for step in plan.steps] == ["merge_and_analyze", "merge_and_visualize"]
+    assert plan.steps[0].params["analysis_type"] == "correlation"
+    assert plan.steps[1].params["plot_type"] == "heatmap"
+    assert plan.steps[1].params["title"] == "Immune markers"
+    assert plan.steps[0].params["file_paths"] == plan.steps[1].params["file_paths"]
+
+# Directives are parsed in one pass
+def test_directives():
+    plan = compile_query("Analyze file: data/example/lifestyle_data.csv analysis type: distribution "
+                         "columns: age, weight_kg. group by: gender")
+    assert plan.steps[0].params == {
+        "analysis_type": "distribution",
+        "file_path": "data/example/lifestyle_data.csv",
+        "columns": ["age", "weight_kg"],
+        "groupby": "gender",
+    }
+
+# Steps of a plan share loaded and merged data
+def test_plan_shares_data():
+    reads = []
+    original = utils.merge_dataframes
+
+    def counting_merge(dataframes, on=None):
+        reads.append(on)
+        return original(dataframes, on=on)
+
+    utils.merge_dataframes = counting_merge
+    try:
+        response = CohortAgent().run("merge lifestyle and blood, then summary, then plot heatmap")
+    finally:
+        utils.merge_dataframes = original
+    print(response)
+    assert "Merged Analysis Results" in response
+    assert "Merged visualization created" in response
+    assert reads == ["id"]
+
+if __name__ == "__main__":
+    test_merge_analysis_routing()
+    test_multi_step_plan()
+    test_directives()
+    test_plan_shares_data()
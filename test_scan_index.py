@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from src.cache import ResultCache
+from src.scan_index import ScanIndex, perceptual_hash, resolve_scans
+from src.tools import analyze_images
+
+def make_archive():
+    """Scans of two subjects; SUBJ001's liver scan is also exported twice more."""
+    scan_dir = tempfile.mkdtemp()
+    rng = np.random.default_rng(1)
+    for subject in ("SUBJ001", "SUBJ002"):
+        os.makedirs(os.path.join(scan_dir, subject))
+        for name in ("liver", "brain"):
+            base = rng.integers(0, 256, size=(8, 8), dtype=np.uint8)
+            Image.fromarray(base).resize((256, 256), Image.BILINEAR).save(
+                os.path.join(scan_dir, subject, f"{name}.png"))
+    liver = Image.open(os.path.join(scan_dir, "SUBJ001", "liver.png"))
+    os.makedirs(os.path.join(scan_dir, "exports"))
+    liver.convert("RGB").save(os.path.join(scan_dir, "exports", "SUBJ001_liver_copy.jpg"), quality=80)
+    liver.resize((200, 200)).point(lambda v: min(255, v + 3)).save(
+        os.path.join(scan_dir, "exports", "SUBJ001_liver_small.png"))
+    return scan_dir
+
+# The index records headers, subject ids and hashes, and persists
+def test_index_records_and_lookup():
+    scan_dir = make_archive()
+    index_path = os.path.join(scan_dir, ".index", "index.json")
+    try:
+        index = ScanIndex(scan_dir, index_path=index_path)
+        assert index.refresh() == {"added": 6, "updated": 0, "removed": 0, "unchanged": 0}
+        assert index.subjects() == ["SUBJ001", "SUBJ002"]
+        scans = index.scans_for("subj_001")
+        assert len(scans) == 4 and all(s.path.startswith(scan_dir) for s in scans)
+        brain = [s for s in scans if s.path.endswith("brain.png")][0]
+        assert (brain.width, brain.height, brain.format) == (256, 256, "PNG")
+        # A new instance loads the saved index without reopening any scan
+        reloaded = ScanIndex(scan_dir, index_path=index_path)
+        assert reloaded.refresh() == {"added": 0, "updated": 0, "removed": 0, "unchanged": 6}
+        assert [s.phash for s in reloaded.scans_for("SUBJ001")] == [s.phash for s in scans]
+    finally:
+        shutil.rmtree(scan_dir)
+
+# Only new, changed and removed files are processed on refresh
+def test_incremental_refresh():
+    scan_dir = make_archive()
+    try:
+        index = ScanIndex(scan_dir, index_path=os.path.join(scan_dir, ".index.json"))
+        index.refresh()
+        time.sleep(0.01)
+        os.remove(os.path.join(scan_dir, "SUBJ002", "brain.png"))
+        Image.new("L", (32, 32)).save(os.path.join(scan_dir, "SUBJ002", "spleen.png"))
+        counts = index.refresh()
+        assert counts == {"added": 1, "updated": 0, "removed": 1, "unchanged": 5}
+        # Overwriting in place does not change the directory; a full refresh notices
+        Image.new("L", (48, 48)).save(os.path.join(scan_dir, "SUBJ002", "liver.png"))
+        assert index.refresh(full=True)["updated"] == 1
+        assert {s.width for s in index.scans_for("SUBJ002")} == {32, 48}
+    finally:
+        shutil.rmtree(scan_dir)
+
+# Re-encoded and rescaled exports hash alike; distinct scans do not
+def test_near_duplicates():
+    scan_dir = make_archive()
+    try:
+        index = ScanIndex(scan_dir, index_path=os.path.join(scan_dir, ".index.json"))
+        index.refresh()
+        kept, skipped = index.unique(index.paths())
+        print(f"Skipped near-duplicates: {skipped}")
+        # The first copy by path (SUBJ001/liver.png) is kept
+        assert [os.path.basename(p) for p in skipped] == ["SUBJ001_liver_copy.jpg", "SUBJ001_liver_small.png"]
+        assert len(kept) == 4
+        original = perceptual_hash(os.path.join(scan_dir, "SUBJ001", "liver.png"))[1]
+        other = perceptual_hash(os.path.join(scan_dir, "SUBJ002", "liver.png"))[1]
+        assert original != other
+    finally:
+        shutil.rmtree(scan_dir)
+
+# analyze_images resolves a subject's scans through the index
+def test_subject_lookup_in_tool():
+    scan_dir = make_archive()
+    try:
+        paths, skipped = resolve_scans(subject="SUBJ001", scan_dir=scan_dir)
+        assert len(paths) == 2 and len(skipped) == 2
+        report = analyze_images(subject="SUBJ002", scan_dir=scan_dir)
+        assert report.count("Image: ") == 2 and "Skipped" not in report
+        assert "No scans found" in analyze_images(subject="SUBJ999", scan_dir=scan_dir)
+        assert analyze_images([scan_dir], dedupe=False).count("Image: ") == 6
+    finally:
+        shutil.rmtree(scan_dir)
+
+# New scans under scan_dir invalidate cached subject lookups
+def test_cached_subject_lookup():
+    scan_dir = make_archive()
+    cache_dir = tempfile.mkdtemp()
+    try:
+        tool = ResultCache(cache_dir).wrap("analyze_images", analyze_images)
+        assert tool(subject="SUBJ002", scan_dir=scan_dir).count("Image: ") == 2
+        Image.new("L", (32, 32)).save(os.path.join(scan_dir, "SUBJ002", "spleen.png"))
+        report = tool(subject="SUBJ002", scan_dir=scan_dir)
+        print(report)
+        assert report.count("Image: ") == 3 and "spleen.png" in report
+    finally:
+        shutil.rmtree(scan_dir)
+        shutil.rmtree(cache_dir)
+
+if __name__ == "__main__":
+    test_index_records_and_lookup()
+    test_incremental_refresh()
+    test_near_duplicates()
+    test_subject_lookup_in_tool()
+    test_cached_subject_lookup()
+    print("All scan index tests passed")
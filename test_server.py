@@ -0,0 +1,84 @@
+import os
+import sys
+import tempfile
+import threading
+
+from src import cli
+from src.agent import CohortAgent
+from src.client import DaemonClient
+from src.server import AgentServer
+
+def _start_server():
+    server = AgentServer(CohortAgent(), port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, DaemonClient(host, port, server.token)
+
+# Queries and tool calls are answered by the warm agent
+def test_daemon_queries():
+    server, client = _start_server()
+    try:
+        assert client.health()["status"] == "ok"
+        response = client.query("summary of blood columns: ESR_mm_hr")
+        print(response)
+        assert response.startswith("Analysis Results")
+        result = client.call_tool("analyze_data", {
+            "file_path": "data/example/blood_biochemistry.csv",
+            "analysis_type": "summary", "columns": ["ESR_mm_hr"]})
+        assert result["ok"] and "ESR_mm_hr" in result["result"]
+        # The dataset was parsed once and reused by the second request
+        assert len(server.data_cache.frames) == 1
+        assert not client.call_tool("no_such_tool", {})["ok"]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# Requests without the daemon's token are rejected
+def test_daemon_requires_token():
+    server, client = _start_server()
+    try:
+        client.token = "wrong"
+        try:
+            client.health()
+            assert False, "request without a valid token was accepted"
+        except ConnectionError as e:
+            print(f"Rejected: {e}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# Queries the daemon would run differently from a local run are run locally
+def test_daemon_only_when_transparent():
+    server, client = _start_server()
+    argv = sys.argv
+    try:
+        info = client.health()
+        assert info["cwd"] == os.path.realpath(os.getcwd()) and info["model"] is None
+        info = dict(info, model="ollama/llava")
+        sys.argv = ["cohortagent", "--query", "summary of lifestyle"]
+        assert cli.daemon_conflicts(cli.parse_args(), info) == []
+        sys.argv += ["--no-cache", "--max-rows", "100", "--model", "ollama/other"]
+        conflicts = cli.daemon_conflicts(cli.parse_args(), info)
+        print(conflicts)
+        assert conflicts[:2] == ["--no-cache", "--max-rows"] and conflicts[2].startswith("--model")
+
+        # Relative paths would resolve against the daemon's directory
+        cwd = os.getcwd()
+        os.chdir(tempfile.gettempdir())
+        try:
+            assert "working directory" in cli.daemon_conflicts(cli.parse_args(), info)[-1]
+            client.query("summary of lifestyle")
+            assert False, "query from another directory was answered"
+        except ConnectionError as e:
+            print(f"Refused: {e}")
+        finally:
+            os.chdir(cwd)
+    finally:
+        sys.argv = argv
+        server.shutdown()
+        server.server_close()
+
+if __name__ == "__main__":
+    test_daemon_queries()
+    test_daemon_requires_token()
+    test_daemon_only_when_transparent()
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+import time
+
+from src.cli import STARTUP_BUDGET_SECONDS
+
+HEAVY_MODULES = ["pandas", "numpy", "matplotlib", "seaborn", "scipy", "PIL"]
+
+# Importing the CLI and the agent must not pull in the scientific stack
+def test_import_is_lightweight():
+    code = (
+        "import sys, src.cli, src.agent, src.tools, src.utils; "
+        f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    print(f"Heavy modules imported at startup: {output.strip()}")
+    assert output.strip() == "[]"
+
+# `cohortagent --help` must stay within the startup budget
+def test_help_startup_budget():
+    # Best of a few runs to smooth out noise from a cold filesystem cache
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "src.cli", "--help"],
+                       check=True, stdout=subprocess.DEVNULL)
+        timings.append(time.perf_counter() - start)
+    print(f"--help startup: {min(timings):.3f}s (budget {STARTUP_BUDGET_SECONDS}s)")
+    assert min(timings) < STARTUP_BUDGET_SECONDS
+
+# A summary query should not pay for plotting or scipy imports
+def test_summary_query_imports():
+    code = (
+        "import sys; from src.agent import CohortAgent; "
+        "CohortAgent().run('Show summary statistics'); "
+        "print([m for m in ['matplotlib', 'seaborn', 'scipy', 'PIL'] if m in sys.modules])"
+    )
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip().splitlines()[-1] == "[]"
+
+if __name__ == "__main__":
+    test_import_is_lightweight()
+    test_help_startup_budget()
+    test_summary_query_imports()
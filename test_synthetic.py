@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import tracemalloc
+
+import pandas as pd
+
+from src.synthetic import generate_cohort, main
+from src.tools import merge_and_analyze
+
+# The same seed gives the same files for any chunk size or number of workers
+def test_deterministic():
+    out = tempfile.mkdtemp()
+    try:
+        first = generate_cohort(os.path.join(out, "a"), n_subjects=700, features=30, n_sites=3,
+                                missing_rate=0.1, workers=1)
+        generate_cohort(os.path.join(out, "b"), n_subjects=700, features=30, n_sites=3,
+                        missing_rate=0.1, workers=2, chunk_size=256)
+        for modality, path in first["files"].items():
+            with open(path, "rb") as a, open(os.path.join(out, "b", os.path.basename(path)), "rb") as b:
+                assert a.read() == b.read(), modality
+        generate_cohort(os.path.join(out, "c"), n_subjects=700, features=30, seed=7,
+                        modalities=["proteomics"], workers=1)
+        assert (pd.read_csv(os.path.join(out, "c", "proteomics.csv"))["PROT_00001"]
+                != pd.read_csv(first["files"]["proteomics"])["PROT_00001"]).any()
+    finally:
+        shutil.rmtree(out)
+
+# Modalities share ids and sites; missingness, BMI and compositions are as asked
+def test_cohort_contents():
+    out = tempfile.mkdtemp()
+    try:
+        summary = generate_cohort(out, n_subjects=1200, features={"proteomics": 40, "microbiome": 25},
+                                  n_sites=4, missing_rate=0.2, workers=1)
+        lifestyle = pd.read_csv(summary["files"]["lifestyle"])
+        proteomics = pd.read_csv(summary["files"]["proteomics"])
+        microbiome = pd.read_csv(summary["files"]["microbiome"])
+        assert list(lifestyle["id"][:2]) == ["SUBJ0001", "SUBJ0002"] and len(lifestyle) == 1200
+        assert (lifestyle[["id", "site"]] == proteomics[["id", "site"]]).all().all()
+        assert sorted(lifestyle["site"].unique()) == ["SITE01", "SITE02", "SITE03", "SITE04"]
+        assert proteomics.shape == (1200, 42) and microbiome.shape == (1200, 27)
+        missing = proteomics.iloc[:, 2:].isna().mean().mean()
+        print(f"Missing: {missing:.3f}")
+        assert 0.18 < missing < 0.22
+        assert pd.api.types.is_float_dtype(lifestyle["bmi"])
+        complete = microbiome.dropna().iloc[:, 2:].sum(axis=1)
+        assert ((complete - 1).abs() < 1e-3).all()
+        # Generated files work with the tools like the example data
+        result = merge_and_analyze(file_paths=[summary["files"]["lifestyle"], summary["files"]["proteomics"]],
+                                   analysis_type="summary", columns=["bmi", "PROT_00001"])
+        assert "PROT_00001" in result
+    finally:
+        shutil.rmtree(out)
+
+# Parquet holds the same data as CSV
+def test_parquet():
+    out = tempfile.mkdtemp()
+    try:
+        csv_files = generate_cohort(os.path.join(out, "csv"), n_subjects=600, features=20,
+                                    modalities=["lifestyle", "metabolomics"], workers=1, chunk_size=256)
+        pq_files = generate_cohort(os.path.join(out, "pq"), n_subjects=600, features=20, output_format="parquet",
+                                   modalities=["lifestyle", "metabolomics"], workers=1, chunk_size=256)
+        for modality in ("lifestyle", "metabolomics"):
+            from_csv = pd.read_csv(csv_files["files"][modality])
+            from_parquet = pd.read_parquet(pq_files["files"][modality])
+            pd.testing.assert_frame_equal(from_csv, from_parquet, check_dtype=False, rtol=1e-5)
+    finally:
+        shutil.rmtree(out)
+
+# Memory stays bounded by the chunk size, not the cohort size
+def test_bounded_memory():
+    out = tempfile.mkdtemp()
+    try:
+        peaks = []
+        for n_subjects in (2048, 10240):
+            tracemalloc.start()
+            summary = generate_cohort(out, n_subjects=n_subjects, features=200, modalities=["proteomics"],
+                                      workers=1, chunk_size=1024)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            print(f"{n_subjects} subjects: wrote {summary['bytes'] / 1e6:.1f} MB "
+                  f"with a peak of {peaks[-1] / 1e6:.1f} MB in {summary['seconds']}s")
+        assert peaks[1] < 1.5 * peaks[0] and peaks[1] < summary["bytes"] / 2
+    finally:
+        shutil.rmtree(out)
+
+# The command line takes per-modality feature counts
+def test_cli():
+    out = tempfile.mkdtemp()
+    try:
+        main([out, "-n", "300", "-f", "proteomics=5", "lipidomics=7", "--modalities", "proteomics", "lipidomics",
+              "--sites", "2", "--workers", "1"])
+        assert sorted(os.listdir(out)) == ["lipidomics.csv", "proteomics.csv"]
+        assert pd.read_csv(os.path.join(out, "lipidomics.csv")).shape == (300, 9)
+    finally:
+        shutil.rmtree(out)
+
+if __name__ == "__main__":
+    test_deterministic()
+    test_cohort_contents()
+    test_parquet()
+    test_bounded_memory()
+    test_cli()
+    print("All synthetic cohort tests passed")
@@ -77,6 +77,95 @@ def test_heatmap_visualization():
     )
     print(f"Heatmap visualization saved to: {result}")
 
+# Test plotly figure spec output
+def test_plotly_spec_visualization():
+    print("Testing plotly spec output...")
+    import json
+    result = merge_and_visualize(
+        file_paths=["data/example/lifestyle_data.csv", "data/example/blood_biochemistry.csv"],
+        plot_type="histogram",
+        columns=["age", "weight_kg", "Hemoglobin_g_dL"],
+        merge_on="id",
+        output_path="output/test_spec.png",
+        output_format="plotly"
+    )
+    print(f"Plotly spec saved to: {result}")
+    assert result == "output/test_spec.json"
+    with open(result) as f:
+        spec = json.load(f)
+    # Histograms are pre-binned on the server
+    assert [trace["name"] for trace in spec["data"]] == ["age", "weight_kg", "Hemoglobin_g_dL"]
+    assert sum(spec["data"][0]["y"]) == 100
+    os.remove(result)
+    print("\n" + "-"*50 + "\n")
+
+# Violins are real violin traces; columns without values get no trace instead of NaN stats
+def test_plotly_violin_and_empty_columns():
+    import json
+    import shutil
+    import tempfile
+    import numpy as np
+    import pandas as pd
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "sparse.csv")
+    pd.DataFrame({"empty": [np.nan] * 6, "value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                  "group": list("aabbcc")}).to_csv(path, index=False)
+    for plot_type in ("box", "violin"):
+        result = visualize_data(path, plot_type, columns=["empty", "value"],
+                                output_path=os.path.join(tmp_dir, "plot.png"), output_format="plotly")
+        with open(result) as f:
+            spec = json.load(f)
+        print(plot_type, [trace["type"] for trace in spec["data"]])
+        assert [(trace["type"], trace["name"]) for trace in spec["data"]] == [(plot_type, "value")]
+    result = visualize_data(path, "violin", columns=["value"], groupby="group",
+                            output_path=os.path.join(tmp_dir, "plot.png"), output_format="plotly")
+    with open(result) as f:
+        assert [trace["name"] for trace in json.load(f)["data"]] == ["a", "b", "c"]
+    shutil.rmtree(tmp_dir)
+
+# Plot types without a plotly builder are rendered as PNG when plotly output is asked for
+def test_plotly_falls_back_to_png():
+    import shutil
+    import tempfile
+    tmp_dir = tempfile.mkdtemp()
+    output = os.path.join(tmp_dir, "pair.png")
+    result = visualize_data("data/example/lifestyle_data.csv", "pair", columns=["age", "weight_kg"],
+                            output_path=output, output_format="plotly")
+    print(f"Pair plot with plotly output: {result}")
+    assert result == output and os.path.getsize(output) > 0
+    assert not os.path.exists(os.path.join(tmp_dir, "pair.json"))
+    merged = merge_and_visualize(["data/example/lifestyle_data.csv"], "pair", columns=["age", "weight_kg"],
+                                 output_path=output, output_format="plotly")
+    assert merged == output
+    shutil.rmtree(tmp_dir)
+
+# Plotly specs never touch pyplot, so they don't wait for the plot lock
+def test_plotly_spec_skips_plot_lock():
+    import threading
+    from src.utils import PLOT_LOCK
+    held, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with PLOT_LOCK:
+            held.set()
+            release.wait(60)
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    held.wait()
+    try:
+        result = visualize_data("data/example/lifestyle_data.csv", "box", columns=["age"],
+                                output_path="output/test_lock.png", output_format="plotly")
+        assert result == "output/test_lock.json"
+        result = merge_and_visualize(["data/example/lifestyle_data.csv", "missing.csv"], "box",
+                                     output_path="output/test_lock.png", output_format="plotly")
+        with open(result) as f:
+            assert "Error creating box plot" in f.read()
+        os.remove(result)
+    finally:
+        release.set()
+        holder.join()
+
 if __name__ == "__main__":
     # Create output directory if it doesn't exist
     os.makedirs("output", exist_ok=True)
@@ -87,4 +176,8 @@ if __name__ == "__main__":
     test_visualization()
     test_merge_analysis()
     test_complex_visualization()
-    test_heatmap_visualization()
\ No newline at end of file
+    test_heatmap_visualization()
+    test_plotly_spec_visualization()
+    test_plotly_violin_and_empty_columns()
+    test_plotly_falls_back_to_png()
+    test_plotly_spec_skips_plot_lock()
\ No newline at end of file
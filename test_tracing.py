@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import time
+
+from src.tools import analyze_data
+from src.tracing import span, tracing
+from src.utils import data_cache
+
+# Tool phases are recorded with their attributes; nested time is not double counted
+def test_spans_recorded():
+    with tracing() as tracer, data_cache():
+        analyze_data("data/example/lifestyle_data.csv", "summary", columns=["age", "weight_kg"])
+    print(tracer.format_summary())
+    phases = {p["phase"]: p for p in tracer.summary()}
+    assert {"load_csv", "read_csv", "statistics"} <= set(phases)
+    assert phases["read_csv"]["rows"] == 100
+    assert phases["read_csv"]["bytes"] == os.path.getsize("data/example/lifestyle_data.csv")
+    load = phases["load_csv"]
+    assert load["self_ms"] <= load["total_ms"] - phases["read_csv"]["total_ms"] + 0.01
+
+# The Chrome trace export holds one complete event per span
+def test_chrome_trace_export():
+    with tracing() as tracer:
+        with span("outer", rows=3) as s:
+            with span("inner"):
+                time.sleep(0.01)
+            s.set(bytes=10)
+    path = os.path.join(tempfile.mkdtemp(), "trace.json")
+    tracer.export_chrome_trace(path)
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert [e["name"] for e in events] == ["outer", "inner"]
+    assert events[0]["ph"] == "X" and events[0]["args"] == {"rows": 3, "bytes": 10}
+    assert events[0]["dur"] >= events[1]["dur"] >= 10000
+
+# Without a tracer, spans record nothing and cost next to nothing
+def test_disabled_overhead():
+    n = 100000
+    start = time.perf_counter()
+    for _ in range(n):
+        with span("noop", rows=1) as s:
+            s.set(bytes=1)
+    per_span_us = (time.perf_counter() - start) / n * 1e6
+    print(f"Disabled span overhead: {per_span_us:.3f} us")
+    assert per_span_us < 5
+
+if __name__ == "__main__":
+    test_spans_recorded()
+    test_chrome_trace_export()
+    test_disabled_overhead()
@@ -0,0 +1,167 @@
+import gzip
+import os
+import shutil
+import struct
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from src.planner import compile_query
+from src.tools import analyze_volumes
+from src.volumes import NiftiVolume, find_volumes, open_volume, volume_stats
+
+def write_nifti(path, data, spacing=(1.0, 1.0, 2.0), slope=0.0, intercept=0.0, description=b"T1 brain"):
+    """Write a minimal single-file NIfTI-1 volume (int16 or float32)."""
+    datatype = {np.dtype("int16"): 4, np.dtype("float32"): 16}[data.dtype]
+    header = bytearray(352)
+    struct.pack_into("<i", header, 0, 348)
+    struct.pack_into("<8h", header, 40, data.ndim, *data.shape, *([1] * (7 - data.ndim)))
+    struct.pack_into("<hh", header, 70, datatype, data.dtype.itemsize * 8)
+    struct.pack_into("<8f", header, 76, 1.0, *spacing, *([1.0] * (7 - len(spacing))))
+    struct.pack_into("<3f", header, 108, 352.0, slope, intercept)
+    header[148:148 + len(description)] = description
+    header[344:348] = b"n+1\0"
+    payload = bytes(header) + data.tobytes(order="F")
+    with (gzip.open if path.endswith(".gz") else open)(path, "wb") as f:
+        f.write(payload)
+
+def make_volumes():
+    volume_dir = tempfile.mkdtemp()
+    data = (np.arange(40 * 30 * 20, dtype=np.int16).reshape((40, 30, 20), order="F") % 1000)
+    write_nifti(os.path.join(volume_dir, "brain.nii"), data)
+    os.makedirs(os.path.join(volume_dir, "liver"))
+    write_nifti(os.path.join(volume_dir, "liver", "fat.nii.gz"), data, slope=0.5, intercept=-10.0)
+    with open(os.path.join(volume_dir, "notes.txt"), "w") as f:
+        f.write("not a volume")
+    return volume_dir, data
+
+# Headers come without reading voxels; slices are memory-mapped views
+def test_nifti_header_and_slices():
+    volume_dir, data = make_volumes()
+    try:
+        with open_volume(os.path.join(volume_dir, "brain.nii")) as volume:
+            assert isinstance(volume, NiftiVolume)
+            header = volume.header
+            assert header.shape == (40, 30, 20) and header.spacing == (1.0, 1.0, 2.0)
+            assert header.dtype == "i2" and header.description == "T1 brain"
+            assert header.voxel_volume_ml == 0.002
+            assert isinstance(volume.slice(7), np.memmap)
+            assert np.array_equal(volume.slice(7), data[:, :, 7])
+        with open_volume(os.path.join(volume_dir, "liver", "fat.nii.gz")) as volume:
+            assert volume.header.extra["compressed"] and volume.header.slope == 0.5
+            assert np.array_equal(volume.slice(12), data[:, :, 12])
+            # Going back reopens the compressed stream
+            assert np.array_equal(volume.slab(3, 5), data[:, :, 3:5])
+    finally:
+        shutil.rmtree(volume_dir)
+
+# Chunked statistics match numpy on the whole array, with bounded memory
+def test_chunked_stats():
+    volume_dir, data = make_volumes()
+    try:
+        big = np.random.default_rng(0).normal(100, 15, size=(128, 128, 64)).astype(np.float32)
+        path = os.path.join(volume_dir, "big.nii")
+        write_nifti(path, big)
+        with open_volume(path) as volume:
+            tracemalloc.start()
+            stats = volume_stats(volume, chunk_bytes=128 * 128 * 4 * 4, threshold=100)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print(f"Stats: {stats}, peak Python memory {peak / 1e6:.1f} MB for a "
+              f"{big.nbytes * 2 / 1e6:.1f} MB float64 volume")
+        assert np.isclose(stats["mean"], big.astype(np.float64).mean())
+        assert np.isclose(stats["std"], big.astype(np.float64).std())
+        assert stats["voxels"] == big.size and stats["slices_read"] == 64
+        assert np.isclose(stats["foreground_ml"], np.count_nonzero(big > 100) * 0.002)
+        assert peak < big.nbytes
+        with open_volume(os.path.join(volume_dir, "liver", "fat.nii.gz")) as volume:
+            scaled = volume_stats(volume, chunk_bytes=1)
+        assert np.isclose(scaled["max"], data.max() * 0.5 - 10)
+    finally:
+        shutil.rmtree(volume_dir)
+
+# With the default chunk size a volume larger than it is never held in memory
+def test_default_chunk_memory():
+    volume_dir = tempfile.mkdtemp()
+    try:
+        # A 128 MB int16 volume whose first slice holds data and the rest is sparse
+        first = np.arange(512 * 512, dtype=np.int16).reshape((512, 512, 1), order="F") % 1000
+        path = os.path.join(volume_dir, "large.nii")
+        write_nifti(path, first)
+        size = 352 + first.nbytes * 256
+        with open(path, "r+b") as f:
+            f.seek(46)
+            f.write(struct.pack("<h", 256))
+            f.truncate(size)
+        with open_volume(path) as volume:
+            tracemalloc.start()
+            stats = volume_stats(volume, threshold=500)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        print(f"Stats: {stats}, peak Python memory {peak / 1e6:.1f} MB for a {size / 1e6:.1f} MB file")
+        assert stats["voxels"] == 512 * 512 * 256 and stats["slices_read"] == 256
+        assert stats["max"] == 999
+        assert np.isclose(stats["mean"], first.astype(np.float64).mean() / 256)
+        assert np.isclose(stats["foreground_ml"], np.count_nonzero(first > 500) * 0.002)
+        assert peak < size / 1.5
+    finally:
+        shutil.rmtree(volume_dir)
+
+# The tool finds volumes under directories and reports each one
+def test_analyze_volumes_tool():
+    volume_dir, _ = make_volumes()
+    try:
+        assert [os.path.basename(p) for p in find_volumes([volume_dir])] == ["brain.nii", "fat.nii.gz"]
+        report = analyze_volumes([volume_dir, os.path.join(volume_dir, "notes.txt")], threshold=500)
+        print(report)
+        assert "- Dimensions: 40x30x20 voxels" in report
+        assert "- Spacing: 1.00 x 1.00 x 2.00 mm" in report
+        assert "NIfTI (i2, compressed)" in report
+        assert "Volume above 500" in report
+        assert "Failed to analyze" in report and "notes.txt" in report
+        step = compile_query(f"describe the volumes, file: {volume_dir}/brain.nii").steps[0]
+        assert step.tool == "analyze_volumes"
+    finally:
+        shutil.rmtree(volume_dir)
+
+# A DICOM series is read slice by slice (only when pydicom is installed)
+def test_dicom_series():
+    try:
+        import pydicom
+        from pydicom.dataset import FileDataset, FileMetaDataset
+        from pydicom.uid import ExplicitVRLittleEndian
+    except ImportError:
+        print("pydicom not installed; skipping the DICOM test")
+        return
+    series_dir = tempfile.mkdtemp()
+    try:
+        slices = [np.full((16, 12), 10 * i, dtype=np.uint16) for i in range(5)]
+        for i, pixels in enumerate(slices):
+            meta = FileMetaDataset()
+            meta.TransferSyntaxUID = ExplicitVRLittleEndian
+            meta.MediaStorageSOPClassUID = "1.2.840.10008.5.1.4.1.1.4"
+            meta.MediaStorageSOPInstanceUID = f"1.2.3.{i}"
+            ds = FileDataset(None, {}, file_meta=meta, preamble=b"\0" * 128)
+            ds.Modality, ds.Rows, ds.Columns = "MR", 16, 12
+            ds.BitsAllocated, ds.BitsStored, ds.HighBit, ds.PixelRepresentation = 16, 16, 15, 0
+            ds.SamplesPerPixel, ds.PhotometricInterpretation = 1, "MONOCHROME2"
+            ds.PixelSpacing, ds.ImagePositionPatient = [0.5, 0.5], [0, 0, 3.0 * (4 - i)]
+            ds.InstanceNumber, ds.PixelData = i + 1, pixels.tobytes()
+            ds.save_as(os.path.join(series_dir, f"slice_{i}.dcm"), write_like_original=False)
+        with open_volume(series_dir) as volume:
+            assert volume.header.shape == (16, 12, 5) and volume.header.modality == "MR"
+            assert volume.header.spacing == (0.5, 0.5, 3.0)
+            # Sorted by position, so the last file written is the first slice
+            assert volume.slice(0)[0, 0] == 40
+            assert volume_stats(volume, chunk_bytes=1)["mean"] == 20
+    finally:
+        shutil.rmtree(series_dir)
+
+if __name__ == "__main__":
+    test_nifti_header_and_slices()
+    test_chunked_stats()
+    test_default_chunk_memory()
+    test_analyze_volumes_tool()
+    test_dicom_series()
+    print("All volume tests passed")